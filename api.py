@@ -12,12 +12,12 @@ import datetime
 import re
 import ssl
 from typing import Optional, List, Dict, Any, Union
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from starlette.responses import Response, JSONResponse
+from starlette.responses import Response, JSONResponse, StreamingResponse
 import logging
 import os
 from pathlib import Path
@@ -49,8 +49,10 @@ from core import (
     get_agent_documents,
     delete_document,
     get_conversation_history,
+    aget_conversation_history,
     clear_history,
-    process_question,
+    aprocess_question,
+    astream_question,
     process_documents,
     reset_chain,
 )
@@ -58,7 +60,11 @@ from core.database import Channel, Tool, Session as DBSession, SessionLocal, Api
 # core.graph.create_rag_agent removed â€” not used by any route
 from core.processing.scraper import process_urls
 from core.config import MODEL_BACKENDS
-from core.agent_config import sync_agent_config
+from core.agent_config import sync_agent_config, flush_agent_usage
+from core.message_journal import flush_message_journal
+from core.clickhouse import flush_clickhouse
+from core.llm_gateway import close_backends as close_llm_backends
+from core.prompt_budget import warm_tokenizers
 
 # Import metrics from core.monitoring
 from core.monitoring import (
@@ -75,7 +81,21 @@ from fastapi import Depends
 manager = ConnectionManager()
 
 # ============== APP SETUP ==============
-from core.database import init_db
+from core.database import init_db, dispose_async_engine
+from core.offload import run_blocking, shutdown_executors
+from core.processing.document_loader import shutdown_extraction_pool
+from core.agent_cache import start_agent_change_listener, stop_agent_change_listener
+from core.cache_lifecycle import start_cache_maintenance, stop_cache_maintenance
+from core.ingest_queue import (
+    cancel_job as cancel_ingestion_job,
+    enqueue_documents,
+    enqueue_urls,
+    get_job as get_ingestion_job,
+    list_jobs as list_ingestion_jobs,
+    queue_available as ingest_queue_available,
+    start_ingest_workers,
+    stop_ingest_workers,
+)
 
 
 # ============== STARTUP VALIDATION ==============
@@ -175,11 +195,26 @@ async def lifespan(app: FastAPI):
         raise RuntimeError(f"Database initialization failed: {db_init_error}")
 
     await auth.init_http_client()
+    start_agent_change_listener()
+    start_cache_maintenance()
+    start_ingest_workers()
+    # Tokenizers can take a while to load (or download); keep that off the request path.
+    await run_blocking(warm_tokenizers)
     try:
         await validate_dependencies()
         yield
     finally:
+        stop_agent_change_listener()
+        await run_blocking(stop_ingest_workers)
+        await run_blocking(stop_cache_maintenance)
         await auth.close_http_client()
+        await close_llm_backends()
+        await run_blocking(flush_agent_usage)
+        await run_blocking(flush_message_journal)
+        await run_blocking(flush_clickhouse)
+        await dispose_async_engine()
+        shutdown_executors()
+        shutdown_extraction_pool()
 
 
 app = FastAPI(
@@ -225,6 +260,7 @@ class QueryRequest(BaseModel):
     channel_name: Optional[str] = "TEXT"  # TEXT | VOICE
     channel_type: Optional[str] = "UTILITY"  # TEXT: UTILITY|MARKETING|AUTHENTICATION, VOICE: PROMOTIONAL|TRANSACTIONAL
     mock_mode: bool = False  # True = bypass LLM for load testing
+    stream: bool = False  # True = answer as Server-Sent Events (delta / blocked / done / error)
 
 
 class QueryResponse(BaseModel):
@@ -749,7 +785,7 @@ async def query(request: QueryRequest, api_key: ApiKey = Depends(get_api_key)):
     started = time.perf_counter()
     agent_id = _normalize_uuid(request.id, "id", required=True)
     # Enforce that only the owning API key can use this agent.
-    agent = _require_agent_access(agent_id, api_key)
+    agent = await run_blocking(_require_agent_access, agent_id, api_key)
     legacy_auth_user_id = _legacy_user_id_from_api_key(api_key)
 
     resolved_question = _resolve_query_text(request)
@@ -797,6 +833,48 @@ async def query(request: QueryRequest, api_key: ApiKey = Depends(get_api_key)):
             return "[REDACTED_LONG_TEXT]"
         return q
 
+    def log_query_out(answer_text):
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        query_logger.info(json.dumps({
+            "event": "query_out",
+            "request_id": request_id,
+            "status": 200,
+            "latency_ms": latency_ms,
+            "answer_preview": (answer_text or "")[:500].replace("\n", " ").strip(),
+            "answer_chars": len(answer_text or ""),
+        }, ensure_ascii=False))
+
+    def log_query_error(status_code, error, session_id):
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        try:
+            from core.clickhouse import log_usage_to_clickhouse
+
+            log_usage_to_clickhouse(
+                agent_id=agent_id,
+                model=resolved_model_selection or MODEL_BACKENDS.get("default", {}).get("model", "unknown"),
+                prompt_tokens=0,
+                completion_tokens=0,
+                latency_ms=latency_ms,
+                cost=0.0,
+                request_id=request_id,
+                session_id=session_id,
+                user_id=analytics_user_id,
+                channel_name=normalized_channel_name,
+                channel_type=normalized_channel_type,
+                product_id=product_id,
+                status="error",
+                error=error,
+            )
+        except Exception:
+            pass
+        query_logger.error(json.dumps({
+            "event": "query_error",
+            "request_id": request_id,
+            "status": status_code,
+            "latency_ms": latency_ms,
+            "error": error,
+        }, ensure_ascii=False))
+
     query_logger.info(json.dumps({
         "event": "query_in",
         "request_id": request_id,
@@ -816,59 +894,16 @@ async def query(request: QueryRequest, api_key: ApiKey = Depends(get_api_key)):
         # Track metrics
         CHAT_REQUESTS.labels(agent_id=agent_id).inc()
         
-        # Session Tracking
+        # Session Tracking (blocking DB work runs on the offload pool)
         session_id = request.session_id
-        db = None
-        try:
-            if not session_id:
-                # Auto-session policy: one generated session per agent+user+channel per day.
-                if agent_id:
-                    from sqlalchemy import func as sa_func
-
-                    db = SessionLocal()
-                    user_key = effective_user_id or "anonymous"
-                    channel_key = (normalized_channel_name or "TEXT").lower()
-                    today = datetime.datetime.now().date()
-
-                    existing_session = (
-                        db.query(DBSession)
-                        .filter(
-                            DBSession.agent_id == agent_id,
-                            DBSession.user_id == user_key,
-                            DBSession.channel_type == channel_key,
-                            sa_func.date(DBSession.start_time) == today,
-                        )
-                        .order_by(DBSession.start_time.desc())
-                        .first()
-                    )
+        if not session_id:
+            session_id = await run_blocking(
+                _resolve_chat_session_id,
+                agent_id,
+                effective_user_id,
+                normalized_channel_name,
+            )
 
-                    if existing_session:
-                        session_id = existing_session.id
-                    else:
-                        session_id = str(uuid.uuid4())
-                        new_sess = DBSession(
-                            id=session_id,
-                            agent_id=agent_id,
-                            user_id=user_key,
-                            status="active",
-                            channel_type=channel_key,
-                        )
-                        db.add(new_sess)
-                        db.commit()
-                else:
-                    # No agent id to anchor persistence, return ephemeral generated session id.
-                    session_id = str(uuid.uuid4())
-            
-            # Update existing session duration/end_time is usually done on completion or heartbeat
-            # For now, we just ensure it exists
-        except Exception as e:
-            logging.warning(f"Session tracking error: {e}")
-            print(f"⚠️  Session tracking error: {e}")
-        finally:
-            if db is not None:
-                db.close()
-            
-        
         # Mock Mode: Skip LLM for load testing (tests DB + vector store only)
         if request.mock_mode:
             # Simulate minimal processing
@@ -879,27 +914,20 @@ async def query(request: QueryRequest, api_key: ApiKey = Depends(get_api_key)):
                 session_id=session_id,
                 request_id=request_id,
             )
-            latency_ms = round((time.perf_counter() - started) * 1000, 2)
-            query_logger.info(json.dumps({
-                "event": "query_out",
-                "request_id": request_id,
-                "status": 200,
-                "latency_ms": latency_ms,
-                "answer_preview": response.answer[:500].replace("\n", " ").strip(),
-                "answer_chars": len(response.answer or ""),
-            }, ensure_ascii=False))
+            log_query_out(response.answer)
             return response
         
         # Get conversation history
         history = []
         if agent_id:
-            history = get_conversation_history(
+            history = await aget_conversation_history(
                 agent_id=agent_id,
                 limit=request.max_history * 2
             )
         
-        # Process question
-        answer = process_question(
+        from core.response_parser import process_rich_response_for_frontend
+
+        turn_args = dict(
             question=resolved_question,
             agent_id=agent_id,
             conversation_history=history,
@@ -910,11 +938,54 @@ async def query(request: QueryRequest, api_key: ApiKey = Depends(get_api_key)):
             user_id=analytics_user_id,
             channel_name=normalized_channel_name,
             channel_type=normalized_channel_type,
+            agent=agent,
         )
+
+        if request.stream:
+            async def stream_events():
+                try:
+                    # aclosing: a client disconnect stops the LLM stream right away.
+                    async with aclosing(astream_question(**turn_args)) as events:
+                        async for event in events:
+                            if event["type"] == "delta":
+                                content = event["content"]
+                                if "[" in content:
+                                    content = await run_blocking(
+                                        process_rich_response_for_frontend, content, agent_id=agent_id, agent=agent
+                                    )
+                                yield _sse("delta", {"content": content})
+                            elif event["type"] == "blocked":
+                                yield _sse("blocked", {"reason": event["reason"]})
+                            else:
+                                final_answer = await run_blocking(
+                                    process_rich_response_for_frontend, event["answer"], agent_id=agent_id, agent=agent
+                                )
+                                done = QueryResponse(
+                                    answer=final_answer,
+                                    id=agent_id,
+                                    session_id=session_id,
+                                    request_id=request_id,
+                                )
+                                yield _sse("done", _model_to_dict(done))
+                                log_query_out(final_answer)
+                except FileNotFoundError:
+                    log_query_error(400, "Upload documents first", session_id)
+                    yield _sse("error", {"status": 400, "detail": "Upload documents first", "request_id": request_id})
+                except Exception as e:
+                    log_query_error(500, str(e), session_id)
+                    yield _sse("error", {"status": 500, "detail": str(e), "request_id": request_id})
+
+            return StreamingResponse(
+                stream_events(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        # Process question (async pipeline; never blocks the event loop)
+        answer = await aprocess_question(**turn_args)
         
         # Replace [image][filename] and other tags with actual URLs/Markdown for frontend
-        from core.response_parser import process_rich_response_for_frontend
-        answer = process_rich_response_for_frontend(answer, agent_id=agent_id)
+        answer = await run_blocking(process_rich_response_for_frontend, answer, agent_id=agent_id, agent=agent)
         
         response = QueryResponse(
             answer=answer,
@@ -922,78 +993,14 @@ async def query(request: QueryRequest, api_key: ApiKey = Depends(get_api_key)):
             session_id=session_id,
             request_id=request_id,
         )
-        latency_ms = round((time.perf_counter() - started) * 1000, 2)
-        query_logger.info(json.dumps({
-            "event": "query_out",
-            "request_id": request_id,
-            "status": 200,
-            "latency_ms": latency_ms,
-            "answer_preview": (answer or "")[:500].replace("\n", " ").strip(),
-            "answer_chars": len(answer or ""),
-        }, ensure_ascii=False))
+        log_query_out(answer)
         return response
     
     except FileNotFoundError:
-        latency_ms = round((time.perf_counter() - started) * 1000, 2)
-        try:
-            from core.clickhouse import log_usage_to_clickhouse
-
-            log_usage_to_clickhouse(
-                agent_id=agent_id,
-                model=resolved_model_selection or MODEL_BACKENDS.get("default", {}).get("model", "unknown"),
-                prompt_tokens=0,
-                completion_tokens=0,
-                latency_ms=latency_ms,
-                cost=0.0,
-                request_id=request_id,
-                session_id=locals().get("session_id"),
-                user_id=analytics_user_id,
-                channel_name=normalized_channel_name,
-                channel_type=normalized_channel_type,
-                product_id=product_id,
-                status="error",
-                error="Upload documents first",
-            )
-        except Exception:
-            pass
-        query_logger.error(json.dumps({
-            "event": "query_error",
-            "request_id": request_id,
-            "status": 400,
-            "latency_ms": latency_ms,
-            "error": "Upload documents first",
-        }, ensure_ascii=False))
+        log_query_error(400, "Upload documents first", locals().get("session_id"))
         raise HTTPException(status_code=400, detail="Upload documents first")
     except Exception as e:
-        latency_ms = round((time.perf_counter() - started) * 1000, 2)
-        try:
-            from core.clickhouse import log_usage_to_clickhouse
-
-            log_usage_to_clickhouse(
-                agent_id=agent_id,
-                model=resolved_model_selection or MODEL_BACKENDS.get("default", {}).get("model", "unknown"),
-                prompt_tokens=0,
-                completion_tokens=0,
-                latency_ms=latency_ms,
-                cost=0.0,
-                request_id=request_id,
-                session_id=locals().get("session_id"),
-                user_id=analytics_user_id,
-                channel_name=normalized_channel_name,
-                channel_type=normalized_channel_type,
-                product_id=product_id,
-                status="error",
-                error=str(e),
-            )
-        except Exception:
-            pass
-        query_logger.error(json.dumps({
-            "event": "query_error",
-            "request_id": request_id,
-            "status": 500,
-            "latency_ms": latency_ms,
-            "error": str(e),
-        }, ensure_ascii=False))
+        log_query_error(500, str(e), locals().get("session_id"))
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1019,26 +1026,33 @@ async def websocket_endpoint(websocket: WebSocket, agent_id: str):
                 # 1. Send "Thinking" status
                 await manager.send_personal_message(json.dumps({"type": "status", "status": "thinking"}), websocket)
                 
-                # 2. Process with actual RAG pipeline (run in thread to avoid blocking)
+                # 2. Stream the answer from the RAG pipeline as "delta" frames
+                #    ("blocked" if the output guardrail trips mid-answer)
                 try:
-                    history = get_conversation_history(agent_id=agent_id, limit=10)
-                    resolved_model_selection = _resolve_model_selection_for_agent(agent_id)
-                    answer = await asyncio.get_event_loop().run_in_executor(
-                        None,
-                        lambda: process_question(
-                            question=question,
-                            agent_id=agent_id,
-                            conversation_history=history,
-                            model_selection=resolved_model_selection,
-                            request_id=str(uuid.uuid4()),
-                            user_id="websocket",
-                            channel_name="websocket",
-                        )
+                    history = await aget_conversation_history(agent_id=agent_id, limit=10)
+                    resolved_model_selection = await run_blocking(_resolve_model_selection_for_agent, agent_id)
+                    answer = ""
+                    events = astream_question(
+                        question=question,
+                        agent_id=agent_id,
+                        conversation_history=history,
+                        model_selection=resolved_model_selection,
+                        request_id=str(uuid.uuid4()),
+                        user_id="websocket",
+                        channel_name="websocket",
                     )
+                    async with aclosing(events):
+                        async for event in events:
+                            if event["type"] == "done":
+                                answer = event["answer"]
+                            else:
+                                await manager.send_personal_message(json.dumps(event), websocket)
+                except WebSocketDisconnect:
+                    raise
                 except Exception as e:
                     answer = f"Error: {str(e)}"
                 
-                # 3. Send Answer
+                # 3. Send the final answer (replaces the streamed text)
                 await manager.send_personal_message(json.dumps({"type": "message", "content": answer}), websocket)
                 
                 # 4. Send "Idle" status
@@ -1317,6 +1331,10 @@ def _normalize_model_selection_strict(value: Optional[str]) -> Optional[str]:
     return normalized
 
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 def _resolve_query_text(request_payload: QueryRequest) -> str:
     return str((request_payload.question or request_payload.query or "")).strip()
 
@@ -1333,6 +1351,54 @@ def _normalize_uuid(value: Optional[str], field_name: str, *, required: bool = F
         raise HTTPException(status_code=400, detail=f"{field_name} must be a valid UUID")
 
 
+def _resolve_chat_session_id(agent_id: Optional[str], user_id: Optional[str], channel_name: Optional[str]) -> Optional[str]:
+    """Auto-session policy: one generated session per agent+user+channel per day."""
+    if not agent_id:
+        # No agent id to anchor persistence, return ephemeral generated session id.
+        return str(uuid.uuid4())
+
+    from sqlalchemy import func as sa_func
+
+    db = SessionLocal()
+    try:
+        user_key = user_id or "anonymous"
+        channel_key = (channel_name or "TEXT").lower()
+        today = datetime.datetime.now().date()
+
+        existing_session = (
+            db.query(DBSession)
+            .filter(
+                DBSession.agent_id == agent_id,
+                DBSession.user_id == user_key,
+                DBSession.channel_type == channel_key,
+                sa_func.date(DBSession.start_time) == today,
+            )
+            .order_by(DBSession.start_time.desc())
+            .first()
+        )
+        if existing_session:
+            return existing_session.id
+
+        session_id = str(uuid.uuid4())
+        db.add(
+            DBSession(
+                id=session_id,
+                agent_id=agent_id,
+                user_id=user_key,
+                status="active",
+                channel_type=channel_key,
+            )
+        )
+        db.commit()
+        return session_id
+    except Exception as e:
+        logging.warning(f"Session tracking error: {e}")
+        print(f"⚠️  Session tracking error: {e}")
+        return None
+    finally:
+        db.close()
+
+
 def _resolve_model_selection_for_agent(id: Optional[str]) -> Optional[str]:
     if not id:
         return None
@@ -2427,7 +2493,10 @@ async def create_new_agent(agent_request: AgentCreate, request: Request, backgro
         
         # Trigger URL Scraping in Background
         if normalized["urls"]:
-            background_tasks.add_task(process_urls, normalized["urls"], created_id)
+            if ingest_queue_available():
+                enqueue_urls(created_id, normalized["urls"])
+            else:
+                background_tasks.add_task(process_urls, normalized["urls"], created_id)
 
         # Agent lifecycle analytics row in ClickHouse.
         try:
@@ -2596,7 +2665,10 @@ async def update_agent_endpoint(
 
     # Optional URL scrape refresh
     if normalized["urls"]:
-        background_tasks.add_task(process_urls, normalized["urls"], agent_id)
+        if ingest_queue_available():
+            enqueue_urls(agent_id, normalized["urls"])
+        else:
+            background_tasks.add_task(process_urls, normalized["urls"], agent_id)
 
     # Optional runtime restart behavior: clear agent chat history and reset LLM chain cache.
     if agent_request.restart_after_update:
@@ -2695,13 +2767,30 @@ async def upload_documents(
     text: Optional[str] = Form(None),
     api_key: ApiKey = Depends(get_api_key)
 ):
-    """Upload documents to an agent"""
+    """Upload documents to an agent
+
+    Queued for a background ingestion worker (202 + job id) when the job
+    queue is available; otherwise processed inline off the event loop.
+    """
     _require_agent_access(agent_id, api_key)
     
     if not files and not text:
         raise HTTPException(status_code=400, detail="Provide files or text")
     
-    result = process_documents(
+    if ingest_queue_available():
+        job = await run_blocking(enqueue_documents, agent_id, files or [], text)
+        return JSONResponse(
+            status_code=202,
+            content={
+                "status": "queued",
+                "job_id": job["id"],
+                "job": job,
+                "status_url": f"/ingestion/jobs/{job['id']}",
+            },
+        )
+
+    result = await run_blocking(
+        process_documents,
         files=files if files else None,
         text_input=text,
         agent_id=agent_id
@@ -2713,6 +2802,34 @@ async def upload_documents(
     return {"status": "success", "warning": result.get("warning")}
 
 
+# --- Ingestion jobs ---
+@app.get("/agents/{agent_id}/ingestion/jobs")
+async def list_agent_ingestion_jobs(agent_id: str, limit: int = 20, api_key: ApiKey = Depends(get_api_key)):
+    """Recent ingestion jobs for an agent (newest first)"""
+    _require_agent_access(agent_id, api_key)
+    return await run_blocking(list_ingestion_jobs, agent_id, limit)
+
+
+@app.get("/ingestion/jobs/{job_id}")
+async def get_ingestion_job_status(job_id: str, api_key: ApiKey = Depends(get_api_key)):
+    """Status, stage and progress of an ingestion job"""
+    job = await run_blocking(get_ingestion_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    _require_agent_access(job["agent_id"], api_key)
+    return job
+
+
+@app.post("/ingestion/jobs/{job_id}/cancel")
+async def cancel_ingestion_job_endpoint(job_id: str, api_key: ApiKey = Depends(get_api_key)):
+    """Cancel a queued job, or ask the worker to stop a running one"""
+    job = await run_blocking(get_ingestion_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    _require_agent_access(job["agent_id"], api_key)
+    return await run_blocking(cancel_ingestion_job, job_id)
+
+
 @app.delete("/documents/{document_id}", response_model=StatusResponse)
 async def delete_document_endpoint(document_id: int, api_key: ApiKey = Depends(get_api_key)):
     """Delete a document"""
@@ -9,7 +9,9 @@ from .config import DATABASE_URL, LLM_MODEL
 # Database
 from .database import (
     save_message,
+    asave_message,
     get_conversation_history,
+    aget_conversation_history,
     clear_history,
     get_agent_documents,
     delete_document,
@@ -40,10 +42,10 @@ from .rag.vector_store import (
 )
 
 # Chat
-from .chat_service import process_question, process_documents
+from .chat_service import process_question, aprocess_question, process_documents
 
 # LLM
-from .llm import get_llm, invoke_chain, reset_chain
+from .llm import get_llm, invoke_chain, ainvoke_chain, reset_chain
 
 # Model Loader
 # Prompts
@@ -62,7 +64,8 @@ __all__ = [
     'DATABASE_URL', 'LLM_MODEL',
     
     # Database
-    'save_message', 'get_conversation_history', 'clear_history',
+    'save_message', 'asave_message',
+    'get_conversation_history', 'aget_conversation_history', 'clear_history',
     'get_agent_documents', 'delete_document', 'save_document_metadata',
     'log_usage', 'get_usage_stats',
     
@@ -75,10 +78,10 @@ __all__ = [
     'search_documents', 'delete_vector_store', 'get_vector_count',
     
     # Chat
-    'process_question', 'process_documents',
+    'process_question', 'aprocess_question', 'process_documents',
     
     # LLM
-    'get_llm', 'invoke_chain', 'reset_chain',
+    'get_llm', 'invoke_chain', 'ainvoke_chain', 'reset_chain',
     
     # Prompts
     'RAG_SYSTEM_PROMPT', 'TOOL_AGENT_PROMPT',
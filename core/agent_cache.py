@@ -0,0 +1,239 @@
+"""
+In-process agent config cache with change-driven invalidation.
+
+get_agent() used to open a session and rebuild the agent dict on every call,
+and a single chat turn reaches it from several places (access check,
+retrieval config, media inventory, response rendering). Agent rows change
+rarely, so they are served from a per-process cache instead:
+
+- Entries are versioned: an invalidation bumps the agent's version, and a
+  load that raced with it is discarded instead of re-populating stale data.
+- Writers in this process invalidate directly after commit.
+- Other workers are told through Postgres NOTIFY on AGENT_CHANGE_CHANNEL;
+  a daemon LISTEN thread drops the matching entry (or everything after a
+  reconnect, since notifications may have been missed while disconnected).
+- AGENT_CACHE_TTL bounds staleness of fields written without an explicit
+  invalidation (e.g. the per-message counter) and acts as a safety net.
+"""
+import copy
+import os
+import select
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from .database import engine
+from .monitoring import AGENT_CACHE_EVENTS, AGENT_CACHE_SIZE
+
+AGENT_CHANGE_CHANNEL = "omni_agent_changed"
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _cache_enabled() -> bool:
+    return os.getenv("AGENT_CACHE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _cache_ttl() -> float:
+    return max(0.0, _env_float("AGENT_CACHE_TTL", 300.0))
+
+
+def _cache_max_entries() -> int:
+    return max(1, _env_int("AGENT_CACHE_MAX_ENTRIES", 2048))
+
+
+class AgentConfigCache:
+    """Versioned TTL cache of agent dicts keyed by agent id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # agent_id -> (version, stored_at, agent dict)
+        self._entries: Dict[str, Tuple[int, float, Dict]] = {}
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._listeners: List[Callable[[Optional[str]], None]] = []
+
+    def add_invalidation_listener(self, callback: Callable[[Optional[str]], None]) -> None:
+        """Call `callback(agent_id)` (None = everything) after each invalidation.
+
+        Lets per-agent resources elsewhere (e.g. retrieval handles) follow the
+        same local + LISTEN/NOTIFY invalidation path as agent configs.
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def _version_of(self, agent_id: str) -> Tuple[int, int]:
+        return self._epoch, self._versions.get(agent_id, 0)
+
+    def get(self, agent_id: str, loader: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+        """Return a deep copy of the cached agent, loading it on miss.
+
+        Agents carry nested lists/dicts (conversation_starters, image_urls,
+        retrieval settings), so callers must never share them with the cache.
+        """
+        if not agent_id or not _cache_enabled():
+            return loader(agent_id)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(agent_id)
+            if entry is not None and now - entry[1] < _cache_ttl():
+                self.hits += 1
+                AGENT_CACHE_EVENTS.labels(event="hit").inc()
+                return copy.deepcopy(entry[2])
+            version = self._version_of(agent_id)
+            self.misses += 1
+        AGENT_CACHE_EVENTS.labels(event="miss").inc()
+
+        agent = loader(agent_id)
+        if agent is None:
+            # Unknown/deleted ids are not cached so a later create is seen immediately.
+            return None
+
+        with self._lock:
+            # Skip the store if an invalidation landed while we were loading.
+            if self._version_of(agent_id) == version:
+                if agent_id not in self._entries and len(self._entries) >= _cache_max_entries():
+                    oldest = min(self._entries, key=lambda key: self._entries[key][1])
+                    self._entries.pop(oldest, None)
+                self._entries[agent_id] = (version[1], time.monotonic(), agent)
+            AGENT_CACHE_SIZE.set(len(self._entries))
+        return copy.deepcopy(agent)
+
+    def invalidate(self, agent_id: Optional[str] = None) -> None:
+        """Drop one agent (or every agent when agent_id is None)."""
+        with self._lock:
+            if agent_id:
+                self._versions[agent_id] = self._versions.get(agent_id, 0) + 1
+                self._entries.pop(agent_id, None)
+            else:
+                self._epoch += 1
+                self._entries.clear()
+            self.invalidations += 1
+            AGENT_CACHE_SIZE.set(len(self._entries))
+        AGENT_CACHE_EVENTS.labels(event="invalidation").inc()
+        for callback in list(self._listeners):
+            try:
+                callback(agent_id or None)
+            except Exception as e:
+                print(f"[WARN] Agent invalidation listener failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+agent_cache = AgentConfigCache()
+
+
+def notify_agent_changed(db, agent_id: str) -> None:
+    """Queue a cross-worker invalidation inside the caller's transaction.
+
+    NOTIFY is delivered on commit, so listeners never see a change that was
+    rolled back. No-op on non-Postgres backends.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        db.execute(
+            text("SELECT pg_notify(:channel, :agent_id)"),
+            {"channel": AGENT_CHANGE_CHANNEL, "agent_id": str(agent_id)},
+        )
+    except Exception as e:
+        print(f"[WARN] Agent change notify failed for {agent_id}: {e}")
+
+
+# =============================================================================
+# CROSS-WORKER LISTENER
+# =============================================================================
+
+_LISTENER_THREAD: Optional[threading.Thread] = None
+_LISTENER_STOP = threading.Event()
+_LISTENER_LOCK = threading.Lock()
+
+
+def _listen_forever() -> None:
+    import psycopg2
+    import psycopg2.extensions
+
+    dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    backoff = 1.0
+    first_connect = True
+    while not _LISTENER_STOP.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {AGENT_CHANGE_CHANNEL};")
+            if not first_connect:
+                # Changes made while we were disconnected were never delivered.
+                agent_cache.invalidate()
+            first_connect = False
+            backoff = 1.0
+            while not _LISTENER_STOP.is_set():
+                ready, _, _ = select.select([conn], [], [], 5.0)
+                if not ready:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    agent_cache.invalidate(note.payload or None)
+        except Exception as e:
+            if _LISTENER_STOP.is_set():
+                break
+            print(f"[WARN] Agent change listener error: {e}; retrying in {backoff:.0f}s")
+            first_connect = False
+            _LISTENER_STOP.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+def start_agent_change_listener() -> bool:
+    """Start the LISTEN thread (Postgres only). Returns True if running."""
+    global _LISTENER_THREAD
+    if engine.dialect.name != "postgresql" or not _cache_enabled():
+        return False
+    with _LISTENER_LOCK:
+        if _LISTENER_THREAD is not None and _LISTENER_THREAD.is_alive():
+            return True
+        _LISTENER_STOP.clear()
+        _LISTENER_THREAD = threading.Thread(
+            target=_listen_forever,
+            name="agent-cache-listener",
+            daemon=True,
+        )
+        _LISTENER_THREAD.start()
+    return True
+
+
+def stop_agent_change_listener() -> None:
+    """Signal the LISTEN thread to exit (it polls the stop flag every 5s)."""
+    _LISTENER_STOP.set()
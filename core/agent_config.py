@@ -3,20 +3,26 @@ Per-agent YAML config snapshot writer.
 
 Stores runtime agent configuration and cumulative token totals under:
 storage/agents/<agent_name>/config.yaml
+
+Usage snapshots are materialized in the background: record_usage() only
+queues a token delta in memory; a daemon thread coalesces deltas every
+AGENT_CONFIG_SYNC_INTERVAL seconds, applies them to omni_agent_usage_totals
+and rewrites each touched agent's YAML once per interval.
 """
 from __future__ import annotations
 
 import copy
 import json
+import os
 import tempfile
+import threading
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, Optional
-
-from sqlalchemy import func
+from typing import Any, Dict, Optional, Tuple
 
 from .agent_manager import get_agent
-from .database import SessionLocal, UsageLog
+from .database import get_usage_totals, increment_usage_totals, rebuild_usage_totals
 
 try:
     import yaml  # type: ignore
@@ -48,10 +54,24 @@ def _ensure_writable_dir(path: Path) -> bool:
         return False
 
 
+# (agent_id, folder) -> resolved config.yaml path; avoids a write probe per sync.
+_CONFIG_PATHS: Dict[Tuple[str, str], Path] = {}
+
+
 def _config_path_for_agent(agent: Dict[str, Any]) -> Optional[Path]:
     agent_id = str(agent.get("id") or "unknown_agent")
     agent_name = str(agent.get("name") or agent_id)
     folder = _safe_agent_dir_name(agent_name, agent_id)
+    cached = _CONFIG_PATHS.get((agent_id, folder))
+    if cached is not None:
+        return cached
+    path = _probe_config_path(agent_id, folder)
+    if path is not None:
+        _CONFIG_PATHS[(agent_id, folder)] = path
+    return path
+
+
+def _probe_config_path(agent_id: str, folder: str) -> Optional[Path]:
     tmp_root = Path(tempfile.gettempdir()) / "omnicortex_agents"
 
     candidates = [
@@ -94,29 +114,6 @@ def _agent_snapshot(agent: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def _usage_totals(agent_id: str) -> Dict[str, int]:
-    db = SessionLocal()
-    try:
-        sums = (
-            db.query(
-                func.coalesce(func.sum(UsageLog.prompt_tokens), 0),
-                func.coalesce(func.sum(UsageLog.completion_tokens), 0),
-                func.coalesce(func.sum(UsageLog.query_tokens), 0),
-                func.coalesce(func.sum(UsageLog.rag_query_tokens), 0),
-            )
-            .filter(UsageLog.agent_id == agent_id)
-            .one()
-        )
-        return {
-            "total_input_tokens": int(sums[0] or 0),
-            "total_output_tokens": int(sums[1] or 0),
-            "total_query_tokens": int(sums[2] or 0),
-            "total_rag_query_tokens": int(sums[3] or 0),
-        }
-    finally:
-        db.close()
-
-
 def _load_yaml(path: Path) -> Dict[str, Any]:
     if not path.exists():
         return {}
@@ -161,12 +158,14 @@ def sync_agent_config(
     *,
     event_type: Optional[str] = None,
     event_payload: Optional[Dict[str, Any]] = None,
+    rebuild_usage: bool = False,
 ) -> None:
     """
     Persist/update storage/agents/<agent_name>/config.yaml.
 
     - On create/update: append lifecycle event with payload snapshot.
-    - On usage sync: refresh cumulative token totals.
+    - On usage sync: refresh cumulative token totals from the counter row.
+    - rebuild_usage: recompute the counter row from omni_usage first (backfill/repair).
     """
     agent = get_agent(agent_id)
     if not agent:
@@ -177,10 +176,13 @@ def sync_agent_config(
         return
     cfg = _load_yaml(path)
 
+    if rebuild_usage:
+        rebuild_usage_totals(agent_id)
+
     now = _now_iso()
     cfg["version"] = 1
     cfg["agent"] = _agent_snapshot(agent)
-    cfg["usage"] = {**_usage_totals(agent_id), "last_synced_at": now}
+    cfg["usage"] = {**get_usage_totals(agent_id), "last_synced_at": now}
 
     lifecycle = cfg.get("lifecycle")
     if not isinstance(lifecycle, dict):
@@ -202,4 +204,109 @@ def sync_agent_config(
         )
         cfg["events"] = events[-30:]
 
-    _write_yaml(path, cfg)
+    try:
+        _write_yaml(path, cfg)
+    except Exception:
+        # Directory may have become unwritable; re-probe on the next sync.
+        for key, cached in list(_CONFIG_PATHS.items()):
+            if cached == path:
+                _CONFIG_PATHS.pop(key, None)
+        raise
+
+
+# =============================================================================
+# BACKGROUND USAGE MATERIALIZER
+# =============================================================================
+
+_PENDING_USAGE: Dict[str, Dict[str, int]] = {}
+_PENDING_LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_MATERIALIZER_STARTED = False
+_MATERIALIZER_LOCK = threading.Lock()
+
+
+def _sync_interval() -> float:
+    try:
+        return max(1.0, float(os.getenv("AGENT_CONFIG_SYNC_INTERVAL", "30")))
+    except (ValueError, TypeError):
+        return 30.0
+
+
+def record_usage(
+    agent_id: str,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    query_tokens: int = 0,
+    rag_query_tokens: int = 0,
+) -> None:
+    """Queue a usage delta for the background materializer (no I/O)."""
+    if not agent_id:
+        return
+    with _PENDING_LOCK:
+        pending = _PENDING_USAGE.setdefault(
+            str(agent_id),
+            {
+                "total_input_tokens": 0,
+                "total_output_tokens": 0,
+                "total_query_tokens": 0,
+                "total_rag_query_tokens": 0,
+            },
+        )
+        pending["total_input_tokens"] += int(prompt_tokens or 0)
+        pending["total_output_tokens"] += int(completion_tokens or 0)
+        pending["total_query_tokens"] += int(query_tokens or 0)
+        pending["total_rag_query_tokens"] += int(rag_query_tokens or 0)
+    _start_materializer_once()
+
+
+def flush_agent_usage() -> int:
+    """Apply queued deltas and rewrite each touched agent's YAML once.
+
+    Returns the number of agents flushed.
+    """
+    with _FLUSH_LOCK:
+        with _PENDING_LOCK:
+            if not _PENDING_USAGE:
+                return 0
+            batch = dict(_PENDING_USAGE)
+            _PENDING_USAGE.clear()
+
+        try:
+            increment_usage_totals(batch)
+        except Exception as exc:
+            # Put the deltas back so the next interval retries them.
+            with _PENDING_LOCK:
+                for agent_id, delta in batch.items():
+                    pending = _PENDING_USAGE.setdefault(agent_id, {k: 0 for k in delta})
+                    for key, value in delta.items():
+                        pending[key] = pending.get(key, 0) + value
+            print(f"[WARN] Agent usage totals flush failed: {exc}")
+            return 0
+
+        for agent_id in batch:
+            try:
+                sync_agent_config(agent_id)
+            except Exception as exc:
+                print(f"[WARN] Agent config usage sync failed for {agent_id}: {exc}")
+        return len(batch)
+
+
+def _materializer_worker() -> None:
+    while True:
+        time.sleep(_sync_interval())
+        try:
+            flush_agent_usage()
+        except Exception as exc:
+            print(f"[WARN] Agent config materializer error: {exc}")
+
+
+def _start_materializer_once() -> None:
+    global _MATERIALIZER_STARTED
+    if _MATERIALIZER_STARTED:
+        return
+    with _MATERIALIZER_LOCK:
+        if _MATERIALIZER_STARTED:
+            return
+        thread = threading.Thread(target=_materializer_worker, name="agent-config-materializer", daemon=True)
+        thread.start()
+        _MATERIALIZER_STARTED = True
@@ -7,6 +7,7 @@ import time
 from typing import List, Dict, Optional, Any
 
 from .database import SessionLocal, Agent
+from .agent_cache import agent_cache, notify_agent_changed
 from .rag.vector_store import delete_vector_store
 
 
@@ -144,7 +145,9 @@ def create_agent(
             extra_data=extra_data or {},
         )
         db.add(agent)
+        notify_agent_changed(db, agent_id)
         db.commit()
+        agent_cache.invalidate(agent_id)
         print(f"[OK] Created agent: {name} (Role: {role_type})")
         return agent_id
     finally:
@@ -152,7 +155,12 @@ def create_agent(
 
 
 def get_agent(agent_id: str) -> Optional[Dict]:
-    """Get agent by ID"""
+    """Get agent by ID (served from the in-process config cache)"""
+    return agent_cache.get(agent_id, _load_agent)
+
+
+def _load_agent(agent_id: str) -> Optional[Dict]:
+    """Load an agent dict straight from the database."""
     db = SessionLocal()
     try:
         agent = db.query(Agent).filter(Agent.id == agent_id, _not_deleted()).first()
@@ -297,7 +305,9 @@ def update_agent(
             existing.update(extra_data)
             agent.extra_data = existing
 
+        notify_agent_changed(db, agent_id)
         db.commit()
+        agent_cache.invalidate(agent_id)
         return True
     finally:
         db.close()
@@ -313,7 +323,9 @@ def update_agent_metadata(agent_id: str, document_count: int = None, message_cou
                 agent.document_count = (agent.document_count or 0) + document_count
             if message_count is not None:
                 agent.message_count = message_count
+            notify_agent_changed(db, agent_id)
             db.commit()
+            agent_cache.invalidate(agent_id)
     finally:
         db.close()
 
@@ -390,7 +402,9 @@ def delete_agent(agent_id: str) -> bool:
         )
 
         agent.deleted = True
+        notify_agent_changed(db, agent_id)
         db.commit()
+        agent_cache.invalidate(agent_id)
 
         _schedule_deleted_agent_cleanup(agent_id)
         print(f"[OK] Marked agent deleted: {agent_name}")
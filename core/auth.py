@@ -1,11 +1,19 @@
+import asyncio
+import base64
+import hashlib
+import json
 import logging
 import os
-from typing import Any, Dict
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
 
 import httpx
 from fastapi import Security, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from starlette.status import HTTP_403_FORBIDDEN, HTTP_503_SERVICE_UNAVAILABLE
+from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN, HTTP_503_SERVICE_UNAVAILABLE
+
+from .monitoring import AUTH_CACHE_EVENTS
 
 
 bearer_scheme = HTTPBearer(auto_error=False)
@@ -32,6 +40,7 @@ async def close_http_client() -> None:
     if _http_client is not None and not _http_client.is_closed:
         await _http_client.aclose()
     _http_client = None
+    clear_token_cache()
 
 
 def _auth_verify_url() -> str:
@@ -46,14 +55,145 @@ def _auth_verify_timeout() -> float:
         return 8.0
 
 
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)).strip())
+    except (ValueError, TypeError, AttributeError):
+        return default
+
+
+def _auth_cache_ttl() -> float:
+    return max(0.0, _env_float("AUTH_CACHE_TTL", 60.0))
+
+
+def _auth_negative_cache_ttl() -> float:
+    return max(0.0, _env_float("AUTH_NEGATIVE_CACHE_TTL", 5.0))
+
+
+def _auth_cache_max_entries() -> int:
+    return max(1, int(_env_float("AUTH_CACHE_MAX_ENTRIES", 10000)))
+
+
+# =============================================================================
+# VERIFIED-TOKEN CACHE
+# =============================================================================
+# Keyed by sha256(token, x_user_id) so raw tokens are never held as dict keys.
+# Values: (expires_at_monotonic, profile or None for a rejected token).
+_TOKEN_CACHE: "OrderedDict[str, Tuple[float, Optional[Any]]]" = OrderedDict()
+# Concurrent verifications of the same key share one upstream request.
+_INFLIGHT: Dict[str, "asyncio.Task[Optional[Any]]"] = {}
+
+
+def clear_token_cache() -> None:
+    _TOKEN_CACHE.clear()
+    _INFLIGHT.clear()
+
+
+def _token_cache_key(token: str, x_user_id: str) -> str:
+    return hashlib.sha256(f"{token}\0{x_user_id}".encode("utf-8")).hexdigest()
+
+
+def _token_exp(token: str) -> Optional[float]:
+    """Best-effort `exp` claim of a JWT (unverified; only ever shortens the TTL)."""
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        segment = parts[1] + "=" * (-len(parts[1]) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(segment.encode("ascii")))
+        exp = claims.get("exp") if isinstance(claims, dict) else None
+        return float(exp) if isinstance(exp, (int, float)) else None
+    except Exception:
+        return None
+
+
+def _cache_lookup(key: str) -> Tuple[bool, Optional[Any]]:
+    entry = _TOKEN_CACHE.get(key)
+    if entry is None:
+        return False, None
+    expires_at, profile = entry
+    if time.monotonic() >= expires_at:
+        _TOKEN_CACHE.pop(key, None)
+        return False, None
+    _TOKEN_CACHE.move_to_end(key)
+    return True, profile
+
+
+def _cache_store(key: str, profile: Optional[Any], ttl: float) -> None:
+    if ttl <= 0:
+        return
+    _TOKEN_CACHE[key] = (time.monotonic() + ttl, profile)
+    _TOKEN_CACHE.move_to_end(key)
+    while len(_TOKEN_CACHE) > _auth_cache_max_entries():
+        _TOKEN_CACHE.popitem(last=False)
+
+
+def _forbidden() -> HTTPException:
+    return HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Invalid bearer token")
+
+
 async def verify_bearer_token(token: str, x_user_id: str | None = None) -> Dict[str, Any]:
-    """Verify bearer token against external auth callback and return profile metadata."""
+    """Verify bearer token against external auth callback and return profile metadata.
+
+    Verified profiles are cached for AUTH_CACHE_TTL (never past the token's
+    `exp` claim), rejections for AUTH_NEGATIVE_CACHE_TTL, and concurrent
+    checks of the same token share a single upstream call.
+    """
     clean_token = (token or "").strip()
     if not clean_token:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN, detail="Authorization Bearer token missing"
         )
+    clean_user_id = (x_user_id or "").strip()
+
+    key = _token_cache_key(clean_token, clean_user_id)
+    found, profile = _cache_lookup(key)
+    if found:
+        if profile is None:
+            AUTH_CACHE_EVENTS.labels(event="negative_hit").inc()
+            raise _forbidden()
+        AUTH_CACHE_EVENTS.labels(event="hit").inc()
+        return {"token": clean_token, "profile": profile, "x_user_id": clean_user_id or None}
+
+    task = _INFLIGHT.get(key)
+    if task is None:
+        AUTH_CACHE_EVENTS.labels(event="miss").inc()
+        task = asyncio.ensure_future(_verify_and_cache(key, clean_token, clean_user_id))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda done, _key=key: _release_inflight(_key, done))
+    else:
+        AUTH_CACHE_EVENTS.labels(event="coalesced").inc()
+
+    # Shield so one caller disconnecting does not cancel the shared request.
+    profile = await asyncio.shield(task)
+    if profile is None:
+        raise _forbidden()
+    return {"token": clean_token, "profile": profile, "x_user_id": clean_user_id or None}
+
 
+def _release_inflight(key: str, task: "asyncio.Task[Optional[Any]]") -> None:
+    if _INFLIGHT.get(key) is task:
+        _INFLIGHT.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # mark retrieved even if every waiter went away
+
+
+async def _verify_and_cache(key: str, clean_token: str, clean_user_id: str) -> Optional[Any]:
+    """Call the auth service once; cache the outcome. Returns None if rejected (401/403)."""
+    profile = await _verify_upstream(clean_token, clean_user_id)
+    if profile is None:
+        _cache_store(key, None, _auth_negative_cache_ttl())
+        return None
+
+    ttl = _auth_cache_ttl()
+    exp = _token_exp(clean_token)
+    if exp is not None:
+        ttl = min(ttl, exp - time.time())
+    _cache_store(key, profile, ttl)
+    return profile
+
+
+async def _verify_upstream(clean_token: str, clean_user_id: str) -> Optional[Any]:
     verify_url = _auth_verify_url()
     if not verify_url:
         raise HTTPException(
@@ -62,7 +202,6 @@ async def verify_bearer_token(token: str, x_user_id: str | None = None) -> Dict[
         )
 
     verify_headers = {"Authorization": f"Bearer {clean_token}"}
-    clean_user_id = (x_user_id or "").strip()
     if clean_user_id:
         verify_headers["X-User-Id"] = clean_user_id
 
@@ -85,15 +224,23 @@ async def verify_bearer_token(token: str, x_user_id: str | None = None) -> Dict[
             detail="Auth verification unavailable",
         )
 
+    if response.status_code in (HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN):
+        return None
     if response.status_code != 200:
-        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Invalid bearer token")
+        # 5xx / 429 / anything unexpected is an outage, not a verdict on the
+        # token: surface it and leave the negative cache alone.
+        logging.error("Auth verification returned HTTP %s", response.status_code)
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Auth verification unavailable",
+        )
 
     try:
         profile = response.json()
     except ValueError:
         profile = {"raw": response.text[:1000]}
 
-    return {"token": clean_token, "profile": profile, "x_user_id": clean_user_id or None}
+    return profile if profile is not None else {}
 
 
 async def get_api_key(
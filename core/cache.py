@@ -1,13 +1,20 @@
 """
 Semantic cache module.
 Uses Postgres pgvector to cache and retrieve LLM responses.
+
+Lookups are nearest-neighbour queries (ORDER BY distance LIMIT k) so the
+HNSW indexes created by init_db() can serve them; the similarity threshold
+is applied to the returned candidates instead of inside the WHERE clause,
+which would force a scan of every row in scope.
 """
-from typing import Optional
+import os
+from typing import List, Optional, Sequence, Tuple
 
 from sqlalchemy import text
 
+from .cache_lifecycle import record_cache_lookup
 from .database import SemanticCache, get_session
-from .rag.embeddings import get_embeddings
+from .rag.embeddings import embed_query_cached
 
 
 # Cache configuration
@@ -15,38 +22,108 @@ CACHE_THRESHOLD = 0.92
 CACHE_TTL = 3600 * 24  # 24 hours
 
 
+def _env_int(key: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(key, str(default))))
+    except (ValueError, TypeError):
+        return default
+
+
+# Candidates fetched per leg before the threshold is applied.
+CACHE_CANDIDATES = _env_int("SEMANTIC_CACHE_CANDIDATES", 4)
+# HNSW search breadth for cache lookups (pgvector default is 40).
+CACHE_EF_SEARCH = _env_int("SEMANTIC_CACHE_EF_SEARCH", 40)
+
+_NEAREST_SQL = """
+SELECT id, answer, embedding <=> :q_vec AS distance
+FROM {table}
+WHERE {scope}
+  AND created_at > NOW() - make_interval(secs => :ttl_seconds)
+ORDER BY embedding <=> :q_vec
+LIMIT :k
+"""
+
+_ITERATIVE_SCAN_SUPPORTED: Optional[bool] = None
+
+
+def _pgvector_supports_iterative_scan(db) -> bool:
+    """pgvector >= 0.8 keeps scanning HNSW until filtered LIMIT k is satisfied."""
+    global _ITERATIVE_SCAN_SUPPORTED
+    if _ITERATIVE_SCAN_SUPPORTED is None:
+        try:
+            version = db.execute(
+                text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            ).scalar() or "0"
+            parts = tuple(int(p) for p in str(version).split(".")[:2] if p.isdigit())
+            _ITERATIVE_SCAN_SUPPORTED = parts >= (0, 8)
+        except Exception:
+            _ITERATIVE_SCAN_SUPPORTED = False
+    return _ITERATIVE_SCAN_SUPPORTED
+
+
+def _tune_hnsw_session(db) -> None:
+    # SET LOCAL only lasts for the current transaction (this lookup).
+    db.execute(text(f"SET LOCAL hnsw.ef_search = {int(CACHE_EF_SEARCH)}"))
+    if _pgvector_supports_iterative_scan(db):
+        db.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+
+
+def nearest_cached_answers(
+    db,
+    q_vec: Sequence[float],
+    agent_id: Optional[str] = None,
+    k: int = CACHE_CANDIDATES,
+    table: str = "omni_semantic_cache",
+) -> List[Tuple[int, str, float]]:
+    """Return up to k (id, answer, cosine distance) candidates per scope leg.
+
+    With an agent the agent-scoped rows and the shared (agent_id IS NULL)
+    rows are queried as separate legs, each able to use its own index,
+    instead of one OR filter that neither index can serve.
+    """
+    _tune_hnsw_session(db)
+    params = {"q_vec": str(list(q_vec)), "ttl_seconds": CACHE_TTL, "k": int(k)}
+    if agent_id:
+        params["agent_id"] = agent_id
+        scopes = ["agent_id = :agent_id", "agent_id IS NULL"]
+    else:
+        scopes = ["TRUE"]
+
+    candidates: List[Tuple[int, str, float]] = []
+    for scope in scopes:
+        rows = db.execute(text(_NEAREST_SQL.format(table=table, scope=scope)), params).fetchall()
+        candidates.extend((row.id, row.answer, float(row.distance)) for row in rows)
+    return candidates
+
+
+def best_cached_answer(
+    candidates: Sequence[Tuple[int, str, float]],
+    threshold: float = CACHE_THRESHOLD,
+) -> Optional[Tuple[int, str, float]]:
+    """Pick the most similar candidate above the threshold: (id, answer, similarity)."""
+    best: Optional[Tuple[int, str, float]] = None
+    for entry_id, answer, distance in candidates:
+        similarity = 1.0 - distance
+        if similarity > threshold and (best is None or similarity > best[2]):
+            best = (entry_id, answer, similarity)
+    return best
+
+
 def check_cache(question: str, agent_id: str = None) -> Optional[str]:
     """
     Check if a similar question has been answered recently.
     Returns the cached answer or None.
     """
     try:
-        embeddings = get_embeddings()
-        q_vec = embeddings.embed_query(question)
+        q_vec = embed_query_cached(question)
 
         db = get_session()
-        sql = """
-        SELECT answer, 1 - (embedding <=> :q_vec) as similarity
-        FROM omni_semantic_cache
-        WHERE 1 - (embedding <=> :q_vec) > :threshold
-          AND created_at > NOW() - make_interval(secs => :ttl_seconds)
-        """
-        params = {
-            "q_vec": str(q_vec),
-            "threshold": CACHE_THRESHOLD,
-            "ttl_seconds": CACHE_TTL,
-        }
-
-        if agent_id:
-            sql += " AND (agent_id = :agent_id OR agent_id IS NULL)"
-            params["agent_id"] = agent_id
-
-        sql += " ORDER BY similarity DESC LIMIT 1"
-        result = db.execute(text(sql), params).fetchone()
-
-        if result:
-            print(f"[CACHE] Hit. Similarity: {result.similarity:.3f}")
-            return result.answer
+        match = best_cached_answer(nearest_cached_answers(db, q_vec, agent_id))
+        record_cache_lookup(match[0] if match else None)
+
+        if match:
+            print(f"[CACHE] Hit. Similarity: {match[2]:.3f}")
+            return match[1]
         return None
     except Exception as e:
         print(f"[WARN] Cache check failed: {e}")
@@ -78,8 +155,7 @@ def invalidate_agent_cache(agent_id: Optional[str]):
 def save_to_cache(question: str, answer: str, agent_id: str = None):
     """Save a question-answer pair to the cache."""
     try:
-        embeddings = get_embeddings()
-        q_vec = embeddings.embed_query(question)
+        q_vec = embed_query_cached(question)
 
         db = get_session()
         cache_entry = SemanticCache(
@@ -0,0 +1,279 @@
+"""
+Semantic cache lifecycle: hit accounting, expiry and per-agent budgets.
+
+- Hits are counted in memory and applied in one batched UPDATE every
+  SEMANTIC_CACHE_HIT_FLUSH_INTERVAL seconds (hit_count, last_hit_at).
+- A background reaper deletes rows older than CACHE_TTL in bounded batches
+  and trims agents above SEMANTIC_CACHE_MAX_ROWS_PER_AGENT, evicting the
+  least frequently (lfu) or least recently (lru) used rows first.
+- Only one worker reaps per cycle (Postgres advisory lock).
+
+Keeping the table bounded keeps the HNSW index, and lookup latency, bounded.
+"""
+import os
+import threading
+import time
+from collections import Counter as TallyCounter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from .database import SessionLocal, engine
+from .monitoring import (
+    SEMANTIC_CACHE_EVICTIONS,
+    SEMANTIC_CACHE_HIT_RATIO,
+    SEMANTIC_CACHE_LOOKUPS,
+    SEMANTIC_CACHE_ROWS,
+)
+
+# Arbitrary constant shared by all workers for the reaper advisory lock.
+_REAPER_LOCK_KEY = 0x0C0CAC4E
+
+_PENDING_HITS: "TallyCounter[int]" = TallyCounter()
+_PENDING_LOCK = threading.Lock()
+_LOOKUP_TOTALS = {"hit": 0, "miss": 0}
+
+_WORKER_THREAD: Optional[threading.Thread] = None
+_WORKER_STOP = threading.Event()
+_WORKER_LOCK = threading.Lock()
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _hit_flush_interval() -> float:
+    return max(0.5, _env_float("SEMANTIC_CACHE_HIT_FLUSH_INTERVAL", 5.0))
+
+
+def _reap_interval() -> float:
+    return max(5.0, _env_float("SEMANTIC_CACHE_REAP_INTERVAL", 300.0))
+
+
+def _reap_batch_size() -> int:
+    return max(1, _env_int("SEMANTIC_CACHE_REAP_BATCH", 1000))
+
+
+def _reap_max_batches() -> int:
+    return max(1, _env_int("SEMANTIC_CACHE_REAP_MAX_BATCHES", 50))
+
+
+def _max_rows_per_agent() -> int:
+    """0 disables per-agent budgets."""
+    return max(0, _env_int("SEMANTIC_CACHE_MAX_ROWS_PER_AGENT", 5000))
+
+
+def _eviction_policy() -> str:
+    policy = os.getenv("SEMANTIC_CACHE_EVICTION", "lfu").strip().lower()
+    return policy if policy in {"lfu", "lru"} else "lfu"
+
+
+def _eviction_order() -> str:
+    recency = "COALESCE(last_hit_at, created_at) ASC"
+    if _eviction_policy() == "lru":
+        return recency
+    return f"hit_count ASC, {recency}"
+
+
+# =============================================================================
+# HIT ACCOUNTING
+# =============================================================================
+
+def record_cache_lookup(entry_id: Optional[int]) -> None:
+    """Count a lookup; hits are queued for the batched hit_count update."""
+    result = "hit" if entry_id is not None else "miss"
+    SEMANTIC_CACHE_LOOKUPS.labels(result=result).inc()
+    with _PENDING_LOCK:
+        _LOOKUP_TOTALS[result] += 1
+        if entry_id is not None:
+            _PENDING_HITS[int(entry_id)] += 1
+        total = _LOOKUP_TOTALS["hit"] + _LOOKUP_TOTALS["miss"]
+        SEMANTIC_CACHE_HIT_RATIO.set(_LOOKUP_TOTALS["hit"] / total)
+
+
+def flush_cache_hits() -> int:
+    """Apply queued hits in a single UPDATE. Returns rows targeted."""
+    with _PENDING_LOCK:
+        if not _PENDING_HITS:
+            return 0
+        batch: List[Tuple[int, int]] = list(_PENDING_HITS.items())
+        _PENDING_HITS.clear()
+
+    db = SessionLocal()
+    try:
+        db.execute(
+            text(
+                """
+                UPDATE omni_semantic_cache AS c
+                SET hit_count = COALESCE(c.hit_count, 0) + v.n,
+                    last_hit_at = NOW()
+                FROM unnest(CAST(:ids AS integer[]), CAST(:counts AS integer[])) AS v(id, n)
+                WHERE c.id = v.id
+                """
+            ),
+            {"ids": [entry_id for entry_id, _ in batch], "counts": [n for _, n in batch]},
+        )
+        db.commit()
+        return len(batch)
+    except Exception as e:
+        db.rollback()
+        # Put the hits back so the next interval retries them.
+        with _PENDING_LOCK:
+            for entry_id, n in batch:
+                _PENDING_HITS[entry_id] += n
+        print(f"[WARN] Semantic cache hit flush failed: {e}")
+        return 0
+    finally:
+        db.close()
+
+
+# =============================================================================
+# REAPER
+# =============================================================================
+
+def _delete_in_batches(db, select_ids_sql: str, params: Dict, limit: int) -> int:
+    """Delete up to `limit` rows chosen by select_ids_sql, one bounded batch per commit."""
+    deleted = 0
+    batch_size = _reap_batch_size()
+    while deleted < limit:
+        take = min(batch_size, limit - deleted)
+        result = db.execute(
+            text(f"DELETE FROM omni_semantic_cache WHERE id IN ({select_ids_sql} LIMIT :take)"),
+            {**params, "take": take},
+        )
+        db.commit()
+        removed = result.rowcount or 0
+        deleted += removed
+        if removed < take:
+            break
+    return deleted
+
+
+def reap_semantic_cache() -> Dict[str, int]:
+    """Delete expired rows, then enforce per-agent budgets. Returns counts removed."""
+    from .cache import CACHE_TTL
+
+    summary = {"expired": 0, "budget": 0}
+    # One pinned connection: the session-level advisory lock must be released
+    # on the same backend that took it.
+    db = engine.connect()
+    locked = False
+    try:
+        locked = bool(db.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _REAPER_LOCK_KEY}).scalar())
+        db.commit()
+        if not locked:
+            return summary
+
+        max_rows = _reap_batch_size() * _reap_max_batches()
+        summary["expired"] = _delete_in_batches(
+            db,
+            """
+            SELECT id FROM omni_semantic_cache
+            WHERE created_at < NOW() - make_interval(secs => :ttl_seconds)
+            ORDER BY created_at
+            """,
+            {"ttl_seconds": CACHE_TTL},
+            max_rows,
+        )
+
+        budget = _max_rows_per_agent()
+        rows = db.execute(
+            text("SELECT agent_id, COUNT(*) AS n FROM omni_semantic_cache GROUP BY agent_id")
+        ).fetchall()
+        db.commit()
+        total_rows = sum(int(row.n) for row in rows)
+
+        if budget:
+            order_by = _eviction_order()
+            remaining = max_rows
+            for row in rows:
+                excess = int(row.n) - budget
+                if excess <= 0 or remaining <= 0:
+                    continue
+                scope = "agent_id = :agent_id" if row.agent_id is not None else "agent_id IS NULL"
+                removed = _delete_in_batches(
+                    db,
+                    f"SELECT id FROM omni_semantic_cache WHERE {scope} ORDER BY {order_by}",
+                    {"agent_id": row.agent_id},
+                    min(excess, remaining),
+                )
+                summary["budget"] += removed
+                remaining -= removed
+            total_rows -= summary["budget"]
+
+        SEMANTIC_CACHE_ROWS.set(max(0, total_rows))
+        for reason, count in summary.items():
+            if count:
+                SEMANTIC_CACHE_EVICTIONS.labels(reason=reason).inc(count)
+        if summary["expired"] or summary["budget"]:
+            print(
+                f"[OK] Semantic cache reaped: expired={summary['expired']} "
+                f"budget={summary['budget']} ({_eviction_policy()})"
+            )
+        return summary
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] Semantic cache reaper failed: {e}")
+        return summary
+    finally:
+        if locked:
+            try:
+                db.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _REAPER_LOCK_KEY})
+                db.commit()
+            except Exception:
+                db.rollback()
+        db.close()
+
+
+# =============================================================================
+# BACKGROUND WORKER
+# =============================================================================
+
+def _maintenance_worker() -> None:
+    next_reap = time.monotonic() + min(_reap_interval(), 30.0)
+    while not _WORKER_STOP.wait(_hit_flush_interval()):
+        flush_cache_hits()
+        if time.monotonic() >= next_reap:
+            reap_semantic_cache()
+            next_reap = time.monotonic() + _reap_interval()
+    flush_cache_hits()
+
+
+def start_cache_maintenance() -> bool:
+    """Start the hit-flush/reaper thread once (Postgres only; called from the API lifespan)."""
+    global _WORKER_THREAD
+    if _WORKER_THREAD is not None and _WORKER_THREAD.is_alive():
+        return True
+    if engine.dialect.name != "postgresql":
+        return False
+    with _WORKER_LOCK:
+        if _WORKER_THREAD is not None and _WORKER_THREAD.is_alive():
+            return True
+        _WORKER_STOP.clear()
+        _WORKER_THREAD = threading.Thread(
+            target=_maintenance_worker,
+            name="semantic-cache-maintenance",
+            daemon=True,
+        )
+        _WORKER_THREAD.start()
+    return True
+
+
+def stop_cache_maintenance(timeout: float = 5.0) -> None:
+    """Stop the worker and flush queued hits (called on API shutdown)."""
+    _WORKER_STOP.set()
+    thread = _WORKER_THREAD
+    if thread is not None and thread.is_alive():
+        thread.join(timeout=timeout)
+    else:
+        flush_cache_hits()
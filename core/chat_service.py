@@ -1,25 +1,37 @@
 """
 Chat Service - Orchestrates the RAG workflow
 """
+import asyncio
 import os
 import json
 import time
 import re
 import tempfile
-from typing import Dict, List, Optional
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 from urllib.parse import unquote
 
 from .agent_manager import get_agent, update_agent_metadata
 from .cache import check_cache, invalidate_agent_cache, save_to_cache
-from .guardrails import validate_input, validate_output
-from .llm import invoke_chain
-from .response_parser import enforce_canonical_media_tags
-from .processing.chunking import parent_child_split
-from .processing.document_loader import extract_text_from_files, get_file_info, validate_extraction
+from .guardrails import OutputStreamGuard, validate_input, validate_output
+from .llm import ainvoke_chain, astream_chain, invoke_chain
+from .offload import get_io_executor, run_blocking, run_cpu_bound, submit_with_context
+from .response_parser import MediaTagStream, enforce_canonical_media_tags
+from .processing.chunking import ParentChildStream
+from .processing.document_loader import get_file_info, stream_indexed_text_from_files, validate_extraction
 from .processing.pii import mask_pii
-from .rag.retrieval import hybrid_search
+from .rag.embeddings import query_embedding_scope, with_query_embedding_scope
+from .prompt_budget import (
+    count_tokens,
+    format_documents,
+    format_messages,
+    get_tokenizer,
+    plan_prompt,
+    tokenizer_ready,
+)
+from .rag.retrieval import ahybrid_search, hybrid_search
 from .rag.vector_store import create_vector_store
-from .database import Document, SessionLocal, save_message
+from .database import asave_message, finish_ingested_documents, save_ingested_documents, save_message
 
 
 # ---------------------------------------------------------------------------
@@ -103,68 +115,132 @@ def _rule_based_agent_reply(
     return None
 
 
-def format_history(messages: List[Dict], max_messages: int = 10) -> str:
-    """Format conversation history for prompt with size limit."""
-    if not messages:
-        return "No previous conversation."
+def format_history(
+    messages: List[Dict],
+    max_messages: int = 10,
+    max_tokens: Optional[int] = None,
+    model_key: Optional[str] = None,
+) -> str:
+    """Format conversation history for prompt within a token budget (newest first)."""
+    return format_messages(messages, max_tokens, max_messages, model_key)
 
-    recent = messages[-(max_messages * 2) :]
-    formatted: List[str] = []
-    total_chars = 0
-    max_history_chars = 1000
 
-    for msg in recent:
-        role = "User" if msg["role"] == "user" else "Assistant"
-        content = msg["content"]
-        if len(content) > 200:
-            content = content[:200] + "..."
+def format_context(docs, max_tokens: Optional[int] = None, model_key: Optional[str] = None) -> str:
+    """Format retrieved documents into context string within a token budget."""
+    return format_documents(docs, max_tokens, model_key)
 
-        line = f"{role}: {content}"
-        if total_chars + len(line) > max_history_chars:
-            break
-        formatted.append(line)
-        total_chars += len(line)
 
-    return "\n".join(formatted)
+def estimate_tokens(text: str, model_key: Optional[str] = None) -> int:
+    """Token count with the serving model's tokenizer (heuristic fallback)."""
+    return count_tokens(text, model_key)
 
 
-def format_context(docs) -> str:
-    """Format retrieved documents into context string with size limit."""
-    if not docs:
-        return "No relevant documents found."
+def _media_names(urls) -> List[str]:
+    names: List[str] = []
+    for u in urls or []:
+        if isinstance(u, dict):
+            raw_url = u.get("url") or u.get("link") or u.get("src") or ""
+        else:
+            raw_url = str(u)
+        fname = unquote(raw_url.rstrip("/").rsplit("/", 1)[-1].split("?", 1)[0]).strip()
+        if fname:
+            names.append(fname)
+    return names
 
-    context_parts: List[str] = []
-    total_chars = 0
-    max_context_chars = 2500
 
-    for i, doc in enumerate(docs, 1):
-        if hasattr(doc, "page_content"):
-            content = doc.page_content
-        elif isinstance(doc, dict) and "content" in doc:
-            content = doc["content"]
-        else:
-            content = str(doc)
+def _media_inventory(agent: Optional[Dict], agent_id: Optional[str]) -> str:
+    """Build the "Available Images/Videos/Documents" context sections."""
+    if not agent_id or not agent:
+        return ""
+    try:
+        # Inject available media inventories for tag-aware responses.
+        media_sections = []
 
-        if len(content) > 500:
-            content = content[:500] + "..."
+        # 1. Images
+        image_names = _media_names(agent.get("image_urls"))
+        if image_names:
+            media_sections.append("Available Images: " + json.dumps(image_names, ensure_ascii=False))
 
-        doc_text = f"[Document {i}]: {content}"
-        if total_chars + len(doc_text) > max_context_chars:
-            break
+        # 2. Videos
+        video_names = _media_names(agent.get("video_urls"))
+        if video_names:
+            media_sections.append("Available Videos: " + json.dumps(video_names, ensure_ascii=False))
 
-        context_parts.append(doc_text)
-        total_chars += len(doc_text)
+        # 3. Documents (Filenames) — served from 60-second TTL cache.
+        doc_names = _get_doc_names_cached(agent_id)
+        if doc_names:
+            media_sections.append("Available Documents: " + json.dumps(doc_names, ensure_ascii=False))
 
-    return "\n\n".join(context_parts)
+        return "\n\n".join(media_sections)
+    except Exception:
+        return ""
 
 
-def estimate_tokens(text: str) -> int:
-    """Lightweight token estimate (approx. 1 token ~= 4 chars)."""
-    if not text:
-        return 0
-    return max(1, (len(text) + 3) // 4)
+def _log_chat_event(
+    agent_id: Optional[str],
+    question: str,
+    answer: str,
+    request_id: Optional[str],
+    session_id: Optional[str],
+    user_id: Optional[str],
+    status: str,
+    error: Optional[str] = None,
+) -> None:
+    try:
+        from .clickhouse import log_chat_to_clickhouse
 
+        log_chat_to_clickhouse(
+            agent_id=agent_id,
+            user_message=question,
+            assistant_message=answer,
+            request_id=request_id,
+            session_id=session_id,
+            user_id=user_id,
+            status=status,
+            error=error,
+        )
+    except Exception:
+        pass
+
+
+def _log_shortcut_usage(
+    agent_id: Optional[str],
+    model: str,
+    query_tokens: int,
+    rag_query_tokens: int,
+    started_at: float,
+    request_id: Optional[str],
+    session_id: Optional[str],
+    user_id: Optional[str],
+    channel_name: str,
+    channel_type: str,
+    status: str,
+) -> None:
+    """Usage row for turns answered without an LLM call (rules, cache)."""
+    try:
+        from .clickhouse import log_usage_to_clickhouse
 
+        log_usage_to_clickhouse(
+            agent_id=agent_id,
+            model=model,
+            query_tokens=query_tokens,
+            rag_query_tokens=rag_query_tokens,
+            prompt_tokens=0,
+            completion_tokens=0,
+            latency_ms=(time.perf_counter() - started_at) * 1000.0,
+            cost=0.0,
+            request_id=request_id,
+            session_id=session_id,
+            user_id=user_id,
+            channel_name=channel_name,
+            channel_type=channel_type,
+            status=status,
+        )
+    except Exception:
+        pass
+
+
+@with_query_embedding_scope
 def process_question(
     question: str,
     agent_id: str = None,
@@ -178,36 +254,33 @@ def process_question(
     user_id: Optional[str] = None,
     channel_name: str = "web",
     channel_type: str = "UTILITY",
+    agent: Optional[Dict] = None,
 ) -> str:
     """Process user question with RAG and guardrails."""
     started_at = time.perf_counter()
     is_valid, reason = validate_input(question)
     if not is_valid:
         blocked_answer = f"Request Blocked: {reason}"
-        try:
-            from .clickhouse import log_chat_to_clickhouse
-
-            log_chat_to_clickhouse(
-                agent_id=agent_id,
-                user_message=question,
-                assistant_message=blocked_answer,
-                request_id=request_id,
-                session_id=session_id,
-                user_id=user_id,
-                status="blocked",
-                error=reason,
-            )
-        except Exception:
-            pass
+        _log_chat_event(agent_id, question, blocked_answer, request_id, session_id, user_id, "blocked", reason)
         return blocked_answer
 
     safe_question = mask_pii(question)
     query_tokens = estimate_tokens(question)
     rag_query_tokens = estimate_tokens(safe_question)
+    usage_ctx = dict(
+        query_tokens=query_tokens,
+        rag_query_tokens=rag_query_tokens,
+        started_at=started_at,
+        request_id=request_id,
+        session_id=session_id,
+        user_id=user_id,
+        channel_name=channel_name,
+        channel_type=channel_type,
+    )
 
     # Fetch agent once and reuse throughout this request.
-    _agent_data: Optional[Dict] = None
-    if agent_id:
+    _agent_data: Optional[Dict] = agent
+    if agent_id and _agent_data is None:
         try:
             _agent_data = get_agent(agent_id)
         except Exception:
@@ -219,41 +292,8 @@ def process_question(
         scripted_reply = enforce_canonical_media_tags(scripted_reply)
         save_message("user", safe_question, agent_id=agent_id)
         save_message("assistant", scripted_reply, agent_id=agent_id)
-        try:
-            from .clickhouse import log_chat_to_clickhouse
-
-            log_chat_to_clickhouse(
-                agent_id=agent_id,
-                user_message=question,
-                assistant_message=scripted_reply,
-                request_id=request_id,
-                session_id=session_id,
-                user_id=user_id,
-                status="rule_based",
-            )
-        except Exception:
-            pass
-        try:
-            from .clickhouse import log_usage_to_clickhouse
-
-            log_usage_to_clickhouse(
-                agent_id=agent_id,
-                model="conversation_rule",
-                query_tokens=query_tokens,
-                rag_query_tokens=rag_query_tokens,
-                prompt_tokens=0,
-                completion_tokens=0,
-                latency_ms=(time.perf_counter() - started_at) * 1000.0,
-                cost=0.0,
-                request_id=request_id,
-                session_id=session_id,
-                user_id=user_id,
-                channel_name=channel_name,
-                channel_type=channel_type,
-                status="rule_based",
-            )
-        except Exception:
-            pass
+        _log_chat_event(agent_id, question, scripted_reply, request_id, session_id, user_id, "rule_based")
+        _log_shortcut_usage(agent_id, "conversation_rule", status="rule_based", **usage_ctx)
         return scripted_reply
 
     cached = check_cache(safe_question, agent_id)
@@ -261,41 +301,8 @@ def process_question(
         cached = enforce_canonical_media_tags(cached)
         save_message("user", safe_question, agent_id=agent_id)
         save_message("assistant", cached, agent_id=agent_id)
-        try:
-            from .clickhouse import log_chat_to_clickhouse
-
-            log_chat_to_clickhouse(
-                agent_id=agent_id,
-                user_message=question,
-                assistant_message=cached,
-                request_id=request_id,
-                session_id=session_id,
-                user_id=user_id,
-                status="cached",
-            )
-        except Exception:
-            pass
-        try:
-            from .clickhouse import log_usage_to_clickhouse
-
-            log_usage_to_clickhouse(
-                agent_id=agent_id,
-                model=model_selection or "cache",
-                query_tokens=query_tokens,
-                rag_query_tokens=rag_query_tokens,
-                prompt_tokens=0,
-                completion_tokens=0,
-                latency_ms=(time.perf_counter() - started_at) * 1000.0,
-                cost=0.0,
-                request_id=request_id,
-                session_id=session_id,
-                user_id=user_id,
-                channel_name=channel_name,
-                channel_type=channel_type,
-                status="cached",
-            )
-        except Exception:
-            pass
+        _log_chat_event(agent_id, question, cached, request_id, session_id, user_id, "cached")
+        _log_shortcut_usage(agent_id, model_selection or "cache", status="cached", **usage_ctx)
         return cached
 
     from .agent_manager import resolve_retrieval_config
@@ -311,60 +318,17 @@ def process_question(
         rerank=_effective_rerank,
         reranker_model=_effective_reranker_model,
     )
-    context = format_context(docs)
-    history = format_history(conversation_history or [], max_history)
-
-    agent_name = "default"
-    if agent_id:
-        try:
-            agent = _agent_data
-            if agent:
-                agent_name = agent.get("name", "unknown")
-                
-                # Inject available media inventories for tag-aware responses.
-                media_sections = []
-                
-                # 1. Images
-                image_urls = agent.get("image_urls") or []
-                if image_urls:
-                    image_names = []
-                    for u in image_urls:
-                        if isinstance(u, dict):
-                            raw_url = u.get("url") or u.get("link") or u.get("src") or ""
-                        else:
-                            raw_url = str(u)
-                        fname = unquote(raw_url.rstrip("/").rsplit("/", 1)[-1].split("?", 1)[0]).strip()
-                        if fname:
-                            image_names.append(fname)
-                    if image_names:
-                        media_sections.append("Available Images: " + json.dumps(image_names, ensure_ascii=False))
-                
-                # 2. Videos
-                video_urls = agent.get("video_urls") or []
-                if video_urls:
-                    video_names = []
-                    for u in video_urls:
-                        if isinstance(u, dict):
-                            raw_url = u.get("url") or u.get("link") or u.get("src") or ""
-                        else:
-                            raw_url = str(u)
-                        fname = unquote(raw_url.rstrip("/").rsplit("/", 1)[-1].split("?", 1)[0]).strip()
-                        if fname:
-                            video_names.append(fname)
-                    if video_names:
-                        media_sections.append("Available Videos: " + json.dumps(video_names, ensure_ascii=False))
-                
-                # 3. Documents (Filenames) — served from 60-second TTL cache.
-                doc_names = _get_doc_names_cached(agent_id)
-                if doc_names:
-                    media_sections.append("Available Documents: " + json.dumps(doc_names, ensure_ascii=False))
-
-                if media_sections:
-                    context += "\n\n" + "\n\n".join(media_sections)
-
-        except Exception:
-            pass
-
+    agent_name = _agent_data.get("name", "unknown") if agent_id and _agent_data else "default"
+    media_context = _media_inventory(_agent_data, agent_id)
+    plan = plan_prompt(
+        safe_question,
+        docs,
+        conversation_history,
+        media_context=media_context or "",
+        max_messages=max_history,
+        model_key=model_selection,
+    )
+    context, history = plan.context, plan.history
 
     answer = invoke_chain(
         safe_question,
@@ -381,6 +345,7 @@ def process_question(
         channel_type=channel_type,
         query_tokens=query_tokens,
         rag_query_tokens=rag_query_tokens,
+        agent_context=plan.agent_context,
     )
     answer = enforce_canonical_media_tags(answer)
 
@@ -395,25 +360,295 @@ def process_question(
     save_message("user", safe_question, agent_id=agent_id)
     save_message("assistant", answer, agent_id=agent_id)
 
-    try:
-        from .clickhouse import log_chat_to_clickhouse
+    _log_chat_event(
+        agent_id, question, answer, request_id, session_id, user_id, response_status,
+        out_reason if response_status == "blocked" else None,
+    )
+    return answer
 
-        log_chat_to_clickhouse(
+
+async def _aprepare_turn(
+    question: str,
+    agent_id: Optional[str],
+    conversation_history: Optional[List[Dict]],
+    max_history: int,
+    model_selection: Optional[str],
+    rerank: Optional[bool],
+    request_id: Optional[str],
+    session_id: Optional[str],
+    user_id: Optional[str],
+    channel_name: str,
+    channel_type: str,
+    agent: Optional[Dict],
+) -> Dict:
+    """
+    Everything before the LLM call for the async turn handlers.
+
+    Returns {"answer": ...} when the turn is already settled (blocked input,
+    scripted reply, cache hit; persisted and logged), otherwise the prompt
+    inputs for ainvoke_chain/astream_chain.
+    """
+    started_at = time.perf_counter()
+    is_valid, reason = validate_input(question)
+    if not is_valid:
+        blocked_answer = f"Request Blocked: {reason}"
+        _log_chat_event(agent_id, question, blocked_answer, request_id, session_id, user_id, "blocked", reason)
+        return {"answer": blocked_answer, "status": "blocked"}
+
+    safe_question = mask_pii(question)
+    if not tokenizer_ready():
+        # Loading (or downloading) a tokenizer must not stall the event loop.
+        await run_blocking(get_tokenizer)
+    query_tokens = estimate_tokens(question)
+    rag_query_tokens = estimate_tokens(safe_question)
+    usage_ctx = dict(
+        query_tokens=query_tokens,
+        rag_query_tokens=rag_query_tokens,
+        started_at=started_at,
+        request_id=request_id,
+        session_id=session_id,
+        user_id=user_id,
+        channel_name=channel_name,
+        channel_type=channel_type,
+    )
+
+    _agent_data: Optional[Dict] = agent
+    if agent_id and _agent_data is None:
+        try:
+            _agent_data = await run_blocking(get_agent, agent_id)
+        except Exception:
+            pass
+
+    scripted_reply = _rule_based_agent_reply(question, agent_id, agent=_agent_data)
+    if scripted_reply:
+        scripted_reply = enforce_canonical_media_tags(scripted_reply)
+        await asave_message("user", safe_question, agent_id=agent_id)
+        await asave_message("assistant", scripted_reply, agent_id=agent_id)
+        _log_chat_event(agent_id, question, scripted_reply, request_id, session_id, user_id, "rule_based")
+        _log_shortcut_usage(agent_id, "conversation_rule", status="rule_based", **usage_ctx)
+        return {"answer": scripted_reply, "status": "rule_based"}
+
+    # Query embedding dominates the cache probe, so it runs on the CPU pool.
+    cached = await run_cpu_bound(check_cache, safe_question, agent_id)
+    if cached:
+        cached = enforce_canonical_media_tags(cached)
+        await asave_message("user", safe_question, agent_id=agent_id)
+        await asave_message("assistant", cached, agent_id=agent_id)
+        _log_chat_event(agent_id, question, cached, request_id, session_id, user_id, "cached")
+        _log_shortcut_usage(agent_id, model_selection or "cache", status="cached", **usage_ctx)
+        return {"answer": cached, "status": "cached"}
+
+    from .agent_manager import resolve_retrieval_config
+    _ret_cfg = resolve_retrieval_config(agent_id, agent=_agent_data) if agent_id else {}
+    _effective_top_k = _ret_cfg.get("top_k", 2) if _ret_cfg else 2
+    _effective_rerank = rerank if rerank is not None else _ret_cfg.get("use_reranker")
+    _effective_reranker_model = _ret_cfg.get("reranker_model") if _ret_cfg else None
+    docs = await ahybrid_search(
+        safe_question,
+        agent_id=agent_id,
+        top_k=_effective_top_k,
+        use_hybrid=_ret_cfg.get("use_hybrid_search"),
+        rerank=_effective_rerank,
+        reranker_model=_effective_reranker_model,
+    )
+    agent_name = _agent_data.get("name", "unknown") if agent_id and _agent_data else "default"
+    media_context = await run_blocking(_media_inventory, _agent_data, agent_id)
+    plan = await run_cpu_bound(
+        plan_prompt,
+        safe_question,
+        docs,
+        conversation_history,
+        media_context=media_context or "",
+        max_messages=max_history,
+        model_key=model_selection,
+    )
+    context, history = plan.context, plan.history
+
+    return {
+        "safe_question": safe_question,
+        "llm_args": (safe_question, context, history),
+        "llm_kwargs": dict(
             agent_id=agent_id,
-            user_message=question,
-            assistant_message=answer,
+            agent_name=agent_name,
+            model_key=model_selection,
             request_id=request_id,
             session_id=session_id,
             user_id=user_id,
-            status=response_status,
-            error=out_reason if response_status == "blocked" else None,
-        )
-    except Exception:
-        pass
+            channel_name=channel_name,
+            channel_type=channel_type,
+            query_tokens=query_tokens,
+            rag_query_tokens=rag_query_tokens,
+            agent_context=plan.agent_context,
+        ),
+    }
+
+
+async def _afinish_turn(
+    turn: Dict,
+    question: str,
+    answer: str,
+    agent_id: Optional[str],
+    request_id: Optional[str],
+    session_id: Optional[str],
+    user_id: Optional[str],
+    blocked_reason: Optional[str] = None,
+) -> Tuple[str, str]:
+    """Output guardrail, cache write, persistence and chat log. Returns (answer, status)."""
+    safe_question = turn["safe_question"]
+    answer = enforce_canonical_media_tags(answer)
 
+    response_status = "success"
+    out_reason = blocked_reason
+    if out_reason is None:
+        is_valid_out, reason = validate_output(answer)
+        out_reason = None if is_valid_out else reason
+    if out_reason is not None:
+        response_status = "blocked"
+        answer = f"Response Blocked: {out_reason}"
+    else:
+        await run_cpu_bound(save_to_cache, safe_question, answer, agent_id)
+
+    await asave_message("user", safe_question, agent_id=agent_id)
+    await asave_message("assistant", answer, agent_id=agent_id)
+
+    _log_chat_event(
+        agent_id, question, answer, request_id, session_id, user_id, response_status,
+        out_reason if response_status == "blocked" else None,
+    )
+    return answer, response_status
+
+
+@with_query_embedding_scope
+async def aprocess_question(
+    question: str,
+    agent_id: str = None,
+    conversation_history: List[Dict] = None,
+    max_history: int = 5,
+    verbosity: str = "medium",
+    model_selection: str = None,
+    rerank: Optional[bool] = None,
+    request_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    channel_name: str = "web",
+    channel_type: str = "UTILITY",
+    agent: Optional[Dict] = None,
+) -> str:
+    """
+    Async process_question for event-loop callers (/query, /ws/chat).
+
+    Same turn semantics as process_question; DB and retrieval stages are
+    awaited or offloaded to bounded pools and the LLM call is awaited natively.
+    """
+    turn = await _aprepare_turn(
+        question, agent_id, conversation_history, max_history, model_selection, rerank,
+        request_id, session_id, user_id, channel_name, channel_type, agent,
+    )
+    if "answer" in turn:
+        return turn["answer"]
+
+    answer = await ainvoke_chain(*turn["llm_args"], verbosity=verbosity, **turn["llm_kwargs"])
+    answer, _ = await _afinish_turn(turn, question, answer, agent_id, request_id, session_id, user_id)
     return answer
 
 
+async def astream_question(
+    question: str,
+    agent_id: str = None,
+    conversation_history: List[Dict] = None,
+    max_history: int = 5,
+    verbosity: str = "medium",
+    model_selection: str = None,
+    rerank: Optional[bool] = None,
+    request_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    channel_name: str = "web",
+    channel_type: str = "UTILITY",
+    agent: Optional[Dict] = None,
+) -> AsyncIterator[Dict]:
+    """
+    Streaming aprocess_question. Yields events:
+
+    - {"type": "delta", "content": ...}: answer text, media tags normalized
+      and always whole (see MediaTagStream);
+    - {"type": "blocked", "reason": ...}: the output guardrail tripped; text
+      already sent must be replaced by the final answer;
+    - {"type": "done", "answer": ..., "status": ...}: final answer as stored
+      in history, once persistence and logging are done.
+    """
+    with query_embedding_scope() as turn_vectors:
+        turn = await _aprepare_turn(
+            question, agent_id, conversation_history, max_history, model_selection, rerank,
+            request_id, session_id, user_id, channel_name, channel_type, agent,
+        )
+    if "answer" in turn:
+        yield {"type": "delta", "content": turn["answer"]}
+        yield {"type": "done", "answer": turn["answer"], "status": turn["status"]}
+        return
+
+    guard = OutputStreamGuard()
+    tags = MediaTagStream()
+    raw_parts: List[str] = []
+    finishing = False
+    try:
+        async with aclosing(astream_chain(*turn["llm_args"], verbosity=verbosity, **turn["llm_kwargs"])) as deltas:
+            async for delta in deltas:
+                raw_parts.append(delta)
+                text = tags.feed(guard.feed(delta))
+                if guard.blocked_reason is not None:
+                    # Stop generating: nothing past this point can be released anyway.
+                    yield {"type": "blocked", "reason": guard.blocked_reason}
+                    break
+                if text:
+                    yield {"type": "delta", "content": text}
+        if guard.blocked_reason is None:
+            text = tags.feed(guard.finish()) + tags.finish()
+            if text:
+                yield {"type": "delta", "content": text}
+
+        finishing = True
+        # Same scope as the prepare stage: the cache insert reuses the question's vector.
+        with query_embedding_scope(turn_vectors):
+            answer, status = await _afinish_turn(
+                turn, question, "".join(raw_parts), agent_id, request_id, session_id, user_id,
+                blocked_reason=guard.blocked_reason,
+            )
+        yield {"type": "done", "answer": answer, "status": status}
+    except (GeneratorExit, asyncio.CancelledError):
+        if not finishing:
+            # The client went away mid-answer: there is no loop left to await
+            # on, so the partial turn is persisted from the I/O pool.
+            submit_with_context(
+                get_io_executor(), _persist_cancelled_turn,
+                turn, question, "".join(raw_parts), agent_id, request_id, session_id, user_id,
+            )
+        raise
+
+
+def _persist_cancelled_turn(
+    turn: Dict,
+    question: str,
+    partial_answer: str,
+    agent_id: Optional[str],
+    request_id: Optional[str],
+    session_id: Optional[str],
+    user_id: Optional[str],
+) -> None:
+    """History and chat log for a stream the client closed early (never cached)."""
+    try:
+        answer = enforce_canonical_media_tags(partial_answer)
+        is_valid_out, out_reason = validate_output(answer)
+        if not is_valid_out:
+            answer = f"Response Blocked: {out_reason}"
+        save_message("user", turn["safe_question"], agent_id=agent_id)
+        if answer:
+            save_message("assistant", answer, agent_id=agent_id)
+        _log_chat_event(agent_id, question, answer, request_id, session_id, user_id, "cancelled")
+    except Exception as e:
+        print(f"[WARN] Failed to persist cancelled turn: {e}")
+
+
 def _resolve_agent_storage_dir(agent_id: str, agent_name: str) -> str:
     safe_name = (agent_name or "").strip().replace(" ", "_").lower() or str(agent_id)
     tmp_root = os.path.join(tempfile.gettempdir(), "omnicortex_agents")
@@ -461,14 +696,53 @@ def save_text_to_file(agent_id: str, filename: str, text: str):
         print(f"[WARN] Failed to save file: {e}")
 
 
-def process_documents(files=None, text_input: str = None, agent_id: str = None) -> Dict:
-    """Process and index documents, updating omni_documents.status transitions."""
+def process_documents(
+    files=None,
+    text_input: str = None,
+    agent_id: str = None,
+    progress: Optional[Callable[..., None]] = None,
+) -> Dict:
+    """Process and index documents, updating omni_documents.status transitions.
+
+    progress(stage, fraction, **info) is called between stages and after each
+    embedding batch (used by core.ingest_queue for status and cancellation).
+    """
+    def _report(stage: str, fraction: float, **info) -> None:
+        if progress is not None:
+            progress(stage, fraction, **info)
+
     result = {"success": False, "warning": None, "error": None}
     raw_text = ""
-    processed_files: List[Dict] = []
+    # (document row fields, (child, parent) pairs) per source, in upload order.
+    sources: List[tuple] = []
 
     if files:
-        extracted_files, skipped = extract_text_from_files(files)
+        files = list(files)
+        skipped: List[tuple] = []
+        failed_uploads: Set[int] = set()
+        # Keyed by upload index so two uploads with the same filename stay separate.
+        file_names: Dict[int, str] = {}
+        file_parts: Dict[int, List[str]] = {}
+        # Chunking consumes extracted segments as they arrive from the extraction pool;
+        # each file gets its own splitter so parents never straddle two documents.
+        splitters: Dict[int, ParentChildStream] = {}
+        file_pairs: Dict[int, List[tuple]] = {}
+        for index, filename, segment in stream_indexed_text_from_files(files, skipped, failed_uploads):
+            if index not in file_parts:
+                file_names[index] = filename
+                file_parts[index] = []
+                splitters[index] = ParentChildStream()
+                file_pairs[index] = []
+                _report("extracting", 0.05)
+            file_parts[index].append(segment)
+            file_pairs[index].extend(splitters[index].feed(segment))
+
+        # Files that failed part-way are reported in `skipped`, not half-indexed.
+        extracted_files = []
+        for index, parts in file_parts.items():
+            text = "".join(parts)
+            if index not in failed_uploads and text.strip():
+                extracted_files.append((index, text))
         combined_text = "\n\n".join([t for _, t in extracted_files])
         validation = validate_extraction(combined_text, skipped)
 
@@ -480,84 +754,102 @@ def process_documents(files=None, text_input: str = None, agent_id: str = None)
 
         raw_text += combined_text
 
-        for filename, text in extracted_files:
+        for index, text in extracted_files:
             if agent_id:
-                save_text_to_file(agent_id, filename, text)
-            file_obj = next(
-                (f for f in files if getattr(f, "filename", getattr(f, "name", "")) == filename),
-                None,
-            )
-            if file_obj:
-                processed_files.append(get_file_info(file_obj))
+                save_text_to_file(agent_id, file_names[index], text)
+            pairs = file_pairs[index] + splitters[index].finish()
+            info = get_file_info(files[index])
+            sources.append(({
+                "filename": info["filename"],
+                "file_type": info["type"],
+                "file_size": info["size"],
+                "content_preview": text[:500],
+                "extra_data": info.get("metadata", {}),
+            }, pairs))
 
     if text_input and text_input.strip():
         raw_text += "\n" + text_input
+        splitter = ParentChildStream()
+        pairs = splitter.feed(text_input) + splitter.finish()
+        sources.append(({
+            "filename": "[Pasted Text]",
+            "file_type": "text",
+            "file_size": len(text_input.encode("utf-8")),
+            "content_preview": text_input[:500],
+        }, pairs))
         if agent_id:
             save_text_to_file(agent_id, "pasted_text.txt", text_input)
 
     if not raw_text.strip():
         result["error"] = "No content to process"
         return result
-
-    pairs = parent_child_split(raw_text)
-    unique_parents = list(dict.fromkeys(parent for _, parent in pairs))
-    from .database import batch_save_parent_chunks
+    _report("extracted", 0.2)
+
+    # Children of one parent share the parent string object; group consecutive runs.
+    grouped: List[List[tuple]] = []
+    for fields, pairs in sources:
+        parents: List[tuple] = []
+        for child, parent in pairs:
+            if parents and parents[-1][0] is parent:
+                parents[-1][1].append(child)
+            else:
+                parents.append((parent, [child]))
+        grouped.append(parents)
+    parent_total = sum(len(parents) for parents in grouped)
+    _report("chunked", 0.3)
 
     doc_ids: List[int] = []
+    source_doc_ids: Dict[int, int] = {}
+    parent_ids: List[List[Optional[int]]] = [[None] * len(parents) for parents in grouped]
     if agent_id:
-        db = SessionLocal()
+        rows = [
+            (i, dict(fields, parents=[parent for parent, _ in grouped[i]]))
+            for i, (fields, _) in enumerate(sources)
+            if fields is not None
+        ]
         try:
-            for info in processed_files:
-                doc = Document(
-                    agent_id=agent_id,
-                    filename=info["filename"],
-                    file_type=info["type"],
-                    file_size=info["size"],
-                    content_preview=raw_text[:500],
-                    chunk_count=0,
-                    extra_data=info.get("metadata", {}),
-                    status="indexing",
-                )
-                db.add(doc)
-                db.commit()
-                db.refresh(doc)
-                doc_ids.append(doc.id)
-
-            if text_input and text_input.strip():
-                doc = Document(
-                    agent_id=agent_id,
-                    filename="[Pasted Text]",
-                    file_type="text",
-                    file_size=len(text_input.encode("utf-8")),
-                    content_preview=text_input[:500],
-                    chunk_count=0,
-                    status="indexing",
-                )
-                db.add(doc)
-                db.commit()
-                db.refresh(doc)
-                doc_ids.append(doc.id)
+            saved = save_ingested_documents(agent_id, [doc for _, doc in rows])
         except Exception as e:
-            print(f"[WARN] Failed to pre-create document rows: {e}")
-        finally:
-            db.close()
+            print(f"[ERROR] Document persistence failed: {e}")
+            result["error"] = f"Failed to save documents: {e}"
+            return result
+        for (i, _), entry in zip(rows, saved):
+            doc_ids.append(entry["id"])
+            source_doc_ids[i] = entry["id"]
+            parent_ids[i] = entry["parent_ids"]
 
-    parent_id_map = {}
-    if agent_id and unique_parents:
-        source_doc_id = doc_ids[0] if doc_ids else None
-        parent_id_map = batch_save_parent_chunks(unique_parents, source_doc_id=source_doc_id)
+    _report("documents", 0.35, document_ids=list(doc_ids))
 
     chunks = []
     metadatas = []
-    for child, parent in pairs:
-        chunks.append(child)
-        parent_id = parent_id_map.get(parent)
-        metadatas.append({"parent_id": parent_id} if parent_id else {})
+    doc_chunk_counts: Dict[int, int] = {}
+    for i, parents in enumerate(grouped):
+        doc_id = source_doc_ids.get(i)
+        for (parent, children), parent_id in zip(parents, parent_ids[i]):
+            for child in children:
+                chunks.append(child)
+                metadata = {}
+                if parent_id:
+                    metadata["parent_id"] = parent_id
+                if doc_id:
+                    metadata["document_id"] = doc_id
+                metadatas.append(metadata)
+            if doc_id:
+                doc_chunk_counts[doc_id] = doc_chunk_counts.get(doc_id, 0) + len(children)
+
+    _report("parents", 0.4)
 
     t0 = time.time()
     status = "ready"
     try:
-        create_vector_store(chunks, agent_id=agent_id, metadatas=metadatas)
+        create_vector_store(
+            chunks,
+            agent_id=agent_id,
+            metadatas=metadatas,
+            on_batch=(lambda done, total: _report("embedding", 0.4 + 0.55 * done / max(total, 1)))
+            if progress is not None
+            else None,
+        )
     except Exception as e:
         status = "error"
         result["error"] = str(e)
@@ -565,18 +857,15 @@ def process_documents(files=None, text_input: str = None, agent_id: str = None)
     embedding_duration = time.time() - t0
 
     if agent_id and doc_ids:
-        db = SessionLocal()
-        try:
-            for doc_id in doc_ids:
-                doc = db.query(Document).filter(Document.id == doc_id).first()
-                if not doc:
-                    continue
-                doc.status = status
-                doc.embedding_time = embedding_duration
-                doc.chunk_count = len(chunks) // max(len(doc_ids), 1)
-            db.commit()
-        finally:
-            db.close()
+        finish_ingested_documents([
+            {
+                "id": doc_id,
+                "status": status,
+                "embedding_time": embedding_duration,
+                "chunk_count": doc_chunk_counts.get(doc_id, 0),
+            }
+            for doc_id in doc_ids
+        ])
 
         if status == "ready":
             update_agent_metadata(agent_id, document_count=len(doc_ids))
@@ -585,7 +874,7 @@ def process_documents(files=None, text_input: str = None, agent_id: str = None)
 
     result["vector_store"] = f"omni_agent_{agent_id}" if agent_id else "omni_default"
     result["vector_chunks"] = len(chunks)
-    result["parent_chunks"] = len(unique_parents)
+    result["parent_chunks"] = parent_total
     result["document_rows"] = len(doc_ids)
     result["success"] = status == "ready"
     return result
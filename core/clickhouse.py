@@ -4,6 +4,23 @@ ClickHouse analytics writer.
 No-role chat model:
 - One row per turn in ChatArchive.
 - content stores JSON string: {"user": "...", "ai": "..."}.
+
+Delivery:
+- Rows are appended to a local spool of JSON-lines segment files
+  (CLICKHOUSE_SPOOL_PATH), one open segment per table and process. Request
+  threads only do a buffered file append; nothing is dropped while
+  ClickHouse is unreachable and nothing is lost if the process dies.
+- Segments are sealed at CLICKHOUSE_BATCH_SIZE rows or after
+  CLICKHOUSE_FLUSH_INTERVAL, and a background thread inserts them oldest
+  first, deleting each file only after its insert succeeded.
+- Failed inserts back off exponentially up to CLICKHOUSE_RETRY_MAX_BACKOFF.
+  A segment ClickHouse rejects permanently (bad value, schema mismatch,
+  non-retryable server error code, or CLICKHOUSE_MAX_SEGMENT_ATTEMPTS
+  unexplained failures) is renamed to .dead and skipped, so it cannot hold
+  back later rows (omnicortex_clickhouse_rows_total{result="dead"}).
+- Above CLICKHOUSE_SPOOL_MAX_BYTES new rows are rejected (counted in
+  omnicortex_clickhouse_rows_total{result="dropped"}) instead of growing the
+  disk without bound.
 """
 
 from __future__ import annotations
@@ -11,6 +28,7 @@ from __future__ import annotations
 import json
 import logging
 import os
+import re
 import threading
 import time
 import uuid
@@ -18,18 +36,26 @@ import zlib
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
+from .monitoring import (
+    CLICKHOUSE_RETRY_BACKOFF,
+    CLICKHOUSE_ROWS,
+    CLICKHOUSE_SPOOL_BYTES,
+    CLICKHOUSE_SPOOL_DEAD_SEGMENTS,
+    CLICKHOUSE_SPOOL_SEGMENTS,
+)
+
 logger = logging.getLogger(__name__)
 
 _CLIENT = None
 _CLIENT_LOCK = threading.Lock()
 
-_USAGE_BUFFER: List[List[Any]] = []
-_CHAT_BUFFER: List[List[Any]] = []
-_AGENT_EVENT_BUFFER: List[List[Any]] = []
-_BUFFER_LOCK = threading.Lock()
+_SPOOL: Optional["_Spool"] = None
+_SPOOL_LOCK = threading.Lock()
 
 _FLUSHER_STARTED = False
 _FLUSHER_LOCK = threading.Lock()
+_FLUSH_WAKE = threading.Event()
+_SEND_LOCK = threading.Lock()
 
 _ZERO_UUID = uuid.UUID("00000000-0000-0000-0000-000000000000")
 _I32_MIN = -(2**31)
@@ -87,6 +113,12 @@ _AGENT_EVENT_COLS = [
     "Error",
 ]
 
+_TABLE_COLUMNS = {
+    "UsageLogs": _USAGE_COLS,
+    "ChatArchive": _CHAT_COLS,
+    "AgentLogs": _AGENT_EVENT_COLS,
+}
+
 _ALLOWED_CHANNEL_NAMES = {"TEXT", "VOICE"}
 _TEXT_CHANNEL_TYPES = {"UTILITY", "MARKETING", "AUTHENTICATION"}
 _VOICE_CHANNEL_TYPES = {"PROMOTIONAL", "TRANSACTIONAL"}
@@ -147,11 +179,31 @@ def _clickhouse_flush_interval() -> float:
         return 1.5
 
 
-def _clickhouse_max_buffer_rows() -> int:
+def _clickhouse_spool_path() -> str:
+    from .config import STORAGE_PATH
+
+    return os.getenv("CLICKHOUSE_SPOOL_PATH", "").strip() or os.path.join(STORAGE_PATH, "spool", "clickhouse")
+
+
+def _clickhouse_spool_max_bytes() -> int:
     try:
-        return max(100, int(os.getenv("CLICKHOUSE_MAX_BUFFER_ROWS", "5000")))
+        return max(1024 * 1024, int(os.getenv("CLICKHOUSE_SPOOL_MAX_BYTES", str(1024 ** 3))))
     except Exception:
-        return 5000
+        return 1024 ** 3
+
+
+def _clickhouse_retry_max_backoff() -> float:
+    try:
+        return max(1.0, float(os.getenv("CLICKHOUSE_RETRY_MAX_BACKOFF", "60")))
+    except Exception:
+        return 60.0
+
+
+def _clickhouse_max_segment_attempts() -> int:
+    try:
+        return max(1, int(os.getenv("CLICKHOUSE_MAX_SEGMENT_ATTEMPTS", "10")))
+    except Exception:
+        return 10
 
 
 def _safe_positive_float(value: Optional[Any], default: float) -> float:
@@ -311,9 +363,24 @@ def _start_flusher_once() -> None:
 
 
 def _flush_worker() -> None:
+    backoff = 0.0
     while True:
-        time.sleep(_clickhouse_flush_interval())
-        _flush_buffers()
+        if backoff:
+            # Full segments keep waking us; don't hammer a ClickHouse that is down.
+            time.sleep(backoff)
+        else:
+            _FLUSH_WAKE.wait(_clickhouse_flush_interval())
+        _FLUSH_WAKE.clear()
+        try:
+            delivered = _flush_spool()
+        except Exception as exc:
+            logger.warning("ClickHouse flusher error: %s", exc)
+            delivered = False
+        if delivered:
+            backoff = 0.0
+        else:
+            backoff = min(_clickhouse_retry_max_backoff(), max(1.0, backoff * 2))
+        CLICKHOUSE_RETRY_BACKOFF.set(backoff)
 
 
 def get_clickhouse_client():
@@ -374,67 +441,304 @@ def get_clickhouse_client():
             return None
 
 
-def _append_row(buffer_ref: List[List[Any]], row: List[Any], buffer_name: str) -> None:
-    if not _clickhouse_enabled():
-        return
+# =============================================================================
+# DISK SPOOL
+# =============================================================================
 
-    _start_flusher_once()
-    should_flush = False
-    with _BUFFER_LOCK:
-        buffer_ref.append(row)
-        max_rows = _clickhouse_max_buffer_rows()
-        if len(buffer_ref) > max_rows:
-            overflow = len(buffer_ref) - max_rows
-            del buffer_ref[:overflow]
-            logger.warning("ClickHouse %s buffer overflow, dropped %s rows", buffer_name, overflow)
-        should_flush = len(buffer_ref) >= _clickhouse_batch_size()
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, uuid.UUID):
+        return {"$uuid": str(value)}
+    return value
 
-    if should_flush:
-        _flush_buffers()
 
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "$dt" in value:
+            return datetime.fromisoformat(value["$dt"])
+        if "$uuid" in value:
+            return uuid.UUID(value["$uuid"])
+    return value
 
-def _flush_buffers() -> None:
-    if not _clickhouse_enabled():
-        return
 
-    with _BUFFER_LOCK:
-        usage_rows = list(_USAGE_BUFFER)
-        chat_rows = list(_CHAT_BUFFER)
-        agent_event_rows = list(_AGENT_EVENT_BUFFER)
-        _USAGE_BUFFER.clear()
-        _CHAT_BUFFER.clear()
-        _AGENT_EVENT_BUFFER.clear()
+class _Spool:
+    """Append-only JSON-lines segments: <table>.<created_ns>.<pid>.{open,seg,sending}.
 
-    if not usage_rows and not chat_rows and not agent_event_rows:
-        return
+    .open is being appended to by its process, .seg is sealed and waiting,
+    .sending is claimed by a flusher (renames are atomic, so several worker
+    processes can share one directory), .dead was rejected by ClickHouse and
+    is kept for inspection outside the size cap.
+    """
 
-    client = get_clickhouse_client()
-    if client is None:
-        logger.warning(
-            "ClickHouse unavailable; dropping %s usage, %s chat, %s agent_event rows",
-            len(usage_rows),
-            len(chat_rows),
-            len(agent_event_rows),
-        )
-        return
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._open: Dict[str, Dict[str, Any]] = {}
+        self._bytes = 0
+        self._rescanned = 0.0
+        self._recover()
 
-    if usage_rows:
-        try:
-            client.insert("UsageLogs", usage_rows, column_names=_USAGE_COLS)
-        except Exception as exc:
-            logger.warning("ClickHouse UsageLogs insert failed: %s", exc)
+    # -- bookkeeping ---------------------------------------------------------
 
-    if chat_rows:
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
         try:
-            client.insert("ChatArchive", chat_rows, column_names=_CHAT_COLS)
-        except Exception as exc:
-            logger.warning("ClickHouse ChatArchive insert failed: %s", exc)
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except Exception:
+            return True
+        return True
 
-    if agent_event_rows:
+    def _recover(self) -> None:
+        """Seal segments left open/claimed by processes that are gone.
+
+        Segments named with our own PID are sealed too: this process has none
+        open yet, so they belong to a crashed predecessor that had the same
+        PID (containers usually restart as PID 1).
+        """
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            parts = name.split(".")
+            if len(parts) != 4:
+                continue
+            table, created, pid, state = parts
+            if state not in {"open", "sending"}:
+                continue
+            try:
+                owner = int(pid)
+            except ValueError:
+                continue  # Not one of ours.
+            if owner != os.getpid() and self._pid_alive(owner):
+                continue
+            try:
+                os.replace(path, os.path.join(self.root, f"{table}.{created}.{pid}.seg"))
+            except FileNotFoundError:
+                pass  # Another process recovered it first.
+        self.rescan()
+
+    def _disk_bytes(self) -> int:
+        total = 0
+        for name in os.listdir(self.root):
+            if name.endswith(".dead"):
+                continue
+            try:
+                total += os.path.getsize(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass  # Delivered by another process meanwhile.
+        return total
+
+    def rescan(self) -> None:
+        """Re-measure the directory: other processes deliver and delete segments too."""
+        size = self._disk_bytes()
+        with self._lock:
+            self._bytes = size
+            self._rescanned = time.monotonic()
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        names = os.listdir(self.root)
+        CLICKHOUSE_SPOOL_BYTES.set(self._bytes)
+        CLICKHOUSE_SPOOL_SEGMENTS.set(sum(1 for name in names if name.endswith(".seg")))
+        CLICKHOUSE_SPOOL_DEAD_SEGMENTS.set(sum(1 for name in names if name.endswith(".dead")))
+
+    # -- writers -------------------------------------------------------------
+
+    def append(self, table: str, row: List[Any]) -> bool:
+        line = (json.dumps([_encode_value(v) for v in row], ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self._bytes + len(line) > _clickhouse_spool_max_bytes():
+                # The local count only shrinks for segments this process
+                # delivered; re-measure (at most once a second) before refusing.
+                if time.monotonic() - self._rescanned < 1.0:
+                    return False
+                self._bytes = self._disk_bytes()
+                self._rescanned = time.monotonic()
+                if self._bytes + len(line) > _clickhouse_spool_max_bytes():
+                    return False
+            segment = self._open.get(table)
+            if segment is None:
+                path = os.path.join(self.root, f"{table}.{time.time_ns():020d}.{os.getpid()}.open")
+                segment = {"path": path, "handle": open(path, "ab"), "rows": 0, "opened": time.monotonic()}
+                self._open[table] = segment
+            segment["handle"].write(line)
+            # Hand the bytes to the OS: a crashed process loses nothing already appended.
+            segment["handle"].flush()
+            segment["rows"] += 1
+            self._bytes += len(line)
+            full = segment["rows"] >= _clickhouse_batch_size()
+            if full:
+                self._seal_locked(table)
+        CLICKHOUSE_SPOOL_BYTES.set(self._bytes)
+        if full:
+            _FLUSH_WAKE.set()
+        return True
+
+    def _seal_locked(self, table: str) -> None:
+        segment = self._open.pop(table, None)
+        if segment is None:
+            return
+        segment["handle"].close()
+        os.replace(segment["path"], segment["path"][: -len(".open")] + ".seg")
+
+    def seal(self, max_age: float = 0.0) -> None:
+        """Seal open segments older than max_age seconds (0 = all)."""
+        now = time.monotonic()
+        with self._lock:
+            for table in list(self._open):
+                if now - self._open[table]["opened"] >= max_age:
+                    self._seal_locked(table)
+
+    # -- flusher -------------------------------------------------------------
+
+    def sealed(self) -> List[str]:
+        names = [name for name in os.listdir(self.root) if name.endswith(".seg")]
+        return [os.path.join(self.root, name) for name in sorted(names, key=lambda n: n.split(".")[1])]
+
+    def claim(self, path: str) -> Optional[str]:
+        base = os.path.basename(path).split(".")
+        claimed = os.path.join(self.root, f"{base[0]}.{base[1]}.{os.getpid()}.sending")
         try:
-            client.insert("AgentLogs", agent_event_rows, column_names=_AGENT_EVENT_COLS)
-        except Exception as exc:
-            logger.warning("ClickHouse AgentLogs insert failed: %s", exc)
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            return None  # Another process took it.
+        return claimed
+
+    def release(self, claimed: str) -> None:
+        os.replace(claimed, claimed[: -len(".sending")] + ".seg")
+
+    def bury(self, claimed: str) -> None:
+        """Park a segment ClickHouse will never accept; it no longer counts towards the cap."""
+        size = os.path.getsize(claimed)
+        os.replace(claimed, claimed[: -len(".sending")] + ".dead")
+        with self._lock:
+            self._bytes = max(0, self._bytes - size)
+        self._update_gauges()
+
+    def read(self, claimed: str):
+        table = os.path.basename(claimed).split(".")[0]
+        rows = []
+        with open(claimed, "rb") as handle:
+            for raw in handle:
+                try:
+                    rows.append([_decode_value(v) for v in json.loads(raw)])
+                except ValueError:
+                    # Torn final line from a crash mid-write.
+                    logger.warning("Skipping unreadable ClickHouse spool line in %s", claimed)
+        return table, rows
+
+    def remove(self, claimed: str) -> None:
+        size = os.path.getsize(claimed)
+        os.remove(claimed)
+        with self._lock:
+            self._bytes = max(0, self._bytes - size)
+        self._update_gauges()
+
+
+def _get_spool() -> "_Spool":
+    global _SPOOL
+    if _SPOOL is None:
+        with _SPOOL_LOCK:
+            if _SPOOL is None:
+                _SPOOL = _Spool(_clickhouse_spool_path())
+    return _SPOOL
+
+
+def _append_row(table: str, row: List[Any]) -> None:
+    if not _clickhouse_enabled():
+        return
+
+    _start_flusher_once()
+    try:
+        spooled = _get_spool().append(table, row)
+    except Exception as exc:
+        logger.warning("ClickHouse spool write failed for %s: %s", table, exc)
+        spooled = False
+    CLICKHOUSE_ROWS.labels(table=table, result="spooled" if spooled else "dropped").inc()
+
+
+# Server error codes worth retrying unchanged: overload, timeouts, network,
+# replication/keeper trouble, read-only tables, auth/config being fixed.
+_RETRYABLE_CODES = {
+    3, 159, 164, 202, 203, 209, 210, 241, 242, 252, 285, 319, 425, 497, 516, 999, 1000,
+}
+_CODE_RE = re.compile(r"Code:\s*(\d+)")
+_SEGMENT_FAILURES: Dict[str, int] = {}
+
+
+def _insert_error_kind(exc: Exception) -> str:
+    """'transient' (retry, ClickHouse unreachable/busy), 'permanent' (rows rejected) or 'unknown'."""
+    if isinstance(exc, (ConnectionError, TimeoutError, OSError)) or type(exc).__name__ == "OperationalError":
+        return "transient"
+    if isinstance(exc, (TypeError, ValueError, OverflowError, KeyError, IndexError)):
+        return "permanent"  # The row cannot even be serialized.
+    if type(exc).__name__ in {"DataError", "ProgrammingError"}:
+        return "permanent"
+    match = _CODE_RE.search(str(exc))
+    if match:
+        return "transient" if int(match.group(1)) in _RETRYABLE_CODES else "permanent"
+    return "unknown"
+
+
+def _flush_spool() -> bool:
+    """Insert sealed segments oldest first. Returns False if a delivery must be retried."""
+    spool = _get_spool()
+    spool.seal(max_age=_clickhouse_flush_interval())
+    spool.rescan()
+    with _SEND_LOCK:
+        pending = spool.sealed()
+        if not pending:
+            return True
+        client = get_clickhouse_client()
+        if client is None:
+            logger.warning("ClickHouse unavailable; %s spooled segments kept for retry", len(pending))
+            return False
+
+        for path in pending:
+            claimed = spool.claim(path)
+            if claimed is None:
+                continue
+            segment = ".".join(os.path.basename(claimed).split(".")[:2])
+            table, rows = spool.read(claimed)
+            columns = _TABLE_COLUMNS.get(table)
+            if columns is None or not rows:
+                spool.remove(claimed)
+                continue
+            try:
+                client.insert(table, rows, column_names=columns)
+            except Exception as exc:
+                kind = _insert_error_kind(exc)
+                if kind == "unknown":
+                    _SEGMENT_FAILURES[segment] = _SEGMENT_FAILURES.get(segment, 0) + 1
+                    if _SEGMENT_FAILURES[segment] >= _clickhouse_max_segment_attempts():
+                        kind = "permanent"
+                if kind == "permanent":
+                    _SEGMENT_FAILURES.pop(segment, None)
+                    spool.bury(claimed)
+                    CLICKHOUSE_ROWS.labels(table=table, result="dead").inc(len(rows))
+                    logger.warning("ClickHouse rejected %s segment %s (%s rows parked as .dead): %s", table, segment, len(rows), exc)
+                    continue
+                spool.release(claimed)
+                logger.warning("ClickHouse %s insert failed (%s rows kept): %s", table, len(rows), exc)
+                return False
+            _SEGMENT_FAILURES.pop(segment, None)
+            spool.remove(claimed)
+            CLICKHOUSE_ROWS.labels(table=table, result="inserted").inc(len(rows))
+        return True
+
+
+def flush_clickhouse() -> bool:
+    """Seal everything and try one delivery pass (API shutdown)."""
+    if not _clickhouse_enabled() or _SPOOL is None:
+        return True
+    _SPOOL.seal()
+    try:
+        return _flush_spool()
+    except Exception as exc:
+        logger.warning("ClickHouse final flush failed: %s", exc)
+        return False
 
 
 def log_chat_to_clickhouse(
@@ -472,7 +776,7 @@ def log_chat_to_clickhouse(
         str(status or "success"),
         str(error) if error else "",
     ]
-    _append_row(_CHAT_BUFFER, row, "chat")
+    _append_row("ChatArchive", row)
 
 
 def log_usage_to_clickhouse(
@@ -520,7 +824,7 @@ def log_usage_to_clickhouse(
         str(status or "success"),
         str(error) if error else "",
     ]
-    _append_row(_USAGE_BUFFER, row, "usage")
+    _append_row("UsageLogs", row)
 
 
 def log_agent_event_to_clickhouse(
@@ -574,4 +878,4 @@ def log_agent_event_to_clickhouse(
         payload_text,
         str(error) if error else "",
     ]
-    _append_row(_AGENT_EVENT_BUFFER, row, "AgentLogs")
+    _append_row("AgentLogs", row)
@@ -41,19 +41,26 @@ VLLM2_MODEL = _first_non_empty(
 )
 VLLM2_API_KEY = _first_non_empty("VLLM2_API_KEY", "VLLM1_API_KEY", default="not-needed")
 
+# Optional second replica serving the same model (failover / hedged requests).
+VLLM1_REPLICA_BASE_URL = _first_non_empty("VLLM1_REPLICA_BASE_URL", default="")
+VLLM2_REPLICA_BASE_URL = _first_non_empty("VLLM2_REPLICA_BASE_URL", default="")
+
 MODEL_BACKENDS = {
     "default": {
         "base_url": VLLM1_BASE_URL,
+        "replica_base_url": VLLM1_REPLICA_BASE_URL,
         "model": VLLM1_MODEL,
         "api_key": VLLM1_API_KEY,
     },
     "Meta Llama 3.1": {
         "base_url": VLLM1_BASE_URL,
+        "replica_base_url": VLLM1_REPLICA_BASE_URL,
         "model": VLLM1_MODEL,
         "api_key": VLLM1_API_KEY,
     },
     "Qwen 2.5 7B": {
         "base_url": VLLM2_BASE_URL,
+        "replica_base_url": VLLM2_REPLICA_BASE_URL,
         "model": VLLM2_MODEL,
         "api_key": VLLM2_API_KEY,
     },
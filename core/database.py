@@ -1,11 +1,14 @@
 """
 PostgreSQL Database Models with pgvector support
 """
+from datetime import datetime
 from typing import List, Dict, Optional
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Index, JSON, Float, text, Boolean
+from sqlalchemy import create_engine, Column, Computed, Integer, BigInteger, String, Text, DateTime, ForeignKey, Index, JSON, Float, text, Boolean, insert, update
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.sql import func
+from sqlalchemy.orm import sessionmaker, relationship, deferred
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.sql import func, or_
 from pgvector.sqlalchemy import Vector
 from .config import DATABASE_URL, EMBEDDING_DIM
 
@@ -264,38 +267,91 @@ def ensure_schema_updates(engine):
             except Exception as e:
                 print(f"Schema update (backfill dedicated agent columns) skipped/failed: {e}")
 
+            # Parent chunk keyword search: owner column + stored tsvector
+            try:
+                conn.execute(text("ALTER TABLE omni_parent_chunks ADD COLUMN IF NOT EXISTS agent_id VARCHAR"))
+                conn.execute(
+                    text(
+                        """
+                        UPDATE omni_parent_chunks p
+                        SET agent_id = d.agent_id
+                        FROM omni_documents d
+                        WHERE p.source_doc_id = d.id
+                          AND p.agent_id IS NULL
+                          AND d.agent_id IS NOT NULL
+                        """
+                    )
+                )
+            except Exception as e:
+                print(f"Schema update (parent_chunks.agent_id) skipped/failed: {e}")
+
+            try:
+                conn.execute(
+                    text(
+                        "ALTER TABLE omni_parent_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+                        "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED"
+                    )
+                )
+            except Exception as e:
+                print(f"Schema update (parent_chunks.content_tsv) skipped/failed: {e}")
+
             # Phase 3: Document Status
             try:
                 conn.execute(text("ALTER TABLE omni_documents ADD COLUMN IF NOT EXISTS status VARCHAR DEFAULT 'uploading'"))
             except Exception as e:
                 print(f"Schema update (document.status) skipped/failed: {e}")
 
-            # Semantic cache embedding dimension alignment for upgraded embedding models.
+            # Semantic cache lifecycle: LRU eviction key
             try:
-                conn.execute(text("DROP INDEX IF EXISTS idx_cache_embedding_hnsw"))
+                conn.execute(text("ALTER TABLE omni_semantic_cache ADD COLUMN IF NOT EXISTS last_hit_at TIMESTAMPTZ"))
             except Exception as e:
-                print(f"Schema update (drop idx_cache_embedding_hnsw) skipped/failed: {e}")
+                print(f"Schema update (semantic_cache.last_hit_at) skipped/failed: {e}")
 
+            # Semantic cache embedding dimension alignment for upgraded embedding models.
+            # Only drop the HNSW index / retype the column when the dimension actually
+            # changed; otherwise every restart would rebuild the index over the whole cache.
+            current_dim = None
             try:
-                conn.execute(
+                current_dim = conn.execute(
                     text(
-                        f"ALTER TABLE omni_semantic_cache "
-                        f"ALTER COLUMN embedding TYPE vector({EMBEDDING_DIM})"
+                        """
+                        SELECT atttypmod
+                        FROM pg_attribute
+                        WHERE attrelid = 'omni_semantic_cache'::regclass
+                          AND attname = 'embedding'
+                        """
                     )
-                )
+                ).scalar()
             except Exception as e:
-                # Cache is disposable; clear stale rows and retry when dimensions changed.
-                print(f"Schema update (semantic cache vector dim) retrying after truncate: {e}")
+                print(f"Schema update (semantic cache vector dim probe) skipped/failed: {e}")
+
+            if current_dim != EMBEDDING_DIM:
+                for index_name in ("idx_cache_embedding_hnsw", "idx_cache_embedding_global_hnsw"):
+                    try:
+                        conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+                    except Exception as e:
+                        print(f"Schema update (drop {index_name}) skipped/failed: {e}")
+
                 try:
-                    conn.execute(text("TRUNCATE TABLE omni_semantic_cache"))
                     conn.execute(
                         text(
                             f"ALTER TABLE omni_semantic_cache "
                             f"ALTER COLUMN embedding TYPE vector({EMBEDDING_DIM})"
                         )
                     )
-                except Exception as e2:
-                    print(f"Schema update (semantic cache vector dim) skipped/failed: {e2}")
+                except Exception as e:
+                    # Cache is disposable; clear stale rows and retry when dimensions changed.
+                    print(f"Schema update (semantic cache vector dim) retrying after truncate: {e}")
+                    try:
+                        conn.execute(text("TRUNCATE TABLE omni_semantic_cache"))
+                        conn.execute(
+                            text(
+                                f"ALTER TABLE omni_semantic_cache "
+                                f"ALTER COLUMN embedding TYPE vector({EMBEDDING_DIM})"
+                            )
+                        )
+                    except Exception as e2:
+                        print(f"Schema update (semantic cache vector dim) skipped/failed: {e2}")
 
 
 
@@ -332,6 +388,16 @@ class Message(Base):
     )
 
 
+class AgentMessageDelta(Base):
+    """Append-only message count increments, periodically rolled up into omni_agents.message_count"""
+    __tablename__ = "omni_agent_message_deltas"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    agent_id = Column(String, ForeignKey("omni_agents.id", ondelete="CASCADE"), nullable=False)
+    delta = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Document(Base):
     """Document model for tracking uploaded files"""
     __tablename__ = "omni_documents"
@@ -374,6 +440,18 @@ class UsageLog(Base):
     agent = relationship("Agent")
 
 
+class AgentUsageTotal(Base):
+    """Incrementally maintained per-agent token totals (mirrors SUMs over omni_usage)"""
+    __tablename__ = "omni_agent_usage_totals"
+
+    agent_id = Column(String, ForeignKey("omni_agents.id", ondelete="CASCADE"), primary_key=True)
+    total_input_tokens = Column(BigInteger, default=0, nullable=False)
+    total_output_tokens = Column(BigInteger, default=0, nullable=False)
+    total_query_tokens = Column(BigInteger, default=0, nullable=False)
+    total_rag_query_tokens = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 class ApiKey(Base):
     """API Key for authentication"""
     __tablename__ = "omni_api_keys"
@@ -409,6 +487,10 @@ class ParentChunk(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     content = Column(Text, nullable=False)
     source_doc_id = Column(Integer, ForeignKey("omni_documents.id", ondelete="CASCADE"), nullable=True)
+    # Denormalized owner so keyword search filters by agent inside the FTS index.
+    agent_id = Column(String, nullable=True)
+    # Stored lexemes: keyword search neither re-parses content nor re-ranks from text.
+    content_tsv = deferred(Column(TSVECTOR, Computed("to_tsvector('english', content)", persisted=True)))
     
     # Since children are in VectorDB (pgvector table), we just persist ID here.
 
@@ -424,14 +506,113 @@ class SemanticCache(Base):
     agent_id = Column(String, nullable=True)  # Optional: Cache per agent
     hit_count = Column(Integer, default=1)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_hit_at = Column(DateTime(timezone=True), nullable=True)  # LRU eviction key
     
     # We'll create HNSW index via SQL or relying on pgvector extension defaults
     # For now, standard table definition is enough for SQLAlchemy to map it.
 
 
+class IngestionJob(Base):
+    """Queued document/URL ingestion, executed by core.ingest_queue workers"""
+    __tablename__ = "omni_ingestion_jobs"
+
+    id = Column(String, primary_key=True)
+    agent_id = Column(String, ForeignKey("omni_agents.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String, nullable=False)  # documents, urls
+    status = Column(String, nullable=False, default="queued")  # queued, running, succeeded, failed, cancelled
+    stage = Column(String, default="queued")
+    progress = Column(Float, default=0.0)  # 0.0 - 1.0
+    payload = Column(JSON, default={})  # spooled files / text / urls
+    result = Column(JSON, default={})
+    error = Column(Text)
+    cancel_requested = Column(Boolean, default=False, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    worker_id = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    heartbeat_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index('idx_omni_ingest_status_created', 'status', 'created_at'),
+        Index('idx_omni_ingest_agent_status', 'agent_id', 'status'),
+    )
+
+
 # ============== DATABASE OPERATIONS ==============
 
 
+def semantic_cache_index_statements(table: str = "omni_semantic_cache", prefix: str = "idx_cache") -> List[str]:
+    """DDL for the semantic cache lookup path (see core.cache.check_cache).
+
+    - HNSW over every row serves the per-agent nearest-neighbour leg
+      (with pgvector >= 0.8 iterative scans keeping filtered results complete).
+    - Partial HNSW over agent_id IS NULL rows serves the shared/global leg.
+    - (agent_id, created_at) btree lets small agent caches use an exact scan.
+    - created_at btree lets the lifecycle reaper find expired rows in batches.
+    """
+    return [
+        f"""
+        CREATE INDEX IF NOT EXISTS {prefix}_embedding_hnsw
+        ON {table}
+        USING hnsw(embedding vector_cosine_ops)
+        WITH (m = 16, ef_construction = 64);
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS {prefix}_embedding_global_hnsw
+        ON {table}
+        USING hnsw(embedding vector_cosine_ops)
+        WITH (m = 16, ef_construction = 64)
+        WHERE agent_id IS NULL;
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS {prefix}_agent_created
+        ON {table} (agent_id, created_at);
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS {prefix}_created
+        ON {table} (created_at);
+        """,
+    ]
+
+
+def _create_keyword_search_indexes():
+    """GIN indexes over the stored tsvector column of omni_parent_chunks.
+
+    Agent-owned chunks use a composite (agent_id, content_tsv) GIN index
+    (needs btree_gin); shared chunks (agent_id IS NULL) use a partial GIN.
+    Each step runs in its own transaction so one failure does not undo the rest.
+    """
+    def _run(label: str, statement: str) -> bool:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(statement))
+            return True
+        except Exception as e:
+            print(f"[WARN] Keyword index step skipped ({label}): {e}")
+            return False
+
+    has_btree_gin = _run("btree_gin", "CREATE EXTENSION IF NOT EXISTS btree_gin")
+    if has_btree_gin:
+        _run("agent+tsv", """
+            CREATE INDEX IF NOT EXISTS idx_parent_agent_tsv
+            ON omni_parent_chunks
+            USING GIN(agent_id, content_tsv)
+        """)
+    else:
+        # Fallback: agent btree + tsvector GIN combined via bitmap AND.
+        _run("agent", "CREATE INDEX IF NOT EXISTS idx_parent_agent ON omni_parent_chunks (agent_id)")
+        _run("tsv", "CREATE INDEX IF NOT EXISTS idx_parent_tsv ON omni_parent_chunks USING GIN(content_tsv)")
+    _run("shared tsv", """
+        CREATE INDEX IF NOT EXISTS idx_parent_shared_tsv
+        ON omni_parent_chunks
+        USING GIN(content_tsv)
+        WHERE agent_id IS NULL
+    """)
+    # Superseded by the stored-column indexes; dropping it saves write amplification.
+    _run("drop legacy", "DROP INDEX IF EXISTS idx_parent_fts")
+
+
 def init_db() -> Optional[str]:
     """Initialize database tables and performance indexes.
 
@@ -450,29 +631,21 @@ def init_db() -> Optional[str]:
     # Create performance indexes (idempotent)
     db = SessionLocal()
     try:
-        # HNSW Index for Semantic Cache (fast vector similarity)
-        db.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_cache_embedding_hnsw 
-            ON omni_semantic_cache 
-            USING hnsw(embedding vector_cosine_ops)
-            WITH (m = 16, ef_construction = 64);
-        """))
-
-        # GIN Index for Full-Text Search on Parent Chunks
-        db.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_parent_fts 
-            ON omni_parent_chunks 
-            USING GIN(to_tsvector('english', content));
-        """))
+        # Semantic cache: HNSW (+ global-row partial HNSW) and agent/TTL btree
+        for statement in semantic_cache_index_statements():
+            db.execute(text(statement))
 
         db.commit()
-        print("[OK] Performance indexes created (HNSW + GIN)")
+        print("[OK] Performance indexes created (HNSW)")
     except Exception as e:
         print(f"[WARN] Index creation skipped: {e}")
         db.rollback()
     finally:
         db.close()
 
+    _create_keyword_search_indexes()
+
+    seed_usage_totals()
     return None
 
 
@@ -480,6 +653,62 @@ def get_session():
     """Get database session"""
     return SessionLocal()
 
+
+# ============== ASYNC SESSIONS ==============
+
+_ASYNC_ENGINE = None
+_ASYNC_SESSION_FACTORY = None
+_ASYNC_UNAVAILABLE = False
+
+
+def _async_database_url(url: str) -> Optional[str]:
+    """Map the sync Postgres URL onto the psycopg (v3) async driver."""
+    raw = str(url or "")
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if raw.startswith(prefix):
+            return "postgresql+psycopg://" + raw[len(prefix):]
+    if raw.startswith("postgresql+psycopg://"):
+        return raw
+    return None
+
+
+def get_async_session_factory():
+    """Return the async session factory, or None when no async driver is usable."""
+    global _ASYNC_ENGINE, _ASYNC_SESSION_FACTORY, _ASYNC_UNAVAILABLE
+    if _ASYNC_SESSION_FACTORY is not None or _ASYNC_UNAVAILABLE:
+        return _ASYNC_SESSION_FACTORY
+
+    async_url = _async_database_url(DATABASE_URL)
+    if not async_url:
+        _ASYNC_UNAVAILABLE = True
+        return None
+    try:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        _ASYNC_ENGINE = create_async_engine(
+            async_url,
+            echo=False,
+            pool_size=20,
+            max_overflow=40,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            connect_args={"client_encoding": "utf8"},
+        )
+        _ASYNC_SESSION_FACTORY = async_sessionmaker(_ASYNC_ENGINE, expire_on_commit=False)
+    except Exception as e:
+        print(f"[WARN] Async database engine unavailable, using offloaded sync sessions: {e}")
+        _ASYNC_UNAVAILABLE = True
+    return _ASYNC_SESSION_FACTORY
+
+
+async def dispose_async_engine() -> None:
+    """Close pooled async connections (API shutdown)."""
+    global _ASYNC_ENGINE, _ASYNC_SESSION_FACTORY
+    if _ASYNC_ENGINE is not None:
+        await _ASYNC_ENGINE.dispose()
+    _ASYNC_ENGINE = None
+    _ASYNC_SESSION_FACTORY = None
+
 # Usage Operations
 def log_usage(
     agent_id: str,
@@ -521,6 +750,122 @@ def log_usage(
         db.close()
 
 
+_USAGE_TOTAL_COLUMNS = (
+    "total_input_tokens",
+    "total_output_tokens",
+    "total_query_tokens",
+    "total_rag_query_tokens",
+)
+
+_USAGE_TOTALS_SELECT = """
+    SELECT u.agent_id,
+           COALESCE(SUM(u.prompt_tokens), 0),
+           COALESCE(SUM(u.completion_tokens), 0),
+           COALESCE(SUM(u.query_tokens), 0),
+           COALESCE(SUM(u.rag_query_tokens), 0),
+           CURRENT_TIMESTAMP
+    FROM omni_usage u
+    JOIN omni_agents a ON a.id = u.agent_id
+"""
+
+
+def seed_usage_totals():
+    """Backfill totals rows for agents that have usage but no counter row yet.
+
+    Runs once at startup; agents that already have a row are maintained
+    incrementally by increment_usage_totals().
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(text(f"""
+            INSERT INTO omni_agent_usage_totals
+                (agent_id, {", ".join(_USAGE_TOTAL_COLUMNS)}, updated_at)
+            {_USAGE_TOTALS_SELECT}
+            WHERE NOT EXISTS (
+                SELECT 1 FROM omni_agent_usage_totals t WHERE t.agent_id = u.agent_id
+            )
+            GROUP BY u.agent_id
+        """))
+        db.commit()
+        if result.rowcount:
+            print(f"[OK] Seeded usage totals for {result.rowcount} agents")
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] Usage totals seed skipped: {e}")
+    finally:
+        db.close()
+
+
+def rebuild_usage_totals(agent_id: str):
+    """Recompute one agent's totals from omni_usage (repair/backfill only)."""
+    db = SessionLocal()
+    try:
+        db.query(AgentUsageTotal).filter(AgentUsageTotal.agent_id == agent_id).delete()
+        db.execute(text(f"""
+            INSERT INTO omni_agent_usage_totals
+                (agent_id, {", ".join(_USAGE_TOTAL_COLUMNS)}, updated_at)
+            {_USAGE_TOTALS_SELECT}
+            WHERE u.agent_id = :agent_id
+            GROUP BY u.agent_id
+        """), {"agent_id": agent_id})
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def increment_usage_totals(deltas: Dict[str, Dict[str, int]]):
+    """Apply coalesced per-agent token deltas (one UPDATE/INSERT per agent)."""
+    if not deltas:
+        return
+    db = SessionLocal()
+    try:
+        for agent_id, delta in deltas.items():
+            values = {col: int(delta.get(col, 0) or 0) for col in _USAGE_TOTAL_COLUMNS}
+            updated = (
+                db.query(AgentUsageTotal)
+                .filter(AgentUsageTotal.agent_id == agent_id)
+                .update(
+                    {
+                        getattr(AgentUsageTotal, col): getattr(AgentUsageTotal, col) + value
+                        for col, value in values.items()
+                    },
+                    synchronize_session=False,
+                )
+            )
+            if not updated:
+                try:
+                    with db.begin_nested():
+                        db.add(AgentUsageTotal(agent_id=agent_id, **values))
+                except IntegrityError:
+                    # Another worker created the row (or the agent is gone); retry as UPDATE.
+                    db.query(AgentUsageTotal).filter(AgentUsageTotal.agent_id == agent_id).update(
+                        {
+                            getattr(AgentUsageTotal, col): getattr(AgentUsageTotal, col) + value
+                            for col, value in values.items()
+                        },
+                        synchronize_session=False,
+                    )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def get_usage_totals(agent_id: str) -> Dict[str, int]:
+    """Read the maintained totals row for one agent (zeros when absent)."""
+    db = SessionLocal()
+    try:
+        row = db.query(AgentUsageTotal).filter(AgentUsageTotal.agent_id == agent_id).first()
+        return {col: int(getattr(row, col, 0) or 0) if row else 0 for col in _USAGE_TOTAL_COLUMNS}
+    finally:
+        db.close()
+
+
 def get_usage_stats(limit: int = 100):
     """Get usage statistics"""
     db = SessionLocal()
@@ -604,7 +949,18 @@ def clear_webhook_logs():
 
 # Message Operations
 def save_message(role: str, content: str, agent_id: str = None):
-    """Save a message to the database"""
+    """Save a message to the database.
+
+    With the write-behind journal enabled (default) the message is buffered
+    and inserted in a batch shortly after; see core.message_journal.
+    """
+    from .message_journal import enqueue_message, flush_backlog, journal_enabled
+
+    if journal_enabled():
+        if enqueue_message(role, content, agent_id=agent_id):
+            flush_backlog()
+        return
+
     db = SessionLocal()
     try:
         message = Message(agent_id=agent_id, role=role, content=content)
@@ -620,6 +976,99 @@ def save_message(role: str, content: str, agent_id: str = None):
         db.close()
 
 
+def insert_journaled_messages(rows: List[Dict]) -> int:
+    """Bulk-insert buffered messages and append one count delta per agent, in one transaction.
+
+    rows: [{"agent_id", "role", "content", "timestamp"}]. Rows whose agent was
+    deleted in the meantime are dropped. Returns the number of rows inserted.
+    """
+    if not rows:
+        return 0
+
+    def _write(db, batch: List[Dict]) -> None:
+        db.execute(insert(Message), batch)
+        counts: Dict[str, int] = {}
+        for row in batch:
+            if row.get("agent_id"):
+                counts[row["agent_id"]] = counts.get(row["agent_id"], 0) + 1
+        if counts:
+            db.execute(
+                insert(AgentMessageDelta),
+                [{"agent_id": agent_id, "delta": delta} for agent_id, delta in counts.items()],
+            )
+
+    db = SessionLocal()
+    try:
+        try:
+            _write(db, rows)
+            db.commit()
+            return len(rows)
+        except IntegrityError:
+            db.rollback()
+        agent_ids = {row["agent_id"] for row in rows if row.get("agent_id")}
+        live = {row[0] for row in db.query(Agent.id).filter(Agent.id.in_(agent_ids)).all()} if agent_ids else set()
+        kept = [row for row in rows if not row.get("agent_id") or row["agent_id"] in live]
+        if kept:
+            _write(db, kept)
+        db.commit()
+        return len(kept)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def rollup_message_counts() -> int:
+    """Fold pending message deltas into omni_agents.message_count.
+
+    Deltas are claimed with DELETE ... RETURNING, so concurrent workers never
+    apply the same delta twice; each agent row is updated once per rollup.
+    Returns the number of agents updated.
+    """
+    db = SessionLocal()
+    try:
+        claimed = db.execute(text("DELETE FROM omni_agent_message_deltas RETURNING agent_id, delta")).all()
+        totals: Dict[str, int] = {}
+        for agent_id, delta in claimed:
+            totals[agent_id] = totals.get(agent_id, 0) + int(delta or 0)
+        # Sorted so concurrent rollups lock agent rows in the same order.
+        for agent_id in sorted(totals):
+            db.execute(
+                update(Agent)
+                .where(Agent.id == agent_id)
+                .values(message_count=func.coalesce(Agent.message_count, 0) + totals[agent_id])
+            )
+        db.commit()
+        return len(totals)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _merge_pending_history(history: List[Dict], agent_id: Optional[str], limit: Optional[int]) -> List[Dict]:
+    """Append journaled-but-unflushed messages so a turn sees the previous one immediately."""
+    from .message_journal import pending_messages
+
+    pending = pending_messages(agent_id)
+    if not pending:
+        return history
+    # A batch may commit between the query and this merge; don't show it twice.
+    stored = {
+        (msg["role"], msg["content"], datetime.fromisoformat(msg["timestamp"]))
+        for msg in history[-len(pending):]
+        if msg.get("timestamp")
+    }
+    pending = [
+        msg for msg in pending
+        if (msg["role"], msg["content"], datetime.fromisoformat(msg["timestamp"])) not in stored
+    ]
+    merged = history + pending
+    return merged[-limit:] if limit else merged
+
+
 def get_conversation_history(agent_id: str = None, limit: int = None) -> List[Dict]:
     """Get conversation history"""
     db = SessionLocal()
@@ -631,23 +1080,88 @@ def get_conversation_history(agent_id: str = None, limit: int = None) -> List[Di
             query = query.limit(limit)
         
         messages = query.all()
-        return [
+        history = [
             {"role": msg.role, "content": msg.content, 
              "timestamp": msg.timestamp.isoformat() if msg.timestamp else None}
             for msg in reversed(messages)
         ]
     finally:
         db.close()
+    return _merge_pending_history(history, agent_id, limit)
+
+
+async def asave_message(role: str, content: str, agent_id: str = None):
+    """Async variant of save_message for event-loop callers."""
+    from .message_journal import enqueue_message, flush_backlog, journal_enabled
+
+    if journal_enabled():
+        # Buffering is a short lock + append; the backpressure flush is a
+        # database round trip, so it is offloaded.
+        if enqueue_message(role, content, agent_id=agent_id):
+            from .offload import run_blocking
+
+            await run_blocking(flush_backlog)
+        return
+
+    factory = get_async_session_factory()
+    if factory is None:
+        from .offload import run_blocking
+
+        return await run_blocking(save_message, role, content, agent_id=agent_id)
+
+    from sqlalchemy import update
+
+    async with factory() as db:
+        db.add(Message(agent_id=agent_id, role=role, content=content))
+        if agent_id:
+            await db.execute(
+                update(Agent)
+                .where(Agent.id == agent_id)
+                .values(message_count=func.coalesce(Agent.message_count, 0) + 1)
+            )
+        await db.commit()
+
+
+async def aget_conversation_history(agent_id: str = None, limit: int = None) -> List[Dict]:
+    """Async variant of get_conversation_history for event-loop callers."""
+    factory = get_async_session_factory()
+    if factory is None:
+        from .offload import run_blocking
+
+        return await run_blocking(get_conversation_history, agent_id=agent_id, limit=limit)
+
+    from sqlalchemy import select
+
+    stmt = select(Message).order_by(Message.timestamp.desc())
+    if agent_id:
+        stmt = stmt.where(Message.agent_id == agent_id)
+    if limit:
+        stmt = stmt.limit(limit)
+
+    async with factory() as db:
+        messages = (await db.execute(stmt)).scalars().all()
+    history = [
+        {"role": msg.role, "content": msg.content,
+         "timestamp": msg.timestamp.isoformat() if msg.timestamp else None}
+        for msg in reversed(messages)
+    ]
+    return _merge_pending_history(history, agent_id, limit)
 
 
 def clear_history(agent_id: str = None):
-    """Clear conversation history"""
+    """Clear conversation history (including messages still buffered in the journal)"""
+    from .message_journal import discard_pending
+
+    discard_pending(agent_id)
     db = SessionLocal()
     try:
         query = db.query(Message)
+        deltas = db.query(AgentMessageDelta)
         if agent_id:
             query = query.filter(Message.agent_id == agent_id)
+            deltas = deltas.filter(AgentMessageDelta.agent_id == agent_id)
         query.delete()
+        deltas.delete()
         db.commit()
     finally:
         db.close()
@@ -741,7 +1255,12 @@ def delete_document(document_id: int) -> bool:
                 if agent and agent.document_count > 0:
                     agent.document_count = agent.document_count - 1
 
+            from .agent_cache import agent_cache, notify_agent_changed
+            if agent_id:
+                notify_agent_changed(db, agent_id)
             db.commit()
+            if agent_id:
+                agent_cache.invalidate(agent_id)
             return True
         return False
     finally:
@@ -749,11 +1268,20 @@ def delete_document(document_id: int) -> bool:
 
 
 # Parent Chunk Operations
-def save_parent_chunk(content: str, source_doc_id: int = None) -> int:
+def _resolve_chunk_agent(db, source_doc_id: Optional[int]) -> Optional[str]:
+    if source_doc_id is None:
+        return None
+    doc = db.query(Document.agent_id).filter(Document.id == source_doc_id).first()
+    return doc.agent_id if doc else None
+
+
+def save_parent_chunk(content: str, source_doc_id: int = None, agent_id: str = None) -> int:
     """Save a parent chunk and return its ID"""
     db = SessionLocal()
     try:
-        chunk = ParentChunk(content=content, source_doc_id=source_doc_id)
+        if agent_id is None:
+            agent_id = _resolve_chunk_agent(db, source_doc_id)
+        chunk = ParentChunk(content=content, source_doc_id=source_doc_id, agent_id=agent_id)
         db.add(chunk)
         db.commit()
         db.refresh(chunk)
@@ -762,7 +1290,7 @@ def save_parent_chunk(content: str, source_doc_id: int = None) -> int:
         db.close()
 
 
-def batch_save_parent_chunks(chunks: list, source_doc_id: int = None) -> Dict[str, int]:
+def batch_save_parent_chunks(chunks: list, source_doc_id: int = None, agent_id: str = None) -> Dict[str, int]:
     """
     Batch save multiple parent chunks in a single transaction.
     Returns mapping of chunk content to database row ID.
@@ -770,6 +1298,7 @@ def batch_save_parent_chunks(chunks: list, source_doc_id: int = None) -> Dict[st
     Args:
         chunks: List of unique parent content strings
         source_doc_id: Optional document ID to link
+        agent_id: Owning agent (defaults to the source document's agent)
     
     Returns:
         Dict mapping content -> id
@@ -778,9 +1307,11 @@ def batch_save_parent_chunks(chunks: list, source_doc_id: int = None) -> Dict[st
     try:
         content_to_id = {}
         objects = []
+        if agent_id is None:
+            agent_id = _resolve_chunk_agent(db, source_doc_id)
         
         for content in chunks:
-            obj = ParentChunk(content=content, source_doc_id=source_doc_id)
+            obj = ParentChunk(content=content, source_doc_id=source_doc_id, agent_id=agent_id)
             objects.append(obj)
         
         db.add_all(objects)
@@ -805,6 +1336,86 @@ def batch_save_parent_chunks(chunks: list, source_doc_id: int = None) -> Dict[st
         db.close()
 
 
+def save_ingested_documents(agent_id: str, documents: List[Dict]) -> List[Dict]:
+    """
+    Insert document rows and their parent chunks in one transaction.
+
+    Uses multi-row INSERT ... RETURNING (two statements per batch instead of a
+    commit per row), and links every parent to the document it came from.
+    Duplicate parent texts keep their own rows so deleting one document never
+    orphans another document's children.
+
+    Args:
+        agent_id: Owning agent
+        documents: [{"filename", "file_type", "file_size", "content_preview",
+                     "extra_data", "parents": [parent content, ...]}]
+
+    Returns:
+        [{"id": document id, "parent_ids": [id per parent, in order]}] in input order.
+        Raises on failure; nothing is persisted in that case.
+    """
+    if not documents:
+        return []
+    db = SessionLocal()
+    try:
+        doc_rows = [
+            {
+                "agent_id": agent_id,
+                "filename": doc["filename"],
+                "file_type": doc.get("file_type"),
+                "file_size": doc.get("file_size"),
+                "content_preview": (doc.get("content_preview") or "")[:500] or None,
+                "chunk_count": 0,
+                "extra_data": doc.get("extra_data") or {},
+                "status": "indexing",
+            }
+            for doc in documents
+        ]
+        doc_ids = db.execute(
+            insert(Document).returning(Document.id, sort_by_parameter_order=True), doc_rows
+        ).scalars().all()
+
+        parent_rows = [
+            {"content": content, "source_doc_id": doc_id, "agent_id": agent_id}
+            for doc_id, doc in zip(doc_ids, documents)
+            for content in doc.get("parents") or []
+        ]
+        parent_ids = []
+        if parent_rows:
+            parent_ids = db.execute(
+                insert(ParentChunk).returning(ParentChunk.id, sort_by_parameter_order=True), parent_rows
+            ).scalars().all()
+        db.commit()
+
+        saved, offset = [], 0
+        for doc_id, doc in zip(doc_ids, documents):
+            count = len(doc.get("parents") or [])
+            saved.append({"id": doc_id, "parent_ids": list(parent_ids[offset:offset + count])})
+            offset += count
+        print(f"✅ Bulk saved {len(doc_ids)} documents, {len(parent_ids)} parent chunks")
+        return saved
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def finish_ingested_documents(updates: List[Dict]) -> None:
+    """Set final status/chunk_count/embedding_time for many documents in one UPDATE batch.
+
+    updates: [{"id", "status", "chunk_count", "embedding_time"}]
+    """
+    if not updates:
+        return
+    db = SessionLocal()
+    try:
+        db.execute(update(Document), updates)
+        db.commit()
+    finally:
+        db.close()
+
+
 def get_parent_chunk(chunk_id: int) -> str:
     """Get content of a parent chunk"""
     db = SessionLocal()
@@ -815,3 +1426,21 @@ def get_parent_chunk(chunk_id: int) -> str:
         db.close()
 
 
+def get_parent_chunks(chunk_ids: List[int], agent_id: str = None) -> Dict[int, str]:
+    """Fetch many parent chunks in one query. Returns {id: content}.
+
+    With an agent, only its own and shared (agent_id IS NULL) parents are returned.
+    """
+    ids = sorted({int(chunk_id) for chunk_id in chunk_ids if chunk_id is not None})
+    if not ids:
+        return {}
+    db = SessionLocal()
+    try:
+        query = db.query(ParentChunk.id, ParentChunk.content).filter(ParentChunk.id.in_(ids))
+        if agent_id:
+            query = query.filter(or_(ParentChunk.agent_id == agent_id, ParentChunk.agent_id.is_(None)))
+        return {row.id: row.content for row in query.all()}
+    finally:
+        db.close()
+
+
@@ -2,7 +2,10 @@
 Guardrails Module
 Basic Input/Output validation and safety checks.
 """
-from typing import Tuple
+import re
+from typing import Optional, Tuple
+
+from .text_safety import RuleSet
 
 # Blacklisted keywords for prompt injection and jailbreak filtering
 BLACKLIST = [
@@ -20,22 +23,31 @@ BLACKLIST = [
     "bypass your filters",
 ]
 
+_API_KEY_RE = re.compile(r"sk-[a-zA-Z0-9]{20,}")
+
+# Compiled once; each rule set is checked in a single scan.
+_INPUT_RULES = RuleSet.from_phrases("input", BLACKLIST)
+_OUTPUT_RULES = RuleSet("output", {"api_key": _API_KEY_RE.pattern})
+_OUTPUT_REASONS = {"api_key": "Potential API Key leakage detected"}
+
+# A stream tail that could still grow into an API key.
+_API_KEY_TAIL_RE = re.compile(r"(?:sk-[a-zA-Z0-9]*|sk|s)$")
+
+
 def validate_input(text: str) -> Tuple[bool, str]:
     """
     Validate user input.
     Returns (is_valid, reason)
     """
-    text_lower = text.lower()
-    
     # 1. Length Check
     if len(text) > 10000:
         return False, "Input too long (max 10000 chars)"
-        
+
     # 2. Blacklist Check
-    for term in BLACKLIST:
-        if term in text_lower:
-            return False, f"Blocked content detected: '{term}'"
-            
+    term = _INPUT_RULES.search(text)
+    if term is not None:
+        return False, f"Blocked content detected: '{term}'"
+
     return True, "OK"
 
 
@@ -44,11 +56,44 @@ def validate_output(text: str) -> Tuple[bool, str]:
     Validate LLM output.
     Returns (is_valid, reason)
     """
-    # Placeholder for output validation (e.g., checking for leaked keys)
-    if "sk-" in text and len(text) > 20: # Simple OpenAI Key check
-        # Check if it looks like a key
-        import re
-        if re.search(r"sk-[a-zA-Z0-9]{20,}", text):
-            return False, "Potential API Key leakage detected"
-            
+    rule = _OUTPUT_RULES.search(text)
+    if rule is not None:
+        return False, _OUTPUT_REASONS[rule]
+
     return True, "OK"
+
+
+class OutputStreamGuard:
+    """
+    validate_output for streamed answers.
+
+    feed() returns the part of the answer that is safe to send now; text that
+    could still turn into a blocked pattern is held until the next delta
+    decides it. Once blocked, nothing more is released and blocked_reason
+    is set.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self.blocked_reason: Optional[str] = None
+
+    def feed(self, delta: str) -> str:
+        if self.blocked_reason is not None:
+            return ""
+        self._pending += delta
+        is_valid, reason = validate_output(self._pending)
+        if not is_valid:
+            self.blocked_reason = reason
+            self._pending = ""
+            return ""
+        tail = _API_KEY_TAIL_RE.search(self._pending)
+        cut = tail.start() if tail else len(self._pending)
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return ready
+
+    def finish(self) -> str:
+        """Release whatever is still held once the stream has ended."""
+        if self.blocked_reason is not None:
+            return ""
+        ready, self._pending = self._pending, ""
+        return ready
@@ -0,0 +1,544 @@
+"""
+Durable ingestion job queue backed by omni_ingestion_jobs.
+
+POST /agents/{id}/documents used to run process_documents inside the request
+handler, so extraction, chunking and embedding of a large upload held the
+event loop for minutes. Uploads are now spooled to disk and queued; worker
+processes (started by the API lifespan or run standalone with
+`python -m core.ingest_queue`) execute them:
+
+- Claims use FOR UPDATE SKIP LOCKED under a short advisory lock, honouring
+  INGEST_MAX_JOBS_PER_AGENT running jobs per agent.
+- A heartbeat thread writes stage/progress once a second and picks up
+  cancellation requests; process_documents checks them between stages and
+  embedding batches. Cancelled or failed attempts discard their partial
+  documents, parent chunks and vectors.
+- Jobs whose worker stops heartbeating are re-queued (or failed after
+  INGEST_MAX_ATTEMPTS).
+
+Postgres only; on other backends callers fall back to inline processing.
+"""
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.sql import func
+
+from .config import STORAGE_PATH
+from .database import IngestionJob, SessionLocal, engine
+
+TERMINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+
+# Arbitrary constant shared by all workers; serializes claims so the
+# per-agent running count cannot be raced past its limit.
+_CLAIM_LOCK_KEY = 0x1A6E5701
+
+_WORKERS: List[multiprocessing.Process] = []
+_WORKERS_LOCK = threading.Lock()
+
+
+class IngestionCancelled(Exception):
+    """Raised from the progress callback once a job's cancellation is seen."""
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _queue_enabled() -> bool:
+    return os.getenv("INGEST_QUEUE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _worker_processes() -> int:
+    return max(0, _env_int("INGEST_WORKER_PROCESSES", 1))
+
+
+def _max_jobs_per_agent() -> int:
+    return max(1, _env_int("INGEST_MAX_JOBS_PER_AGENT", 1))
+
+
+def _poll_interval() -> float:
+    return max(0.2, _env_float("INGEST_POLL_INTERVAL", 1.0))
+
+
+def _progress_interval() -> float:
+    return max(0.2, _env_float("INGEST_PROGRESS_INTERVAL", 1.0))
+
+
+def _stale_seconds() -> float:
+    return max(30.0, _env_float("INGEST_JOB_STALE_SECONDS", 300.0))
+
+
+def _max_attempts() -> int:
+    return max(1, _env_int("INGEST_MAX_ATTEMPTS", 2))
+
+
+def _spool_root() -> str:
+    return os.getenv("INGEST_SPOOL_PATH", "").strip() or os.path.join(STORAGE_PATH, "ingest")
+
+
+def queue_available() -> bool:
+    """True when uploads should be queued instead of processed inline."""
+    return _queue_enabled() and engine.dialect.name == "postgresql"
+
+
+def _job_dict(job: IngestionJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "agent_id": job.agent_id,
+        "kind": job.kind,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": round(float(job.progress or 0.0), 4),
+        "result": job.result or {},
+        "error": job.error,
+        "cancel_requested": bool(job.cancel_requested),
+        "attempts": job.attempts or 0,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# =============================================================================
+# PRODUCER SIDE (API)
+# =============================================================================
+
+def _safe_filename(name: str) -> str:
+    base = os.path.basename(str(name or "upload"))
+    return re.sub(r"[^A-Za-z0-9._ -]", "_", base).strip() or "upload"
+
+
+def _spool_uploads(job_id: str, files) -> List[Dict[str, Any]]:
+    """Copy uploaded files into the job's spool directory."""
+    spooled: List[Dict[str, Any]] = []
+    job_dir = os.path.join(_spool_root(), job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    for index, upload in enumerate(files or []):
+        filename = getattr(upload, "filename", None) or getattr(upload, "name", None) or f"upload_{index}"
+        source = upload.file if hasattr(upload, "file") else upload
+        # Index prefix keeps same-named uploads apart; the original name is kept in the payload.
+        path = os.path.join(job_dir, f"{index:03d}_{_safe_filename(filename)}")
+        if hasattr(source, "seek"):
+            source.seek(0)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(source, out, length=1024 * 1024)
+        spooled.append({"filename": os.path.basename(str(filename)), "path": path, "size": os.path.getsize(path)})
+    return spooled
+
+
+def enqueue_job(agent_id: str, kind: str, payload: Dict[str, Any], job_id: str = None) -> Dict[str, Any]:
+    db = SessionLocal()
+    try:
+        job = IngestionJob(
+            id=job_id or uuid.uuid4().hex,
+            agent_id=agent_id,
+            kind=kind,
+            status="queued",
+            stage="queued",
+            progress=0.0,
+            payload=payload,
+            result={},
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return _job_dict(job)
+    finally:
+        db.close()
+
+
+def enqueue_documents(agent_id: str, files=None, text_input: str = None) -> Dict[str, Any]:
+    """Spool uploads and queue a documents job (blocking; call via run_blocking)."""
+    job_id = uuid.uuid4().hex
+    try:
+        spooled = _spool_uploads(job_id, files)
+        return enqueue_job(agent_id, "documents", {"files": spooled, "text": text_input or ""}, job_id=job_id)
+    except Exception:
+        shutil.rmtree(os.path.join(_spool_root(), job_id), ignore_errors=True)
+        raise
+
+
+def enqueue_urls(agent_id: str, urls: List[str]) -> Dict[str, Any]:
+    return enqueue_job(agent_id, "urls", {"urls": list(urls or [])})
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        return _job_dict(job) if job else None
+    finally:
+        db.close()
+
+
+def list_jobs(agent_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        jobs = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.agent_id == agent_id)
+            .order_by(IngestionJob.created_at.desc())
+            .limit(max(1, min(int(limit), 200)))
+            .all()
+        )
+        return [_job_dict(job) for job in jobs]
+    finally:
+        db.close()
+
+
+def cancel_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Cancel a queued job outright, or flag a running one for its worker."""
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).with_for_update().first()
+        if job is None:
+            return None
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.stage = "cancelled"
+            job.finished_at = func.now()
+        elif job.status == "running":
+            job.cancel_requested = True
+        db.commit()
+        db.refresh(job)
+        if job.status == "cancelled":
+            shutil.rmtree(os.path.join(_spool_root(), job.id), ignore_errors=True)
+        return _job_dict(job)
+    finally:
+        db.close()
+
+
+# =============================================================================
+# WORKER SIDE
+# =============================================================================
+
+class _SpooledUpload:
+    """UploadFile look-alike over a spooled file (what extract_text_from_files expects)."""
+
+    def __init__(self, path: str, filename: str, size: int):
+        self.filename = filename
+        self.size = size
+        self.file = open(path, "rb")
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def close(self):
+        self.file.close()
+
+
+def _requeue_stale(conn) -> None:
+    conn.execute(
+        text(
+            """
+            UPDATE omni_ingestion_jobs
+            SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'queued' END,
+                stage = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'requeued' END,
+                error = CASE WHEN attempts >= :max_attempts THEN 'Worker stopped responding' ELSE error END,
+                finished_at = CASE WHEN attempts >= :max_attempts THEN NOW() ELSE NULL END,
+                worker_id = NULL
+            WHERE status = 'running'
+              AND heartbeat_at < NOW() - make_interval(secs => :stale)
+            """
+        ),
+        {"max_attempts": _max_attempts(), "stale": _stale_seconds()},
+    )
+
+
+def _claim_next(worker_id: str, requeue: bool = False) -> Optional[Dict[str, Any]]:
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _CLAIM_LOCK_KEY})
+        if requeue:
+            _requeue_stale(conn)
+        row = conn.execute(
+            text(
+                """
+                UPDATE omni_ingestion_jobs
+                SET status = 'running', stage = 'starting', worker_id = :worker_id,
+                    attempts = attempts + 1, started_at = NOW(), heartbeat_at = NOW()
+                WHERE id = (
+                    SELECT j.id FROM omni_ingestion_jobs j
+                    WHERE j.status = 'queued'
+                      AND j.cancel_requested = FALSE
+                      AND (
+                          SELECT COUNT(*) FROM omni_ingestion_jobs r
+                          WHERE r.agent_id = j.agent_id AND r.status = 'running'
+                      ) < :per_agent
+                    ORDER BY j.created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, agent_id, kind, payload, result, attempts
+                """
+            ),
+            {"worker_id": worker_id, "per_agent": _max_jobs_per_agent()},
+        ).mappings().first()
+        return dict(row) if row else None
+
+
+class _JobRunner:
+    """Runs one claimed job with a heartbeat/progress thread."""
+
+    def __init__(self, job: Dict[str, Any]):
+        self.job = job
+        self.stage = "starting"
+        self.progress = 0.0
+        self.result: Dict[str, Any] = dict(job.get("result") or {})
+        self.cancelled = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def report(self, stage: str, fraction: float, **info) -> None:
+        if self.cancelled.is_set():
+            raise IngestionCancelled()
+        with self._lock:
+            self.stage = stage
+            self.progress = max(self.progress, min(1.0, float(fraction)))
+            if "document_ids" in info:
+                self.result["document_ids"] = list(info["document_ids"])
+
+    def _flush(self) -> None:
+        with self._lock:
+            params = {
+                "id": self.job["id"],
+                "stage": self.stage,
+                "progress": self.progress,
+                "result": dict(self.result),
+            }
+        with engine.begin() as conn:
+            row = conn.execute(
+                text(
+                    """
+                    UPDATE omni_ingestion_jobs
+                    SET stage = :stage, progress = :progress, result = CAST(:result AS JSON),
+                        heartbeat_at = NOW()
+                    WHERE id = :id
+                    RETURNING cancel_requested
+                    """
+                ),
+                {**params, "result": _json(params["result"])},
+            ).first()
+        if row is not None and row.cancel_requested:
+            self.cancelled.set()
+
+    def _heartbeat(self) -> None:
+        while not self._done.wait(_progress_interval()):
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"[WARN] Ingestion heartbeat failed for {self.job['id']}: {e}")
+
+    def run(self, execute: Callable[[Dict[str, Any], Callable[..., None]], Dict[str, Any]]) -> None:
+        job_id = self.job["id"]
+        agent_id = self.job["agent_id"]
+        stale_docs = list(self.result.get("document_ids") or [])
+        if stale_docs:
+            # Left behind by an attempt whose worker died; start clean.
+            _discard_partial_documents(agent_id, stale_docs)
+            self.result.pop("document_ids", None)
+
+        beat = threading.Thread(target=self._heartbeat, name=f"ingest-heartbeat-{job_id[:8]}", daemon=True)
+        beat.start()
+        status, error, outcome = "failed", None, {}
+        try:
+            outcome = execute(self.job, self.report) or {}
+            if self.cancelled.is_set():
+                status = "cancelled"
+            elif outcome.get("error"):
+                error = str(outcome["error"])
+            else:
+                status = "succeeded"
+        except IngestionCancelled:
+            status = "cancelled"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            self._done.set()
+            beat.join(timeout=5)
+
+        result = {**self.result, **{k: v for k, v in outcome.items() if k != "error"}}
+        if status != "succeeded" and result.get("document_ids"):
+            _discard_partial_documents(agent_id, result["document_ids"])
+            result["discarded_document_ids"] = result.pop("document_ids")
+        _finish(job_id, status, result, error)
+        print(f"[OK] Ingestion job {job_id} {status}" + (f": {error}" if error else ""))
+
+
+def _json(value: Any) -> str:
+    return json.dumps(value, default=str)
+
+
+def _finish(job_id: str, status: str, result: Dict[str, Any], error: Optional[str]) -> None:
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                UPDATE omni_ingestion_jobs
+                SET status = :status, stage = :status,
+                    progress = CASE WHEN :status = 'succeeded' THEN 1.0 ELSE progress END,
+                    result = CAST(:result AS JSON), error = :error,
+                    finished_at = NOW(), heartbeat_at = NOW()
+                WHERE id = :id
+                """
+            ),
+            {"id": job_id, "status": status, "result": _json(result), "error": error},
+        )
+    shutil.rmtree(os.path.join(_spool_root(), job_id), ignore_errors=True)
+
+
+def _discard_partial_documents(agent_id: str, doc_ids: List[int]) -> None:
+    """Remove documents (rows, parent chunks and their vectors) of an unfinished attempt."""
+    from .database import delete_document
+    from .rag.vector_store import get_collection_name
+
+    ids = [int(doc_id) for doc_id in doc_ids if doc_id is not None]
+    if not ids:
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    """
+                    DELETE FROM langchain_pg_embedding e
+                    USING langchain_pg_collection c
+                    WHERE e.collection_id = c.uuid
+                      AND c.name = :collection
+                      AND e.cmetadata->>'parent_id' IN (
+                          SELECT id::text FROM omni_parent_chunks WHERE source_doc_id = ANY(:doc_ids)
+                      )
+                    """
+                ),
+                {"collection": get_collection_name(agent_id), "doc_ids": ids},
+            )
+    except Exception as e:
+        print(f"[WARN] Partial vector cleanup failed for {agent_id}: {e}")
+    for doc_id in ids:
+        try:
+            delete_document(doc_id)
+        except Exception as e:
+            print(f"[WARN] Partial document cleanup failed for {doc_id}: {e}")
+
+
+def execute_job(job: Dict[str, Any], progress: Callable[..., None]) -> Dict[str, Any]:
+    """Run a claimed job's payload through the regular ingestion pipeline."""
+    payload = job.get("payload") or {}
+    if job["kind"] == "urls":
+        from .processing.scraper import process_urls
+        return process_urls(payload.get("urls") or [], job["agent_id"], progress=progress)
+
+    from .chat_service import process_documents
+
+    uploads = []
+    try:
+        for item in payload.get("files") or []:
+            if os.path.exists(item["path"]):
+                uploads.append(_SpooledUpload(item["path"], item["filename"], item.get("size", 0)))
+            else:
+                print(f"[WARN] Spooled upload missing: {item['path']}")
+        return process_documents(
+            files=uploads or None,
+            text_input=payload.get("text") or None,
+            agent_id=job["agent_id"],
+            progress=progress,
+        )
+    finally:
+        for upload in uploads:
+            try:
+                upload.close()
+            except Exception:
+                pass
+
+
+def run_worker(stop_event: Optional[threading.Event] = None, worker_id: str = None) -> None:
+    """Claim and run jobs until stop_event is set."""
+    stop_event = stop_event or threading.Event()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    next_requeue = 0.0
+    print(f"[OK] Ingestion worker {worker_id} started")
+    while not stop_event.is_set():
+        try:
+            requeue = time.monotonic() >= next_requeue
+            if requeue:
+                next_requeue = time.monotonic() + _stale_seconds() / 4
+            job = _claim_next(worker_id, requeue=requeue)
+        except Exception as e:
+            print(f"[WARN] Ingestion claim failed: {e}")
+            stop_event.wait(_poll_interval() * 5)
+            continue
+        if job is None:
+            stop_event.wait(_poll_interval())
+            continue
+        _JobRunner(job).run(execute_job)
+    from .processing.document_loader import shutdown_extraction_pool
+    shutdown_extraction_pool()
+    print(f"[OK] Ingestion worker {worker_id} stopped")
+
+
+def _worker_process_main() -> None:
+    stop_event = threading.Event()
+
+    def _stop(*_args):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    run_worker(stop_event)
+
+
+def start_ingest_workers() -> int:
+    """Spawn INGEST_WORKER_PROCESSES worker processes (API lifespan). Returns count running."""
+    if not queue_available():
+        return 0
+    with _WORKERS_LOCK:
+        _WORKERS[:] = [proc for proc in _WORKERS if proc.is_alive()]
+        ctx = multiprocessing.get_context("spawn")
+        while len(_WORKERS) < _worker_processes():
+            proc = ctx.Process(target=_worker_process_main, name=f"omni-ingest-{len(_WORKERS)}")
+            proc.start()
+            _WORKERS.append(proc)
+        return len(_WORKERS)
+
+
+def stop_ingest_workers(timeout: float = 10.0) -> None:
+    """Ask workers to stop after their current job; kill stragglers after timeout.
+
+    A killed job stops heartbeating and is re-queued by the next worker.
+    """
+    with _WORKERS_LOCK:
+        for proc in _WORKERS:
+            if proc.is_alive():
+                proc.terminate()
+        deadline = time.monotonic() + timeout
+        for proc in _WORKERS:
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                proc.kill()
+                proc.join(1.0)
+        _WORKERS.clear()
+
+
+if __name__ == "__main__":
+    _worker_process_main()
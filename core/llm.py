@@ -4,16 +4,20 @@ LLM Integration - vLLM/OpenAI-compatible client with monitoring hooks.
 
 from __future__ import annotations
 
+import asyncio
 import os
 import time
 from functools import lru_cache
+from typing import AsyncIterator
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 
+from . import llm_gateway
 from .config import MODEL_BACKENDS, VLLM_BASE_URL as DEFAULT_BASE_URL, VLLM_MODEL as DEFAULT_MODEL
 from .database import log_usage
-from .agent_config import sync_agent_config
+from .prompt_budget import count_tokens
+from .agent_config import record_usage as record_agent_usage
 from .monitoring import (
     RAG_CONTEXT_HIT,
     RAG_CONTEXT_MISS,
@@ -21,6 +25,7 @@ from .monitoring import (
     RAG_CACHE_MISSES_DEPRECATED,
     ConfigLoader,
     LLM_LATENCY,
+    LLM_TIME_TO_FIRST_TOKEN,
     TOKEN_USAGE,
 )
 
@@ -29,19 +34,39 @@ CONFIG = ConfigLoader.load_model_config()
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", CONFIG.get("llm", {}).get("temperature", 0.6)))
 
 
-def get_llm(model_key: str = None):
-    """Get LLM instance (supports OpenAI-compatible providers, vLLM, Groq, etc.)."""
+def _backend_config(model_key: str = None) -> dict:
+    if model_key and model_key in MODEL_BACKENDS:
+        return MODEL_BACKENDS[model_key]
+    return MODEL_BACKENDS.get("default", {})
+
+
+def _backend_urls(model_key: str = None):
+    """(base_url, replica_base_url or None) for a model key."""
     if model_key and model_key in MODEL_BACKENDS:
         base_url = MODEL_BACKENDS[model_key]["base_url"]
+    else:
+        base_url = DEFAULT_BASE_URL
+    return base_url, (_backend_config(model_key).get("replica_base_url") or None)
+
+
+def get_llm(model_key: str = None, base_url: str = None, max_retries: int = 2):
+    """
+    Get LLM instance (supports OpenAI-compatible providers, vLLM, Groq, etc.).
+
+    base_url overrides the backend URL (a replica of the same model); the
+    HTTP connection pool is shared per URL through core.llm_gateway.
+    """
+    if model_key and model_key in MODEL_BACKENDS:
         model_name = MODEL_BACKENDS[model_key]["model"]
         api_key = MODEL_BACKENDS[model_key].get(
             "api_key",
             os.getenv("VLLM1_API_KEY", os.getenv("VLLM_API_KEY", "not-needed")),
         )
     else:
-        base_url = DEFAULT_BASE_URL
         model_name = DEFAULT_MODEL
         api_key = os.getenv("VLLM1_API_KEY", os.getenv("VLLM_API_KEY", "not-needed"))
+    base_url = base_url or _backend_urls(model_key)[0]
+    backend = llm_gateway.get_backend(base_url)
 
     return ChatOpenAI(
         base_url=base_url,
@@ -49,12 +74,19 @@ def get_llm(model_key: str = None):
         model=model_name,
         temperature=LLM_TEMPERATURE,
         max_tokens=CONFIG.get("llm", {}).get("max_tokens", 2048),
-        timeout=180.0,
-        max_retries=2,
+        timeout=llm_gateway.request_timeout(),
+        max_retries=max_retries,
+        http_client=backend.http_client(),
+        http_async_client=backend.async_http_client(),
+        # Streamed calls end with a usage chunk (OpenAI stream_options / vLLM).
+        stream_usage=True,
     )
 
 
-PROMPT_TEMPLATE = """You are a helpful AI assistant.
+# Stable prefix: byte-identical for every request of an agent, so vLLM's
+# automatic prefix caching reuses its KV blocks. Only per-agent data (the
+# media inventory, as agent_context) is appended; nothing per-request.
+SYSTEM_PROMPT = """You are a helpful AI assistant.
 
 Response Rules:
 1. Answer naturally in plain text when no media is needed.
@@ -84,9 +116,11 @@ Canonical enforcement:
 - Never output shorthand like `[image]file.png`, `[video]file.mp4`, or `[document]file.pdf`.
 
 Context Usage:
-Always check the available context sections before using tags.
+Always check the available context sections before using tags."""
 
-Previous conversation:
+# Per-request part, most reusable first: history only grows between turns of
+# a session, so the previous turn's prompt is usually a prefix of this one.
+TURN_TEMPLATE = """Previous conversation:
 {conversation_history}
 
 Context:
@@ -96,26 +130,196 @@ Question: {question}
 
 Answer:"""
 
+# Flattened form, for token budgeting and usage estimates.
+PROMPT_TEMPLATE = SYSTEM_PROMPT + "\n\n" + TURN_TEMPLATE
+
+
+QA_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", SYSTEM_PROMPT.replace("{", "{{").replace("}", "}}") + "{agent_context}"),
+        ("human", TURN_TEMPLATE),
+    ]
+)
+
+
+def _chain_inputs(question: str, context: str, conversation_history: str, agent_context: str = "") -> dict:
+    return {
+        "agent_context": f"\n\n{agent_context}" if agent_context else "",
+        "question": question,
+        "context": context,
+        "conversation_history": conversation_history,
+    }
+
+
+@lru_cache(maxsize=8)
+def get_qa_chain(model_key: str = None, base_url: str = None):
+    """Get QA chain (cached). Retries are left to core.llm_gateway."""
+    llm = get_llm(model_key, base_url=base_url, max_retries=0)
+    return QA_PROMPT | llm
+
+
+def _resolve_model_name(model_key: str = None) -> str:
+    if model_key and model_key in MODEL_BACKENDS:
+        return MODEL_BACKENDS[model_key]["model"]
+    return DEFAULT_MODEL
 
-@lru_cache(maxsize=4)
-def get_qa_chain(model_key: str = None):
-    """Get QA chain (cached)."""
-    llm = get_llm(model_key)
-    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
-    return prompt | llm
 
+def _observe_context(agent_id: str, context: str) -> None:
+    if context:
+        RAG_CONTEXT_HIT.labels(agent_id=str(agent_id)).inc()
+        RAG_CACHE_HITS_DEPRECATED.labels(agent_id=str(agent_id)).inc()
+    else:
+        RAG_CONTEXT_MISS.labels(agent_id=str(agent_id)).inc()
+        RAG_CACHE_MISSES_DEPRECATED.labels(agent_id=str(agent_id)).inc()
 
-def retry_with_backoff(func, retries=2, initial_delay=2.0):
-    """Simple retry with exponential backoff."""
-    for i in range(retries):
+
+def _record_usage(
+    response_msg,
+    latency_sec: float,
+    agent_id: str = None,
+    agent_name: str = "default",
+    model_key: str = None,
+    request_id: str = None,
+    session_id: str = None,
+    user_id: str = None,
+    channel_name: str = "web",
+    channel_type: str = "UTILITY",
+    query_tokens: int = 0,
+    rag_query_tokens: int = 0,
+) -> None:
+    """Write Postgres/ClickHouse usage rows and Prometheus token counters."""
+    try:
+        usage = response_msg.response_metadata.get("token_usage", {}) or {}
+        usage_meta = getattr(response_msg, "usage_metadata", {}) or {}
+        p_tokens = int(
+            usage.get("prompt_tokens")
+            or usage_meta.get("input_tokens")
+            or 0
+        )
+        c_tokens = int(
+            usage.get("completion_tokens")
+            or usage_meta.get("output_tokens")
+            or 0
+        )
+        # Prompt tokens served from vLLM's prefix cache
+        # (reported with --enable-prompt-tokens-details).
+        cached_tokens = int(
+            (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+            or (usage_meta.get("input_token_details") or {}).get("cache_read")
+            or 0
+        )
+
+        meta_model = response_msg.response_metadata.get("model_name", None)
+        if not meta_model:
+            meta_model = _resolve_model_name(model_key)
+
+        # Postgres usage log (always write a row, even when token metadata is missing)
+        log_usage(
+            agent_id,
+            p_tokens,
+            c_tokens,
+            meta_model,
+            latency=latency_sec,
+            query_tokens=query_tokens,
+            rag_query_tokens=rag_query_tokens,
+        )
+        # YAML usage snapshot is materialized in the background (coalesced per agent).
+        if agent_id:
+            record_agent_usage(
+                str(agent_id),
+                prompt_tokens=p_tokens,
+                completion_tokens=c_tokens,
+                query_tokens=query_tokens,
+                rag_query_tokens=rag_query_tokens,
+            )
+
+        # ClickHouse usage log (always write a row, even when token metadata is missing)
         try:
-            return func()
-        except Exception as exc:
-            if i == retries - 1:
-                raise exc
-            wait = initial_delay * (2**i)
-            print(f"LLM error: {exc}. Retrying in {wait}s... ({i + 1}/{retries})")
-            time.sleep(wait)
+            from .clickhouse import log_usage_to_clickhouse
+
+            cost_est = ((p_tokens / 1_000_000) * 0.50) + ((c_tokens / 1_000_000) * 0.70)
+            log_usage_to_clickhouse(
+                agent_id=str(agent_id) if agent_id else None,
+                model=meta_model,
+                query_tokens=query_tokens,
+                rag_query_tokens=rag_query_tokens,
+                prompt_tokens=p_tokens,
+                completion_tokens=c_tokens,
+                latency_ms=latency_sec * 1000.0,
+                cost=cost_est,
+                request_id=request_id,
+                session_id=session_id,
+                user_id=user_id,
+                channel_name=channel_name,
+                channel_type=channel_type,
+                status="success",
+            )
+        except Exception as ch_exc:
+            print(f"ClickHouse usage logging failed: {ch_exc}")
+
+        if p_tokens:
+            TOKEN_USAGE.labels(agent_id=str(agent_id), agent_name=agent_name, token_type="prompt").inc(p_tokens)
+        if c_tokens:
+            TOKEN_USAGE.labels(agent_id=str(agent_id), agent_name=agent_name, token_type="completion").inc(c_tokens)
+        if cached_tokens:
+            TOKEN_USAGE.labels(agent_id=str(agent_id), agent_name=agent_name, token_type="cached_prompt").inc(
+                cached_tokens
+            )
+    except Exception as exc:
+        print(f"Metrics logging failed: {exc}")
+
+
+def _llm_failure(
+    exc: Exception,
+    started_at: float,
+    agent_id: str = None,
+    model_key: str = None,
+    request_id: str = None,
+    session_id: str = None,
+    user_id: str = None,
+    channel_name: str = "web",
+    channel_type: str = "UTILITY",
+    query_tokens: int = 0,
+    rag_query_tokens: int = 0,
+) -> RuntimeError:
+    """Log a failed invocation and build the user-facing RuntimeError."""
+    error_msg = str(exc)
+    print(f"LLM invocation failed: {error_msg}")
+    try:
+        from .clickhouse import log_usage_to_clickhouse
+
+        log_usage_to_clickhouse(
+            agent_id=str(agent_id) if agent_id else None,
+            model=_resolve_model_name(model_key),
+            query_tokens=query_tokens,
+            rag_query_tokens=rag_query_tokens,
+            prompt_tokens=0,
+            completion_tokens=0,
+            latency_ms=(time.time() - started_at) * 1000.0,
+            cost=0.0,
+            request_id=request_id,
+            session_id=session_id,
+            user_id=user_id,
+            channel_name=channel_name,
+            channel_type=channel_type,
+            status="error",
+            error=error_msg,
+        )
+    except Exception:
+        pass
+
+    if "Connection" in error_msg or "timeout" in error_msg.lower():
+        resolved_model = DEFAULT_MODEL
+        resolved_backend = DEFAULT_BASE_URL
+        if model_key and model_key in MODEL_BACKENDS:
+            resolved_model = MODEL_BACKENDS[model_key]["model"]
+            resolved_backend = MODEL_BACKENDS[model_key]["base_url"]
+        return RuntimeError(
+            f"Cannot connect to LLM backend. Ensure backend is running at '{resolved_backend}' and model '{resolved_model}' is loaded. Error: {error_msg}"
+        )
+    if "memory" in error_msg.lower():
+        return RuntimeError(f"Out of memory. Try a smaller model. Error: {error_msg}")
+    return RuntimeError(f"LLM invocation failed: {error_msg}")
 
 
 def invoke_chain(
@@ -133,147 +337,196 @@ def invoke_chain(
     channel_type: str = "UTILITY",
     query_tokens: int = 0,
     rag_query_tokens: int = 0,
+    agent_context: str = "",
 ) -> str:
     """Invoke the QA chain with monitoring and analytics logging."""
     start_time = time.time()
+    log_ctx = dict(
+        agent_id=agent_id,
+        model_key=model_key,
+        request_id=request_id,
+        session_id=session_id,
+        user_id=user_id,
+        channel_name=channel_name,
+        channel_type=channel_type,
+        query_tokens=query_tokens,
+        rag_query_tokens=rag_query_tokens,
+    )
 
     try:
-        chain = get_qa_chain(model_key)
-
-        if context:
-            RAG_CONTEXT_HIT.labels(agent_id=str(agent_id)).inc()
-            RAG_CACHE_HITS_DEPRECATED.labels(agent_id=str(agent_id)).inc()
-        else:
-            RAG_CONTEXT_MISS.labels(agent_id=str(agent_id)).inc()
-            RAG_CACHE_MISSES_DEPRECATED.labels(agent_id=str(agent_id)).inc()
-
-        response_msg = retry_with_backoff(
-            lambda: chain.invoke(
-                {
-                    "question": question,
-                    "context": context,
-                    "conversation_history": conversation_history,
-                }
-            ),
-            retries=2,
+        base_url, replica_url = _backend_urls(model_key)
+        inputs = _chain_inputs(question, context, conversation_history, agent_context)
+        _observe_context(agent_id, context)
+
+        response_msg = llm_gateway.invoke_sync(
+            base_url,
+            lambda url: get_qa_chain(model_key, url).invoke(inputs),
+            replica_url=replica_url,
         )
 
         latency_sec = time.time() - start_time
         LLM_LATENCY.labels(agent_id=str(agent_id), agent_name=agent_name).observe(latency_sec)
-        answer = response_msg.content
+        _record_usage(response_msg, latency_sec, agent_name=agent_name, **log_ctx)
+        return response_msg.content
 
-        try:
-            usage = response_msg.response_metadata.get("token_usage", {}) or {}
-            usage_meta = getattr(response_msg, "usage_metadata", {}) or {}
-            p_tokens = int(
-                usage.get("prompt_tokens")
-                or usage_meta.get("input_tokens")
-                or 0
-            )
-            c_tokens = int(
-                usage.get("completion_tokens")
-                or usage_meta.get("output_tokens")
-                or 0
-            )
+    except Exception as exc:
+        raise _llm_failure(exc, start_time, **log_ctx)
 
-            meta_model = response_msg.response_metadata.get("model_name", None)
-            if not meta_model:
-                if model_key and model_key in MODEL_BACKENDS:
-                    meta_model = MODEL_BACKENDS[model_key]["model"]
-                else:
-                    meta_model = DEFAULT_MODEL
-
-            # Postgres usage log (always write a row, even when token metadata is missing)
-            log_usage(
-                agent_id,
-                p_tokens,
-                c_tokens,
-                meta_model,
-                latency=latency_sec,
-                query_tokens=query_tokens,
-                rag_query_tokens=rag_query_tokens,
-            )
-            try:
-                if agent_id:
-                    sync_agent_config(str(agent_id))
-            except Exception as cfg_exc:
-                print(f"Agent config usage sync failed: {cfg_exc}")
 
-            # ClickHouse usage log (always write a row, even when token metadata is missing)
-            try:
-                from .clickhouse import log_usage_to_clickhouse
-
-                cost_est = ((p_tokens / 1_000_000) * 0.50) + ((c_tokens / 1_000_000) * 0.70)
-                log_usage_to_clickhouse(
-                    agent_id=str(agent_id) if agent_id else None,
-                    model=meta_model,
-                    query_tokens=query_tokens,
-                    rag_query_tokens=rag_query_tokens,
-                    prompt_tokens=p_tokens,
-                    completion_tokens=c_tokens,
-                    latency_ms=latency_sec * 1000.0,
-                    cost=cost_est,
-                    request_id=request_id,
-                    session_id=session_id,
-                    user_id=user_id,
-                    channel_name=channel_name,
-                    channel_type=channel_type,
-                    status="success",
-                )
-            except Exception as ch_exc:
-                print(f"ClickHouse usage logging failed: {ch_exc}")
-
-            if p_tokens:
-                TOKEN_USAGE.labels(agent_id=str(agent_id), agent_name=agent_name, token_type="prompt").inc(p_tokens)
-            if c_tokens:
-                TOKEN_USAGE.labels(agent_id=str(agent_id), agent_name=agent_name, token_type="completion").inc(c_tokens)
-        except Exception as exc:
-            print(f"Metrics logging failed: {exc}")
-
-        return answer
+async def ainvoke_chain(
+    question: str,
+    context: str,
+    conversation_history: str,
+    agent_id: str = None,
+    agent_name: str = "default",
+    verbosity: str = "medium",
+    model_key: str = None,
+    request_id: str = None,
+    session_id: str = None,
+    user_id: str = None,
+    channel_name: str = "web",
+    channel_type: str = "UTILITY",
+    query_tokens: int = 0,
+    rag_query_tokens: int = 0,
+    agent_context: str = "",
+) -> str:
+    """Async invoke_chain: awaits the backend natively, offloads usage bookkeeping."""
+    from .offload import run_blocking
+
+    start_time = time.time()
+    log_ctx = dict(
+        agent_id=agent_id,
+        model_key=model_key,
+        request_id=request_id,
+        session_id=session_id,
+        user_id=user_id,
+        channel_name=channel_name,
+        channel_type=channel_type,
+        query_tokens=query_tokens,
+        rag_query_tokens=rag_query_tokens,
+    )
+
+    try:
+        base_url, replica_url = _backend_urls(model_key)
+        inputs = _chain_inputs(question, context, conversation_history, agent_context)
+        _observe_context(agent_id, context)
+
+        # Breaker, per-backend limit, async back-off and optional hedging.
+        response_msg = await llm_gateway.ainvoke(
+            base_url,
+            lambda url: get_qa_chain(model_key, url).ainvoke(inputs),
+            replica_url=replica_url,
+        )
+
+        latency_sec = time.time() - start_time
+        LLM_LATENCY.labels(agent_id=str(agent_id), agent_name=agent_name).observe(latency_sec)
+        await run_blocking(_record_usage, response_msg, latency_sec, agent_name=agent_name, **log_ctx)
+        return response_msg.content
 
     except Exception as exc:
-        error_msg = str(exc)
-        print(f"LLM invocation failed: {error_msg}")
-        try:
-            from .clickhouse import log_usage_to_clickhouse
+        raise _llm_failure(exc, start_time, **log_ctx)
 
-            model_name = DEFAULT_MODEL
-            if model_key and model_key in MODEL_BACKENDS:
-                model_name = MODEL_BACKENDS[model_key]["model"]
 
-            log_usage_to_clickhouse(
-                agent_id=str(agent_id) if agent_id else None,
-                model=model_name,
-                query_tokens=query_tokens,
-                rag_query_tokens=rag_query_tokens,
-                prompt_tokens=0,
-                completion_tokens=0,
-                latency_ms=(time.time() - start_time) * 1000.0,
-                cost=0.0,
-                request_id=request_id,
-                session_id=session_id,
-                user_id=user_id,
-                channel_name=channel_name,
-                channel_type=channel_type,
-                status="error",
-                error=error_msg,
-            )
-        except Exception:
-            pass
-
-        if "Connection" in error_msg or "timeout" in error_msg.lower():
-            resolved_model = DEFAULT_MODEL
-            resolved_backend = DEFAULT_BASE_URL
-            if model_key and model_key in MODEL_BACKENDS:
-                resolved_model = MODEL_BACKENDS[model_key]["model"]
-                resolved_backend = MODEL_BACKENDS[model_key]["base_url"]
-            raise RuntimeError(
-                f"Cannot connect to LLM backend. Ensure backend is running at '{resolved_backend}' and model '{resolved_model}' is loaded. Error: {error_msg}"
+async def astream_chain(
+    question: str,
+    context: str,
+    conversation_history: str,
+    agent_id: str = None,
+    agent_name: str = "default",
+    verbosity: str = "medium",
+    model_key: str = None,
+    request_id: str = None,
+    session_id: str = None,
+    user_id: str = None,
+    channel_name: str = "web",
+    channel_type: str = "UTILITY",
+    query_tokens: int = 0,
+    rag_query_tokens: int = 0,
+    agent_context: str = "",
+) -> AsyncIterator[str]:
+    """
+    Streaming ainvoke_chain: yields answer text deltas as the backend emits them.
+
+    Usage is recorded once, when the stream ends: from the backend's final
+    usage chunk, or counted with the model's tokenizer (core.prompt_budget)
+    from the rendered prompt and streamed text if the client went away before
+    it arrived. A failed call is only retried before its first token.
+    """
+    from .offload import get_io_executor, submit_with_context
+
+    start_time = time.time()
+    log_ctx = dict(
+        agent_id=agent_id,
+        model_key=model_key,
+        request_id=request_id,
+        session_id=session_id,
+        user_id=user_id,
+        channel_name=channel_name,
+        channel_type=channel_type,
+        query_tokens=query_tokens,
+        rag_query_tokens=rag_query_tokens,
+    )
+    inputs = _chain_inputs(question, context, conversation_history, agent_context)
+
+    aggregate = None
+    streamed = False
+    failed = False
+    try:
+        base_url, replica_url = _backend_urls(model_key)
+        _observe_context(agent_id, context)
+
+        retries = llm_gateway.retry_attempts()
+        for attempt in range(retries):
+            aggregate = None
+            target = llm_gateway.stream_target(base_url, replica_url)
+            try:
+                async with llm_gateway.stream_slot(target):
+                    async for chunk in get_qa_chain(model_key, target).astream(inputs):
+                        aggregate = chunk if aggregate is None else aggregate + chunk
+                        if chunk.content:
+                            if not streamed:
+                                streamed = True
+                                LLM_TIME_TO_FIRST_TOKEN.labels(agent_id=str(agent_id), agent_name=agent_name).observe(
+                                    time.time() - start_time
+                                )
+                            yield chunk.content
+                break
+            except Exception as exc:
+                if streamed or attempt == retries - 1 or not llm_gateway.is_backend_failure(exc):
+                    raise
+                wait = llm_gateway.retry_delay(attempt)
+                print(f"LLM error: {exc}. Retrying in {wait}s... ({attempt + 1}/{retries})")
+                await asyncio.sleep(wait)
+
+    except Exception as exc:
+        failed = True
+        raise _llm_failure(exc, start_time, **log_ctx)
+
+    finally:
+        # Also reached when the consumer stops early (client disconnect), so
+        # bookkeeping is handed to the I/O pool instead of awaited here.
+        if not failed and aggregate is not None:
+            latency_sec = time.time() - start_time
+            LLM_LATENCY.labels(agent_id=str(agent_id), agent_name=agent_name).observe(latency_sec)
+            submit_with_context(
+                get_io_executor(), _record_stream_usage, aggregate, inputs, latency_sec,
+                agent_name=agent_name, **log_ctx
             )
-        if "memory" in error_msg.lower():
-            raise RuntimeError(f"Out of memory. Try a smaller model. Error: {error_msg}")
-        raise RuntimeError(f"LLM invocation failed: {error_msg}")
+
+
+def _record_stream_usage(aggregate, inputs: dict, latency_sec: float, **log_ctx) -> None:
+    """_record_usage for a stream; counts tokens itself when no usage chunk arrived."""
+    if not getattr(aggregate, "usage_metadata", None):
+        model_key = log_ctx.get("model_key")
+        prompt = "\n\n".join(str(message.content) for message in QA_PROMPT.format_messages(**inputs))
+        input_tokens = count_tokens(prompt, model_key)
+        output_tokens = count_tokens(str(aggregate.content), model_key)
+        aggregate.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+    _record_usage(aggregate, latency_sec, **log_ctx)
 
 
 def reset_chain():
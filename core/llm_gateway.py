@@ -0,0 +1,440 @@
+"""
+Gateway in front of the OpenAI-compatible LLM backends (vLLM replicas).
+
+Every chat call goes through here instead of relying on the OpenAI client's
+own retries (which slept inside executor threads and multiplied with ours):
+
+- One pooled httpx client per backend URL, shared by every ChatOpenAI built
+  for it (keep-alive; HTTP/2 when the optional ``h2`` package is installed
+  and the endpoint negotiates it). Connect timeouts are short so a dead
+  backend fails fast.
+- Per-backend concurrency limit (LLM_MAX_CONCURRENCY): excess calls wait on
+  the event loop instead of piling onto a struggling vLLM.
+- Circuit breaker: after LLM_BREAKER_FAILURES consecutive failures a backend
+  is skipped for LLM_BREAKER_COOLDOWN seconds, then one probe is let through.
+  Calls fail over to the backend's replica while the breaker is open.
+- Retries back off with asyncio.sleep, so no thread is held while waiting.
+  The blocking invoke_sync path (voice turns) has to sleep in its worker
+  thread, so its backoff is capped at LLM_SYNC_RETRY_MAX_DELAY.
+- Hedging (LLM_HEDGE_ENABLED): when a call has not finished after the
+  LLM_HEDGE_PERCENTILE latency of recent calls, the same request is sent to
+  the replica (VLLM1_REPLICA_BASE_URL / VLLM2_REPLICA_BASE_URL) and the
+  first answer wins; the loser is cancelled. Streams are not hedged.
+- Each backend's vLLM prefix-cache hit rate is scraped in the background
+  (core.vllm_metrics).
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from . import vllm_metrics
+from .monitoring import LLM_BACKEND_REQUESTS, LLM_CIRCUIT_STATE, LLM_HEDGED_REQUESTS
+
+T = TypeVar("T")
+
+_CLOSED, _OPEN, _HALF_OPEN = 0, 1, 2
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def retry_attempts() -> int:
+    return max(1, _env_int("LLM_RETRIES", 2))
+
+
+def retry_delay(attempt: int) -> float:
+    return max(0.0, _env_float("LLM_RETRY_BACKOFF", 2.0)) * (2**attempt)
+
+
+def sync_retry_delay(attempt: int) -> float:
+    """retry_delay capped at LLM_SYNC_RETRY_MAX_DELAY: invoke_sync sleeps in a pool thread."""
+    return min(retry_delay(attempt), max(0.0, _env_float("LLM_SYNC_RETRY_MAX_DELAY", 1.0)))
+
+
+def request_timeout() -> httpx.Timeout:
+    return httpx.Timeout(_env_float("LLM_TIMEOUT", 180.0), connect=_env_float("LLM_CONNECT_TIMEOUT", 5.0))
+
+
+def _hedge_enabled() -> bool:
+    return os.getenv("LLM_HEDGE_ENABLED", "false").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("LLM_HTTP2", "true").strip().lower() not in {"1", "true", "yes", "on"}:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without contacting a backend whose breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self, name: str, failures: int, cooldown: float):
+        self.name = name
+        self.failures = max(1, failures)
+        self.cooldown = max(0.0, cooldown)
+        self._lock = threading.Lock()
+        self._state = _CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> int:
+        with self._lock:
+            if self._state == _OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                return _HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == _CLOSED:
+                return True
+            if self._state == _OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self._set_state(_HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self._probing = False
+            self._set_state(_CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            self._probing = False
+            if self._state == _HALF_OPEN or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+                self._set_state(_OPEN)
+
+    def release(self) -> None:
+        """The call was abandoned (hedge lost, client left): no verdict."""
+        with self._lock:
+            self._probing = False
+
+    def _set_state(self, state: int) -> None:
+        # Caller holds _lock.
+        self._state = state
+        LLM_CIRCUIT_STATE.labels(backend=self.name).set(state)
+
+
+class LatencyWindow:
+    """Recent successful-call latencies for the hedging threshold."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+        return ordered[index]
+
+
+class Backend:
+    """Shared state for one backend base URL."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.breaker = CircuitBreaker(
+            base_url,
+            _env_int("LLM_BREAKER_FAILURES", 5),
+            _env_float("LLM_BREAKER_COOLDOWN", 30.0),
+        )
+        self.latencies = LatencyWindow(min_samples=max(1, _env_int("LLM_HEDGE_MIN_SAMPLES", 20)))
+        self.max_concurrency = max(0, _env_int("LLM_MAX_CONCURRENCY", 64))
+        # asyncio.Semaphore binds to the loop that first waits on it.
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._http_client: Optional[httpx.Client] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self.max_concurrency:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores[loop] = semaphore
+        async with semaphore:
+            yield
+
+    def _client_options(self) -> Dict:
+        return dict(
+            timeout=request_timeout(),
+            limits=httpx.Limits(
+                max_connections=max(1, _env_int("LLM_POOL_MAX_CONNECTIONS", 100)),
+                max_keepalive_connections=max(1, _env_int("LLM_POOL_KEEPALIVE", 20)),
+            ),
+            http2=_http2_enabled(),
+        )
+
+    def http_client(self) -> httpx.Client:
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(**self._client_options())
+            return self._http_client
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(**self._client_options())
+            return self._async_http_client
+
+    async def aclose(self) -> None:
+        with self._lock:
+            sync_client, async_client = self._http_client, self._async_http_client
+            self._http_client = self._async_http_client = None
+        if async_client is not None:
+            await async_client.aclose()
+        if sync_client is not None:
+            sync_client.close()
+
+
+_BACKENDS: Dict[str, Backend] = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def get_backend(base_url: str) -> Backend:
+    backend = _BACKENDS.get(base_url)
+    if backend is None:
+        with _BACKENDS_LOCK:
+            backend = _BACKENDS.get(base_url)
+            if backend is None:
+                backend = Backend(base_url)
+                _BACKENDS[base_url] = backend
+                vllm_metrics.watch(base_url)
+    return backend
+
+
+async def close_backends() -> None:
+    """
+    Close pooled connections (API shutdown). Breaker and latency state is
+    kept; chains built before this still hold the closed clients, so callers
+    that keep going must also call core.llm.reset_chain().
+    """
+    with _BACKENDS_LOCK:
+        backends = list(_BACKENDS.values())
+    for backend in backends:
+        await backend.aclose()
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Errors that say the backend is unhealthy (retry, count towards the breaker)."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return True
+
+
+async def _attempt(backend: Backend, call: Callable[[str], Awaitable[T]]) -> T:
+    if not backend.breaker.allow():
+        LLM_BACKEND_REQUESTS.labels(backend=backend.base_url, result="rejected").inc()
+        raise CircuitOpenError(f"LLM backend '{backend.base_url}' is unavailable (circuit open)")
+    async with backend.slot():
+        started = time.monotonic()
+        try:
+            result = await call(backend.base_url)
+        except asyncio.CancelledError:
+            backend.breaker.release()
+            LLM_BACKEND_REQUESTS.labels(backend=backend.base_url, result="cancelled").inc()
+            raise
+        except Exception as exc:
+            if is_backend_failure(exc):
+                backend.breaker.record_failure()
+            else:
+                backend.breaker.release()
+            LLM_BACKEND_REQUESTS.labels(backend=backend.base_url, result="error").inc()
+            raise
+    backend.breaker.record_success()
+    backend.latencies.add(time.monotonic() - started)
+    LLM_BACKEND_REQUESTS.labels(backend=backend.base_url, result="success").inc()
+    return result
+
+
+async def _hedged(primary: Backend, replica: Optional[Backend], call: Callable[[str], Awaitable[T]]) -> T:
+    if replica is None:
+        return await _attempt(primary, call)
+    if primary.breaker.state == _OPEN:
+        return await _attempt(replica, call)
+    threshold = primary.latencies.percentile(_env_float("LLM_HEDGE_PERCENTILE", 95.0)) if _hedge_enabled() else None
+
+    first = asyncio.ensure_future(_attempt(primary, call))
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=threshold)
+        if done:
+            if isinstance(first.exception(), CircuitOpenError):
+                # Half-open and another call holds the probe.
+                return await _attempt(replica, call)
+            return first.result()
+
+        second = asyncio.ensure_future(_attempt(replica, call))
+        tasks.append(second)
+        pending = set(tasks)
+        errors = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = "primary" if task is first else "replica"
+                    LLM_HEDGED_REQUESTS.labels(backend=primary.base_url, winner=winner).inc()
+                    return task.result()
+                errors.append(task.exception())
+        LLM_HEDGED_REQUESTS.labels(backend=primary.base_url, winner="none").inc()
+        raise errors[0]
+    finally:
+        # The loser (or everything, if our caller was cancelled).
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def ainvoke(
+    base_url: str,
+    call: Callable[[str], Awaitable[T]],
+    replica_url: Optional[str] = None,
+) -> T:
+    """
+    Run call(base_url) with breaker, concurrency limit, async retries and
+    (optionally) a hedge to replica_url. call receives the URL to target.
+    """
+    primary = get_backend(base_url)
+    replica = get_backend(replica_url) if replica_url and replica_url != base_url else None
+    retries = retry_attempts()
+    for attempt in range(retries):
+        try:
+            return await _hedged(primary, replica, call)
+        except Exception as exc:
+            if attempt == retries - 1 or not is_backend_failure(exc):
+                raise
+            wait = retry_delay(attempt)
+            print(f"LLM error: {exc}. Retrying in {wait}s... ({attempt + 1}/{retries})")
+            await asyncio.sleep(wait)
+    raise AssertionError("unreachable")
+
+
+def stream_target(base_url: str, replica_url: Optional[str] = None) -> str:
+    """Backend URL for a streamed call: the replica while the primary's breaker is open."""
+    if replica_url and replica_url != base_url and get_backend(base_url).breaker.state == _OPEN:
+        return replica_url
+    return base_url
+
+
+@asynccontextmanager
+async def stream_slot(base_url: str):
+    """Breaker and concurrency limit around one streamed call (no hedging)."""
+    backend = get_backend(base_url)
+    if not backend.breaker.allow():
+        LLM_BACKEND_REQUESTS.labels(backend=base_url, result="rejected").inc()
+        raise CircuitOpenError(f"LLM backend '{base_url}' is unavailable (circuit open)")
+    async with backend.slot():
+        try:
+            yield
+        except (asyncio.CancelledError, GeneratorExit):
+            backend.breaker.release()
+            LLM_BACKEND_REQUESTS.labels(backend=base_url, result="cancelled").inc()
+            raise
+        except Exception as exc:
+            if is_backend_failure(exc):
+                backend.breaker.record_failure()
+            else:
+                backend.breaker.release()
+            LLM_BACKEND_REQUESTS.labels(backend=base_url, result="error").inc()
+            raise
+    backend.breaker.record_success()
+    LLM_BACKEND_REQUESTS.labels(backend=base_url, result="success").inc()
+
+
+def invoke_sync(
+    base_url: str,
+    call: Callable[[str], T],
+    replica_url: Optional[str] = None,
+) -> T:
+    """
+    Blocking callers (voice turns in worker threads): breaker, failover and retries.
+
+    The backoff between retries sleeps in the calling thread, holding it, so
+    it is capped by sync_retry_delay() rather than the full retry_delay().
+    """
+    primary = get_backend(base_url)
+    replica = get_backend(replica_url) if replica_url and replica_url != base_url else None
+    retries = retry_attempts()
+    for attempt in range(retries):
+        backend = primary if primary.breaker.allow() else replica
+        if backend is None:
+            LLM_BACKEND_REQUESTS.labels(backend=base_url, result="rejected").inc()
+            raise CircuitOpenError(f"LLM backend '{base_url}' is unavailable (circuit open)")
+        if backend is replica and not replica.breaker.allow():
+            LLM_BACKEND_REQUESTS.labels(backend=replica.base_url, result="rejected").inc()
+            raise CircuitOpenError(f"LLM backend '{replica.base_url}' is unavailable (circuit open)")
+        started = time.monotonic()
+        try:
+            result = call(backend.base_url)
+        except Exception as exc:
+            failure = is_backend_failure(exc)
+            if failure:
+                backend.breaker.record_failure()
+            else:
+                backend.breaker.release()
+            LLM_BACKEND_REQUESTS.labels(backend=backend.base_url, result="error").inc()
+            if attempt == retries - 1 or not failure:
+                raise
+            wait = sync_retry_delay(attempt)
+            print(f"LLM error: {exc}. Retrying in {wait}s... ({attempt + 1}/{retries})")
+            time.sleep(wait)
+            continue
+        backend.breaker.record_success()
+        backend.latencies.add(time.monotonic() - started)
+        LLM_BACKEND_REQUESTS.labels(backend=backend.base_url, result="success").inc()
+        return result
+    raise AssertionError("unreachable")
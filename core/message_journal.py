@@ -0,0 +1,289 @@
+"""
+Write-behind journal for chat messages.
+
+save_message() used to commit every message on its own and bump
+omni_agents.message_count in the same transaction, so the two writes of
+every turn serialized on the agent row under concurrent traffic. Messages
+are now buffered in-process instead:
+
+- A daemon thread inserts buffered messages in one multi-row INSERT every
+  MESSAGE_JOURNAL_FLUSH_MS (sooner once MESSAGE_JOURNAL_BATCH are waiting).
+- Each flush appends one row per agent to omni_agent_message_deltas rather
+  than updating the agent row; MESSAGE_COUNT_ROLLUP_INTERVAL folds the deltas
+  into message_count (one UPDATE per agent per interval).
+- History reads merge messages that are still buffered, so the next turn
+  sees the previous one immediately.
+- flush_message_journal() drains everything on shutdown. Beyond
+  MESSAGE_JOURNAL_MAX_PENDING buffered rows, callers help flush before
+  returning (async callers through core.offload, never on the event loop),
+  unless a flush is already running or the journal is backing off.
+- Connection/operational errors keep the batch for the next attempt, which
+  is delayed exponentially (up to MESSAGE_JOURNAL_RETRY_MAX_S) while the
+  database stays unreachable. Any other error bisects the batch so only the
+  rows the database rejects are dropped.
+- The buffer never grows past MESSAGE_JOURNAL_HARD_LIMIT: during a long
+  outage the oldest rows are dropped. Drops are counted in
+  omnicortex_message_journal_dropped_total{reason=rejected|overflow}.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from .monitoring import MESSAGE_JOURNAL_DROPPED, MESSAGE_JOURNAL_FLUSH_ROWS, MESSAGE_JOURNAL_PENDING
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def journal_enabled() -> bool:
+    return os.getenv("MESSAGE_JOURNAL_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _flush_interval() -> float:
+    return max(0.01, _env_float("MESSAGE_JOURNAL_FLUSH_MS", 250.0) / 1000.0)
+
+
+def _batch_size() -> int:
+    return max(1, _env_int("MESSAGE_JOURNAL_BATCH", 200))
+
+
+def _max_pending() -> int:
+    return max(1, _env_int("MESSAGE_JOURNAL_MAX_PENDING", 20000))
+
+
+def _hard_limit() -> int:
+    return max(_max_pending(), _env_int("MESSAGE_JOURNAL_HARD_LIMIT", 100000))
+
+
+def _retry_max_delay() -> float:
+    return max(_flush_interval(), _env_float("MESSAGE_JOURNAL_RETRY_MAX_S", 30.0))
+
+
+def _rollup_interval() -> float:
+    return max(1.0, _env_float("MESSAGE_COUNT_ROLLUP_INTERVAL", 10.0))
+
+
+_PENDING: List[Dict] = []
+_IN_FLIGHT: List[Dict] = []
+_CV = threading.Condition()
+_FLUSH_LOCK = threading.Lock()
+_LAST_TIMESTAMP: Optional[datetime] = None
+_WORKER: Optional[threading.Thread] = None
+# Consecutive transient flush failures and when the next attempt may run (monotonic).
+_RETRY = {"failures": 0, "not_before": 0.0}
+
+
+def _next_timestamp() -> datetime:
+    # Caller holds _CV. Strictly increasing so a user/assistant pair keeps its order.
+    global _LAST_TIMESTAMP
+    now = datetime.now(timezone.utc)
+    if _LAST_TIMESTAMP is not None and now <= _LAST_TIMESTAMP:
+        now = _LAST_TIMESTAMP + timedelta(microseconds=1)
+    _LAST_TIMESTAMP = now
+    return now
+
+
+def enqueue_message(role: str, content: str, agent_id: str = None) -> bool:
+    """
+    Buffer one message for the next batched insert. Never touches the database.
+    Returns True when the backlog is over MESSAGE_JOURNAL_MAX_PENDING and the
+    caller should run flush_backlog() (backpressure).
+    """
+    with _CV:
+        _PENDING.append({
+            "agent_id": agent_id,
+            "role": role,
+            "content": content,
+            "timestamp": _next_timestamp(),
+        })
+        overflow = len(_PENDING) - _hard_limit()
+        if overflow > 0:
+            # The database has been down for a while: keep the newest turns.
+            del _PENDING[:overflow]
+            MESSAGE_JOURNAL_DROPPED.labels(reason="overflow").inc(overflow)
+        backlog = len(_PENDING)
+        MESSAGE_JOURNAL_PENDING.set(backlog)
+        _start_worker_once()
+        if backlog >= _batch_size():
+            _CV.notify()
+    # The database is not keeping up (or is down).
+    return backlog >= _max_pending()
+
+
+def pending_messages(agent_id: Optional[str] = None) -> List[Dict]:
+    """Buffered (not yet committed) messages in history format, oldest first."""
+    with _CV:
+        rows = [
+            row for row in _IN_FLIGHT + _PENDING
+            if agent_id is None or row["agent_id"] == agent_id
+        ]
+    return [
+        {"role": row["role"], "content": row["content"], "timestamp": row["timestamp"].isoformat()}
+        for row in rows
+    ]
+
+
+def discard_pending(agent_id: Optional[str] = None) -> int:
+    """Drop buffered messages (history clear). Returns how many were dropped."""
+    with _FLUSH_LOCK:
+        with _CV:
+            before = len(_PENDING)
+            _PENDING[:] = [row for row in _PENDING if agent_id is not None and row["agent_id"] != agent_id]
+            MESSAGE_JOURNAL_PENDING.set(len(_PENDING))
+            return before - len(_PENDING)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Errors worth retrying the same rows for (database unreachable or busy)."""
+    from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+    if isinstance(exc, (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError, ConnectionError, TimeoutError)):
+        return True
+    return isinstance(exc, DBAPIError) and bool(exc.connection_invalidated)
+
+
+def _retry_delay() -> float:
+    """Seconds until the journal may try the database again (0 when healthy)."""
+    return max(0.0, _RETRY["not_before"] - time.monotonic())
+
+
+def _record_flush_outcome(ok: bool) -> None:
+    if ok:
+        _RETRY["failures"] = 0
+        _RETRY["not_before"] = 0.0
+        return
+    _RETRY["failures"] += 1
+    delay = min(_retry_max_delay(), _flush_interval() * (2 ** _RETRY["failures"]))
+    _RETRY["not_before"] = time.monotonic() + delay
+
+
+def flush_backlog() -> int:
+    """
+    Backpressure flush for callers over MESSAGE_JOURNAL_MAX_PENDING.
+
+    Skipped while a flush is already running (that is the progress the caller
+    would wait for) or the journal is backing off after a failed attempt, so
+    an outage never makes every chat turn wait on a connect attempt.
+    """
+    if _retry_delay() > 0 or not _FLUSH_LOCK.acquire(blocking=False):
+        return 0
+    try:
+        return _flush_locked()
+    finally:
+        _FLUSH_LOCK.release()
+
+
+def flush_messages() -> int:
+    """Insert everything buffered so far. Returns the number of rows written."""
+    with _FLUSH_LOCK:
+        return _flush_locked()
+
+
+def _flush_locked() -> int:
+    # Caller holds _FLUSH_LOCK.
+    from .database import insert_journaled_messages
+
+    with _CV:
+        if not _PENDING:
+            return 0
+        _IN_FLIGHT[:] = _PENDING
+        _PENDING.clear()
+        batch = list(_IN_FLIGHT)
+    written = 0
+    # Parts still to insert, next one last.
+    parts = [batch]
+    try:
+        while parts:
+            part = parts.pop()
+            try:
+                written += insert_journaled_messages(part)
+            except Exception as e:
+                if _is_transient(e):
+                    parts.append(part)
+                    raise
+                if len(part) == 1:
+                    MESSAGE_JOURNAL_DROPPED.labels(reason="rejected").inc()
+                    print(f"[WARN] Message journal dropped a row the database rejects: {e}")
+                    continue
+                # Isolate the bad row(s) instead of retrying the batch forever.
+                middle = len(part) // 2
+                parts.extend([part[middle:], part[:middle]])
+    except Exception as e:
+        # Keep the unwritten rows (ahead of newer ones) for the next attempt.
+        unwritten = [row for part in reversed(parts) for row in part]
+        with _CV:
+            _PENDING[:0] = unwritten
+        _record_flush_outcome(False)
+        print(
+            f"[WARN] Message journal flush failed ({len(unwritten)} rows kept, "
+            f"retry in {_retry_delay():.1f}s): {e}"
+        )
+    else:
+        _record_flush_outcome(True)
+    finally:
+        with _CV:
+            _IN_FLIGHT.clear()
+            MESSAGE_JOURNAL_PENDING.set(len(_PENDING))
+    if written:
+        MESSAGE_JOURNAL_FLUSH_ROWS.observe(written)
+    return written
+
+
+def rollup_counts() -> int:
+    from .database import rollup_message_counts
+
+    try:
+        return rollup_message_counts()
+    except Exception as e:
+        print(f"[WARN] Message count rollup failed: {e}")
+        return 0
+
+
+def flush_message_journal() -> int:
+    """Drain the buffer and fold counters (API shutdown)."""
+    written = flush_messages()
+    rollup_counts()
+    return written
+
+
+def _run() -> None:
+    next_rollup = time.monotonic() + _rollup_interval()
+    while True:
+        with _CV:
+            wait = _retry_delay()
+            if not wait and len(_PENDING) < _batch_size():
+                wait = _flush_interval()
+            if wait:
+                _CV.wait(wait)
+        # New rows notify the worker; that must not cut a retry backoff short.
+        if not _retry_delay():
+            try:
+                flush_messages()
+            except Exception as e:
+                print(f"[WARN] Message journal error: {e}")
+        if time.monotonic() >= next_rollup:
+            rollup_counts()
+            next_rollup = time.monotonic() + _rollup_interval()
+
+
+def _start_worker_once() -> None:
+    # Caller holds _CV.
+    global _WORKER
+    if _WORKER is not None and _WORKER.is_alive():
+        return
+    _WORKER = threading.Thread(target=_run, name="message-journal", daemon=True)
+    _WORKER.start()
@@ -29,7 +29,7 @@ CHAT_REQUESTS = Counter(
 TOKEN_USAGE = Counter(
     'omnicortex_agent_tokens_total',
     'Total tokens used per agent',
-    ['agent_id', 'agent_name', 'token_type']  # token_type: prompt, completion
+    ['agent_id', 'agent_name', 'token_type']  # token_type: prompt, completion, cached_prompt
 )
 
 RAG_CONTEXT_HIT = Counter(
@@ -57,6 +57,72 @@ RAG_CACHE_MISSES_DEPRECATED = Counter(
     ['agent_id']
 )
 
+AGENT_CACHE_EVENTS = Counter(
+    'omnicortex_agent_cache_events_total',
+    'Agent config cache lookups and invalidations',
+    ['event']  # event: hit, miss, invalidation
+)
+
+AUTH_CACHE_EVENTS = Counter(
+    'omnicortex_auth_cache_events_total',
+    'Bearer-token verification cache outcomes',
+    ['event']  # event: hit, negative_hit, miss, coalesced
+)
+
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    'omnicortex_semantic_cache_lookups_total',
+    'Semantic cache lookups',
+    ['result']  # result: hit, miss
+)
+
+SEMANTIC_CACHE_EVICTIONS = Counter(
+    'omnicortex_semantic_cache_evictions_total',
+    'Semantic cache rows removed by the lifecycle reaper',
+    ['reason']  # reason: expired, budget
+)
+
+RERANKER_SCORE_CACHE = Counter(
+    'omnicortex_reranker_score_cache_total',
+    'Reranker (query, chunk) score cache outcomes',
+    ['result']  # result: hit, miss
+)
+
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    'omnicortex_embedding_cache_lookups_total',
+    'Ingestion chunk embeddings served from the content-hash cache',
+    ['result']  # result: hit, miss
+)
+
+CLICKHOUSE_ROWS = Counter(
+    'omnicortex_clickhouse_rows_total',
+    'Analytics rows by outcome',
+    ['table', 'result']  # result: spooled, inserted, dropped (spool full / unwritable), dead (rejected by ClickHouse)
+)
+
+LLM_BACKEND_REQUESTS = Counter(
+    'omnicortex_llm_backend_requests_total',
+    'LLM backend calls by outcome',
+    ['backend', 'result']  # result: success, error, rejected (circuit open), cancelled
+)
+
+LLM_PREFIX_CACHE_TOKENS = Counter(
+    'omnicortex_llm_prefix_cache_tokens_total',
+    'Prompt tokens looked up in the vLLM prefix cache, scraped from its /metrics',
+    ['backend', 'result']  # result: hit, miss
+)
+
+SAFETY_RULE_HITS = Counter(
+    'omnicortex_safety_rule_hits_total',
+    'Matches per PII / guardrail rule',
+    ['kind', 'rule']  # kind: pii, input, output
+)
+
+LLM_HEDGED_REQUESTS = Counter(
+    'omnicortex_llm_hedged_requests_total',
+    'LLM calls hedged to a replica, by which copy answered first',
+    ['backend', 'winner']  # winner: primary, replica, none
+)
+
 # Latency
 REQUEST_LATENCY = Histogram(
     'omnicortex_request_latency_seconds',
@@ -71,12 +137,122 @@ LLM_LATENCY = Histogram(
     buckets=[0.5, 1, 2, 5, 10, 30]
 )
 
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    'omnicortex_llm_time_to_first_token_seconds',
+    'Time from LLM call to first streamed token per agent',
+    ['agent_id', 'agent_name'],
+    buckets=[0.1, 0.25, 0.5, 1, 2, 5, 10]
+)
+
+RERANKER_BATCH_PAIRS = Histogram(
+    'omnicortex_reranker_batch_pairs',
+    'Query/document pairs scored per cross-encoder forward batch',
+    buckets=[1, 4, 8, 16, 32, 64, 128, 256]
+)
+
+RERANKER_LATENCY = Histogram(
+    'omnicortex_reranker_latency_seconds',
+    'Time a rerank call waits for its scores (queueing + inference)',
+    buckets=[0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]
+)
+
+EMBEDDING_BATCH_SIZE = Histogram(
+    'omnicortex_embedding_batch_size',
+    'Texts per embedding forward pass from the broker',
+    ['lane'],  # lane: query, ingest
+    buckets=[1, 2, 4, 8, 16, 32, 64, 128]
+)
+
+EMBEDDING_QUEUE_WAIT = Histogram(
+    'omnicortex_embedding_queue_wait_seconds',
+    'Time an embedding request waited in the broker queue',
+    ['lane'],
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 2]
+)
+
+MESSAGE_JOURNAL_FLUSH_ROWS = Histogram(
+    'omnicortex_message_journal_flush_rows',
+    'Messages written per write-behind journal flush',
+    buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+)
+
+PROMPT_TOKENS = Histogram(
+    'omnicortex_prompt_tokens',
+    'Tokens per prompt section after budgeting',
+    ['section'],  # section: fixed, documents, media, history
+    buckets=[0, 64, 128, 256, 512, 1024, 2048, 4096, 8192]
+)
+
 # System
 ACTIVE_AGENTS = Gauge(
     'omnicortex_active_agents_total',
     'Number of active agents'
 )
 
+SEMANTIC_CACHE_ROWS = Gauge(
+    'omnicortex_semantic_cache_rows',
+    'Rows in omni_semantic_cache (refreshed by the lifecycle reaper)'
+)
+
+SEMANTIC_CACHE_HIT_RATIO = Gauge(
+    'omnicortex_semantic_cache_hit_ratio',
+    'Semantic cache hit ratio of this process since start'
+)
+
+EMBEDDING_QUEUE_DEPTH = Gauge(
+    'omnicortex_embedding_queue_depth',
+    'Texts waiting in the embedding broker',
+    ['lane']
+)
+
+MESSAGE_JOURNAL_DROPPED = Counter(
+    'omnicortex_message_journal_dropped_total',
+    'Buffered chat messages dropped (rejected by the database, or buffer overflow during an outage)',
+    ['reason']
+)
+
+MESSAGE_JOURNAL_PENDING = Gauge(
+    'omnicortex_message_journal_pending',
+    'Chat messages buffered in the write-behind journal, not yet inserted'
+)
+
+CLICKHOUSE_SPOOL_BYTES = Gauge(
+    'omnicortex_clickhouse_spool_bytes',
+    'Bytes of analytics rows spooled on disk awaiting ClickHouse'
+)
+
+CLICKHOUSE_SPOOL_SEGMENTS = Gauge(
+    'omnicortex_clickhouse_spool_segments',
+    'Sealed spool segments waiting to be inserted into ClickHouse'
+)
+
+CLICKHOUSE_SPOOL_DEAD_SEGMENTS = Gauge(
+    'omnicortex_clickhouse_spool_dead_segments',
+    'Spool segments ClickHouse rejected permanently, parked as .dead for inspection'
+)
+
+CLICKHOUSE_RETRY_BACKOFF = Gauge(
+    'omnicortex_clickhouse_retry_backoff_seconds',
+    'Current ClickHouse retry delay (0 when deliveries succeed)'
+)
+
+LLM_CIRCUIT_STATE = Gauge(
+    'omnicortex_llm_circuit_state',
+    'LLM backend circuit breaker state (0 closed, 1 open, 2 half-open)',
+    ['backend']
+)
+
+LLM_PREFIX_CACHE_HIT_RATE = Gauge(
+    'omnicortex_llm_prefix_cache_hit_rate',
+    'Share of prompt tokens served from the vLLM prefix cache since the last scrape',
+    ['backend']
+)
+
+AGENT_CACHE_SIZE = Gauge(
+    'omnicortex_agent_cache_entries',
+    'Agents currently held in the in-process config cache'
+)
+
 
 class PrometheusMiddleware:
     """Simple middleware to time requests"""
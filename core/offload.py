@@ -0,0 +1,131 @@
+"""
+Bounded offload executors for blocking work reached from async handlers.
+
+Sync stages (SQLAlchemy sessions, PGVector search, embedding forward passes,
+cross-encoder scoring) run on dedicated pools instead of the event loop, so
+a slow call delays only its own request rather than every request and
+WebSocket on the worker.
+
+- I/O pool: DB round-trips and network-bound helpers (OFFLOAD_IO_WORKERS).
+- CPU pool: model forward passes and other CPU-bound stages (OFFLOAD_CPU_WORKERS).
+- Retrieval pool: vector/keyword search legs, sync and async callers alike
+  (OFFLOAD_RETRIEVAL_WORKERS).
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_IO_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_CPU_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_RETRIEVAL_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _env_workers(key: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(key, str(default))))
+    except (ValueError, TypeError):
+        return default
+
+
+def _io_max_workers() -> int:
+    return _env_workers("OFFLOAD_IO_WORKERS", 32)
+
+
+def _cpu_max_workers() -> int:
+    return _env_workers("OFFLOAD_CPU_WORKERS", max(1, min(8, os.cpu_count() or 1)))
+
+
+def _retrieval_max_workers() -> int:
+    return _env_workers("OFFLOAD_RETRIEVAL_WORKERS", 16)
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Process-wide pool for blocking I/O (DB sessions, HTTP helpers)."""
+    global _IO_EXECUTOR
+    if _IO_EXECUTOR is not None:
+        return _IO_EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _IO_EXECUTOR is None:
+            _IO_EXECUTOR = ThreadPoolExecutor(
+                max_workers=_io_max_workers(),
+                thread_name_prefix="omni-io",
+            )
+    return _IO_EXECUTOR
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """Process-wide pool for CPU-bound stages (embeddings, reranking)."""
+    global _CPU_EXECUTOR
+    if _CPU_EXECUTOR is not None:
+        return _CPU_EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _CPU_EXECUTOR is None:
+            _CPU_EXECUTOR = ThreadPoolExecutor(
+                max_workers=_cpu_max_workers(),
+                thread_name_prefix="omni-cpu",
+            )
+    return _CPU_EXECUTOR
+
+
+def get_retrieval_executor() -> ThreadPoolExecutor:
+    """Process-wide pool for retrieval legs (replaces per-call executors)."""
+    global _RETRIEVAL_EXECUTOR
+    if _RETRIEVAL_EXECUTOR is not None:
+        return _RETRIEVAL_EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _RETRIEVAL_EXECUTOR is None:
+            _RETRIEVAL_EXECUTOR = ThreadPoolExecutor(
+                max_workers=_retrieval_max_workers(),
+                thread_name_prefix="omni-retrieval",
+            )
+    return _RETRIEVAL_EXECUTOR
+
+
+def submit_with_context(executor: ThreadPoolExecutor, func: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+    """Submit from sync code, carrying the caller's contextvars into the worker."""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, func, *args, **kwargs)
+
+
+async def _run_in(executor: ThreadPoolExecutor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    # Carry contextvars (request-scoped state) into the worker thread.
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking I/O callable on the bounded I/O pool."""
+    return await _run_in(get_io_executor(), func, *args, **kwargs)
+
+
+async def run_cpu_bound(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a CPU-bound callable on the bounded CPU pool."""
+    return await _run_in(get_cpu_executor(), func, *args, **kwargs)
+
+
+async def run_retrieval(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a retrieval leg on the bounded retrieval pool."""
+    return await _run_in(get_retrieval_executor(), func, *args, **kwargs)
+
+
+def shutdown_executors(wait: bool = False) -> None:
+    """Release offload pools (called from the API lifespan on shutdown)."""
+    global _IO_EXECUTOR, _CPU_EXECUTOR, _RETRIEVAL_EXECUTOR
+    with _EXECUTOR_LOCK:
+        for executor in (_IO_EXECUTOR, _CPU_EXECUTOR, _RETRIEVAL_EXECUTOR):
+            if executor is not None:
+                executor.shutdown(wait=wait, cancel_futures=True)
+        _IO_EXECUTOR = None
+        _CPU_EXECUTOR = None
+        _RETRIEVAL_EXECUTOR = None
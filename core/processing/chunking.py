@@ -3,60 +3,100 @@ Advanced Chunking Strategies
 - Semantic chunking (embedding-based)
 - Character chunking with overlap (fallback)
 """
-from typing import List
+import os
+import unicodedata
+from functools import lru_cache
+from typing import List, Optional, Tuple
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from ..config import CHUNK_SIZE, CHUNK_OVERLAP, USE_SEMANTIC_CHUNKING
 
 
+class _SanitizeTable(dict):
+    """str.translate table: fixed symbol replacements plus lazily classified code points.
+
+    Each distinct code point is classified with unicodedata once; after that
+    translate() resolves it in C, instead of a Python loop over every character.
+    Control/format/unassigned characters (category C*) are dropped, except tabs/newlines.
+    """
+
+    def __missing__(self, codepoint: int):
+        ch = chr(codepoint)
+        value = None if unicodedata.category(ch).startswith("C") and ch not in "\n\r\t" else codepoint
+        self[codepoint] = value
+        return value
+
+
+_SANITIZE_TABLE = _SanitizeTable({
+    0x25cf: '*',    # Bullet point
+    0x2022: '*',    # Bullet
+    0x2013: '-',    # En dash
+    0x2014: '--',   # Em dash
+    0x2018: "'",    # Left single quote
+    0x2019: "'",    # Right single quote
+    0x201c: '"',    # Left double quote
+    0x201d: '"',    # Right double quote
+    0x2026: '...',  # Ellipsis
+    0x00a0: ' ',    # Non-breaking space
+    0x200b: None,   # Zero-width space
+    0xfeff: None,   # BOM
+})
+
+
 def sanitize_text(text: str) -> str:
     """Normalize problematic symbols while preserving multilingual text."""
-    # Replace common problematic characters
-    replacements = {
-        '\u25cf': '*',  # Bullet point
-        '\u2022': '*',  # Bullet
-        '\u2013': '-',  # En dash
-        '\u2014': '--', # Em dash
-        '\u2018': "'",  # Left single quote
-        '\u2019': "'",  # Right single quote
-        '\u201c': '"',  # Left double quote
-        '\u201d': '"',  # Right double quote
-        '\u2026': '...', # Ellipsis
-        '\u00a0': ' ',  # Non-breaking space
-        '\u200b': '',   # Zero-width space
-        '\ufeff': '',   # BOM
-    }
-    
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-
-    # Remove control characters but keep tabs/newlines and all Unicode scripts.
-    import unicodedata
-    text = "".join(
-        ch for ch in text
-        if (not unicodedata.category(ch).startswith("C")) or ch in "\n\r\t"
+    # Replace common problematic characters and remove control characters
+    # (keeping tabs/newlines and all Unicode scripts) in one translate pass.
+    return text.translate(_SANITIZE_TABLE)
+
+
+@lru_cache(maxsize=32)
+def get_splitter(chunk_size: int, chunk_overlap: int, separators: Optional[Tuple[str, ...]] = None):
+    """Shared RecursiveCharacterTextSplitter per configuration (split_text keeps no state)."""
+    if separators is None:
+        return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=list(separators)
     )
 
-    return text
+
+_SENTENCE_SPLIT = r"(?<=[.?!])\s+"
+
+
+def _semantic_window() -> int:
+    try:
+        return max(8, int(os.getenv("SEMANTIC_CHUNK_WINDOW", "256")))
+    except (ValueError, TypeError):
+        return 256
 
 
 def semantic_chunk(text: str, embeddings=None) -> List[str]:
     """
     Semantic chunking - splits at natural semantic boundaries
     Uses embeddings to detect topic changes
+
+    Sentences are processed in windows of SEMANTIC_CHUNK_WINDOW, so each
+    embed call (and the vectors held in memory) stays bounded regardless of
+    document size; breakpoints are chosen within each window.
     """
     try:
+        import re
         from langchain_experimental.text_splitter import SemanticChunker
         
         if embeddings is None:
-            from ..rag.embeddings import get_embeddings
-            embeddings = get_embeddings()
+            from ..rag.embeddings import get_chunking_embeddings
+            embeddings = get_chunking_embeddings()
         
         splitter = SemanticChunker(
             embeddings,
             breakpoint_threshold_type="percentile",
-            breakpoint_threshold_amount=95  # Higher = fewer splits
+            breakpoint_threshold_amount=95,  # Higher = fewer splits
+            sentence_split_regex=_SENTENCE_SPLIT,
         )
-        chunks = splitter.split_text(text)
+        sentences = re.split(_SENTENCE_SPLIT, text)
+        window = _semantic_window()
+        chunks = []
+        for start in range(0, len(sentences), window):
+            chunks.extend(splitter.split_text(" ".join(sentences[start:start + window])))
         print(f"✅ Semantic chunking: {len(chunks)} chunks")
         return chunks
     except Exception as e:
@@ -68,11 +108,7 @@ def character_chunk(text: str) -> List[str]:
     """
     Character-based chunking with 20% overlap (fallback)
     """
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
+    splitter = get_splitter(CHUNK_SIZE, CHUNK_OVERLAP, ("\n\n", "\n", ". ", " ", ""))
     chunks = splitter.split_text(text)
     print(f"✅ Character chunking: {len(chunks)} chunks ({CHUNK_OVERLAP/CHUNK_SIZE*100:.0f}% overlap)")
     return chunks
@@ -103,25 +139,16 @@ def parent_child_split(text: str, parent_size=2000, child_size=400) -> List[tupl
     Split text into Parent (large) and Child (small) chunks.
     Returns: List of (child_content, parent_content)
     """
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-
     # Sanitize text first
     text = sanitize_text(text)
 
     # 1. Split into Parents
-    parent_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=parent_size,
-        chunk_overlap=int(parent_size * 0.1)
-    )
-    parent_chunks = parent_splitter.split_text(text)
+    parent_chunks = get_splitter(parent_size, int(parent_size * 0.1)).split_text(text)
     
     results = []
     
     # 2. Split each Parent into Children
-    child_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=child_size,
-        chunk_overlap=int(child_size * 0.2)
-    )
+    child_splitter = get_splitter(child_size, int(child_size * 0.2))
     
     for parent in parent_chunks:
         children = child_splitter.split_text(parent)
@@ -131,3 +158,49 @@ def parent_child_split(text: str, parent_size=2000, child_size=400) -> List[tupl
     print(f"✅ Parent-Child split: {len(parent_chunks)} parents -> {len(results)} children")
     return results
 
+
+
+class ParentChildStream:
+    """
+    Incremental parent_child_split over text segments (e.g. extracted pages).
+
+    feed() returns the (child, parent) pairs whose parents are complete; the
+    trailing, possibly unfinished parent is carried into the next segment.
+    finish() flushes the remainder. Joining all fed segments and calling
+    parent_child_split gives the same parents except at carry boundaries.
+    """
+
+    def __init__(self, parent_size=2000, child_size=400):
+        self.parent_size = parent_size
+        self._parent_splitter = get_splitter(parent_size, int(parent_size * 0.1))
+        self._child_splitter = get_splitter(child_size, int(child_size * 0.2))
+        self._buffer = ""
+        self.parent_count = 0
+        self.child_count = 0
+
+    def _emit(self, parents: List[str]) -> List[tuple]:
+        results = []
+        for parent in parents:
+            for child in self._child_splitter.split_text(parent):
+                results.append((child, parent))
+        self.parent_count += len(parents)
+        self.child_count += len(results)
+        return results
+
+    def feed(self, segment: str) -> List[tuple]:
+        self._buffer += sanitize_text(segment)
+        # Wait for several parents' worth so split points match a whole-text split.
+        if len(self._buffer) < self.parent_size * 4:
+            return []
+        parents = self._parent_splitter.split_text(self._buffer)
+        if len(parents) < 2:
+            return []
+        self._buffer = parents[-1]
+        return self._emit(parents[:-1])
+
+    def finish(self) -> List[tuple]:
+        parents = self._parent_splitter.split_text(self._buffer) if self._buffer.strip() else []
+        self._buffer = ""
+        results = self._emit(parents)
+        print(f"✅ Parent-Child split: {self.parent_count} parents -> {self.child_count} children")
+        return results
@@ -0,0 +1,468 @@
+"""
+Async web crawler for URL ingestion.
+
+process_urls() used to fetch URLs one after another with blocking
+requests.get() and parse every page with html.parser. Fetching now runs on
+an httpx.AsyncClient:
+
+- One bounded connection pool (CRAWL_MAX_CONNECTIONS) with keep-alive. At
+  most that many requests are in flight overall (the rest wait their turn
+  instead of timing out on the pool), and at most CRAWL_PER_HOST per host
+  so a knowledge-base import does not hammer a single site.
+- ETag / Last-Modified validators are remembered per (agent, URL) once a
+  fetch has been ingested; the next fetch is conditional and a 304 skips
+  re-ingestion entirely.
+- HTML is parsed with lxml (falling back to BeautifulSoup's html.parser),
+  off the event loop.
+- crawl_iter() runs the crawler on its own loop thread and yields results
+  as they complete, so ingestion can start before the last URL returns.
+"""
+import asyncio
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Sequence
+from urllib.parse import urlparse
+
+from ..config import STORAGE_PATH
+
+SUPPORTED_FILE_EXTENSIONS = {"pdf", "txt", "csv", "docx"}
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+)
+_STRIP_TAGS = ("script", "style", "nav", "footer", "header")
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _max_connections() -> int:
+    return max(1, _env_int("CRAWL_MAX_CONNECTIONS", 32))
+
+
+def _per_host() -> int:
+    return max(1, _env_int("CRAWL_PER_HOST", 4))
+
+
+def _page_timeout() -> float:
+    return max(1.0, _env_float("CRAWL_TIMEOUT", 10.0))
+
+
+def _file_timeout() -> float:
+    return max(1.0, _env_float("CRAWL_FILE_TIMEOUT", 20.0))
+
+
+def _retries() -> int:
+    return max(0, _env_int("CRAWL_RETRIES", 2))
+
+
+def _max_bytes() -> int:
+    return max(1, _env_int("CRAWL_MAX_BYTES", 50 * 1024 * 1024))
+
+
+def conditional_fetch_enabled() -> bool:
+    return os.getenv("CRAWL_CONDITIONAL_FETCH", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+# =============================================================================
+# URL HELPERS
+# =============================================================================
+
+def normalize_file_download_url(url: str) -> str:
+    """
+    Convert common web file links to directly downloadable URLs.
+    Currently handles GitHub blob URLs.
+    """
+    raw = (url or "").strip()
+    if not raw:
+        return raw
+    parsed = urlparse(raw)
+    host = (parsed.netloc or "").lower()
+    if host == "github.com" and "/blob/" in parsed.path:
+        return f"https://raw.githubusercontent.com{parsed.path.replace('/blob/', '/', 1)}"
+    return raw
+
+
+def infer_file_extension(url: str, content_type: str = "") -> str:
+    ext = os.path.splitext(urlparse(url).path)[1].lower().lstrip(".")
+    if ext in SUPPORTED_FILE_EXTENSIONS:
+        return ext
+
+    ctype = (content_type or "").lower()
+    if "application/pdf" in ctype:
+        return "pdf"
+    if "text/plain" in ctype:
+        return "txt"
+    if "text/csv" in ctype or "application/csv" in ctype:
+        return "csv"
+    if "wordprocessingml.document" in ctype:
+        return "docx"
+    return ""
+
+
+def is_file_download_url(url: str) -> bool:
+    return bool(infer_file_extension(normalize_file_download_url(url)))
+
+
+def safe_filename_from_url(url: str, ext: str) -> str:
+    name = os.path.basename(urlparse(url).path.rstrip("/")) or f"source.{ext}"
+    if "." not in name:
+        name = f"{name}.{ext}"
+    safe = "".join(c if c.isalnum() or c in ("-", "_", ".") else "_" for c in name)
+    if len(safe) > 120:
+        stem, suffix = os.path.splitext(safe)
+        safe = f"{stem[:100]}{suffix or f'.{ext}'}"
+    return safe
+
+
+def page_filename(url: str) -> str:
+    parsed = urlparse(url)
+    domain = parsed.netloc.replace("www.", "")
+    path = parsed.path.replace("/", "_")
+    if not path or path == "_":
+        path = "home"
+    filename = f"url_{domain}_{path}.txt"
+    if len(filename) > 100:
+        filename = filename[:100] + ".txt"
+    return filename
+
+
+def source_filename(url: str) -> str:
+    """Document filename a successful crawl of url is ingested under."""
+    if is_file_download_url(url):
+        target = normalize_file_download_url(url)
+        return safe_filename_from_url(target, infer_file_extension(target))
+    return page_filename(url)
+
+
+# =============================================================================
+# HTML -> TEXT
+# =============================================================================
+
+def _clean_lines(text: str) -> str:
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(chunk for chunk in chunks if chunk)
+
+
+def html_to_text(html) -> str:
+    """Visible text of an HTML page (str or bytes), without script/style/nav chrome."""
+    try:
+        import lxml.html
+        from lxml.etree import ParserError
+
+        try:
+            tree = lxml.html.document_fromstring(html)
+        except ValueError:
+            # Unicode input with an XML encoding declaration.
+            tree = lxml.html.document_fromstring(html.encode("utf-8") if isinstance(html, str) else html)
+        except ParserError:
+            return ""
+        for element in tree.xpath("|".join(f"//{tag}" for tag in _STRIP_TAGS)):
+            element.drop_tree()
+        return _clean_lines(tree.text_content())
+    except ImportError:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, "html.parser")
+        for element in soup(list(_STRIP_TAGS)):
+            element.decompose()
+        return _clean_lines(soup.get_text())
+
+
+# =============================================================================
+# CONDITIONAL FETCH VALIDATORS
+# =============================================================================
+
+class ValidatorStore:
+    """SQLite-backed {(agent, url): (etag, last_modified)} of ingested fetches."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS validators (
+                    agent_id TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (agent_id, url)
+                )
+                """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, agent_id: str, urls: Sequence[str]) -> Dict[str, Dict[str, Optional[str]]]:
+        found: Dict[str, Dict[str, Optional[str]]] = {}
+        unique = list(dict.fromkeys(urls))
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT url, etag, last_modified FROM validators WHERE agent_id = ? AND url IN ({marks})",
+                    [agent_id, *chunk],
+                ).fetchall()
+                for url, etag, last_modified in rows:
+                    found[url] = {"etag": etag, "last_modified": last_modified}
+        return found
+
+    def put_many(self, agent_id: str, results: Sequence["CrawlResult"]) -> None:
+        rows = [
+            (agent_id, r.url, r.etag, r.last_modified, time.time())
+            for r in results
+            if r.etag or r.last_modified
+        ]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO validators (agent_id, url, etag, last_modified, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+
+    def forget(self, agent_id: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM validators WHERE agent_id = ?", (agent_id,))
+            conn.commit()
+
+
+_VALIDATORS: Optional[ValidatorStore] = None
+_VALIDATORS_LOCK = threading.Lock()
+
+
+def get_validator_store() -> ValidatorStore:
+    global _VALIDATORS
+    if _VALIDATORS is None:
+        with _VALIDATORS_LOCK:
+            if _VALIDATORS is None:
+                path = os.getenv("CRAWL_VALIDATOR_PATH", "").strip() or os.path.join(
+                    STORAGE_PATH, "cache", "crawl_validators.sqlite3"
+                )
+                _VALIDATORS = ValidatorStore(path)
+    return _VALIDATORS
+
+
+# =============================================================================
+# CRAWLER
+# =============================================================================
+
+@dataclass
+class CrawlResult:
+    url: str
+    path: Optional[str] = None  # temp file ready for process_documents (caller removes it)
+    filename: Optional[str] = None
+    is_download: bool = False
+    not_modified: bool = False
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    error: Optional[str] = None
+
+
+class _Retryable(Exception):
+    pass
+
+
+class AsyncCrawler:
+    """Fetches URLs concurrently over one pooled client with per-host limits."""
+
+    def __init__(self, validators: Optional[Dict[str, Dict[str, Optional[str]]]] = None):
+        self.validators = validators or {}
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        # Requests in flight across all hosts; matches the pool size so no
+        # fetch waits on (and times out acquiring) a pooled connection.
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _slot(self, url: str) -> asyncio.Semaphore:
+        host = (urlparse(url).netloc or "").lower()
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(_per_host())
+        return self._host_slots[host]
+
+    def _global_slot(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(_max_connections())
+        return self._slots
+
+    def _headers(self, url: str) -> Dict[str, str]:
+        headers = {"User-Agent": USER_AGENT}
+        known = self.validators.get(url) or {}
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+        return headers
+
+    async def _read_capped(self, response) -> bytes:
+        body = bytearray()
+        async for block in response.aiter_bytes():
+            body.extend(block)
+            if len(body) > _max_bytes():
+                raise ValueError(f"response larger than CRAWL_MAX_BYTES ({_max_bytes()})")
+        return bytes(body)
+
+    async def _fetch_once(self, client, url: str) -> CrawlResult:
+        import httpx
+
+        is_download = is_file_download_url(url)
+        target = normalize_file_download_url(url) if is_download else url
+        seconds = _file_timeout() if is_download else _page_timeout()
+        timeout = httpx.Timeout(seconds, pool=None)
+        async with client.stream("GET", target, headers=self._headers(url), timeout=timeout) as response:
+            result = CrawlResult(
+                url=url,
+                is_download=is_download,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+            if response.status_code == 304:
+                result.not_modified = True
+                return result
+            if response.status_code >= 500 or response.status_code == 429:
+                raise _Retryable(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            body = await self._read_capped(response)
+            content_type = response.headers.get("Content-Type", "")
+            encoding = response.encoding
+
+        if is_download:
+            ext = infer_file_extension(target, content_type)
+            if not ext:
+                result.error = "unsupported remote file type"
+                return result
+            result.filename = safe_filename_from_url(target, ext)
+            result.path = await asyncio.to_thread(self._write_temp, result.filename, body)
+            return result
+
+        text = await asyncio.to_thread(html_to_text, body.decode(encoding or "utf-8", errors="replace"))
+        if not text:
+            result.error = "no text content"
+            return result
+        result.filename = page_filename(url)
+        page = f"Source URL: {url}\n\n{text}".encode("utf-8")
+        result.path = await asyncio.to_thread(self._write_temp, result.filename, page)
+        return result
+
+    @staticmethod
+    def _write_temp(filename: str, data: bytes) -> str:
+        path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex[:8]}_{filename}")
+        with open(path, "wb") as handle:
+            handle.write(data)
+        return path
+
+    async def fetch(self, client, url: str) -> CrawlResult:
+        import httpx
+
+        last_error = None
+        async with self._slot(normalize_file_download_url(url)):
+            for attempt in range(_retries() + 1):
+                try:
+                    # Held per attempt, not across the retry sleep.
+                    async with self._global_slot():
+                        return await self._fetch_once(client, url)
+                except (_Retryable, httpx.TransportError) as e:
+                    last_error = e
+                except Exception as e:
+                    return CrawlResult(url=url, error=str(e))
+                if attempt < _retries():
+                    await asyncio.sleep(1 + attempt)
+        return CrawlResult(url=url, error=str(last_error or "fetch failed"))
+
+    async def crawl(self, urls: Sequence[str], emit, stop: Optional[threading.Event] = None) -> None:
+        """Fetch every URL, calling emit(result) as each one completes."""
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=_max_connections(),
+            max_keepalive_connections=_max_connections(),
+        )
+        self._slots = asyncio.Semaphore(_max_connections())
+        async with httpx.AsyncClient(limits=limits, follow_redirects=True) as client:
+            async def _one(url: str) -> None:
+                if stop is not None and stop.is_set():
+                    return
+                emit(await self.fetch(client, url))
+
+            await asyncio.gather(*(_one(url) for url in urls))
+
+
+def crawl_iter(
+    urls: Sequence[str],
+    validators: Optional[Dict[str, Dict[str, Optional[str]]]] = None,
+) -> Iterator[CrawlResult]:
+    """Crawl on a private event-loop thread and yield results in completion order.
+
+    Closing the generator early stops scheduling new fetches and removes temp
+    files of results that were never consumed.
+    """
+    urls = list(dict.fromkeys(u for u in urls if u))
+    results: "queue.Queue[Optional[CrawlResult]]" = queue.Queue()
+    stop = threading.Event()
+
+    def _run() -> None:
+        try:
+            asyncio.run(AsyncCrawler(validators).crawl(urls, results.put, stop))
+        except Exception as e:
+            print(f"[WARN] Crawler stopped: {e}")
+        finally:
+            results.put(None)
+
+    worker = threading.Thread(target=_run, name="url-crawler", daemon=True)
+    worker.start()
+    finished = False
+    try:
+        while True:
+            result = results.get()
+            if result is None:
+                finished = True
+                return
+            yield result
+    finally:
+        if not finished:
+            stop.set()
+            worker.join(timeout=_page_timeout())
+            while True:
+                try:
+                    leftover = results.get_nowait()
+                except queue.Empty:
+                    break
+                if leftover is not None and leftover.path:
+                    try:
+                        os.remove(leftover.path)
+                    except OSError:
+                        pass
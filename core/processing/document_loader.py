@@ -1,9 +1,257 @@
 """
 Document Loader - Process PDF, TXT, CSV, DOCX files
+
+Extraction is streamed:
+- Uploads are referenced by path when they already live on disk, otherwise
+  spilled to a temp file in 1 MB copies (never read whole into memory).
+- PDF page ranges and DOCX files are extracted on a process pool
+  (EXTRACT_WORKERS), several files at once, with a bounded number of
+  tasks in flight.
+- stream_text_from_files() yields (filename, segment) in document order as
+  results arrive, so chunking can run while later pages are still extracting.
+  stream_indexed_text_from_files() yields the upload index too, so uploads
+  sharing a filename stay separate documents.
 """
-from typing import List, Tuple
+import codecs
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional, Set, Tuple
+
 from pypdf import PdfReader
 
+SUPPORTED_EXTENSIONS = {"pdf", "txt", "csv", "docx"}
+_STREAM_READ_BYTES = 1024 * 1024
+
+_EXTRACT_POOL: Optional[ProcessPoolExecutor] = None
+_EXTRACT_POOL_LOCK = threading.Lock()
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _extract_workers() -> int:
+    """0 extracts inline on the calling thread."""
+    return max(0, _env_int("EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+def _pages_per_task() -> int:
+    return max(1, _env_int("EXTRACT_PDF_PAGES_PER_TASK", 20))
+
+
+def get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    global _EXTRACT_POOL
+    workers = _extract_workers()
+    if workers <= 0:
+        return None
+    if _EXTRACT_POOL is None:
+        with _EXTRACT_POOL_LOCK:
+            if _EXTRACT_POOL is None:
+                _EXTRACT_POOL = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _EXTRACT_POOL
+
+
+def shutdown_extraction_pool() -> None:
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        pool, _EXTRACT_POOL = _EXTRACT_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _file_name(file) -> str:
+    # Handle both UploadFile (filename) and regular file objects (name)
+    return getattr(file, 'filename', None) or getattr(file, 'name', 'unknown')
+
+
+def _file_ext(filename: str) -> str:
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+def _spill_to_disk(file) -> Tuple[str, bool]:
+    """Return (path, is_temp) for a file object, copying it to disk if needed."""
+    stream = file.file if hasattr(file, 'file') else file
+    existing = getattr(stream, 'name', None)
+    if isinstance(existing, str) and os.path.isfile(existing):
+        return existing, False
+    suffix = "." + _file_ext(_file_name(file)) if _file_ext(_file_name(file)) else ""
+    handle, path = tempfile.mkstemp(prefix="omni_extract_", suffix=suffix)
+    if hasattr(stream, 'seek'):
+        stream.seek(0)
+    with os.fdopen(handle, "wb") as out:
+        shutil.copyfileobj(stream, out, length=_STREAM_READ_BYTES)
+    if hasattr(stream, 'seek'):
+        stream.seek(0)  # Reset for potential reuse
+    return path, True
+
+
+def _clean_page_text(text: str) -> str:
+    # Sanitize text to remove problematic Unicode characters
+    return text.encode('utf-8', errors='ignore').decode('utf-8')
+
+
+def _extract_pdf_pages(path: str, start: int, end: int) -> str:
+    """Pool task: text of pages [start, end) of a PDF on disk."""
+    reader = PdfReader(path)
+    parts = []
+    for index in range(start, min(end, len(reader.pages))):
+        text = reader.pages[index].extract_text()
+        if text:
+            parts.append(_clean_page_text(text))
+    return "\n".join(parts)
+
+
+def _extract_docx_path(path: str) -> str:
+    """Pool task: paragraphs of a DOCX on disk."""
+    return extract_docx(path)
+
+
+def _iter_text_stream(path: str) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    with open(path, "rb") as handle:
+        while True:
+            block = handle.read(_STREAM_READ_BYTES)
+            if not block:
+                break
+            text = decoder.decode(block)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _plan_tasks(index: int, ext: str, path: str) -> List[tuple]:
+    """Split one file into ordered extraction tasks: (file index, func, args)."""
+    if ext == 'pdf':
+        pages = len(PdfReader(path).pages)
+        step = _pages_per_task()
+        return [(index, _extract_pdf_pages, (path, start, start + step)) for start in range(0, pages, step)]
+    if ext == 'docx':
+        return [(index, _extract_docx_path, (path,))]
+    return [(index, _iter_text_stream, (path,))]
+
+
+def _stream_indexed(
+    files, skipped: List[Tuple[str, str]], failed_uploads: Optional[Set[int]] = None
+) -> Iterator[Tuple[int, str, str]]:
+    temp_paths: List[str] = []
+    tasks: List[tuple] = []
+    names: List[str] = []
+    # Position in `files` of each extractable upload, parallel to `names`.
+    uploads: List[int] = []
+    try:
+        for position, file in enumerate(files):
+            filename = _file_name(file)
+            ext = _file_ext(filename)
+            if ext not in SUPPORTED_EXTENSIONS:
+                skipped.append((filename, f"Unsupported format: {ext}"))
+                continue
+            try:
+                path, is_temp = _spill_to_disk(file)
+                if is_temp:
+                    temp_paths.append(path)
+                tasks.extend(_plan_tasks(len(names), ext, path))
+                names.append(filename)
+                uploads.append(position)
+            except Exception as e:
+                skipped.append((filename, str(e)))
+                if failed_uploads is not None:
+                    failed_uploads.add(position)
+
+        pool = get_extraction_pool()
+        in_flight = max(2, _extract_workers() * 2)
+        queue = deque(tasks)
+        pending: deque = deque()
+        has_text = [False] * len(names)
+        started = [False] * len(names)
+        failed: List[Optional[str]] = [None] * len(names)
+
+        while queue or pending:
+            # Keep a bounded window of page ranges in flight, consumed in order.
+            while queue and len(pending) < in_flight:
+                index, func, args = queue.popleft()
+                future = None
+                if pool is not None and func is not _iter_text_stream:
+                    try:
+                        future = pool.submit(func, *args)
+                    except (BrokenProcessPool, RuntimeError) as e:
+                        print(f"[WARN] Extraction pool unavailable ({e}); extracting inline")
+                pending.append((index, func, args, future))
+
+            index, func, args, future = pending.popleft()
+            if failed[index] is not None:
+                continue
+            try:
+                if future is not None:
+                    segments = [future.result()]
+                elif func is _iter_text_stream:
+                    segments = _iter_text_stream(*args)
+                else:
+                    segments = [func(*args)]
+                # Page ranges are newline-joined like whole-file extraction; raw text streams are not.
+                separator = "" if func is _iter_text_stream else "\n"
+                for segment in segments:
+                    if not segment:
+                        continue
+                    if segment.strip():
+                        has_text[index] = True
+                    yield uploads[index], names[index], (separator + segment) if started[index] else segment
+                    started[index] = True
+            except Exception as e:
+                failed[index] = str(e)
+
+        for index, filename in enumerate(names):
+            if failed[index] is not None:
+                skipped.append((filename, failed[index]))
+                if failed_uploads is not None:
+                    failed_uploads.add(uploads[index])
+            elif not has_text[index]:
+                skipped.append((filename, "No text content"))
+    finally:
+        for path in temp_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def stream_text_from_files(files, skipped: List[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (filename, text segment) for each file, in file and page order.
+
+    Concatenating a file's segments gives its full text. Files that cannot
+    be read, are unsupported, or contain no text are appended to `skipped`
+    as (filename, reason) once the stream is exhausted.
+    """
+    for _, filename, segment in _stream_indexed(files, skipped):
+        yield filename, segment
+
+
+def stream_indexed_text_from_files(
+    files, skipped: List[Tuple[str, str]], failed_uploads: Optional[Set[int]] = None
+) -> Iterator[Tuple[int, str, str]]:
+    """
+    Like stream_text_from_files(), but yield (upload index, filename, segment).
+
+    The index is the file's position in `files`. Uploads whose extraction
+    raised (possibly after some segments were yielded) have their index added
+    to `failed_uploads` once the stream is exhausted.
+    """
+    yield from _stream_indexed(files, skipped, failed_uploads)
+
 
 def extract_text_from_files(files) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
     """
@@ -15,84 +263,33 @@ def extract_text_from_files(files) -> Tuple[List[Tuple[str, str]], List[Tuple[st
     Returns:
         Tuple of (list of (filename, text), list of (filename, error) for skipped files)
     """
+    skipped: List[Tuple[str, str]] = []
+    failed: Set[int] = set()
+    names: dict = {}
+    parts: dict = {}
+    for index, filename, segment in _stream_indexed(files, skipped, failed):
+        names[index] = filename
+        parts.setdefault(index, []).append(segment)
+
     extracted_files = []
-    skipped = []
-    
-    for file in files:
-        try:
-            # Handle both UploadFile (filename) and regular file objects (name)
-            filename = getattr(file, 'filename', None) or getattr(file, 'name', 'unknown')
-            ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
-            
-            if ext == 'pdf':
-                text = extract_pdf(file)
-            elif ext == 'txt':
-                # Handle UploadFile vs regular file
-                content = file.file.read() if hasattr(file, 'file') else file.read()
-                text = content.decode('utf-8', errors='ignore')
-                # Reset file pointer if possible
-                if hasattr(file, 'file') and hasattr(file.file, 'seek'):
-                    file.file.seek(0)
-                elif hasattr(file, 'seek'):
-                    file.seek(0)
-            elif ext == 'csv':
-                # Handle UploadFile vs regular file
-                content = file.file.read() if hasattr(file, 'file') else file.read()
-                text = content.decode('utf-8', errors='ignore')
-                # Reset file pointer if possible
-                if hasattr(file, 'file') and hasattr(file.file, 'seek'):
-                    file.file.seek(0)
-                elif hasattr(file, 'seek'):
-                    file.seek(0)
-            elif ext == 'docx':
-                text = extract_docx(file)
-            else:
-                skipped.append((filename, f"Unsupported format: {ext}"))
-                continue
-            
-            if text.strip():
-                extracted_files.append((filename, text))
-            else:
-                skipped.append((filename, "No text content"))
-                
-        except Exception as e:
-            filename = getattr(file, 'filename', None) or getattr(file, 'name', 'unknown')
-            skipped.append((filename, str(e)))
-    
+    for index in sorted(parts):
+        # Files that failed part-way are reported as skipped, not half-indexed.
+        if index in failed:
+            continue
+        text = "".join(parts[index])
+        if text.strip():
+            extracted_files.append((names[index], text))
     return extracted_files, skipped
 
 
 def extract_pdf(file) -> str:
     """Extract text from PDF"""
-    import io
-    
-    # Handle both UploadFile and regular file objects
-    if hasattr(file, 'file'):
-        # FastAPI UploadFile - get the underlying file object
-        file_content = file.file
-    else:
-        file_content = file
-    
-    # Read content into BytesIO for PdfReader
-    if hasattr(file_content, 'read'):
-        content = file_content.read()
-        if hasattr(file_content, 'seek'):
-            file_content.seek(0)  # Reset for potential reuse
-        file_obj = io.BytesIO(content)
-    else:
-        file_obj = file_content
-    
-    reader = PdfReader(file_obj)
-    text_parts = []
-    
-    for page in reader.pages:
-        text = page.extract_text()
-        if text:
-            # Sanitize text to remove problematic Unicode characters
-            text = text.encode('utf-8', errors='ignore').decode('utf-8')
-            text_parts.append(text)
-    
-    return "\n".join(text_parts)
+    path, is_temp = _spill_to_disk(file)
+    try:
+        return _extract_pdf_pages(path, 0, len(PdfReader(path).pages))
+    finally:
+        if is_temp:
+            os.remove(path)
 
 
 def extract_docx(file) -> str:
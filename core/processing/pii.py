@@ -2,8 +2,9 @@
 PII Masking Module
 Redacts sensitive information using Regex patterns.
 Supported: Email, Phone, Credit Card, SSN, IP Address
+All patterns are matched in a single pass (core.text_safety).
 """
-import re
+from ..text_safety import RuleSet
 
 PATTERNS = {
     "EMAIL": r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
@@ -13,18 +14,14 @@ PATTERNS = {
     "IP_ADDRESS": r'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b'
 }
 
+_PII_RULES = RuleSet("pii", PATTERNS)
+
+
 def mask_pii(text: str) -> str:
     """
     Redact PII from text.
     Returns masked text.
     """
-    masked_text = text
-    
-    for label, pattern in PATTERNS.items():
-        masked_text = re.sub(pattern, f"<{label}>", masked_text)
-        
-    if masked_text != text:
-        # print(f"🛡️ PII Masked: {text} -> {masked_text}")
-        pass
-        
-    return masked_text
+    if not text:
+        return text
+    return _PII_RULES.sub(text, lambda label, _match: f"<{label}>")
@@ -1,107 +1,36 @@
-import requests
-from bs4 import BeautifulSoup
-from typing import List, Dict
+"""
+URL ingestion: crawl pages/files concurrently (core.processing.crawler) and
+hand them to process_documents in batches as they arrive.
+"""
 import os
-import tempfile
-import uuid
-import time
-from urllib.parse import urlparse
-from ..chat_service import process_documents
-from ..agent_manager import get_agent
+from typing import Callable, Dict, List, Optional
 
-SUPPORTED_FILE_EXTENSIONS = {"pdf", "txt", "csv", "docx"}
-
-
-def _normalize_file_download_url(url: str) -> str:
-    """
-    Convert common web file links to directly downloadable URLs.
-    Currently handles GitHub blob URLs.
-    """
-    raw = (url or "").strip()
-    if not raw:
-        return raw
-    parsed = urlparse(raw)
-    host = (parsed.netloc or "").lower()
-    if host == "github.com" and "/blob/" in parsed.path:
-        return f"https://raw.githubusercontent.com{parsed.path.replace('/blob/', '/', 1)}"
-    return raw
-
-
-def _infer_file_extension(url: str, content_type: str = "") -> str:
-    ext = os.path.splitext(urlparse(url).path)[1].lower().lstrip(".")
-    if ext in SUPPORTED_FILE_EXTENSIONS:
-        return ext
-
-    ctype = (content_type or "").lower()
-    if "application/pdf" in ctype:
-        return "pdf"
-    if "text/plain" in ctype:
-        return "txt"
-    if "text/csv" in ctype or "application/csv" in ctype:
-        return "csv"
-    if "wordprocessingml.document" in ctype:
-        return "docx"
-    return ""
-
-
-def _is_file_download_url(url: str) -> bool:
-    resolved = _normalize_file_download_url(url)
-    ext = _infer_file_extension(resolved)
-    return bool(ext)
-
-
-def _safe_filename_from_url(url: str, ext: str) -> str:
-    name = os.path.basename(urlparse(url).path.rstrip("/")) or f"source.{ext}"
-    if "." not in name:
-        name = f"{name}.{ext}"
-    safe = "".join(c if c.isalnum() or c in ("-", "_", ".") else "_" for c in name)
-    if len(safe) > 120:
-        stem, suffix = os.path.splitext(safe)
-        safe = f"{stem[:100]}{suffix or f'.{ext}'}"
-    return safe
-
-
-def _download_file_to_temp(url: str) -> tuple:
-    """
-    Download supported file URL to temp storage.
-    Returns (temp_path, source_filename, error_message_or_None).
-    """
-    resolved_url = _normalize_file_download_url(url)
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
-        )
-    }
-    last_error = None
-    response = None
+import requests
 
-    for attempt in range(3):
-        try:
-            response = requests.get(resolved_url, headers=headers, timeout=20, allow_redirects=True)
-            response.raise_for_status()
-            break
-        except Exception as e:
-            last_error = e
-            if attempt < 2:
-                time.sleep(1 + attempt)
+from .crawler import (
+    USER_AGENT,
+    CrawlResult,
+    conditional_fetch_enabled,
+    crawl_iter,
+    get_validator_store,
+    html_to_text,
+    source_filename,
+)
+from ..chat_service import process_documents
+from ..agent_manager import get_agent
+from ..database import get_agent_document_names
 
-    if response is None:
-        return None, None, str(last_error or "download failed")
 
-    ext = _infer_file_extension(resolved_url, response.headers.get("Content-Type", ""))
-    if not ext:
-        return None, None, "unsupported remote file type"
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
 
-    filename = _safe_filename_from_url(resolved_url, ext)
-    temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex[:8]}_{filename}")
 
-    try:
-        with open(temp_path, "wb") as handle:
-            handle.write(response.content)
-        return temp_path, filename, None
-    except Exception as e:
-        return None, None, str(e)
+def _ingest_batch() -> int:
+    """Crawled sources handed to one process_documents call."""
+    return max(1, _env_int("CRAWL_INGEST_BATCH", 25))
 
 
 def _delete_local_extracted_archive(agent_id: str, source_filename: str) -> None:
@@ -132,141 +61,182 @@ def _delete_local_extracted_archive(agent_id: str, source_filename: str) -> None
 
 def scrape_url(url: str) -> str:
     """
-    Scrape text content from a URL using BeautifulSoup.
+    Scrape text content from a single URL (blocking).
     Returns the cleaned text.
     """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
+        response = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=10)
         response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style", "nav", "footer", "header"]):
-            script.decompose()
-            
-        # Get text
-        text = soup.get_text()
-        
-        # Break into lines and remove leading and trailing space on each
-        lines = (line.strip() for line in text.splitlines())
-        # Break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        # Drop blank lines
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        
-        return text
+        return html_to_text(response.text)
     except Exception as e:
         print(f"⚠️ Failed to scrape {url}: {e}")
         return ""
 
-def process_urls(urls: List[str], agent_id: str) -> Dict:
+
+class _CrawledFile:
+    """UploadFile look-alike so documents are named after the source, not the temp path."""
+
+    def __init__(self, item: CrawlResult):
+        self.filename = item.filename
+        self.size = os.path.getsize(item.path)
+        self.file = open(item.path, "rb")
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def close(self):
+        self.file.close()
+
+
+def _merge_results(total: Dict, batch: Dict) -> None:
+    for key in ("vector_chunks", "parent_chunks", "document_rows"):
+        total[key] = total.get(key, 0) + int(batch.get(key) or 0)
+    if batch.get("vector_store"):
+        total["vector_store"] = batch["vector_store"]
+    if batch.get("warning"):
+        total["warning"] = batch["warning"]
+    if batch.get("success"):
+        total["success"] = True
+    elif batch.get("error"):
+        total.setdefault("errors", []).append(str(batch["error"]))
+
+
+def process_urls(urls: List[str], agent_id: str, progress: Optional[Callable[..., None]] = None) -> Dict:
     """
-    Scrape URLs and process them as documents for the agent.
+    Crawl URLs and process them as documents for the agent.
+
+    Results are ingested in CRAWL_INGEST_BATCH groups while the crawl is still
+    running. URLs answered with 304 Not Modified are skipped. progress(stage,
+    fraction, **info) is forwarded with fractions scaled across batches and
+    document_ids accumulated over all batches. If only some batches fail,
+    the result stays successful but keeps their "errors" and a "warning".
     """
     if not urls or not agent_id:
         return {"success": False, "error": "Missing URLs or Agent ID"}
-        
+
     print(f"🌐 Processing {len(urls)} URLs for Agent {agent_id}...")
-    
+
     agent = get_agent(agent_id)
     if not agent:
         return {"success": False, "error": "Agent not found"}
-        
-    temp_files = []
-    file_objs = []
-    downloaded_filenames = []
-    
+
+    validators = {}
+    store = get_validator_store() if conditional_fetch_enabled() else None
+    if store is not None:
+        try:
+            validators = store.get_many(agent_id, urls)
+            if validators:
+                # A 304 only means "already indexed" while the document still exists.
+                indexed = set(get_agent_document_names(agent_id, limit=100000))
+                validators = {url: v for url, v in validators.items() if source_filename(url) in indexed}
+        except Exception as e:
+            print(f"[WARN] Crawl validator lookup failed: {e}")
+
+    batch_size = _ingest_batch()
+    expected_batches = max(1, -(-len(urls) // batch_size))
+    total: Dict = {"success": False, "warning": None, "error": None}
+    document_ids: List[int] = []
+    state = {"batches": 0, "fetched": 0, "unchanged": 0, "failed": 0}
+    pending: List[CrawlResult] = []
+
+    def _forward(stage: str, fraction: float, **info) -> None:
+        if progress is None:
+            return
+        if "document_ids" in info:
+            state["batch_document_ids"] = list(info["document_ids"])
+            info["document_ids"] = document_ids + state["batch_document_ids"]
+        slot = min(state["batches"], expected_batches - 1)
+        progress(stage, 0.15 + 0.85 * (slot + fraction) / expected_batches, **info)
+
+    def _ingest(batch: List[CrawlResult]) -> None:
+        file_objs = []
+        try:
+            for item in batch:
+                file_objs.append(_CrawledFile(item))
+            print(f"  - Ingesting {len(file_objs)} crawled sources...")
+            result = process_documents(
+                files=file_objs, agent_id=agent_id, progress=_forward if progress is not None else None
+            )
+        finally:
+            for handle in file_objs:
+                handle.close()
+            _remove_temp(batch)
+        _merge_results(total, result)
+        # Later batches extend, not replace, the ids the job runner may need to discard.
+        document_ids.extend(state.pop("batch_document_ids", []))
+        if result.get("success"):
+            if store is not None:
+                try:
+                    store.put_many(agent_id, batch)
+                except Exception as e:
+                    print(f"[WARN] Crawl validator update failed: {e}")
+            # Remove local extracted copies for downloaded files to save disk space.
+            for item in batch:
+                if item.is_download and item.filename:
+                    _delete_local_extracted_archive(agent_id, item.filename)
+        state["batches"] += 1
+
+    crawl = crawl_iter(urls, validators=validators)
     try:
-        for url in urls:
-            if _is_file_download_url(url):
-                print(f"  - Downloading file {url}...")
-                temp_path, source_filename, err = _download_file_to_temp(url)
-                if err or not temp_path:
-                    print(f"Warning: failed to download file URL {url}: {err}")
-                    continue
-                f = open(temp_path, "rb")
-                file_objs.append(f)
-                temp_files.append(temp_path)
-                if source_filename:
-                    downloaded_filenames.append(source_filename)
+        for item in crawl:
+            state["fetched"] += 1
+            if progress is not None:
+                progress("scraping", 0.15 * state["fetched"] / len(urls))
+            if item.not_modified:
+                state["unchanged"] += 1
+                print(f"  - Unchanged since last fetch: {item.url}")
                 continue
-
-            print(f"  - Scraping {url}...")
-            text = scrape_url(url)
-            if not text:
+            if item.error or not item.path:
+                state["failed"] += 1
+                print(f"Warning: failed to fetch {item.url}: {item.error}")
                 continue
-                
-            # Create a filename from URL
-            parsed = urlparse(url)
-            domain = parsed.netloc.replace("www.", "")
-            path = parsed.path.replace("/", "_")
-            if not path or path == "_":
-                path = "home"
-            filename = f"url_{domain}_{path}.txt"
-            # Ensure filename is not too long
-            if len(filename) > 100:
-                filename = filename[:100] + ".txt"
-            
-            # Create temp file
-            # process_documents expects file objects. We'll create named temp files.
-            # We use delete=False so we can close them and reopen if needed, or just pass the open file.
-            # However, NamedTemporaryFile on Windows cannot be opened twice. 
-            # Best to keep it open and pass it.
-            
-            # Actually, standard open() files are safer if we manage cleanup.
-            # Let's create files in a temp dir.
-            
-            temp_dir = tempfile.gettempdir()
-            unique_id = uuid.uuid4().hex[:8]
-            temp_path = os.path.join(temp_dir, f"{unique_id}_{filename}")
-            
-            with open(temp_path, "w", encoding="utf-8") as f:
-                f.write(f"Source URL: {url}\n\n")
-                f.write(text)
-            
-            # Open in read mode (binary) for process_documents which expects 'read()' to return bytes usually or string depending on implementation.
-            # extract_text_from_files usually handles bytes for PDF/etc and string for TXT.
-            # Let's check extract_text_from_files in document_loader. But assuming 'rb' is safe.
-            f = open(temp_path, "rb")
-            # We must attach .name attribute for the loader to detect extension
-            # File objects from open() have .name.
-            
-            file_objs.append(f)
-            temp_files.append(temp_path)
-            
-        if not file_objs:
-             return {"success": False, "error": "No content scraped/downloaded from URLs"}
-             
-        # Call process_documents
-        print(f"  - Ingesting {len(file_objs)} scraped pages...")
-        result = process_documents(files=file_objs, agent_id=agent_id)
-
-        # Remove local extracted copies for downloaded files to save disk space.
-        for source_filename in downloaded_filenames:
-            _delete_local_extracted_archive(agent_id, source_filename)
-        
-        return result
-        
+            if any(p.filename == item.filename for p in pending):
+                # Same source name twice (e.g. query-string variants): keep documents separate.
+                batch, pending = pending, []
+                _ingest(batch)
+            pending.append(item)
+            if len(pending) >= batch_size:
+                batch, pending = pending, []
+                _ingest(batch)
+        if pending:
+            batch, pending = pending, []
+            _ingest(batch)
     except Exception as e:
         print(f"❌ Error processing URLs: {e}")
-        return {"success": False, "error": str(e)}
-        
+        total["error"] = str(e)
+        total["success"] = False
+        return total
     finally:
-        # Close handles
-        for f in file_objs:
-            try:
-                f.close()
-            except:
-                pass
-        
-        # Cleanup temp files
-        for path in temp_files:
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except:
-                pass
+        crawl.close()
+        _remove_temp(pending)
+
+    total["urls_unchanged"] = state["unchanged"]
+    total["urls_failed"] = state["failed"]
+    if state["batches"] == 0:
+        if state["unchanged"] and not state["failed"]:
+            total["success"] = True
+            total["warning"] = "All URLs unchanged since last fetch"
+        else:
+            total["error"] = "No content scraped/downloaded from URLs"
+    elif not total["success"]:
+        total["error"] = "; ".join(total.pop("errors", [])) or "URL ingestion failed"
+    elif total.get("errors"):
+        # Earlier batches are indexed, but the user must still see what failed.
+        total["batches_failed"] = len(total["errors"])
+        total["warning"] = (
+            f"Partial import: {len(total['errors'])} of {state['batches']} batches failed: "
+            + "; ".join(total["errors"])
+        )
+    return total
+
+
+def _remove_temp(items: List[CrawlResult]) -> None:
+    for item in items:
+        try:
+            if item.path and os.path.exists(item.path):
+                os.remove(item.path)
+        except OSError:
+            pass
@@ -0,0 +1,317 @@
+"""
+Token-budgeted prompt assembly.
+
+Prompt sections used to be cut at fixed character counts (CONTEXT_MAX_CHARS,
+200 chars per history line, 1000 chars of history) and tokens were estimated
+as len/4. That wasted most of the context window on English and could still
+overflow it on non-Latin text. Sections are now measured with the serving
+model's tokenizer and sized against LLM_CONTEXT_WINDOW:
+
+- The tokenizer is loaded lazily once per model (PROMPT_TOKENIZER overrides
+  the name/path); the API warms them in its lifespan. Without transformers or model access a conservative
+  heuristic is used: 4 ASCII chars per token, 1 token per other char.
+- The window minus the reserved completion (llm.max_tokens), the template,
+  the question and the agent's media inventory (PROMPT_MEDIA_MAX_TOKENS,
+  returned separately as the stable agent_context) is split by priority:
+  the most recent exchange of history (PROMPT_HISTORY_MIN_TOKENS), then
+  retrieved documents (PROMPT_CONTEXT_MAX_TOKENS, PROMPT_DOC_MAX_TOKENS
+  each), then older history (PROMPT_HISTORY_MAX_TOKENS). Same inputs always
+  give the same prompt.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+from .monitoring import PROMPT_TOKENS
+
+_TRUNCATION_MARK = "..."
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _context_window() -> int:
+    return max(512, _env_int("LLM_CONTEXT_WINDOW", 8192))
+
+
+def _output_reserve() -> int:
+    from .llm import CONFIG
+
+    return max(0, _env_int("PROMPT_OUTPUT_RESERVE", int(CONFIG.get("llm", {}).get("max_tokens", 2048))))
+
+
+def _context_max_tokens() -> int:
+    return max(0, _env_int("PROMPT_CONTEXT_MAX_TOKENS", 3000))
+
+
+def _history_max_tokens() -> int:
+    return max(0, _env_int("PROMPT_HISTORY_MAX_TOKENS", 1024))
+
+
+def _safety_margin() -> int:
+    # Chat-template special tokens and tokenizer drift between client and server.
+    return max(0, _env_int("PROMPT_SAFETY_MARGIN", 64))
+
+
+# =============================================================================
+# TOKENIZERS
+# =============================================================================
+
+class HeuristicTokenizer:
+    """Upper-bound estimate when the real tokenizer is unavailable."""
+
+    name = "heuristic"
+
+    @staticmethod
+    def _cost(ch: str) -> float:
+        return 0.25 if ch < "\x80" else 1.0
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        non_ascii = sum(1 for ch in text if ch >= "\x80")
+        ascii_chars = len(text) - non_ascii
+        return (ascii_chars + 3) // 4 + non_ascii
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.count(text) <= max_tokens:
+            return text
+        budget = float(max_tokens)
+        for index, ch in enumerate(text):
+            budget -= self._cost(ch)
+            if budget < 0:
+                return text[:index]
+        return text
+
+
+class HFTokenizer:
+    """Wraps a transformers tokenizer (no special tokens, no truncation state)."""
+
+    def __init__(self, name: str, tokenizer: Any):
+        self.name = name
+        self._tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        ids = self._tokenizer.encode(text, add_special_tokens=False)
+        if len(ids) <= max_tokens:
+            return text
+        return self._tokenizer.decode(ids[:max(0, max_tokens)], skip_special_tokens=True)
+
+
+_TOKENIZERS: Dict[str, Any] = {}
+_TOKENIZER_LOCK = threading.Lock()
+
+
+def _tokenizer_name(model_key: Optional[str] = None) -> str:
+    override = os.getenv("PROMPT_TOKENIZER", "").strip()
+    if override:
+        return override
+    from .config import MODEL_BACKENDS, VLLM_MODEL
+
+    if model_key and model_key in MODEL_BACKENDS:
+        return MODEL_BACKENDS[model_key]["model"]
+    return VLLM_MODEL
+
+
+def _load_tokenizer(name: str):
+    if name == HeuristicTokenizer.name:
+        return HeuristicTokenizer()
+    try:
+        from transformers import AutoTokenizer
+
+        token = os.getenv("HF_TOKEN", "").strip() or None
+        tokenizer = HFTokenizer(name, AutoTokenizer.from_pretrained(name, token=token))
+        print(f"[prompt] tokenizer loaded: {name}")
+        return tokenizer
+    except Exception as e:
+        print(f"[WARN] Tokenizer '{name}' unavailable ({e}); using heuristic token counts")
+        return HeuristicTokenizer()
+
+
+def get_tokenizer(model_key: Optional[str] = None):
+    """Tokenizer for the model behind model_key (loaded once, then shared)."""
+    name = _tokenizer_name(model_key)
+    tokenizer = _TOKENIZERS.get(name)
+    if tokenizer is None:
+        with _TOKENIZER_LOCK:
+            tokenizer = _TOKENIZERS.get(name)
+            if tokenizer is None:
+                tokenizer = _load_tokenizer(name)
+                _TOKENIZERS[name] = tokenizer
+    return tokenizer
+
+
+def tokenizer_ready(model_key: Optional[str] = None) -> bool:
+    """True once get_tokenizer(model_key) no longer loads anything."""
+    return _tokenizer_name(model_key) in _TOKENIZERS
+
+
+def warm_tokenizers() -> None:
+    """Load the default and every backend's tokenizer (blocking; run off the event loop)."""
+    from .config import MODEL_BACKENDS
+
+    get_tokenizer()
+    for model_key in MODEL_BACKENDS:
+        get_tokenizer(model_key)
+
+
+def count_tokens(text: str, model_key: Optional[str] = None) -> int:
+    return get_tokenizer(model_key).count(text or "")
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_key: Optional[str] = None) -> str:
+    """Cut text to max_tokens (marked with "..." when cut)."""
+    tokenizer = get_tokenizer(model_key)
+    if tokenizer.count(text) <= max_tokens:
+        return text
+    mark = tokenizer.count(_TRUNCATION_MARK)
+    return tokenizer.truncate(text, max(0, max_tokens - mark)).rstrip() + _TRUNCATION_MARK
+
+
+@lru_cache(maxsize=8)
+def _template_tokens(tokenizer_name: str) -> int:
+    from .llm import PROMPT_TEMPLATE
+
+    empty = PROMPT_TEMPLATE.format(conversation_history="", context="", question="")
+    return _TOKENIZERS[tokenizer_name].count(empty)
+
+
+# =============================================================================
+# SECTIONS
+# =============================================================================
+
+def _doc_content(doc: Any) -> str:
+    if hasattr(doc, "page_content"):
+        return doc.page_content
+    if isinstance(doc, dict) and "content" in doc:
+        return doc["content"]
+    return str(doc)
+
+
+def format_documents(docs: Sequence[Any], max_tokens: Optional[int] = None, model_key: Optional[str] = None) -> str:
+    """"[Document i]: ..." blocks within max_tokens, best-ranked first."""
+    if not docs:
+        return "No relevant documents found."
+    if max_tokens is None:
+        max_tokens = _context_max_tokens()
+    tokenizer = get_tokenizer(model_key)
+    per_doc = max(16, _env_int("PROMPT_DOC_MAX_TOKENS", 400))
+    min_doc = max(1, _env_int("PROMPT_MIN_DOC_TOKENS", 48))
+    separator = tokenizer.count("\n\n")
+
+    parts: List[str] = []
+    used = 0
+    for i, doc in enumerate(docs, 1):
+        prefix = f"[Document {i}]: "
+        overhead = tokenizer.count(prefix) + (separator if parts else 0)
+        room = min(per_doc, max_tokens - used - overhead)
+        if room < min_doc:
+            break
+        content = truncate_to_tokens(_doc_content(doc), room, model_key)
+        parts.append(prefix + content)
+        used += overhead + tokenizer.count(content)
+    return "\n\n".join(parts)
+
+
+def format_messages(
+    messages: Sequence[Dict],
+    max_tokens: Optional[int] = None,
+    max_messages: int = 10,
+    model_key: Optional[str] = None,
+) -> str:
+    """"User:/Assistant:" lines, newest kept first, within max_tokens."""
+    if not messages:
+        return "No previous conversation."
+    if max_tokens is None:
+        max_tokens = _history_max_tokens()
+    tokenizer = get_tokenizer(model_key)
+    per_message = max(16, _env_int("PROMPT_HISTORY_MESSAGE_TOKENS", 160))
+
+    lines: List[str] = []
+    used = 0
+    for msg in reversed(list(messages)[-(max_messages * 2):]):
+        role = "User" if msg["role"] == "user" else "Assistant"
+        line = f"{role}: " + truncate_to_tokens(msg["content"], per_message, model_key)
+        cost = tokenizer.count(line) + (1 if lines else 0)
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+    lines.reverse()
+    return "\n".join(lines)
+
+
+# =============================================================================
+# PLANNER
+# =============================================================================
+
+@dataclass
+class PromptPlan:
+    context: str
+    history: str
+    agent_context: str = ""
+    tokens: Dict[str, int] = field(default_factory=dict)
+
+
+def plan_prompt(
+    question: str,
+    docs: Sequence[Any],
+    messages: Optional[Sequence[Dict]] = None,
+    media_context: str = "",
+    max_messages: int = 5,
+    model_key: Optional[str] = None,
+) -> PromptPlan:
+    """Size documents, history and the agent's media inventory for one turn."""
+    tokenizer = get_tokenizer(model_key)
+    name = _tokenizer_name(model_key)
+    messages = list(messages or [])
+
+    fixed = _template_tokens(name) + tokenizer.count(question) + _safety_margin()
+    available = max(0, _context_window() - _output_reserve() - fixed)
+
+    # The media inventory is part of the per-agent prompt prefix: a fixed cap,
+    # never the leftover budget, keeps it byte-identical across requests.
+    media_room = min(max(0, _env_int("PROMPT_MEDIA_MAX_TOKENS", 512)), available)
+    media = truncate_to_tokens(media_context, media_room, model_key) if media_context and media_room else ""
+    media_used = tokenizer.count(media)
+    available -= media_used
+
+    full_history = format_messages(messages, available, max_messages, model_key) if messages else ""
+    history_need = tokenizer.count(full_history)
+    history_cap = min(available, _history_max_tokens())
+    history_floor = min(history_need, history_cap, max(0, _env_int("PROMPT_HISTORY_MIN_TOKENS", 256)))
+
+    docs_cap = max(0, min(_context_max_tokens(), available - history_floor))
+    context = format_documents(docs, docs_cap, model_key)
+    docs_used = tokenizer.count(context)
+
+    history_budget = min(history_cap, max(history_floor, available - docs_used))
+    history = format_messages(messages, history_budget, max_messages, model_key)
+
+    plan = PromptPlan(
+        context=context,
+        history=history,
+        agent_context=media,
+        tokens={
+            "fixed": fixed,
+            "documents": docs_used,
+            "media": media_used,
+            "history": tokenizer.count(history),
+        },
+    )
+    for section, count in plan.tokens.items():
+        PROMPT_TOKENS.labels(section=section).observe(count)
+    return plan
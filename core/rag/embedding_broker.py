@@ -0,0 +1,179 @@
+"""
+In-process embedding broker with dynamic micro-batching.
+
+Every caller used to run its own forward pass on the shared
+HuggingFaceEmbeddings model (semantic cache probe, vector search, voice
+prefill, ingestion), so concurrent requests contended for the same CPU
+threads one text at a time. The broker owns the model on a single worker
+thread instead:
+
+- Interactive lane: concurrent query embeds are gathered into one batch,
+  closed at EMBEDDING_BATCH_MAX texts or EMBEDDING_BATCH_WAIT_MS after the
+  first text arrived, whichever comes first.
+- Ingest lane: bulk document embeds are split into EMBEDDING_INGEST_BATCH
+  slices and only run when no query is waiting, so uploads never sit in
+  front of a chat turn for more than one slice.
+- Queue depth and batch sizes are exported per lane.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Deque, List, Optional
+
+from ..monitoring import EMBEDDING_BATCH_SIZE, EMBEDDING_QUEUE_DEPTH, EMBEDDING_QUEUE_WAIT
+
+QUERY_LANE = "query"
+INGEST_LANE = "ingest"
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def broker_enabled() -> bool:
+    return os.getenv("EMBEDDING_BROKER_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _batch_max() -> int:
+    return max(1, _env_int("EMBEDDING_BATCH_MAX", 32))
+
+
+def _batch_wait() -> float:
+    return max(0.0, _env_float("EMBEDDING_BATCH_WAIT_MS", 2.0)) / 1000.0
+
+
+def _ingest_batch() -> int:
+    return max(1, _env_int("EMBEDDING_INGEST_BATCH", 32))
+
+
+def _query_timeout() -> float:
+    return max(0.1, _env_float("EMBEDDING_QUERY_TIMEOUT", 30.0))
+
+
+def embed_query_batch(model, texts: List[str]) -> List[List[float]]:
+    """One forward pass over several queries, honouring query-specific encode kwargs."""
+    embed = getattr(model, "_embed", None)
+    if callable(embed):
+        kwargs = getattr(model, "query_encode_kwargs", None) or getattr(model, "encode_kwargs", None) or {}
+        return [list(v) for v in embed(list(texts), kwargs)]
+    return [list(model.embed_query(text)) for text in texts]
+
+
+def embed_document_batch(model, texts: List[str]) -> List[List[float]]:
+    return [list(v) for v in model.embed_documents(list(texts))]
+
+
+@dataclass
+class _Job:
+    texts: List[str]
+    lane: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+    future: Future = field(default_factory=Future)
+
+
+class EmbeddingBroker:
+    """Single-worker batcher in front of one embeddings model."""
+
+    def __init__(self, resolve_model: Callable[[], object]):
+        self._resolve_model = resolve_model
+        self._cv = threading.Condition()
+        self._lanes = {QUERY_LANE: deque(), INGEST_LANE: deque()}  # type: dict[str, Deque[_Job]]
+        self._worker: Optional[threading.Thread] = None
+
+    def _start_worker_once(self) -> None:
+        # Caller holds self._cv.
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, name="embedding-broker", daemon=True)
+        self._worker.start()
+
+    def _submit(self, job: _Job) -> Future:
+        with self._cv:
+            self._lanes[job.lane].append(job)
+            EMBEDDING_QUEUE_DEPTH.labels(lane=job.lane).inc(len(job.texts))
+            self._start_worker_once()
+            self._cv.notify()
+        return job.future
+
+    def _take_batch(self) -> List[_Job]:
+        queries, ingest = self._lanes[QUERY_LANE], self._lanes[INGEST_LANE]
+        with self._cv:
+            while not queries and not ingest:
+                self._cv.wait()
+            if not queries:
+                return [ingest.popleft()]
+
+            jobs = [queries.popleft()]
+            size = len(jobs[0].texts)
+            deadline = jobs[0].enqueued_at + _batch_wait()
+            while size < _batch_max():
+                if queries:
+                    if size + len(queries[0].texts) > _batch_max():
+                        break
+                    jobs.append(queries.popleft())
+                    size += len(jobs[-1].texts)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cv.wait(remaining)
+            return jobs
+
+    def _run(self) -> None:
+        while True:
+            jobs = self._take_batch()
+            lane = jobs[0].lane
+            texts = [text for job in jobs for text in job.texts]
+            started = time.monotonic()
+            EMBEDDING_QUEUE_DEPTH.labels(lane=lane).dec(len(texts))
+            for job in jobs:
+                EMBEDDING_QUEUE_WAIT.labels(lane=lane).observe(started - job.enqueued_at)
+            try:
+                model = self._resolve_model()
+                if lane == QUERY_LANE:
+                    vectors = embed_query_batch(model, texts)
+                else:
+                    vectors = embed_document_batch(model, texts)
+                EMBEDDING_BATCH_SIZE.labels(lane=lane).observe(len(texts))
+            except Exception as e:
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+            offset = 0
+            for job in jobs:
+                job.future.set_result(vectors[offset:offset + len(job.texts)])
+                offset += len(job.texts)
+
+    def embed_queries(self, texts: List[str], timeout: Optional[float] = None) -> List[List[float]]:
+        """Interactive lane: batched with concurrent callers, bounded latency."""
+        if not texts:
+            return []
+        future = self._submit(_Job(list(texts), QUERY_LANE))
+        return future.result(timeout=timeout or _query_timeout())
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Ingest lane: sliced so queued queries can run between slices."""
+        if not texts:
+            return []
+        step = _ingest_batch()
+        futures = [
+            self._submit(_Job(list(texts[i:i + step]), INGEST_LANE))
+            for i in range(0, len(texts), step)
+        ]
+        vectors: List[List[float]] = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
@@ -0,0 +1,221 @@
+"""
+Content-addressed embedding cache for ingestion.
+
+Re-uploading or re-scraping a source used to re-embed every chunk even when
+the text was byte-identical to something already embedded. Document vectors
+are now kept in a local SQLite file keyed by (model name, sha256(text)):
+
+- BrokeredEmbeddings.embed_documents looks every text up first and only sends
+  the misses (deduplicated) to the embedding broker.
+- Switching EMBEDDING_MODEL never reuses vectors from another model.
+- Rows carry a last-used timestamp; the file is trimmed to
+  EMBEDDING_CACHE_MAX_ROWS least recently used entries. The row count is
+  tracked in memory (counted once at connect, adjusted on insert and evict)
+  and only re-counted when a trim looks due, since other workers may share
+  the file.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ..config import STORAGE_PATH
+from ..monitoring import EMBEDDING_CACHE_LOOKUPS
+
+# SQLite caps bound parameters per statement; stay well below the limit.
+_SQL_CHUNK = 500
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def embedding_cache_enabled() -> bool:
+    return os.getenv("EMBEDDING_CACHE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _cache_path() -> str:
+    return os.getenv("EMBEDDING_CACHE_PATH", "").strip() or os.path.join(
+        STORAGE_PATH, "cache", "embeddings.sqlite3"
+    )
+
+
+def _max_rows() -> int:
+    """0 disables trimming."""
+    return max(0, _env_int("EMBEDDING_CACHE_MAX_ROWS", 500000))
+
+
+def content_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed {(model, digest): vector} store shared by all threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._rows = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (model, digest)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_used ON embeddings (used_at)")
+            conn.commit()
+            self._rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, model: str, digests: Sequence[str]) -> Dict[str, List[float]]:
+        unique = list(dict.fromkeys(digests))
+        found: Dict[str, List[float]] = {}
+        if not unique:
+            return found
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(unique), _SQL_CHUNK):
+                chunk = unique[start:start + _SQL_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT digest, dim, vector FROM embeddings WHERE model = ? AND digest IN ({marks})",
+                    [model, *chunk],
+                ).fetchall()
+                for digest, dim, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if vector.shape[0] == dim:
+                        found[digest] = vector.tolist()
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET used_at = ? WHERE model = ? AND digest = ?",
+                    [(now, model, digest) for digest in found],
+                )
+                conn.commit()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, Sequence[float]]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        rows = []
+        for digest, vector in vectors.items():
+            array = np.asarray(vector, dtype=np.float32)
+            rows.append((model, digest, int(array.shape[0]), array.tobytes(), now))
+        with self._lock:
+            conn = self._connect()
+            # Same (model, digest) means the same vector, so an existing row only
+            # needs its last-used time refreshed; rowcount is then new rows only.
+            inserted = conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, digest, dim, vector, used_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            ).rowcount
+            if inserted < len(rows):
+                conn.executemany(
+                    "UPDATE embeddings SET used_at = ? WHERE model = ? AND digest = ?",
+                    [(now, model, digest) for digest in vectors],
+                )
+            self._rows += max(0, inserted)
+            limit = _max_rows()
+            if limit and self._rows > limit:
+                # Other workers may have written or trimmed the file too.
+                self._rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                if self._rows > limit:
+                    evicted = conn.execute(
+                        "DELETE FROM embeddings WHERE rowid IN "
+                        "(SELECT rowid FROM embeddings ORDER BY used_at LIMIT ?)",
+                        (self._rows - limit,),
+                    ).rowcount
+                    self._rows -= max(0, evicted)
+            conn.commit()
+
+    def clear(self, model: Optional[str] = None) -> None:
+        with self._lock:
+            conn = self._connect()
+            if model is None:
+                removed = conn.execute("DELETE FROM embeddings").rowcount
+            else:
+                removed = conn.execute("DELETE FROM embeddings WHERE model = ?", (model,)).rowcount
+            self._rows = max(0, self._rows - max(0, removed))
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_CACHE: Optional[EmbeddingCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = EmbeddingCache(_cache_path())
+    return _CACHE
+
+
+def embed_with_cache(
+    model: str,
+    texts: Sequence[str],
+    embed: Callable[[List[str]], List[List[float]]],
+    cache: Optional[EmbeddingCache] = None,
+) -> List[List[float]]:
+    """Return vectors for texts, embedding only the distinct texts not cached for model."""
+    texts = list(texts)
+    if not texts:
+        return []
+    cache = cache or get_embedding_cache()
+    digests = [content_digest(text) for text in texts]
+
+    try:
+        known = cache.get_many(model, digests)
+    except Exception as e:
+        print(f"[WARN] Embedding cache read failed: {e}")
+        known = {}
+
+    missing: Dict[str, str] = {}
+    for digest, text in zip(digests, texts):
+        if digest not in known and digest not in missing:
+            missing[digest] = text
+    EMBEDDING_CACHE_LOOKUPS.labels(result="hit").inc(sum(1 for d in digests if d in known))
+    EMBEDDING_CACHE_LOOKUPS.labels(result="miss").inc(sum(1 for d in digests if d not in known))
+
+    if missing:
+        fresh = embed(list(missing.values()))
+        computed = {digest: list(vector) for digest, vector in zip(missing, fresh)}
+        try:
+            cache.put_many(model, computed)
+        except Exception as e:
+            print(f"[WARN] Embedding cache write failed: {e}")
+        known.update(computed)
+
+    return [known[digest] for digest in digests]
@@ -1,19 +1,52 @@
 """
 Embedding model handling with caching and fallbacks.
+
+Query vectors are memoized twice:
+- per turn, via query_embedding_scope()/with_query_embedding_scope, so the
+  semantic cache probe, vector retrieval and cache insert share one forward pass;
+- process-wide, in a small LRU keyed by (model, normalized text).
+
+Forward passes go through the embedding broker (see embedding_broker.py):
+queries share micro-batches, ingestion runs on a lower-priority lane via
+get_ingest_embeddings(), which also reuses stored vectors for unchanged
+chunks (see embedding_cache.py). Semantic splitting uses
+get_chunking_embeddings(), which skips that cache.
 """
+import contextvars
+import functools
+import inspect
 import logging
 import os
 import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from ..config import EMBEDDING_DIM, EMBEDDING_MODEL
+from .embedding_broker import EmbeddingBroker, broker_enabled, embed_query_batch
+from .embedding_cache import embed_with_cache, embedding_cache_enabled
 
 
 logger = logging.getLogger(__name__)
 _EMBEDDINGS_INSTANCE = None
 _EMBEDDINGS_LOCK = threading.Lock()
 
+_QUERY_CACHE: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+_TURN_EMBEDDINGS: contextvars.ContextVar[Optional[Dict[str, List[float]]]] = contextvars.ContextVar(
+    "omni_turn_embeddings", default=None
+)
+
+
+def _query_cache_size() -> int:
+    try:
+        return max(0, int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024")))
+    except (ValueError, TypeError):
+        return 1024
+
 
 def _default_embedding_fallbacks() -> list[str]:
     try:
@@ -139,3 +172,134 @@ def get_embeddings():
         raise RuntimeError(
             "Embeddings unavailable. Tried candidates: " + " | ".join(errors)
         )
+
+
+_BROKER: Optional[EmbeddingBroker] = None
+_BROKER_LOCK = threading.Lock()
+
+
+def get_embedding_broker() -> EmbeddingBroker:
+    global _BROKER
+    if _BROKER is None:
+        with _BROKER_LOCK:
+            if _BROKER is None:
+                # Resolved per batch so a reloaded/fallback model is picked up.
+                _BROKER = EmbeddingBroker(lambda: get_embeddings())
+    return _BROKER
+
+
+class BrokeredEmbeddings(Embeddings):
+    """LangChain Embeddings facade over the broker (ingest lane for documents).
+
+    With use_cache=False every document is embedded fresh and nothing is
+    written to the chunk cache (for throwaway vectors such as sentence groups).
+    """
+
+    def __init__(self, use_cache: bool = True):
+        self.use_cache = use_cache
+
+    @property
+    def model_name(self) -> str:
+        return str(getattr(get_embeddings(), "model_name", "") or "")
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        if not broker_enabled():
+            return [list(v) for v in get_embeddings().embed_documents(list(texts))]
+        return get_embedding_broker().embed_documents(list(texts))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Unchanged chunks (same model, same bytes) reuse their stored vector.
+        if self.use_cache and embedding_cache_enabled():
+            return embed_with_cache(self.model_name, texts, self._embed_uncached)
+        return self._embed_uncached(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embed_query_cached(text)
+
+
+_INGEST_EMBEDDINGS = BrokeredEmbeddings()
+
+
+def get_ingest_embeddings() -> BrokeredEmbeddings:
+    """Embeddings object for vector stores/splitters that embed in bulk."""
+    return _INGEST_EMBEDDINGS
+
+
+_CHUNKING_EMBEDDINGS = BrokeredEmbeddings(use_cache=False)
+
+
+def get_chunking_embeddings() -> BrokeredEmbeddings:
+    """Ingest-lane embeddings that bypass the chunk cache (semantic splitting)."""
+    return _CHUNKING_EMBEDDINGS
+
+
+def _normalize_query(text: str) -> str:
+    return " ".join(str(text or "").split())
+
+
+def embed_query_cached(text: str) -> List[float]:
+    """Embed a query, reusing the vector within the current turn and across turns."""
+    normalized = _normalize_query(text)
+    turn = _TURN_EMBEDDINGS.get()
+    if turn is not None and normalized in turn:
+        return turn[normalized]
+
+    embeddings = get_embeddings()
+    key = (str(getattr(embeddings, "model_name", "") or ""), normalized)
+    vector: Optional[List[float]] = None
+    with _QUERY_CACHE_LOCK:
+        vector = _QUERY_CACHE.get(key)
+        if vector is not None:
+            _QUERY_CACHE.move_to_end(key)
+
+    if vector is None:
+        if broker_enabled():
+            vector = get_embedding_broker().embed_queries([normalized])[0]
+        else:
+            vector = embed_query_batch(embeddings, [normalized])[0]
+        capacity = _query_cache_size()
+        if capacity:
+            with _QUERY_CACHE_LOCK:
+                _QUERY_CACHE[key] = vector
+                _QUERY_CACHE.move_to_end(key)
+                while len(_QUERY_CACHE) > capacity:
+                    _QUERY_CACHE.popitem(last=False)
+
+    if turn is not None:
+        turn[normalized] = vector
+    return vector
+
+
+@contextmanager
+def query_embedding_scope(vectors: Optional[Dict[str, List[float]]] = None):
+    """Share query vectors across every stage of one chat turn.
+
+    The scope dict travels with contextvars, so offloaded stages
+    (core.offload.run_blocking/run_cpu_bound) see the same vectors. It is
+    yielded so a turn split across several blocks (a streamed answer, which
+    must not hold a context variable across its yields) can pass it back in
+    to reopen the same scope.
+    """
+    if vectors is None:
+        vectors = {}
+    token = _TURN_EMBEDDINGS.set(vectors)
+    try:
+        yield vectors
+    finally:
+        _TURN_EMBEDDINGS.reset(token)
+
+
+def with_query_embedding_scope(func):
+    """Decorator form of query_embedding_scope for sync and async turn handlers."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with query_embedding_scope():
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with query_embedding_scope():
+            return func(*args, **kwargs)
+    return wrapper
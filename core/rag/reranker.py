@@ -0,0 +1,279 @@
+"""
+Cross-encoder reranking service.
+
+rerank_documents() used to run CrossEncoder.predict() over full chunk texts
+on each request thread, so concurrent turns competed for the model one
+un-batched forward pass at a time. Scoring now goes through a shared service:
+
+- Pairs from concurrent requests are queued and scored together by one
+  batcher thread (up to RERANKER_MAX_BATCH pairs, waiting at most
+  RERANKER_BATCH_WAIT_MS for company).
+- Documents are capped to RERANKER_MAX_LENGTH tokens (tokenizer truncation,
+  with a cheap character pre-cut so huge chunks are never tokenized in full).
+- Scores are memoized per (model, query, chunk) in an LRU, so repeated
+  questions and overlapping candidate sets skip inference.
+- RERANKER_BACKEND=onnx loads an ONNX Runtime export (optionally an int8
+  quantized file via RERANKER_ONNX_FILE) for CPU serving; it falls back to the
+  sentence-transformers CrossEncoder when optimum/onnxruntime are missing.
+"""
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from ..monitoring import RERANKER_BATCH_PAIRS, RERANKER_LATENCY, RERANKER_SCORE_CACHE
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def default_reranker_model() -> str:
+    return os.getenv("RERANKER_MODEL_NAME", "BAAI/bge-reranker-large")
+
+
+def _max_length() -> int:
+    return max(32, _env_int("RERANKER_MAX_LENGTH", 512))
+
+
+def _max_batch() -> int:
+    return max(1, _env_int("RERANKER_MAX_BATCH", 64))
+
+
+def _batch_wait() -> float:
+    return max(0.0, _env_float("RERANKER_BATCH_WAIT_MS", 5.0)) / 1000.0
+
+
+def _score_cache_size() -> int:
+    return max(0, _env_int("RERANKER_SCORE_CACHE_SIZE", 8192))
+
+
+def _request_timeout() -> float:
+    return max(0.1, _env_float("RERANKER_TIMEOUT", 10.0))
+
+
+def _backend() -> str:
+    backend = os.getenv("RERANKER_BACKEND", "torch").strip().lower()
+    return backend if backend in {"torch", "onnx"} else "torch"
+
+
+# =============================================================================
+# MODEL LOADING
+# =============================================================================
+
+class _OnnxCrossEncoder:
+    """Minimal CrossEncoder-compatible predict() over an ONNX Runtime model."""
+
+    def __init__(self, model_name: str, max_length: int, file_name: Optional[str] = None):
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        kwargs = {"file_name": file_name} if file_name else {"export": True}
+        self.model = ORTModelForSequenceClassification.from_pretrained(model_name, **kwargs)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_length = max_length
+
+    def predict(self, pairs: Sequence[Sequence[str]], batch_size: int = 32, **_kwargs) -> List[float]:
+        scores: List[float] = []
+        for start in range(0, len(pairs), batch_size):
+            chunk = pairs[start:start + batch_size]
+            features = self.tokenizer(
+                [p[0] for p in chunk],
+                [p[1] for p in chunk],
+                padding=True,
+                truncation="only_second",
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            logits = self.model(**features).logits
+            scores.extend(float(row[0]) if len(row) == 1 else float(row[-1]) for row in logits)
+        return scores
+
+
+def load_cross_encoder(model_name: str):
+    """Load the scoring model for the configured backend."""
+    max_length = _max_length()
+    if _backend() == "onnx":
+        try:
+            model = _OnnxCrossEncoder(model_name, max_length, os.getenv("RERANKER_ONNX_FILE") or None)
+            print(f"[retrieval] loaded ONNX reranker: {model_name}")
+            return model
+        except Exception as e:
+            print(f"[WARN] ONNX reranker unavailable ({e}); falling back to CrossEncoder")
+
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(model_name, max_length=max_length)
+
+
+# =============================================================================
+# SERVICE
+# =============================================================================
+
+@dataclass
+class _Job:
+    pairs: List[Tuple[str, str]]
+    future: Future = field(default_factory=Future)
+
+
+class RerankerService:
+    """Batched, cached scorer around one cross-encoder model."""
+
+    def __init__(self, model_name: str, loader: Callable[[str], object] = load_cross_encoder):
+        self.model_name = model_name
+        self._loader = loader
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # -- model ---------------------------------------------------------------
+
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    print(f"[retrieval] loading reranker: {self.model_name}")
+                    self._model = self._loader(self.model_name)
+        return self._model
+
+    # -- cache ---------------------------------------------------------------
+
+    @staticmethod
+    def _key(query: str, text: str) -> Tuple[str, str]:
+        # Whitespace only: cross-encoders are case-sensitive, so "US" != "us".
+        return (
+            " ".join(query.split()),
+            hashlib.sha1(text.encode("utf-8", "ignore")).hexdigest(),
+        )
+
+    def _cached(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _remember(self, key: Tuple[str, str], score: float) -> None:
+        size = _score_cache_size()
+        if size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > size:
+                self._cache.popitem(last=False)
+
+    # -- batching ------------------------------------------------------------
+
+    def _start_worker_once(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="reranker-batcher", daemon=True)
+            self._worker.start()
+
+    def _collect(self, first: _Job) -> List[_Job]:
+        jobs = [first]
+        pairs = len(first.pairs)
+        deadline = time.monotonic() + _batch_wait()
+        while pairs < _max_batch():
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            jobs.append(job)
+            pairs += len(job.pairs)
+        return jobs
+
+    def _run(self) -> None:
+        while True:
+            jobs = self._collect(self._queue.get())
+            pairs = [pair for job in jobs for pair in job.pairs]
+            try:
+                scores = self.model().predict(pairs, batch_size=_max_batch())
+                RERANKER_BATCH_PAIRS.observe(len(pairs))
+            except Exception as e:
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+            offset = 0
+            for job in jobs:
+                job.future.set_result([float(s) for s in scores[offset:offset + len(job.pairs)]])
+                offset += len(job.pairs)
+
+    # -- public --------------------------------------------------------------
+
+    def score(self, query: str, texts: Sequence[str], timeout: Optional[float] = None) -> List[float]:
+        """Relevance score for each text against query (higher is better)."""
+        started = time.perf_counter()
+        # ~4 chars per token; the tokenizer does the exact cut at RERANKER_MAX_LENGTH.
+        char_cap = _max_length() * 4
+        clipped = [(text or "")[:char_cap] for text in texts]
+
+        scores: List[Optional[float]] = [None] * len(clipped)
+        todo: Dict[Tuple[str, str], List[int]] = {}
+        for i, text in enumerate(clipped):
+            key = self._key(query, text)
+            cached = self._cached(key)
+            if cached is not None:
+                scores[i] = cached
+            else:
+                todo.setdefault(key, []).append(i)
+        RERANKER_SCORE_CACHE.labels(result="hit").inc(len(clipped) - sum(len(v) for v in todo.values()))
+        RERANKER_SCORE_CACHE.labels(result="miss").inc(sum(len(v) for v in todo.values()))
+
+        if todo:
+            keys = list(todo)
+            job = _Job([(query, clipped[todo[key][0]]) for key in keys])
+            self._start_worker_once()
+            self._queue.put(job)
+            fresh = job.future.result(timeout=timeout or _request_timeout())
+            for key, score in zip(keys, fresh):
+                self._remember(key, score)
+                for i in todo[key]:
+                    scores[i] = score
+
+        RERANKER_LATENCY.observe(time.perf_counter() - started)
+        return [float(s) for s in scores]
+
+
+_SERVICE: Optional[RerankerService] = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_reranker_service(model_name: str = None) -> RerankerService:
+    """Process-wide service (one model is kept resident, like the old singleton)."""
+    global _SERVICE
+    resolved = model_name or default_reranker_model()
+    if _SERVICE is None:
+        with _SERVICE_LOCK:
+            if _SERVICE is None:
+                _SERVICE = RerankerService(resolved)
+    if model_name and model_name != _SERVICE.model_name:
+        print(
+            f"[WARN] Reranker model mismatch: requested={model_name}, "
+            f"loaded={_SERVICE.model_name}; using loaded model"
+        )
+    return _SERVICE
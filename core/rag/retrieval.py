@@ -3,9 +3,11 @@ Advanced Retrieval Module
 - Hybrid Search (Vector + Keyword)
 - Reciprocal Rank Fusion (RRF)
 - Cross-Encoder Reranking
+- Parent-chunk expansion (children -> deduplicated parents within the context budget)
 """
 
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import threading
 import time
 from typing import Any, Dict, List, Optional
@@ -13,15 +15,12 @@ import os
 
 from sqlalchemy import text
 
-from ..database import get_session
+from ..database import get_parent_chunks, get_session
+from ..offload import get_retrieval_executor, submit_with_context
+from .reranker import get_reranker_service
 from .vector_store import search_documents as vector_search_func
 
-# Lazy load reranker model to save startup time/memory if not used.
-_RERANKER_MODEL = None
-_RERANKER_LOADED_NAME: Optional[str] = None
-
 _VECTOR_FAILURE_LOCK = threading.Lock()
-_RERANKER_INIT_LOCK = threading.Lock()
 _LAST_VECTOR_FAILURE_AT: Optional[float] = None
 _VECTOR_FAILURE_THROTTLE_SECONDS = max(
     1.0,
@@ -30,61 +29,62 @@ _VECTOR_FAILURE_THROTTLE_SECONDS = max(
 
 
 def get_reranker(model_name: str = None):
-    global _RERANKER_MODEL, _RERANKER_LOADED_NAME
-    resolved_name = model_name or os.getenv("RERANKER_MODEL_NAME", "BAAI/bge-reranker-large")
-    
-    # First check (without lock)
-    if _RERANKER_MODEL is not None:
-        if model_name and model_name != _RERANKER_LOADED_NAME:
-            print(
-                f"[WARN] Reranker model mismatch: requested={model_name}, "
-                f"loaded={_RERANKER_LOADED_NAME}; using loaded model"
-            )
-        return _RERANKER_MODEL
-    
-    # Acquire lock for initialization
-    with _RERANKER_INIT_LOCK:
-        # Second check (with lock) to ensure another thread didn't beat us
-        if _RERANKER_MODEL is not None:
-            if model_name and model_name != _RERANKER_LOADED_NAME:
-                print(
-                    f"[WARN] Reranker model mismatch: requested={model_name}, "
-                    f"loaded={_RERANKER_LOADED_NAME}; using loaded model"
-                )
-            return _RERANKER_MODEL
-        
-        # Load the model while holding the lock
-        print(f"[retrieval] loading reranker: {resolved_name}")
-        from sentence_transformers import CrossEncoder
-
-        _RERANKER_MODEL = CrossEncoder(resolved_name)
-        _RERANKER_LOADED_NAME = resolved_name
-    
-    return _RERANKER_MODEL
+    """Return the loaded cross-encoder (kept for callers that predict directly)."""
+    return get_reranker_service(model_name).model()
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+# Character pre-caps for expanded parents; core.prompt_budget makes the final
+# token-accurate cut, so these only bound what is handed to it.
+CONTEXT_MAX_CHARS = max(200, _env_int("CONTEXT_MAX_CHARS", 12000))
+CONTEXT_DOC_MAX_CHARS = max(100, _env_int("CONTEXT_DOC_MAX_CHARS", 1600))
+
+
+def _parent_expansion_enabled(expand: Optional[bool]) -> bool:
+    if expand is not None:
+        return bool(expand)
+    return os.getenv("USE_PARENT_EXPANSION", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+_KEYWORD_LEG_SQL = """
+    SELECT p.id, p.content, p.agent_id,
+           ts_rank(p.content_tsv, plainto_tsquery('english', :query)) AS rank
+    FROM omni_parent_chunks p
+    WHERE p.content_tsv @@ plainto_tsquery('english', :query)
+      AND {scope}
+    ORDER BY rank DESC
+    LIMIT :limit_k
+"""
 
 
 def keyword_search(query: str, agent_id: str = None, k: int = 10) -> List[Dict[str, Any]]:
     """
     Perform keyword search on ParentChunks using Postgres Full-Text Search (tsvector).
+
+    Matches and ranks against the stored content_tsv column. With an agent,
+    its own chunks and shared chunks (agent_id IS NULL) are separate legs so
+    each is served by its own GIN index (see database._create_keyword_search_indexes).
     """
     db = get_session()
     try:
-        sql = """
-        SELECT p.id, p.content, d.agent_id,
-               ts_rank(to_tsvector('english', p.content), plainto_tsquery('english', :query)) as rank
-        FROM omni_parent_chunks p
-        LEFT JOIN omni_documents d ON p.source_doc_id = d.id
-        WHERE to_tsvector('english', p.content) @@ plainto_tsquery('english', :query)
-        """
-        params: Dict[str, Any] = {"query": query}
-
+        params: Dict[str, Any] = {"query": query, "limit_k": k}
         if agent_id:
-            sql += " AND (d.agent_id = :agent_id OR d.agent_id IS NULL)"
             params["agent_id"] = agent_id
-
-        sql += " ORDER BY rank DESC"
-        sql += " LIMIT :limit_k"
-        params["limit_k"] = k
+            sql = (
+                "SELECT * FROM ("
+                f"({_KEYWORD_LEG_SQL.format(scope='p.agent_id = :agent_id')})"
+                " UNION ALL "
+                f"({_KEYWORD_LEG_SQL.format(scope='p.agent_id IS NULL')})"
+                ") hits ORDER BY rank DESC LIMIT :limit_k"
+            )
+        else:
+            sql = _KEYWORD_LEG_SQL.format(scope="TRUE")
 
         results = db.execute(text(sql), params).fetchall()
         return [
@@ -126,15 +126,16 @@ def rerank_documents(
 ) -> List[Any]:
     """
     Rerank documents using Cross-Encoder.
+
+    Scoring goes through the shared RerankerService (cross-request batching,
+    token-capped pairs, (query, chunk) score cache).
     """
     if not docs:
         return []
 
     try:
-        reranker = get_reranker(model_name=reranker_model)
-        doc_texts = [doc.get("page_content") or doc.get("content") for doc in docs]
-        pairs = [[query, text] for text in doc_texts]
-        scores = reranker.predict(pairs)
+        doc_texts = [doc.get("page_content") or doc.get("content") or "" for doc in docs]
+        scores = get_reranker_service(reranker_model).score(query, doc_texts)
 
         scored_docs = [(doc, scores[i]) for i, doc in enumerate(docs)]
         scored_docs.sort(key=lambda item: item[1], reverse=True)
@@ -145,6 +146,141 @@ def rerank_documents(
         return docs[:top_n]
 
 
+def _doc_text(doc: Any) -> str:
+    if isinstance(doc, dict):
+        return doc.get("content") or doc.get("page_content") or ""
+    return getattr(doc, "page_content", "") or ""
+
+
+def _is_keyword_hit(doc: Dict[str, Any]) -> bool:
+    return doc.get("source") != "vector" and (doc.get("metadata") or {}).get("source") == "keyword"
+
+
+def _doc_parent_id(doc: Dict[str, Any]) -> Optional[int]:
+    metadata = doc.get("metadata") or {}
+    # Keyword hits are parent rows themselves; vector hits are children.
+    raw = metadata.get("id") if _is_keyword_hit(doc) else metadata.get("parent_id")
+    try:
+        return int(raw) if raw is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parent_window(parent: str, children: List[str], limit: int) -> str:
+    """Slice of `parent` (at most `limit` chars) covering the matched children.
+
+    Whole parent when it fits; otherwise the span of all matched children, or a
+    window centred on the best-ranked child when that span is too wide.
+    """
+    if len(parent) <= limit:
+        return parent
+    spans = []
+    for child in children:
+        start = parent.find(child)
+        if start >= 0:
+            spans.append((start, start + len(child)))
+    if not spans:
+        return children[0][:limit] if children else parent[:limit]
+
+    start, end = min(s for s, _ in spans), max(e for _, e in spans)
+    if end - start > limit:
+        start, end = spans[0]
+    if end - start >= limit:
+        return parent[start:start + limit]
+
+    slack = limit - (end - start)
+    start = max(0, start - slack // 2)
+    end = min(len(parent), start + limit)
+    start = max(0, end - limit)
+    # Snap to whitespace so the window does not open/close mid-word.
+    if start > 0:
+        cut = parent.find(" ", start, start + 40)
+        start = cut + 1 if cut >= 0 else start
+    if end < len(parent):
+        cut = parent.rfind(" ", end - 40, end)
+        end = cut if cut > start else end
+    return parent[start:end].strip()
+
+
+def expand_to_parents(
+    docs: List[Any],
+    agent_id: Optional[str] = None,
+    top_k: Optional[int] = None,
+    max_chars: int = None,
+    doc_max_chars: int = None,
+) -> List[Dict[str, Any]]:
+    """
+    Replace ranked child hits with their parent chunks.
+
+    - Children sharing a parent collapse into one entry at the best child's rank.
+    - All missing parents are fetched in a single query.
+    - Each entry is pre-sized for the prompt planner: the parent (or the part
+      of it around the matched children) up to doc_max_chars, stopping once
+      max_chars is used. Hits without a parent pass through unchanged.
+    """
+    if not docs:
+        return []
+    max_chars = CONTEXT_MAX_CHARS if max_chars is None else max_chars
+    doc_max_chars = CONTEXT_DOC_MAX_CHARS if doc_max_chars is None else doc_max_chars
+
+    groups: List[Dict[str, Any]] = []
+    by_key: Dict[Any, Dict[str, Any]] = {}
+    known_parents: Dict[int, str] = {}
+    for doc in docs:
+        if not isinstance(doc, dict):
+            doc = {"content": _doc_text(doc), "metadata": dict(getattr(doc, "metadata", {}) or {}), "source": "vector"}
+        content = _doc_text(doc)
+        if not content:
+            continue
+        parent_id = _doc_parent_id(doc)
+        key = ("parent", parent_id) if parent_id is not None else ("text", content)
+        group = by_key.get(key)
+        if group is None:
+            if top_k is not None and len(groups) >= top_k:
+                continue
+            group = {"doc": doc, "parent_id": parent_id, "children": []}
+            by_key[key] = group
+            groups.append(group)
+        if parent_id is None:
+            continue
+        if _is_keyword_hit(doc):
+            known_parents[parent_id] = content
+        elif content not in group["children"]:
+            group["children"].append(content)
+
+    missing = [g["parent_id"] for g in groups if g["parent_id"] is not None and g["parent_id"] not in known_parents]
+    if missing:
+        try:
+            known_parents.update(get_parent_chunks(missing, agent_id=agent_id))
+        except Exception as e:
+            print(f"[WARN] Parent chunk fetch failed: {e}")
+
+    expanded: List[Dict[str, Any]] = []
+    used = 0
+    for group in groups:
+        # Mirrors format_context's per-document "[Document i]: " prefix.
+        overhead = len(f"[Document {len(expanded) + 1}]: ")
+        limit = min(doc_max_chars, max_chars - used - overhead)
+        if limit <= 0:
+            break
+        doc = group["doc"]
+        parent = known_parents.get(group["parent_id"]) if group["parent_id"] is not None else None
+        if parent:
+            content = _parent_window(parent, group["children"], limit)
+        else:
+            content = _doc_text(doc)[:limit]
+        if not content:
+            continue
+        metadata = dict(doc.get("metadata") or {})
+        if parent:
+            metadata.update({"parent_id": group["parent_id"], "child_hits": len(group["children"])})
+        expanded.append({"content": content, "metadata": metadata, "source": doc.get("source", "vector")})
+        used += overhead + len(content)
+
+    print(f"[retrieval] parent expansion {len(docs)} hits -> {len(expanded)} contexts ({used} chars)")
+    return expanded
+
+
 def _resolve_vector_docs(query: str, agent_id: Optional[str], limit_k: int) -> List[Any]:
     global _LAST_VECTOR_FAILURE_AT
     try:
@@ -167,6 +303,41 @@ def _resolve_vector_docs(query: str, agent_id: Optional[str], limit_k: int) -> L
         return []
 
 
+def _resolve_search_modes(use_hybrid: Optional[bool], rerank: Optional[bool]) -> tuple:
+    use_hybrid_search = (
+        os.getenv("USE_HYBRID_SEARCH", "true").lower() == "true"
+        if use_hybrid is None
+        else bool(use_hybrid)
+    )
+    use_reranker = (
+        os.getenv("USE_RERANKER", "false").lower() == "true"
+        if rerank is None
+        else bool(rerank)
+    )
+    return use_hybrid_search, use_reranker
+
+
+def _fuse_candidates(
+    vector_docs: List[Any],
+    keyword_docs: List[Dict[str, Any]],
+    use_hybrid_search: bool,
+) -> List[Any]:
+    print(f"[retrieval] candidates vector={len(vector_docs)} keyword={len(keyword_docs)}")
+
+    norm_vector = [
+        {
+            "content": doc.page_content,
+            "metadata": doc.metadata,
+            "source": "vector",
+        }
+        for doc in vector_docs
+    ]
+
+    if use_hybrid_search:
+        return reciprocal_rank_fusion({"vector": norm_vector, "keyword": keyword_docs})
+    return norm_vector if norm_vector else keyword_docs
+
+
 def hybrid_search(
     query: str,
     agent_id: str = None,
@@ -174,23 +345,17 @@ def hybrid_search(
     use_hybrid: Optional[bool] = None,
     rerank: Optional[bool] = None,
     reranker_model: Optional[str] = None,
+    expand_parents: Optional[bool] = None,
 ) -> List[Any]:
     """
     Main retrieval entry point.
 
     - use_hybrid=True: Vector + keyword in parallel, fused by RRF.
     - use_hybrid=False: Vector-only retrieval, with keyword fallback if vector is empty.
+    - expand_parents: Swap child hits for their deduplicated parent chunks
+      (default USE_PARENT_EXPANSION).
     """
-    use_hybrid_search = (
-        os.getenv("USE_HYBRID_SEARCH", "true").lower() == "true"
-        if use_hybrid is None
-        else bool(use_hybrid)
-    )
-    use_reranker = (
-        os.getenv("USE_RERANKER", "false").lower() == "true"
-        if rerank is None
-        else bool(rerank)
-    )
+    use_hybrid_search, use_reranker = _resolve_search_modes(use_hybrid, rerank)
 
     mode_label = "hybrid" if use_hybrid_search else "vector-only"
     print(f"[retrieval] {mode_label} query: {query!r}")
@@ -199,24 +364,25 @@ def hybrid_search(
     keyword_docs: List[Dict[str, Any]] = []
 
     if use_hybrid_search:
-        with ThreadPoolExecutor(max_workers=2) as pool:
-            fut_vector = pool.submit(_resolve_vector_docs, query, agent_id, top_k * 2)
-            fut_keyword = pool.submit(keyword_search, query, agent_id, top_k * 2)
-
-            try:
-                vector_docs = fut_vector.result(timeout=15)
-            except FutureTimeoutError:
-                print("[WARN] Vector search timed out")
-                vector_docs = []
-            except Exception as e:
-                print(f"[WARN] Vector search failed: {e}")
-                vector_docs = []
-
-            try:
-                keyword_docs = fut_keyword.result(timeout=15)
-            except Exception as e:
-                print(f"[WARN] Keyword search failed: {e}")
-                keyword_docs = []
+        # Shared bounded pool; legs inherit the turn's embedding scope.
+        pool = get_retrieval_executor()
+        fut_vector = submit_with_context(pool, _resolve_vector_docs, query, agent_id, top_k * 2)
+        fut_keyword = submit_with_context(pool, keyword_search, query, agent_id, top_k * 2)
+
+        try:
+            vector_docs = fut_vector.result(timeout=15)
+        except FutureTimeoutError:
+            print("[WARN] Vector search timed out")
+            vector_docs = []
+        except Exception as e:
+            print(f"[WARN] Vector search failed: {e}")
+            vector_docs = []
+
+        try:
+            keyword_docs = fut_keyword.result(timeout=15)
+        except Exception as e:
+            print(f"[WARN] Keyword search failed: {e}")
+            keyword_docs = []
     else:
         vector_docs = _resolve_vector_docs(query, agent_id, top_k * 2)
         if not vector_docs:
@@ -224,26 +390,82 @@ def hybrid_search(
             if keyword_docs:
                 print("[retrieval] vector-empty fallback to keyword search")
 
-    print(f"[retrieval] candidates vector={len(vector_docs)} keyword={len(keyword_docs)}")
+    all_docs = _fuse_candidates(vector_docs, keyword_docs, use_hybrid_search)
+    expand = _parent_expansion_enabled(expand_parents)
+    # Expansion dedupes by parent, so it needs the full ranking to fill top_k.
+    keep = len(all_docs) if expand else top_k
 
-    norm_vector = [
-        {
-            "content": doc.page_content,
-            "metadata": doc.metadata,
-            "source": "vector",
-        }
-        for doc in vector_docs
-    ]
+    if use_reranker:
+        print("[retrieval] reranker enabled")
+        ranked = rerank_documents(query, all_docs, top_n=keep, reranker_model=reranker_model)
+    else:
+        print("[retrieval] reranker disabled")
+        ranked = all_docs[:keep]
 
+    if expand:
+        return expand_to_parents(ranked, agent_id=agent_id, top_k=top_k)
+    return ranked
+
+
+async def _await_leg(coro, label: str, timeout: float = 15.0) -> List[Any]:
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"[WARN] {label} search timed out")
+    except Exception as e:
+        print(f"[WARN] {label} search failed: {e}")
+    return []
+
+
+async def ahybrid_search(
+    query: str,
+    agent_id: str = None,
+    top_k: int = 5,
+    use_hybrid: Optional[bool] = None,
+    rerank: Optional[bool] = None,
+    reranker_model: Optional[str] = None,
+    expand_parents: Optional[bool] = None,
+) -> List[Any]:
+    """
+    Async hybrid_search for event-loop callers.
+
+    Vector and keyword legs run concurrently on the bounded retrieval pool;
+    the cross-encoder pass is batched by the shared reranker service.
+    """
+    from ..offload import run_retrieval
+
+    use_hybrid_search, use_reranker = _resolve_search_modes(use_hybrid, rerank)
+
+    mode_label = "hybrid" if use_hybrid_search else "vector-only"
+    print(f"[retrieval] {mode_label} query: {query!r}")
+
+    keyword_docs: List[Dict[str, Any]] = []
     if use_hybrid_search:
-        all_docs = reciprocal_rank_fusion({"vector": norm_vector, "keyword": keyword_docs})
+        vector_docs, keyword_docs = await asyncio.gather(
+            _await_leg(run_retrieval(_resolve_vector_docs, query, agent_id, top_k * 2), "Vector"),
+            _await_leg(run_retrieval(keyword_search, query, agent_id, top_k * 2), "Keyword"),
+        )
     else:
-        all_docs = norm_vector if norm_vector else keyword_docs
+        vector_docs = await run_retrieval(_resolve_vector_docs, query, agent_id, top_k * 2)
+        if not vector_docs:
+            keyword_docs = await run_retrieval(keyword_search, query, agent_id, top_k * 2)
+            if keyword_docs:
+                print("[retrieval] vector-empty fallback to keyword search")
+
+    all_docs = _fuse_candidates(vector_docs, keyword_docs, use_hybrid_search)
+    expand = _parent_expansion_enabled(expand_parents)
+    keep = len(all_docs) if expand else top_k
 
     if use_reranker:
         print("[retrieval] reranker enabled")
-        return rerank_documents(query, all_docs, top_n=top_k, reranker_model=reranker_model)
-
-    print("[retrieval] reranker disabled")
-    return all_docs[:top_k]
+        # Inference happens on the reranker batcher thread; this only waits for scores.
+        ranked = await run_retrieval(
+            rerank_documents, query, all_docs, top_n=keep, reranker_model=reranker_model
+        )
+    else:
+        print("[retrieval] reranker disabled")
+        ranked = all_docs[:keep]
 
+    if expand:
+        return await run_retrieval(expand_to_parents, ranked, agent_id, top_k)
+    return ranked
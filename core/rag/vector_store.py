@@ -1,13 +1,35 @@
 """
 Vector Store Operations with pgvector
+
+Searches go through a per-agent handle registry: the PGVector instance
+(bound to the shared engine/pool) and its collection UUID are resolved once
+and reused, so a query is a single statement against langchain_pg_embedding
+instead of engine creation + extension/table/collection checks every time.
+Handles are dropped on vector store deletion and on agent invalidation
+(local or via the agent-cache LISTEN/NOTIFY path).
 """
-from typing import List
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document as LCDocument
 from langchain_postgres import PGVector
-from .embeddings import get_embeddings
-from ..config import DATABASE_URL
+from sqlalchemy import text
+
+from .embeddings import embed_query_cached, get_ingest_embeddings
+from ..agent_cache import agent_cache
 from ..database import engine as shared_engine
 
 
+def _ingest_vector_batch() -> int:
+    try:
+        return max(1, int(os.getenv("INGEST_VECTOR_BATCH", "256")))
+    except (ValueError, TypeError):
+        return 256
+
+
 def get_collection_name(agent_id: str = None) -> str:
     """Get collection name for agent"""
     if agent_id:
@@ -15,35 +37,114 @@ def get_collection_name(agent_id: str = None) -> str:
     return "omni_default"
 
 
-def create_vector_store(text_chunks: List[str], agent_id: str = None, metadatas: List[dict] = None):
-    """Create vector store from text chunks"""
-    embeddings = get_embeddings()
+def create_vector_store(
+    text_chunks: List[str],
+    agent_id: str = None,
+    metadatas: List[dict] = None,
+    on_batch: Optional[Callable[[int, int], None]] = None,
+):
+    """Create vector store from text chunks
+
+    With on_batch, chunks are written in INGEST_VECTOR_BATCH slices and
+    on_batch(done, total) runs after each one (progress / cancellation point).
+    """
     collection = get_collection_name(agent_id)
+    handle = get_retrieval_handle(agent_id)
+    if on_batch is None:
+        handle.store.add_texts(texts=text_chunks, metadatas=metadatas)
+    else:
+        step = _ingest_vector_batch()
+        total = len(text_chunks)
+        for start in range(0, total, step):
+            end = min(total, start + step)
+            handle.store.add_texts(
+                texts=text_chunks[start:end],
+                metadatas=metadatas[start:end] if metadatas else None,
+            )
+            on_batch(end, total)
+    if handle.collection_uuid is None:
+        _resolve_collection_uuid(handle)
     
-    PGVector.from_texts(
-        texts=text_chunks,
-        embedding=embeddings,
+    print(f"✅ Vector store created: {collection} ({len(text_chunks)} chunks)")
+
+
+@dataclass
+class RetrievalHandle:
+    """Long-lived per-agent search state."""
+    store: PGVector
+    collection_name: str
+    collection_uuid: Optional[str]
+    created_at: float
+
+
+_HANDLES: Dict[str, RetrievalHandle] = {}
+_HANDLES_LOCK = threading.Lock()
+_EXTENSION_READY = False
+
+# Compiled once and reused for every search (SQLAlchemy statement cache).
+_SEARCH_SQL = text("""
+    SELECT e.id, e.document, e.cmetadata
+    FROM langchain_pg_embedding e
+    WHERE e.collection_id = :collection_id
+    ORDER BY e.embedding <=> :q_vec
+    LIMIT :k
+""")
+
+
+def _build_handle(agent_id: Optional[str]) -> RetrievalHandle:
+    global _EXTENSION_READY
+    collection = get_collection_name(agent_id)
+    store = PGVector(
+        # Document embeds go through the broker's low-priority ingest lane.
+        embeddings=get_ingest_embeddings(),
         collection_name=collection,
-        connection=DATABASE_URL,
-        metadatas=metadatas,
-        pre_delete_collection=False
+        connection=shared_engine,
+        create_extension=not _EXTENSION_READY,
     )
-    
-    print(f"✅ Vector store created: {collection} ({len(text_chunks)} chunks)")
+    _EXTENSION_READY = True
+    handle = RetrievalHandle(store, collection, None, time.monotonic())
+    _resolve_collection_uuid(handle)
+    return handle
+
+
+def _resolve_collection_uuid(handle: RetrievalHandle) -> Optional[str]:
+    with handle.store._make_sync_session() as session:
+        found = handle.store.get_collection(session)
+        handle.collection_uuid = str(found.uuid) if found is not None else None
+    return handle.collection_uuid
+
+
+def get_retrieval_handle(agent_id: str = None) -> RetrievalHandle:
+    """Return the cached handle for an agent, creating it on first use."""
+    key = get_collection_name(agent_id)
+    handle = _HANDLES.get(key)
+    if handle is not None:
+        return handle
+    with _HANDLES_LOCK:
+        handle = _HANDLES.get(key)
+        if handle is None:
+            handle = _build_handle(agent_id)
+            _HANDLES[key] = handle
+    return handle
+
+
+def evict_retrieval_handle(agent_id: Optional[str] = None) -> None:
+    """Drop one agent's handle (or all handles when agent_id is None)."""
+    with _HANDLES_LOCK:
+        if agent_id is None:
+            _HANDLES.clear()
+        else:
+            _HANDLES.pop(get_collection_name(agent_id), None)
+
+
+# Agent deletes/updates (this worker or others via NOTIFY) drop stale handles.
+agent_cache.add_invalidation_listener(evict_retrieval_handle)
 
 
 def load_vector_store(agent_id: str = None):
-    """Load existing vector store"""
-    embeddings = get_embeddings()
-    collection = get_collection_name(agent_id)
-    
+    """Load existing vector store (shared, long-lived instance)"""
     try:
-        store = PGVector(
-            embeddings=embeddings,
-            collection_name=collection,
-            connection=DATABASE_URL
-        )
-        return store
+        return get_retrieval_handle(agent_id).store
     except Exception as e:
         raise FileNotFoundError(
             f"Vector store not found for agent. Upload documents first."
@@ -52,21 +153,35 @@ def load_vector_store(agent_id: str = None):
 
 def search_documents(query: str, agent_id: str = None, k: int = 4) -> List:
     """Search for similar documents"""
-    store = load_vector_store(agent_id)
-    return store.similarity_search(query, k=k)
+    try:
+        handle = get_retrieval_handle(agent_id)
+    except Exception:
+        raise FileNotFoundError(
+            f"Vector store not found for agent. Upload documents first."
+        )
+    # Collections created by another path/worker since the handle was built.
+    if handle.collection_uuid is None and _resolve_collection_uuid(handle) is None:
+        return []
+
+    # Reuse the turn's query vector (shared with the semantic cache probe).
+    q_vec = embed_query_cached(query)
+    with shared_engine.connect() as conn:
+        rows = conn.execute(
+            _SEARCH_SQL,
+            {"collection_id": handle.collection_uuid, "q_vec": str(list(q_vec)), "k": int(k)},
+        ).fetchall()
+    return [
+        LCDocument(id=str(row.id), page_content=row.document, metadata=row.cmetadata or {})
+        for row in rows
+    ]
 
 
 def delete_vector_store(agent_id: str) -> bool:
     """Delete vector store for an agent"""
     try:
-        embeddings = get_embeddings()
         collection = get_collection_name(agent_id)
-        store = PGVector(
-            embeddings=embeddings,
-            collection_name=collection,
-            connection=DATABASE_URL
-        )
-        store.delete_collection()
+        get_retrieval_handle(agent_id).store.delete_collection()
+        evict_retrieval_handle(agent_id)
         print(f"✅ Deleted vector store: {collection}")
         return True
     except Exception as e:
@@ -29,13 +29,14 @@ CANONICAL_MEDIA_RE = re.compile(r"\[(image|video|document)\]\[([^\]]+)\]", re.IG
 FALLBACK_MEDIA_RE = re.compile(r"\[(image|video|document)\]\s*(?!\[)([^\s\]\r\n]+)", re.IGNORECASE)
 
 
-def parse_response(answer: str, agent_id: str = None) -> List[Dict[str, Any]]:
+def parse_response(answer: str, agent_id: str = None, agent: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """Parse tagged LLM output into ordered structured parts."""
     answer = enforce_canonical_media_tags(answer)
     if not answer:
         return [{"type": "text", "content": ""}]
 
-    agent = get_agent(agent_id) if agent_id else None
+    if agent is None and agent_id:
+        agent = get_agent(agent_id)
     parts: List[Dict[str, Any]] = []
 
     cursor = 0
@@ -153,13 +154,14 @@ def parse_response(answer: str, agent_id: str = None) -> List[Dict[str, Any]]:
     return parts
 
 
-def process_rich_response_for_frontend(answer: str, agent_id: str = None) -> str:
+def process_rich_response_for_frontend(answer: str, agent_id: str = None, agent: Optional[Dict[str, Any]] = None) -> str:
     """Convert tags into web-friendly markdown-like output."""
     answer = enforce_canonical_media_tags(answer)
     if not answer:
         return ""
 
-    agent = get_agent(agent_id) if agent_id else None
+    if agent is None and agent_id:
+        agent = get_agent(agent_id)
     processed = answer
 
     def image_sub(match: re.Match[str]) -> str:
@@ -222,6 +224,42 @@ def enforce_canonical_media_tags(answer: str) -> str:
     return normalized
 
 
+class MediaTagStream:
+    """
+    enforce_canonical_media_tags for streamed answers.
+
+    Plain text passes straight through. From the first "[" of a line the
+    text is held until the line ends (tags sit on their own line), so a tag
+    is always normalized, and converted by callers, as a whole. A held run
+    longer than max_hold chars is released as-is.
+    """
+
+    def __init__(self, max_hold: int = 512):
+        self.max_hold = max_hold
+        self._pending = ""
+
+    def feed(self, delta: str) -> str:
+        self._pending += delta
+        ready = ""
+        newline = self._pending.rfind("\n")
+        if newline >= 0:
+            ready, self._pending = self._pending[: newline + 1], self._pending[newline + 1:]
+        bracket = self._pending.find("[")
+        if bracket < 0 or len(self._pending) > self.max_hold:
+            ready, self._pending = ready + self._pending, ""
+        else:
+            ready, self._pending = ready + self._pending[:bracket], self._pending[bracket:]
+        return _normalize_segment(ready)
+
+    def finish(self) -> str:
+        ready, self._pending = self._pending, ""
+        return _normalize_segment(ready)
+
+
+def _normalize_segment(text: str) -> str:
+    return enforce_canonical_media_tags(text) if "[" in text else text
+
+
 def _extract_tag_value(match: re.Match[str]) -> str:
     """Return first non-empty captured value from tolerant tag regex."""
     for group in match.groups():
@@ -0,0 +1,66 @@
+"""
+Text safety engine shared by PII masking and the input/output guardrails.
+
+Each rule set is compiled once into a single alternation of named groups,
+so a message is scanned in one pass however many rules there are (instead
+of one re.sub / substring check per rule). At any position the rules are
+tried in declaration order, which keeps the old sequential priority.
+
+Every match is counted per rule in omnicortex_safety_rule_hits_total.
+"""
+from __future__ import annotations
+
+import re
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .monitoring import SAFETY_RULE_HITS
+
+
+class RuleSet:
+    """Named regex rules matched together in one scan."""
+
+    def __init__(self, kind: str, rules: Dict[str, str], flags: int = 0):
+        if not rules:
+            raise ValueError(f"Rule set '{kind}' has no rules")
+        self.kind = kind
+        self.names: Tuple[str, ...] = tuple(rules)
+        self.pattern = re.compile(
+            "|".join(f"(?P<r{i}>{pattern})" for i, pattern in enumerate(rules.values())),
+            flags,
+        )
+
+    @classmethod
+    def from_phrases(cls, kind: str, phrases: Iterable[str]) -> "RuleSet":
+        """Literal, case-insensitive phrases; each phrase is its own rule."""
+        return cls(kind, {phrase: re.escape(phrase) for phrase in phrases}, re.IGNORECASE)
+
+    def rule(self, match: "re.Match[str]") -> str:
+        # Rule groups are the outermost ones, so they close last.
+        return self.names[int(match.lastgroup[1:])]
+
+    def _count(self, rule: str, hits: int = 1) -> None:
+        SAFETY_RULE_HITS.labels(kind=self.kind, rule=rule).inc(hits)
+
+    def search(self, text: str) -> Optional[str]:
+        """Name of the rule with the leftmost match, or None."""
+        match = self.pattern.search(text)
+        if match is None:
+            return None
+        rule = self.rule(match)
+        self._count(rule)
+        return rule
+
+    def sub(self, text: str, replace: Callable[[str, str], str]) -> str:
+        """Replace every match in one pass; replace(rule, matched_text) gives the substitute."""
+        hits: Counter = Counter()
+
+        def _replace(match: "re.Match[str]") -> str:
+            rule = self.rule(match)
+            hits[rule] += 1
+            return replace(rule, match.group())
+
+        result = self.pattern.sub(_replace, text)
+        for rule, count in hits.items():
+            self._count(rule, count)
+        return result
@@ -0,0 +1,145 @@
+"""
+Prefix-cache hit rates scraped from the vLLM backends' /metrics endpoint.
+
+vLLM counts prompt tokens looked up in (and served from) its automatic prefix
+cache. Every backend that core.llm_gateway talks to is watched by one daemon
+thread that polls ``<base_url without /v1>/metrics`` every
+VLLM_METRICS_INTERVAL seconds (0 disables) and exports:
+
+- omnicortex_llm_prefix_cache_tokens_total{backend, result=hit|miss}
+- omnicortex_llm_prefix_cache_hit_rate{backend} over the last interval
+
+Both the V1 counters (vllm:prefix_cache_queries / _hits) and the older V0
+gauge (vllm:gpu_prefix_cache_hit_rate) are understood. Backends without a
+Prometheus endpoint (hosted OpenAI-compatible APIs) are dropped after the
+first 404.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from .monitoring import LLM_PREFIX_CACHE_HIT_RATE, LLM_PREFIX_CACHE_TOKENS
+
+_QUERY_FAMILIES = ("vllm:prefix_cache_queries", "vllm:gpu_prefix_cache_queries")
+_HIT_FAMILIES = ("vllm:prefix_cache_hits", "vllm:gpu_prefix_cache_hits")
+_RATE_GAUGE = "vllm:gpu_prefix_cache_hit_rate"
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _scrape_interval() -> float:
+    return max(0.0, _env_float("VLLM_METRICS_INTERVAL", 30.0))
+
+
+def metrics_url(base_url: str) -> str:
+    root = base_url.rstrip("/")
+    if root.endswith("/v1"):
+        root = root[: -len("/v1")]
+    return root + "/metrics"
+
+
+def parse_prefix_cache(text: str) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """(queries, hits, hit_rate) from a Prometheus exposition, summed over engines."""
+    queries = hits = rate = None
+    # Matched on sample names: depending on the parser version the "_total"
+    # samples land in the typed family or in one of their own.
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == _RATE_GAUGE:
+                rate = sample.value if rate is None else max(rate, sample.value)
+                continue
+            if not sample.name.endswith("_total"):
+                continue
+            base = sample.name[: -len("_total")]
+            if base in _QUERY_FAMILIES:
+                queries = (queries or 0.0) + sample.value
+            elif base in _HIT_FAMILIES:
+                hits = (hits or 0.0) + sample.value
+    return queries, hits, rate
+
+
+class _Watched:
+    __slots__ = ("queries", "hits")
+
+    def __init__(self):
+        self.queries: Optional[float] = None
+        self.hits: Optional[float] = None
+
+
+_WATCHED: Dict[str, _Watched] = {}
+_WATCH_LOCK = threading.Lock()
+_SCRAPER_STARTED = False
+
+
+def scrape(base_url: str, client: Optional[httpx.Client] = None) -> Optional[float]:
+    """
+    Poll one backend and update the prefix-cache metrics.
+    Returns the hit rate over the interval since the previous scrape (the
+    backend's lifetime rate on the first one), or None when unknown.
+    """
+    state = _WATCHED.setdefault(base_url, _Watched())
+    response = (client or httpx).get(metrics_url(base_url), timeout=5.0)
+    response.raise_for_status()
+    queries, hits, rate = parse_prefix_cache(response.text)
+
+    if queries is not None and hits is not None:
+        # A counter that went backwards means vLLM restarted.
+        restarted = state.queries is not None and queries < state.queries
+        prev_queries = 0.0 if state.queries is None or restarted else state.queries
+        prev_hits = 0.0 if state.hits is None or restarted else state.hits
+        first = state.queries is None
+        state.queries, state.hits = queries, hits
+        delta_queries = queries - prev_queries
+        delta_hits = max(0.0, min(hits - prev_hits, delta_queries))
+        if not first:
+            LLM_PREFIX_CACHE_TOKENS.labels(backend=base_url, result="hit").inc(delta_hits)
+            LLM_PREFIX_CACHE_TOKENS.labels(backend=base_url, result="miss").inc(delta_queries - delta_hits)
+        rate = delta_hits / delta_queries if delta_queries > 0 else None
+
+    if rate is not None:
+        LLM_PREFIX_CACHE_HIT_RATE.labels(backend=base_url).set(rate)
+    return rate
+
+
+def _scrape_worker() -> None:
+    with httpx.Client() as client:
+        while True:
+            time.sleep(_scrape_interval() or 30.0)
+            with _WATCH_LOCK:
+                urls = list(_WATCHED)
+            for base_url in urls:
+                try:
+                    scrape(base_url, client)
+                except httpx.HTTPStatusError as exc:
+                    if exc.response.status_code == 404:
+                        print(f"[WARN] No Prometheus metrics at {metrics_url(base_url)}; prefix-cache stats disabled for it")
+                        with _WATCH_LOCK:
+                            _WATCHED.pop(base_url, None)
+                except Exception:
+                    # Backend down or restarting; the next interval retries.
+                    pass
+
+
+def watch(base_url: str) -> None:
+    """Start scraping base_url (idempotent; no-op when VLLM_METRICS_INTERVAL=0)."""
+    global _SCRAPER_STARTED
+    if not base_url or not _scrape_interval():
+        return
+    with _WATCH_LOCK:
+        _WATCHED.setdefault(base_url, _Watched())
+        if _SCRAPER_STARTED:
+            return
+        thread = threading.Thread(target=_scrape_worker, name="vllm-metrics-scraper", daemon=True)
+        thread.start()
+        _SCRAPER_STARTED = True
@@ -6,7 +6,7 @@ Compared to process_question():
   - KEEP mask_pii()
   - SKIP _rule_based_agent_reply()    (voice model handles greetings)
   - SKIP check_cache() / save_to_cache() (ASR noise = unreliable cache)
-  - KEEP hybrid_search() + format_context() (RAG grounding is the point)
+  - KEEP hybrid_search() + plan_prompt() (RAG grounding is the point)
   - KEEP invoke_chain()
   - SKIP enforce_canonical_media_tags() + strip media tags
   - SKIP validate_output()            (don't block mid-speech)
@@ -20,10 +20,12 @@ import logging
 from typing import Dict, List, Optional
 
 from .agent_manager import get_agent, resolve_retrieval_config
-from .chat_service import format_context, format_history, estimate_tokens
+from .chat_service import estimate_tokens
 from .llm import invoke_chain
 from .processing.pii import mask_pii
+from .prompt_budget import plan_prompt
 from .rag.retrieval import hybrid_search
+from .rag.embeddings import with_query_embedding_scope
 from .database import save_message
 
 logger = logging.getLogger(__name__)
@@ -40,6 +42,7 @@ def _strip_media_tags(text: str) -> str:
     return _MEDIA_TAG_RE.sub("", text).strip()
 
 
+@with_query_embedding_scope
 def process_question_voice(
     question: str,
     agent_id: str = None,
@@ -67,8 +70,15 @@ def process_question_voice(
     query_tokens = estimate_tokens(question)
     rag_query_tokens = estimate_tokens(safe_question)
 
+    agent = None
+    if agent_id:
+        try:
+            agent = get_agent(agent_id)
+        except Exception as e:
+            logger.warning("Voice agent lookup failed (agent_id=%s): %s", agent_id, e)
+
     # RAG retrieval — use agent-level config if available
-    _ret_cfg = (resolve_retrieval_config(agent_id) if agent_id else None) or {}
+    _ret_cfg = (resolve_retrieval_config(agent_id, agent=agent) if agent_id else None) or {}
     _vk = _ret_cfg.get("voice_top_k", _ret_cfg.get("top_k", 2))
     _rerank = _ret_cfg.get("use_reranker")
     _reranker_model = _ret_cfg.get("reranker_model")
@@ -80,17 +90,16 @@ def process_question_voice(
         rerank=_rerank,
         reranker_model=_reranker_model,
     )
-    context = format_context(docs)
-    history = format_history(conversation_history or [], max_history)
+    plan = plan_prompt(
+        safe_question,
+        docs,
+        conversation_history,
+        max_messages=max_history,
+        model_key=model_selection,
+    )
+    context, history = plan.context, plan.history
 
-    agent_name = "default"
-    if agent_id:
-        try:
-            agent = get_agent(agent_id)
-            if agent:
-                agent_name = agent.get("name") or "default"
-        except Exception as e:
-            logger.warning("Voice agent lookup failed (agent_id=%s): %s", agent_id, e)
+    agent_name = (agent.get("name") if agent else None) or "default"
 
     # LLM invocation
     answer = invoke_chain(
@@ -1,5 +1,6 @@
 """
 Backfill agent YAML config snapshots for all existing agents.
+Also rebuilds each agent's usage counter row from omni_usage.
 
 Usage:
   source .venv/bin/activate
@@ -18,7 +19,7 @@ def main() -> None:
         if not agent_id:
             continue
         try:
-            sync_agent_config(agent_id, event_type="sync")
+            sync_agent_config(agent_id, event_type="sync", rebuild_usage=True)
             print(f"[OK] {agent_id}")
         except Exception as exc:
             print(f"[FAIL] {agent_id}: {exc}")
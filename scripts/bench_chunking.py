@@ -0,0 +1,118 @@
+"""
+Chunking throughput benchmark.
+
+Builds a synthetic document (mixed ASCII / multilingual / symbol-heavy text)
+and reports MB/s for:
+  - sanitize:  legacy per-character unicodedata loop vs core sanitize_text
+               (translate table)
+  - split:     legacy parent_child_split (splitters rebuilt per call, legacy
+               sanitizer) vs core parent_child_split (cached splitters)
+
+Usage:
+  python scripts/bench_chunking.py --mb 8
+  python scripts/bench_chunking.py --mb 2 --docs 200 --repeat 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import random
+import sys
+import time
+import unicodedata
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter  # noqa: E402
+
+from core.processing.chunking import parent_child_split, sanitize_text  # noqa: E402
+
+
+_LEGACY_REPLACEMENTS = {
+    '\u25cf': '*', '\u2022': '*', '\u2013': '-', '\u2014': '--',
+    '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"',
+    '\u2026': '...', '\u00a0': ' ', '\u200b': '', '\ufeff': '',
+}
+
+
+def legacy_sanitize(text: str) -> str:
+    for old, new in _LEGACY_REPLACEMENTS.items():
+        text = text.replace(old, new)
+    return "".join(
+        ch for ch in text
+        if (not unicodedata.category(ch).startswith("C")) or ch in "\n\r\t"
+    )
+
+
+def legacy_parent_child_split(text: str, parent_size=2000, child_size=400) -> List[tuple]:
+    text = legacy_sanitize(text)
+    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=parent_size, chunk_overlap=int(parent_size * 0.1))
+    child_splitter = RecursiveCharacterTextSplitter(chunk_size=child_size, chunk_overlap=int(child_size * 0.2))
+    return [
+        (child, parent)
+        for parent in parent_splitter.split_text(text)
+        for child in child_splitter.split_text(parent)
+    ]
+
+
+_WORDS = (
+    "policy refund shipping invoice customer account balance statement branch loan "
+    "interest premium claim नमस्ते खाता ग्राहक 账户 客户 余额 Überweisung Kündigung"
+).split()
+_SYMBOLS = ["\u2022 ", "\u2014", "\u201cquoted\u201d", "\u2026", "\u00a0", "\u200b", "\x0c", "\ufeff"]
+
+
+def make_document(size_bytes: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    parts: List[str] = []
+    total = 0
+    while total < size_bytes:
+        sentence = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 18)))
+        if rng.random() < 0.3:
+            sentence = rng.choice(_SYMBOLS) + sentence
+        sentence += rng.choice([". ", ". ", "? ", ".\n", ".\n\n"])
+        parts.append(sentence)
+        total += len(sentence.encode("utf-8"))
+    return "".join(parts)
+
+
+def _mb_per_s(fn: Callable[[str], object], docs: List[str], repeat: int) -> float:
+    size = sum(len(doc.encode("utf-8")) for doc in docs)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for doc in docs:
+                fn(doc)
+        best = min(best, time.perf_counter() - started)
+    return size / (1024 * 1024) / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=8.0, help="total text size")
+    parser.add_argument("--docs", type=int, default=50, help="split the text into this many documents")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    per_doc = int(args.mb * 1024 * 1024 / max(1, args.docs))
+    docs = [make_document(per_doc, seed=i) for i in range(args.docs)]
+    assert all(legacy_sanitize(doc) == sanitize_text(doc) for doc in docs[:3]), "sanitizer output differs"
+
+    print(f"{args.docs} documents, {args.mb:.1f} MB total")
+    print(f"{'stage':<12} {'legacy MB/s':>12} {'current MB/s':>13} {'speedup':>8}")
+    for label, legacy, current in (
+        ("sanitize", legacy_sanitize, sanitize_text),
+        ("split", legacy_parent_child_split, parent_child_split),
+    ):
+        before = _mb_per_s(legacy, docs, args.repeat)
+        after = _mb_per_s(current, docs, args.repeat)
+        print(f"{label:<12} {before:>12.2f} {after:>13.2f} {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Semantic cache lookup benchmark.
+
+Grows a scratch copy of omni_semantic_cache (same columns + indexes) in
+steps and, at each size, times:
+  - legacy:  WHERE 1 - (embedding <=> q) > threshold ... ORDER BY similarity
+  - nearest: core.cache.nearest_cached_answers (ORDER BY distance LIMIT k,
+             threshold applied to the candidates)
+
+The nearest-neighbour path should stay flat as the table grows; the legacy
+predicate scans every row in scope.
+
+Usage:
+  python scripts/bench_semantic_cache.py --sizes 10000,100000,1000000 --agents 50
+  python scripts/bench_semantic_cache.py --dim 256 --queries 200 --keep
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.cache import CACHE_THRESHOLD, CACHE_TTL, best_cached_answer, nearest_cached_answers  # noqa: E402
+from core.config import EMBEDDING_DIM  # noqa: E402
+from core.database import engine, SessionLocal, semantic_cache_index_statements  # noqa: E402
+
+
+BENCH_TABLE = "omni_semantic_cache_bench"
+
+LEGACY_SQL = f"""
+SELECT answer, 1 - (embedding <=> :q_vec) AS similarity
+FROM {BENCH_TABLE}
+WHERE 1 - (embedding <=> :q_vec) > :threshold
+  AND created_at > NOW() - make_interval(secs => :ttl_seconds)
+  AND (agent_id = :agent_id OR agent_id IS NULL)
+ORDER BY similarity DESC LIMIT 1
+"""
+
+
+def _random_unit(rng: np.random.Generator, rows: int, dim: int) -> np.ndarray:
+    vecs = rng.standard_normal((rows, dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs
+
+
+def _create_table(dim: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+        conn.execute(text(f"""
+            CREATE TABLE {BENCH_TABLE} (
+                id BIGSERIAL PRIMARY KEY,
+                question TEXT NOT NULL,
+                embedding vector({dim}),
+                answer TEXT NOT NULL,
+                agent_id VARCHAR,
+                hit_count INTEGER DEFAULT 1,
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                last_hit_at TIMESTAMPTZ
+            )
+        """))
+
+
+def _create_indexes() -> None:
+    with engine.begin() as conn:
+        for statement in semantic_cache_index_statements(table=BENCH_TABLE, prefix="idx_bench_cache"):
+            conn.execute(text(statement))
+        conn.execute(text(f"ANALYZE {BENCH_TABLE}"))
+
+
+def _copy_rows(vecs: np.ndarray, agents: List[str], start: int) -> None:
+    buf = io.StringIO()
+    for offset, vec in enumerate(vecs):
+        row_id = start + offset
+        agent = agents[row_id % len(agents)]
+        agent_field = "\\N" if agent is None else agent
+        vec_text = "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
+        buf.write(f"q{row_id}\t{vec_text}\ta{row_id}\t{agent_field}\n")
+    buf.seek(0)
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.copy_expert(
+                f"COPY {BENCH_TABLE} (question, embedding, answer, agent_id) FROM STDIN",
+                buf,
+            )
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def _time_queries(fn: Callable[[], None], count: int) -> List[float]:
+    samples = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples
+
+
+def _summary(samples: List[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    return f"p50={statistics.median(ordered):8.2f}ms  p95={p95:8.2f}ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark semantic cache lookup vs cache size.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated cumulative row counts")
+    parser.add_argument("--agents", type=int, default=50, help="Distinct agent ids (plus shared NULL rows)")
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=100, help="Timed lookups per size and mode")
+    parser.add_argument("--batch", type=int, default=20000, help="Rows per COPY batch")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the nearest-neighbour path")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch table afterwards")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    sizes = sorted(int(s) for s in args.sizes.split(",") if s.strip())
+    rng = np.random.default_rng(args.seed)
+    agents: List[str] = [f"bench-agent-{i}" for i in range(args.agents)] + [None]  # type: ignore[list-item]
+    queries = _random_unit(rng, args.queries, args.dim)
+
+    _create_table(args.dim)
+    # Build indexes up front so inserts pay the maintenance cost the live table pays.
+    _create_indexes()
+    loaded = 0
+    try:
+        for size in sizes:
+            while loaded < size:
+                step = min(args.batch, size - loaded)
+                _copy_rows(_random_unit(rng, step, args.dim), agents, loaded)
+                loaded += step
+            with engine.begin() as conn:
+                conn.execute(text(f"ANALYZE {BENCH_TABLE}"))
+
+            def run_nearest() -> None:
+                q = queries[random.randrange(len(queries))]
+                db = SessionLocal()
+                try:
+                    best_cached_answer(
+                        nearest_cached_answers(db, q.tolist(), random.choice(agents[:-1]), table=BENCH_TABLE)
+                    )
+                finally:
+                    db.close()
+
+            def run_legacy() -> None:
+                q = queries[random.randrange(len(queries))]
+                db = SessionLocal()
+                try:
+                    db.execute(text(LEGACY_SQL), {
+                        "q_vec": str(q.tolist()),
+                        "threshold": CACHE_THRESHOLD,
+                        "ttl_seconds": CACHE_TTL,
+                        "agent_id": random.choice(agents[:-1]),
+                    }).fetchone()
+                finally:
+                    db.close()
+
+            run_nearest()  # warm caches/plans
+            line = f"rows={loaded:>10,}  nearest {_summary(_time_queries(run_nearest, args.queries))}"
+            if not args.skip_legacy:
+                run_legacy()
+                line += f"  | legacy {_summary(_time_queries(run_legacy, args.queries))}"
+            print(line, flush=True)
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
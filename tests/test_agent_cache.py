@@ -0,0 +1,46 @@
+from core.agent_cache import AgentConfigCache
+
+
+def test_agent_cache_serves_hits_until_invalidated():
+    cache = AgentConfigCache()
+    loads = []
+
+    def loader(agent_id):
+        loads.append(agent_id)
+        return {"id": agent_id, "name": f"agent-{len(loads)}"}
+
+    assert cache.get("a1", loader)["name"] == "agent-1"
+    assert cache.get("a1", loader)["name"] == "agent-1"
+    assert loads == ["a1"]
+
+    cache.invalidate("a1")
+    assert cache.get("a1", loader)["name"] == "agent-2"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_agent_cache_discards_load_that_raced_an_invalidation():
+    cache = AgentConfigCache()
+
+    def stale_loader(agent_id):
+        # Simulates an update committing while the old row is being read.
+        cache.invalidate(agent_id)
+        return {"id": agent_id, "name": "stale"}
+
+    assert cache.get("a1", stale_loader)["name"] == "stale"
+    assert cache.get("a1", lambda agent_id: {"id": agent_id, "name": "fresh"})["name"] == "fresh"
+
+
+def test_agent_cache_returns_copies_and_skips_missing_agents():
+    cache = AgentConfigCache()
+    first = cache.get("a1", lambda agent_id: {"id": agent_id, "name": "one", "image_urls": ["a.png"]})
+    first["name"] = "mutated"
+    first["image_urls"].append("injected.png")
+    second = cache.get("a1", lambda agent_id: None)
+    assert second["name"] == "one"
+    assert second["image_urls"] == ["a.png"]
+    second["image_urls"].clear()
+    assert cache.get("a1", lambda agent_id: None)["image_urls"] == ["a.png"]
+
+    assert cache.get("missing", lambda agent_id: None) is None
+    assert cache.stats()["entries"] == 1
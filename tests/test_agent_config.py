@@ -0,0 +1,43 @@
+import core.agent_config as agent_config
+
+
+def _reset_pending(monkeypatch):
+    monkeypatch.setattr(agent_config, "_PENDING_USAGE", {})
+    monkeypatch.setattr(agent_config, "_start_materializer_once", lambda: None)
+
+
+def test_flush_coalesces_usage_into_one_write_per_agent(monkeypatch):
+    _reset_pending(monkeypatch)
+    applied = []
+    synced = []
+    monkeypatch.setattr(agent_config, "increment_usage_totals", lambda batch: applied.append(batch))
+    monkeypatch.setattr(agent_config, "sync_agent_config", lambda agent_id: synced.append(agent_id))
+
+    for _ in range(3):
+        agent_config.record_usage("a1", prompt_tokens=10, completion_tokens=5, query_tokens=2)
+    agent_config.record_usage("a2", prompt_tokens=1)
+
+    assert agent_config.flush_agent_usage() == 2
+    assert applied[0]["a1"]["total_input_tokens"] == 30
+    assert applied[0]["a1"]["total_output_tokens"] == 15
+    assert applied[0]["a1"]["total_query_tokens"] == 6
+    assert sorted(synced) == ["a1", "a2"]
+    assert agent_config.flush_agent_usage() == 0
+
+
+def test_flush_requeues_deltas_when_counter_update_fails(monkeypatch):
+    _reset_pending(monkeypatch)
+
+    def failing(batch):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(agent_config, "increment_usage_totals", failing)
+    agent_config.record_usage("a1", prompt_tokens=7)
+    assert agent_config.flush_agent_usage() == 0
+
+    agent_config.record_usage("a1", prompt_tokens=3)
+    applied = []
+    monkeypatch.setattr(agent_config, "increment_usage_totals", lambda batch: applied.append(batch))
+    monkeypatch.setattr(agent_config, "sync_agent_config", lambda agent_id: None)
+    assert agent_config.flush_agent_usage() == 1
+    assert applied[0]["a1"]["total_input_tokens"] == 10
@@ -0,0 +1,89 @@
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import core.auth as auth
+
+
+def _jwt(exp: float) -> str:
+    def seg(data):
+        raw = json.dumps(data).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    return f"{seg({'alg': 'none'})}.{seg({'sub': 'u1', 'exp': exp})}.sig"
+
+
+def _install_upstream(monkeypatch, status_code=200, delay=0.0):
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.headers.get("authorization"))
+        if delay:
+            await asyncio.sleep(delay)
+        return httpx.Response(status_code, json={"id": "u1"})
+
+    monkeypatch.setenv("AUTH_VERIFY_URL", "http://auth.test/me")
+    monkeypatch.setattr(auth, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    auth.clear_token_cache()
+    return calls
+
+
+def test_concurrent_verifications_share_one_upstream_call(monkeypatch):
+    calls = _install_upstream(monkeypatch, delay=0.05)
+
+    async def scenario():
+        results = await asyncio.gather(*(auth.verify_bearer_token("tok-a") for _ in range(5)))
+        again = await auth.verify_bearer_token("tok-a")
+        return results, again
+
+    results, again = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(r["profile"] == {"id": "u1"} for r in results)
+    assert again["token"] == "tok-a"
+
+
+def test_rejected_token_is_negatively_cached(monkeypatch):
+    calls = _install_upstream(monkeypatch, status_code=401)
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(HTTPException) as exc:
+                await auth.verify_bearer_token("bad")
+            assert exc.value.status_code == 403
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+
+
+def test_expired_jwt_is_not_cached(monkeypatch):
+    calls = _install_upstream(monkeypatch)
+    expired = _jwt(time.time() - 10)
+    live = _jwt(time.time() + 3600)
+
+    async def scenario():
+        await auth.verify_bearer_token(expired)
+        await auth.verify_bearer_token(expired)
+        await auth.verify_bearer_token(live)
+        await auth.verify_bearer_token(live)
+
+    asyncio.run(scenario())
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("status_code", [503, 429])
+def test_upstream_outage_is_not_cached(monkeypatch, status_code):
+    calls = _install_upstream(monkeypatch, status_code=status_code)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                await auth.verify_bearer_token("tok-b")
+            assert exc.value.status_code == 503
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
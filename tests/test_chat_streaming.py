@@ -0,0 +1,223 @@
+import asyncio
+
+from langchain_core.messages import AIMessageChunk
+
+import core.chat_service as chat_service
+import core.llm as llm
+import core.offload as offload
+import core.prompt_budget as budget
+from core.guardrails import OutputStreamGuard
+from core.response_parser import MediaTagStream
+
+
+def _drain(stream, deltas):
+    return [stream.feed(delta) for delta in deltas] + [stream.finish()]
+
+
+def test_guard_never_releases_a_key_split_across_deltas():
+    guard = OutputStreamGuard()
+    released = _drain(guard, ["Your key is s", "k-abcdefghij", "klmnopqrstuvwxyz", " done"])
+
+    assert "".join(released) == "Your key is "
+    assert guard.blocked_reason == "Potential API Key leakage detected"
+
+
+def test_guard_releases_harmless_text_once_decided():
+    guard = OutputStreamGuard()
+    released = _drain(guard, ["Ask", " about sk-", "12 plans"])
+
+    assert released[0] == "A"
+    assert "".join(released) == "Ask about sk-12 plans"
+    assert guard.blocked_reason is None
+
+
+def test_media_tags_are_held_until_whole_and_normalized():
+    tags = MediaTagStream()
+    released = _drain(tags, ["Here it is.\n[ima", "ge]photo", ".png\nMore", " text"])
+
+    assert released[0] == "Here it is.\n"
+    assert released[1] == ""
+    assert released[2] == "[image][photo.png]\nMore"
+    assert "".join(released) == "Here it is.\n[image][photo.png]\nMore text"
+
+
+class _FakeChain:
+    def __init__(self, pieces, usage):
+        self.pieces = pieces
+        self.usage = usage
+
+    async def astream(self, inputs):
+        for piece in self.pieces:
+            yield AIMessageChunk(content=piece)
+        yield AIMessageChunk(content="", usage_metadata=self.usage)
+
+
+def _run_sync(executor, func, *args, **kwargs):
+    func(*args, **kwargs)
+
+
+def test_astream_chain_yields_deltas_and_records_usage_once(monkeypatch):
+    usage = {"input_tokens": 120, "output_tokens": 3, "total_tokens": 123}
+    recorded = []
+    monkeypatch.setattr(llm, "get_qa_chain", lambda model_key=None, base_url=None: _FakeChain(["Hel", "lo", "!"], usage))
+    monkeypatch.setattr(llm, "_record_usage", lambda msg, latency, **kw: recorded.append(msg))
+    monkeypatch.setattr(offload, "submit_with_context", _run_sync)
+
+    async def consume():
+        return [delta async for delta in llm.astream_chain("q", "ctx", "", agent_id="a1")]
+
+    assert asyncio.run(consume()) == ["Hel", "lo", "!"]
+    assert len(recorded) == 1
+    assert recorded[0].content == "Hello!"
+    assert recorded[0].usage_metadata["output_tokens"] == 3
+
+
+def test_astream_chain_estimates_usage_when_client_leaves_early(monkeypatch):
+    recorded = []
+    monkeypatch.setenv("PROMPT_TOKENIZER", "heuristic")
+    monkeypatch.setattr(llm, "get_qa_chain", lambda model_key=None, base_url=None: _FakeChain(["a" * 40, "b" * 40], None))
+    monkeypatch.setattr(llm, "_record_usage", lambda msg, latency, **kw: recorded.append(msg))
+    monkeypatch.setattr(offload, "submit_with_context", _run_sync)
+
+    async def first_only():
+        stream = llm.astream_chain("q", "ctx", "", agent_id="a1")
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(first_only()) == "a" * 40
+    assert len(recorded) == 1
+    assert recorded[0].usage_metadata["output_tokens"] == 10
+    prompt = "\n\n".join(m.content for m in llm.QA_PROMPT.format_messages(**llm._chain_inputs("q", "ctx", "", "")))
+    assert recorded[0].usage_metadata["input_tokens"] == budget.count_tokens(prompt)
+
+
+def test_astream_question_streams_and_persists_final_answer(monkeypatch):
+    saved = []
+
+    async def fake_prepare(*args):
+        return {"safe_question": "hi?", "llm_args": ("hi?", "ctx", ""), "llm_kwargs": {}}
+
+    async def fake_stream(*args, **kwargs):
+        for piece in ["See ", "below\n[document]", "guide.pdf\n", "Thanks"]:
+            yield piece
+
+    async def fake_save(role, content, agent_id=None):
+        saved.append((role, content))
+
+    monkeypatch.setattr(chat_service, "_aprepare_turn", fake_prepare)
+    monkeypatch.setattr(chat_service, "astream_chain", fake_stream)
+    monkeypatch.setattr(chat_service, "asave_message", fake_save)
+    monkeypatch.setattr(chat_service, "save_to_cache", lambda *args: None)
+    monkeypatch.setattr(chat_service, "_log_chat_event", lambda *args: None)
+
+    async def consume():
+        return [event async for event in chat_service.astream_question("hi?", agent_id="a1")]
+
+    events = asyncio.run(consume())
+    deltas = [e["content"] for e in events if e["type"] == "delta"]
+
+    assert deltas[0] == "See "
+    assert "[document][guide.pdf]\n" in deltas
+    assert events[-1] == {"type": "done", "answer": "See below\n[document][guide.pdf]\nThanks", "status": "success"}
+    assert saved == [("user", "hi?"), ("assistant", "See below\n[document][guide.pdf]\nThanks")]
+
+
+def test_astream_question_blocks_mid_stream(monkeypatch):
+    saved = []
+
+    async def fake_prepare(*args):
+        return {"safe_question": "key?", "llm_args": ("key?", "ctx", ""), "llm_kwargs": {}}
+
+    async def fake_stream(*args, **kwargs):
+        for piece in ["Sure: ", "sk-" + "a" * 24, " more"]:
+            yield piece
+
+    async def fake_save(role, content, agent_id=None):
+        saved.append((role, content))
+
+    monkeypatch.setattr(chat_service, "_aprepare_turn", fake_prepare)
+    monkeypatch.setattr(chat_service, "astream_chain", fake_stream)
+    monkeypatch.setattr(chat_service, "asave_message", fake_save)
+    monkeypatch.setattr(chat_service, "save_to_cache", lambda *args: None)
+    monkeypatch.setattr(chat_service, "_log_chat_event", lambda *args: None)
+
+    async def consume():
+        return [event async for event in chat_service.astream_question("key?", agent_id="a1")]
+
+    events = asyncio.run(consume())
+
+    assert [e["type"] for e in events] == ["delta", "blocked", "done"]
+    assert "sk-" not in events[0]["content"]
+    assert events[-1]["status"] == "blocked"
+    assert saved[-1] == ("assistant", "Response Blocked: Potential API Key leakage detected")
+
+
+def test_astream_question_persists_a_cancelled_turn_without_caching(monkeypatch):
+    saved = []
+    logged = []
+    cached = []
+
+    async def fake_prepare(*args):
+        return {"safe_question": "long?", "llm_args": ("long?", "ctx", ""), "llm_kwargs": {}}
+
+    async def fake_stream(*args, **kwargs):
+        for piece in ["Part one. ", "Part two. ", "Part three."]:
+            yield piece
+
+    monkeypatch.setattr(chat_service, "_aprepare_turn", fake_prepare)
+    monkeypatch.setattr(chat_service, "astream_chain", fake_stream)
+    monkeypatch.setattr(chat_service, "save_message", lambda role, content, agent_id=None: saved.append((role, content)))
+    monkeypatch.setattr(chat_service, "save_to_cache", lambda *args: cached.append(args))
+    monkeypatch.setattr(chat_service, "_log_chat_event", lambda *args: logged.append(args[6]))
+    monkeypatch.setattr(chat_service, "submit_with_context", _run_sync)
+
+    async def leave_after_first_delta():
+        stream = chat_service.astream_question("long?", agent_id="a1")
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(leave_after_first_delta()) == {"type": "delta", "content": "Part one. "}
+    assert saved == [("user", "long?"), ("assistant", "Part one. ")]
+    assert logged == ["cancelled"]
+    assert cached == []
+
+
+def test_streamed_turn_embeds_the_question_once(monkeypatch):
+    import core.rag.embeddings as embeddings
+
+    calls = []
+
+    class _Embeddings:
+        model_name = "fake-model"
+
+        def embed_query(self, text):
+            calls.append(text)
+            return [1.0, 0.0]
+
+    monkeypatch.setattr(embeddings, "get_embeddings", lambda: _Embeddings())
+    monkeypatch.setenv("QUERY_EMBEDDING_CACHE_SIZE", "0")
+
+    async def fake_prepare(*args):
+        # The semantic-cache probe embeds the question inside the prepare stage.
+        await offload.run_cpu_bound(embeddings.embed_query_cached, "hours?")
+        return {"safe_question": "hours?", "llm_args": ("hours?", "ctx", ""), "llm_kwargs": {}}
+
+    async def fake_stream(*args, **kwargs):
+        yield "Nine to five."
+
+    async def fake_save(role, content, agent_id=None):
+        pass
+
+    monkeypatch.setattr(chat_service, "_aprepare_turn", fake_prepare)
+    monkeypatch.setattr(chat_service, "astream_chain", fake_stream)
+    monkeypatch.setattr(chat_service, "asave_message", fake_save)
+    monkeypatch.setattr(chat_service, "save_to_cache", lambda question, answer, agent_id: embeddings.embed_query_cached(question))
+    monkeypatch.setattr(chat_service, "_log_chat_event", lambda *args: None)
+
+    async def consume():
+        return [event async for event in chat_service.astream_question("hours?", agent_id="a1")]
+
+    assert asyncio.run(consume())[-1]["status"] == "success"
+    assert calls == ["hours?"]
@@ -0,0 +1,40 @@
+import unicodedata
+
+from core.processing import chunking
+
+
+def _reference_sanitize(text):
+    for old, new in {
+        "\u25cf": "*", "\u2022": "*", "\u2013": "-", "\u2014": "--",
+        "\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"',
+        "\u2026": "...", "\u00a0": " ", "\u200b": "", "\ufeff": "",
+    }.items():
+        text = text.replace(old, new)
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith("C") or ch in "\n\r\t")
+
+
+def test_translate_sanitizer_matches_per_character_filter():
+    sample = "".join(chr(cp) for cp in range(0, 0x3100)) + "\U0001F600 \U000E0001 \ud800 मराठी 中文"
+    assert chunking.sanitize_text(sample) == _reference_sanitize(sample)
+    assert chunking.sanitize_text("a\u2014b\u200b\x00\tc\n") == "a--b\tc\n"
+
+
+def test_splitters_are_shared_and_semantic_chunking_is_windowed(monkeypatch):
+    assert chunking.get_splitter(2000, 200) is chunking.get_splitter(2000, 200)
+
+    calls = []
+
+    class FakeEmbeddings:
+        def embed_documents(self, texts):
+            calls.append(len(texts))
+            return [[1.0, float(i % 3)] for i in range(len(texts))]
+
+        def embed_query(self, text):
+            return [1.0, 0.0]
+
+    monkeypatch.setenv("SEMANTIC_CHUNK_WINDOW", "10")
+    text = " ".join(f"Sentence number {i}." for i in range(35))
+    chunks = chunking.semantic_chunk(text, embeddings=FakeEmbeddings())
+
+    assert calls == [10, 10, 10, 5]
+    assert " ".join(chunks).split() == text.split()
@@ -0,0 +1,161 @@
+import os
+import uuid
+from datetime import datetime
+
+import core.clickhouse as ch
+
+
+class _FakeClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.inserts = []
+
+    def insert(self, table, rows, column_names=None):
+        if self.fail:
+            raise ConnectionError("clickhouse down")
+        self.inserts.append((table, rows, column_names))
+
+
+def _spool(monkeypatch, tmp_path, client=None):
+    monkeypatch.setenv("CLICKHOUSE_ENABLED", "true")
+    monkeypatch.setenv("CLICKHOUSE_SPOOL_PATH", str(tmp_path))
+    monkeypatch.setenv("CLICKHOUSE_BATCH_SIZE", "2")
+    monkeypatch.setattr(ch, "_SPOOL", None)
+    monkeypatch.setattr(ch, "_start_flusher_once", lambda: None)
+    monkeypatch.setattr(ch, "get_clickhouse_client", lambda: client)
+
+
+def _files(tmp_path, suffix):
+    return sorted(name for name in os.listdir(tmp_path) if name.endswith(suffix))
+
+
+def test_rows_survive_clickhouse_outage_and_are_delivered_in_order(monkeypatch, tmp_path):
+    _spool(monkeypatch, tmp_path, client=None)
+    agent = str(uuid.uuid4())
+
+    for i in range(3):
+        ch.log_usage_to_clickhouse(agent, "model-x", prompt_tokens=i, request_id=f"r{i}")
+
+    # Two rows sealed one segment; the third sits in the open one.
+    assert len(_files(tmp_path, ".seg")) == 1
+    assert len(_files(tmp_path, ".open")) == 1
+    assert ch._flush_spool() is False
+    assert len(_files(tmp_path, ".seg")) == 1
+
+    client = _FakeClient()
+    monkeypatch.setattr(ch, "get_clickhouse_client", lambda: client)
+    assert ch.flush_clickhouse() is True
+
+    rows = [row for table, batch, cols in client.inserts for row in batch]
+    assert [table for table, _, _ in client.inserts] == ["UsageLogs", "UsageLogs"]
+    assert client.inserts[0][2] == ch._USAGE_COLS
+    assert [row[1] for row in rows] == ["r0", "r1", "r2"]
+    assert isinstance(rows[0][0], datetime)
+    assert rows[0][3] == uuid.UUID(agent)
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_insert_keeps_segment_for_retry(monkeypatch, tmp_path):
+    _spool(monkeypatch, tmp_path, client=_FakeClient(fail=True))
+
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="a")
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="b")
+
+    assert ch._flush_spool() is False
+    assert len(_files(tmp_path, ".seg")) == 1
+    assert _files(tmp_path, ".sending") == []
+
+
+def test_dead_process_segments_are_recovered_and_torn_lines_skipped(monkeypatch, tmp_path):
+    _spool(monkeypatch, tmp_path)
+    monkeypatch.setattr(ch._Spool, "_pid_alive", staticmethod(lambda pid: False))
+    (tmp_path / f"AgentLogs.{1:020d}.99999.open").write_text(
+        '["2026-01-01T00:00:00+00:00", "x"]\n["2026-01-01T00:00:01+00:00", "y"]\n["trunc'
+    )
+
+    spool = ch._get_spool()
+
+    assert _files(tmp_path, ".open") == []
+    claimed = spool.claim(spool.sealed()[0])
+    table, rows = spool.read(claimed)
+    assert table == "AgentLogs"
+    assert [row[1] for row in rows] == ["x", "y"]
+
+
+def test_full_spool_drops_new_rows_without_blocking(monkeypatch, tmp_path):
+    _spool(monkeypatch, tmp_path)
+    monkeypatch.setattr(ch, "_clickhouse_spool_max_bytes", lambda: 10)
+
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="a")
+
+    assert ch._get_spool()._bytes == 0
+    assert _files(tmp_path, ".open") == []
+
+
+class _PoisonClient(_FakeClient):
+    def insert(self, table, rows, column_names=None):
+        if any(row[1] == "poison" for row in rows):
+            raise RuntimeError("Code: 53. DB::Exception: Type mismatch in VALUES section")
+        super().insert(table, rows, column_names)
+
+
+def test_rejected_segment_is_parked_and_later_rows_still_flow(monkeypatch, tmp_path):
+    client = _PoisonClient()
+    _spool(monkeypatch, tmp_path, client=client)
+
+    for request_id in ["poison", "x", "ok1", "ok2"]:
+        ch.log_usage_to_clickhouse(None, "model-x", request_id=request_id)
+
+    assert ch._flush_spool() is True
+    assert [row[1] for _, batch, _ in client.inserts for row in batch] == ["ok1", "ok2"]
+    assert len(_files(tmp_path, ".dead")) == 1
+    assert _files(tmp_path, ".seg") == []
+    assert ch._get_spool()._bytes == 0
+
+
+def test_unexplained_failures_park_a_segment_after_max_attempts(monkeypatch, tmp_path):
+    class _Flaky(_FakeClient):
+        def insert(self, table, rows, column_names=None):
+            raise RuntimeError("something odd")
+
+    _spool(monkeypatch, tmp_path, client=_Flaky())
+    monkeypatch.setenv("CLICKHOUSE_MAX_SEGMENT_ATTEMPTS", "2")
+    monkeypatch.setattr(ch, "_SEGMENT_FAILURES", {})
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="a")
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="b")
+
+    assert ch._flush_spool() is False
+    assert len(_files(tmp_path, ".seg")) == 1
+    assert ch._flush_spool() is True
+    assert len(_files(tmp_path, ".dead")) == 1
+
+
+def test_space_freed_by_another_process_is_noticed(monkeypatch, tmp_path):
+    _spool(monkeypatch, tmp_path)
+
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="a")
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="b")
+    spool = ch._get_spool()
+    full = spool._bytes
+    monkeypatch.setattr(ch, "_clickhouse_spool_max_bytes", lambda: full + 10)
+    # Another process (e.g. the API flusher) delivered and deleted the segment.
+    for name in _files(tmp_path, ".seg"):
+        os.remove(tmp_path / name)
+    spool._rescanned = 0.0
+
+    ch.log_usage_to_clickhouse(None, "model-x", request_id="c")
+
+    assert len(_files(tmp_path, ".open")) == 1
+    assert spool._bytes < full
+
+
+def test_segments_from_a_crashed_process_with_our_pid_are_recovered(monkeypatch, tmp_path):
+    _spool(monkeypatch, tmp_path)
+    (tmp_path / f"AgentLogs.{1:020d}.{os.getpid()}.sending").write_text('["2026-01-01T00:00:00+00:00", "x"]\n')
+    (tmp_path / f"AgentLogs.{2:020d}.pid.open").write_text("stray")
+
+    spool = ch._get_spool()
+
+    assert _files(tmp_path, ".sending") == []
+    assert len(spool.sealed()) == 1
+    assert len(_files(tmp_path, ".open")) == 1
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import core.processing.scraper as scraper
+from core.processing import crawler
+
+
+class _Site:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = []
+
+
+@pytest.fixture
+def site():
+    state = _Site()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with state.lock:
+                state.in_flight += 1
+                state.peak = max(state.peak, state.in_flight)
+                state.requests.append((self.path, self.headers.get("If-None-Match")))
+            try:
+                time.sleep(0.05)
+                if self.path == "/broken":
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                etag = f'"{self.path}-v1"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                if self.path.endswith(".txt"):
+                    body, ctype = b"plain file body", "text/plain"
+                else:
+                    body = (
+                        f"<html><head><script>var x = 1;</script></head><body><nav>menu</nav>"
+                        f"<p>Content of {self.path}</p></body></html>"
+                    ).encode()
+                    ctype = "text/html; charset=utf-8"
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_crawl_is_concurrent_but_capped_per_host(site, monkeypatch):
+    monkeypatch.setenv("CRAWL_PER_HOST", "3")
+    monkeypatch.setenv("CRAWL_RETRIES", "0")
+    urls = [f"{site.base}/page/{i}" for i in range(12)] + [f"{site.base}/notes.txt", f"{site.base}/broken"]
+
+    results = {r.url: r for r in crawler.crawl_iter(urls)}
+
+    assert set(results) == set(urls)
+    assert 1 < site.peak <= 3
+    assert results[f"{site.base}/broken"].error
+    page = results[f"{site.base}/page/3"]
+    with open(page.path, encoding="utf-8") as handle:
+        text = handle.read()
+    assert "Content of /page/3" in text and "var x" not in text and "menu" not in text
+    download = results[f"{site.base}/notes.txt"]
+    assert download.is_download and download.filename == "notes.txt"
+    for result in results.values():
+        if result.path:
+            os.remove(result.path)
+
+
+def test_queued_urls_wait_for_a_connection_instead_of_timing_out(site, monkeypatch):
+    monkeypatch.setenv("CRAWL_MAX_CONNECTIONS", "1")
+    monkeypatch.setenv("CRAWL_PER_HOST", "50")
+    monkeypatch.setenv("CRAWL_TIMEOUT", "1")
+    monkeypatch.setenv("CRAWL_RETRIES", "0")
+    # ~2s of serial fetches: longer than the per-request timeout.
+    urls = [f"{site.base}/slow/{i}" for i in range(40)]
+
+    results = list(crawler.crawl_iter(urls))
+
+    assert [r.error for r in results if r.error] == []
+    assert site.peak == 1
+    for result in results:
+        os.remove(result.path)
+
+
+def test_process_urls_ingests_in_batches_and_skips_unchanged(site, monkeypatch, tmp_path):
+    monkeypatch.setenv("CRAWL_INGEST_BATCH", "4")
+    monkeypatch.setattr(crawler, "_VALIDATORS", crawler.ValidatorStore(str(tmp_path / "validators.sqlite3")))
+    monkeypatch.setattr(scraper, "get_agent", lambda agent_id: {"id": agent_id, "name": "Kb"})
+    calls = []
+
+    def fake_process(files, agent_id, progress=None):
+        names = [f.filename for f in files]
+        calls.append(names)
+        progress("documents", 0.35, document_ids=[len(calls) * 100 + i for i in range(len(names))])
+        return {"success": True, "vector_chunks": len(names), "document_rows": len(names)}
+
+    monkeypatch.setattr(scraper, "process_documents", fake_process)
+    reported = []
+    urls = [f"{site.base}/page/{i}" for i in range(10)]
+
+    result = scraper.process_urls(urls, "a1", progress=lambda stage, fraction, **info: reported.append(info))
+
+    assert result["success"] and result["document_rows"] == 10
+    assert [len(batch) for batch in calls] == [4, 4, 2]
+    assert all(name.startswith("url_127.0.0.1") for batch in calls for name in batch)
+    assert len([info for info in reported if "document_ids" in info][-1]["document_ids"]) == 10
+
+    # Second import: every page answers 304 and nothing is re-ingested.
+    indexed = [crawler.source_filename(url) for url in urls]
+    monkeypatch.setattr(scraper, "get_agent_document_names", lambda agent_id, limit=50: indexed)
+    calls.clear()
+    result = scraper.process_urls(urls, "a1")
+
+    assert result["success"] and result["urls_unchanged"] == 10
+    assert calls == []
+    assert all(etag for path, etag in site.requests[-10:])
+
+
+def test_failed_later_batch_is_reported_not_swallowed(site, monkeypatch, tmp_path):
+    monkeypatch.setenv("CRAWL_INGEST_BATCH", "2")
+    monkeypatch.setattr(crawler, "_VALIDATORS", crawler.ValidatorStore(str(tmp_path / "validators.sqlite3")))
+    monkeypatch.setattr(scraper, "get_agent", lambda agent_id: {"id": agent_id, "name": "Kb"})
+    calls = []
+
+    def flaky_process(files, agent_id, progress=None):
+        calls.append(len(files))
+        if len(calls) == 2:
+            return {"success": False, "error": "vector store unavailable"}
+        return {"success": True, "vector_chunks": len(files), "document_rows": len(files)}
+
+    monkeypatch.setattr(scraper, "process_documents", flaky_process)
+
+    result = scraper.process_urls([f"{site.base}/page/{i}" for i in range(4)], "a1")
+
+    assert calls == [2, 2]
+    assert result["success"] and result["document_rows"] == 2
+    assert result["errors"] == ["vector store unavailable"]
+    assert result["batches_failed"] == 1
+    assert "1 of 2 batches failed" in result["warning"]
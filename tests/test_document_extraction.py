@@ -0,0 +1,78 @@
+import io
+
+from core.processing import document_loader
+from core.processing.chunking import ParentChildStream, parent_child_split
+
+
+def _pdf_bytes(pages):
+    """Minimal multi-page PDF with one Helvetica text line per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+class _Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.file = io.BytesIO(data)
+
+
+def test_pdf_pages_stream_in_order_across_the_process_pool(monkeypatch):
+    monkeypatch.setenv("EXTRACT_WORKERS", "2")
+    monkeypatch.setenv("EXTRACT_PDF_PAGES_PER_TASK", "2")
+    pages = [f"Page number {i}" for i in range(5)]
+    files = [_Upload("big.pdf", _pdf_bytes(pages)), _Upload("notes.txt", b"plain notes"), _Upload("x.bin", b"?")]
+
+    try:
+        skipped = []
+        segments = list(document_loader.stream_text_from_files(files, skipped))
+    finally:
+        document_loader.shutdown_extraction_pool()
+
+    pdf_text = "".join(seg for name, seg in segments if name == "big.pdf")
+    assert [name for name, _ in segments].count("big.pdf") == 3  # 3 page ranges
+    assert pdf_text.split("\n") == pages
+    assert ("notes.txt", "plain notes") in segments
+    assert skipped == [("x.bin", "Unsupported format: bin")]
+
+    monkeypatch.setenv("EXTRACT_WORKERS", "0")
+    extracted, _ = document_loader.extract_text_from_files([_Upload("big.pdf", _pdf_bytes(pages))])
+    assert extracted == [("big.pdf", pdf_text)]
+
+
+def test_incremental_parent_child_split_matches_whole_text():
+    text = " ".join(f"Sentence {i} talks about topic {i % 7}." for i in range(2000))
+    stream = ParentChildStream()
+    pairs = []
+    for start in range(0, len(text), 3000):
+        pairs.extend(stream.feed(text[start:start + 3000]))
+        if start == 9000:
+            assert pairs, "complete parents are emitted before the input ends"
+    pairs.extend(stream.finish())
+
+    whole = parent_child_split(text)
+    assert pairs[0][1] == whole[0][1]
+    assert abs(len(pairs) - len(whole)) <= len(whole) * 0.05
+    assert all(len(parent) <= 2000 for _, parent in pairs)
@@ -0,0 +1,134 @@
+import io
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import core.chat_service as chat_service
+import core.database as database
+
+
+def _sqlite_sessions():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE omni_documents (id INTEGER PRIMARY KEY AUTOINCREMENT, agent_id TEXT, filename TEXT, "
+            "file_type TEXT, file_size INTEGER, content_preview TEXT, chunk_count INTEGER, uploaded_at TIMESTAMP, "
+            "extra_data JSON, embedding_time FLOAT, status TEXT)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE omni_parent_chunks (id INTEGER PRIMARY KEY AUTOINCREMENT, content TEXT, "
+            "source_doc_id INTEGER, agent_id TEXT)"
+        ))
+    return engine, sessionmaker(bind=engine)
+
+
+def test_bulk_save_attributes_parents_per_document(monkeypatch):
+    engine, sessions = _sqlite_sessions()
+    monkeypatch.setattr(database, "SessionLocal", sessions)
+
+    saved = database.save_ingested_documents("a1", [
+        {"filename": "a.txt", "parents": ["shared", "only a"]},
+        {"filename": "empty.txt", "parents": []},
+        {"filename": "b.txt", "parents": ["shared"]},
+    ])
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, content, source_doc_id FROM omni_parent_chunks ORDER BY id")).all()
+    doc_a, doc_empty, doc_b = (entry["id"] for entry in saved)
+    assert len({doc_a, doc_empty, doc_b}) == 3
+    assert saved[1]["parent_ids"] == []
+    # Duplicate text stays one row per document.
+    assert [(r.content, r.source_doc_id) for r in rows] == [("shared", doc_a), ("only a", doc_a), ("shared", doc_b)]
+    assert saved[0]["parent_ids"] + saved[2]["parent_ids"] == [r.id for r in rows]
+
+    database.finish_ingested_documents([
+        {"id": doc_a, "status": "ready", "chunk_count": 2, "embedding_time": 0.5},
+        {"id": doc_b, "status": "ready", "chunk_count": 1, "embedding_time": 0.5},
+    ])
+    with engine.connect() as conn:
+        counts = dict(conn.execute(text("SELECT id, chunk_count FROM omni_documents WHERE status = 'ready'")).all())
+    assert counts == {doc_a: 2, doc_b: 1}
+
+
+class _Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.file = io.BytesIO(data)
+
+
+def test_process_documents_links_children_to_their_own_document(monkeypatch):
+    monkeypatch.setenv("EXTRACT_WORKERS", "0")
+    stored = {}
+    finished = []
+
+    def fake_save(agent_id, documents):
+        stored["documents"] = documents
+        next_parent = iter(range(100, 1000))
+        return [
+            {"id": i + 1, "parent_ids": [next(next_parent) for _ in doc["parents"]]}
+            for i, doc in enumerate(documents)
+        ]
+
+    def fake_vectors(chunks, agent_id=None, metadatas=None, on_batch=None):
+        stored["chunks"] = list(zip(chunks, metadatas))
+
+    monkeypatch.setattr(chat_service, "save_ingested_documents", fake_save)
+    monkeypatch.setattr(chat_service, "finish_ingested_documents", finished.extend)
+    monkeypatch.setattr(chat_service, "create_vector_store", fake_vectors)
+    monkeypatch.setattr(chat_service, "save_text_to_file", lambda *args: None)
+    monkeypatch.setattr(chat_service, "update_agent_metadata", lambda *args, **kwargs: None)
+    monkeypatch.setattr(chat_service, "invalidate_agent_cache", lambda *args: None)
+
+    long_text = " ".join(f"Fact {i} about apples." for i in range(400)).encode()
+    result = chat_service.process_documents(
+        files=[_Upload("apples.txt", long_text), _Upload("pears.txt", b"Pears are green.")],
+        text_input="Plums are purple.",
+        agent_id="a1",
+    )
+
+    assert result["success"], result
+    assert [doc["filename"] for doc in stored["documents"]] == ["apples.txt", "pears.txt", "[Pasted Text]"]
+    assert len(stored["documents"][0]["parents"]) > 1
+    assert stored["documents"][1]["parents"] == ["Pears are green."]
+
+    by_doc = {}
+    for chunk, metadata in stored["chunks"]:
+        by_doc.setdefault(metadata["document_id"], []).append(chunk)
+    assert by_doc[2] == ["Pears are green."]
+    assert by_doc[3] == ["Plums are purple."]
+    assert all("apples" in chunk for chunk in by_doc[1])
+    assert {row["id"]: row["chunk_count"] for row in finished} == {doc: len(c) for doc, c in by_doc.items()}
+    assert result["parent_chunks"] == sum(len(doc["parents"]) for doc in stored["documents"])
+
+
+def test_process_documents_keeps_same_name_uploads_apart_and_drops_failed_ones(monkeypatch):
+    stored = {}
+
+    def fake_stream(files, skipped, failed_uploads):
+        yield 0, "notes.txt", "First notes file."
+        yield 1, "notes.txt", "Second notes file."
+        yield 2, "broken.pdf", "Page one survived."
+        # Page two of broken.pdf raised after page one was streamed.
+        skipped.append(("broken.pdf", "bad xref"))
+        failed_uploads.add(2)
+
+    def fake_save(agent_id, documents):
+        stored["documents"] = documents
+        return [{"id": i + 1, "parent_ids": [None] * len(doc["parents"])} for i, doc in enumerate(documents)]
+
+    monkeypatch.setattr(chat_service, "stream_indexed_text_from_files", fake_stream)
+    monkeypatch.setattr(chat_service, "save_ingested_documents", fake_save)
+    monkeypatch.setattr(chat_service, "finish_ingested_documents", lambda rows: None)
+    monkeypatch.setattr(chat_service, "create_vector_store", lambda chunks, **kwargs: stored.setdefault("chunks", chunks))
+    monkeypatch.setattr(chat_service, "save_text_to_file", lambda *args: None)
+    monkeypatch.setattr(chat_service, "update_agent_metadata", lambda *args, **kwargs: None)
+    monkeypatch.setattr(chat_service, "invalidate_agent_cache", lambda *args: None)
+
+    files = [_Upload("notes.txt", b""), _Upload("notes.txt", b""), _Upload("broken.pdf", b"")]
+    result = chat_service.process_documents(files=files, agent_id="a1")
+
+    assert result["success"], result
+    assert result["warning"] == "Skipped: broken.pdf"
+    assert [doc["parents"] for doc in stored["documents"]] == [["First notes file."], ["Second notes file."]]
+    assert "Page one survived." not in stored["chunks"]
@@ -0,0 +1,56 @@
+import threading
+import time
+
+from core.rag.embedding_broker import EmbeddingBroker
+
+
+class _RecordingModel:
+    def __init__(self, delay=0.0):
+        self.calls = []
+        self.delay = delay
+
+    def _embed(self, texts, kwargs):
+        self.calls.append(("query", list(texts)))
+        return [[float(len(t))] for t in texts]
+
+    def embed_documents(self, texts):
+        time.sleep(self.delay)
+        self.calls.append(("ingest", list(texts)))
+        return [[float(len(t))] for t in texts]
+
+
+def test_concurrent_queries_share_one_forward_pass(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_BATCH_WAIT_MS", "100")
+    model = _RecordingModel()
+    broker = EmbeddingBroker(lambda: model)
+    results = {}
+
+    def ask(text):
+        results[text] = broker.embed_queries([text])[0]
+
+    threads = [threading.Thread(target=ask, args=(t,)) for t in ("a", "bb", "ccc", "dddd")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == {"a": [1.0], "bb": [2.0], "ccc": [3.0], "dddd": [4.0]}
+    assert len(model.calls) < 4
+
+
+def test_queries_overtake_queued_ingest_slices(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_BATCH_WAIT_MS", "0")
+    monkeypatch.setenv("EMBEDDING_INGEST_BATCH", "2")
+    model = _RecordingModel(delay=0.05)
+    broker = EmbeddingBroker(lambda: model)
+
+    ingest = threading.Thread(target=lambda: broker.embed_documents([f"doc{i}" for i in range(8)]))
+    ingest.start()
+    time.sleep(0.02)
+    assert broker.embed_queries(["hello"]) == [[5.0]]
+    ingest.join(5)
+
+    lanes = [lane for lane, _ in model.calls]
+    assert lanes.count("ingest") == 4
+    # The query ran before the remaining ingest slices, not after all of them.
+    assert lanes.index("query") < 3
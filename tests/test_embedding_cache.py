@@ -0,0 +1,74 @@
+import core.rag.embeddings as embeddings
+from core.rag.embedding_cache import EmbeddingCache, embed_with_cache
+
+
+def test_reingest_only_embeds_changed_chunks_per_model(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    embedded = []
+
+    def embed(texts):
+        embedded.append(list(texts))
+        return [[float(len(t)), 0.5] for t in texts]
+
+    first = embed_with_cache("bge", ["alpha", "beta", "alpha"], embed, cache=cache)
+    assert embedded == [["alpha", "beta"]]
+    assert first == [[5.0, 0.5], [4.0, 0.5], [5.0, 0.5]]
+
+    second = embed_with_cache("bge", ["alpha", "beta", "gamma!"], embed, cache=cache)
+    assert embedded[-1] == ["gamma!"]
+    assert second == [[5.0, 0.5], [4.0, 0.5], [6.0, 0.5]]
+
+    # Vectors are never shared across embedding models; the file persists across instances.
+    embed_with_cache("other-model", ["alpha"], embed, cache=cache)
+    assert embedded[-1] == ["alpha"]
+    cache.close()
+    reopened = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    embed_with_cache("bge", ["beta", "gamma!"], embed, cache=reopened)
+    assert len(embedded) == 3
+
+
+def test_row_budget_is_tracked_without_recounting_every_write(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_MAX_ROWS", "3")
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"))
+    statements = []
+    conn = cache._connect()
+    conn.set_trace_callback(statements.append)
+
+    cache.put_many("m", {"a": [0.1], "b": [0.2]})
+    cache.put_many("m", {"b": [0.2], "c": [0.3]})
+    assert cache._rows == 3
+    assert not any("COUNT(*)" in sql for sql in statements)
+
+    cache.put_many("m", {"d": [0.4]})
+    assert cache._rows == 3
+    assert set(cache.get_many("m", ["a", "b", "c", "d"])) == {"b", "c", "d"}
+
+    cache.clear("m")
+    assert cache._rows == 0
+    cache.put_many("m", {"e": [0.5]})
+    cache.close()
+
+    # The count is taken once when the file is opened.
+    reopened = EmbeddingCache(str(tmp_path / "emb.sqlite3"))
+    reopened._connect()
+    assert reopened._rows == 1
+
+
+def test_semantic_chunking_vectors_bypass_the_chunk_cache(monkeypatch):
+    class FakeModel:
+        model_name = "bge"
+
+        def embed_documents(self, texts):
+            return [[float(len(t))] for t in texts]
+
+    def cached(*args, **kwargs):
+        raise AssertionError("sentence groups must not reach the chunk cache")
+
+    monkeypatch.setenv("EMBEDDING_CACHE_ENABLED", "true")
+    monkeypatch.setattr(embeddings, "broker_enabled", lambda: False)
+    monkeypatch.setattr(embeddings, "get_embeddings", lambda: FakeModel())
+    monkeypatch.setattr(embeddings, "embed_with_cache", cached)
+
+    chunker = embeddings.get_chunking_embeddings()
+    assert chunker is not embeddings.get_ingest_embeddings()
+    assert chunker.embed_documents(["one.", "three."]) == [[4.0], [6.0]]
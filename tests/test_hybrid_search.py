@@ -0,0 +1,56 @@
+import asyncio
+
+from langchain_core.documents import Document
+
+import core.rag.retrieval as retrieval
+
+
+def _install_legs(monkeypatch, vector, keyword):
+    calls = []
+
+    def fake_vector(query, agent_id, k):
+        calls.append(("vector", query, agent_id, k))
+        if isinstance(vector, Exception):
+            raise vector
+        return list(vector)
+
+    def fake_keyword(query, agent_id, k):
+        calls.append(("keyword", query, agent_id, k))
+        return list(keyword)
+
+    monkeypatch.setattr(retrieval, "_resolve_vector_docs", fake_vector)
+    monkeypatch.setattr(retrieval, "keyword_search", fake_keyword)
+    return calls
+
+
+def _both(**kwargs):
+    sync_docs = retrieval.hybrid_search("refund policy", agent_id="a1", top_k=2, expand_parents=False, **kwargs)
+    async_docs = asyncio.run(
+        retrieval.ahybrid_search("refund policy", agent_id="a1", top_k=2, expand_parents=False, **kwargs)
+    )
+    return sync_docs, async_docs
+
+
+def test_async_hybrid_search_fuses_like_the_sync_path(monkeypatch):
+    vector = [Document(page_content=f"vector {i}", metadata={"i": i}) for i in range(3)]
+    keyword = [{"content": "keyword 0", "metadata": {}, "source": "keyword"}, {"content": "vector 1", "metadata": {"i": 1}}]
+    calls = _install_legs(monkeypatch, vector, keyword)
+
+    sync_docs, async_docs = _both(use_hybrid=True, rerank=False)
+
+    assert async_docs == sync_docs
+    assert len(async_docs) == 2
+    assert sorted(calls) == sorted([("vector", "refund policy", "a1", 4), ("keyword", "refund policy", "a1", 4)] * 2)
+
+
+def test_async_search_survives_a_failed_leg_and_falls_back_to_keywords(monkeypatch):
+    keyword = [{"content": "keyword 0", "metadata": {}, "source": "keyword"}]
+    _install_legs(monkeypatch, RuntimeError("pgvector down"), keyword)
+
+    sync_docs, async_docs = _both(use_hybrid=True, rerank=False)
+    assert async_docs == sync_docs
+    assert [doc["content"] for doc in async_docs] == ["keyword 0"]
+
+    _install_legs(monkeypatch, [], keyword)
+    sync_docs, async_docs = _both(use_hybrid=False, rerank=False)
+    assert async_docs == sync_docs == keyword
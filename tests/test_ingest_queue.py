@@ -0,0 +1,64 @@
+import io
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import core.ingest_queue as ingest_queue
+from core.database import IngestionJob
+
+
+class _Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.file = io.BytesIO(data)
+
+
+def _sqlite_queue(monkeypatch, tmp_path):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    IngestionJob.__table__.create(engine)
+    monkeypatch.setattr(ingest_queue, "SessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setenv("INGEST_SPOOL_PATH", str(tmp_path / "spool"))
+
+
+def test_uploads_are_spooled_and_queued_jobs_cancel_immediately(monkeypatch, tmp_path):
+    _sqlite_queue(monkeypatch, tmp_path)
+
+    job = ingest_queue.enqueue_documents("a1", [_Upload("../notes.txt", b"hello")], "pasted")
+
+    assert job["status"] == "queued" and job["kind"] == "documents"
+    spooled = ingest_queue.get_job(job["id"])
+    assert spooled["agent_id"] == "a1"
+    files = ingest_queue.SessionLocal().get(IngestionJob, job["id"]).payload["files"]
+    assert files[0]["filename"] == "notes.txt"
+    assert open(files[0]["path"], "rb").read() == b"hello"
+
+    cancelled = ingest_queue.cancel_job(job["id"])
+    assert cancelled["status"] == "cancelled"
+    assert not os.path.exists(os.path.dirname(files[0]["path"]))
+    assert [j["id"] for j in ingest_queue.list_jobs("a1")] == [job["id"]]
+
+
+def test_runner_reports_progress_and_discards_documents_on_cancel(monkeypatch):
+    finished, discarded = [], []
+    monkeypatch.setattr(ingest_queue, "_finish", lambda *args: finished.append(args))
+    monkeypatch.setattr(ingest_queue, "_discard_partial_documents", lambda agent, ids: discarded.append((agent, ids)))
+    monkeypatch.setattr(ingest_queue._JobRunner, "_flush", lambda self: None)
+
+    runner = ingest_queue._JobRunner({"id": "j1", "agent_id": "a1", "kind": "documents", "result": {}})
+
+    def execute(job, progress):
+        progress("documents", 0.35, document_ids=[11, 12])
+        progress("embedding", 0.6)
+        runner.cancelled.set()  # what the heartbeat does when cancel_requested is seen
+        progress("embedding", 0.8)
+        raise AssertionError("cancellation should have stopped the job")
+
+    runner.run(execute)
+
+    assert runner.progress == 0.6
+    assert discarded == [("a1", [11, 12])]
+    job_id, status, result, error = finished[0]
+    assert (job_id, status, error) == ("j1", "cancelled", None)
+    assert result["discarded_document_ids"] == [11, 12]
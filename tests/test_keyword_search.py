@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import core.rag.retrieval as retrieval
+
+
+class _Session:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def execute(self, statement, params=None):
+        self.calls.append((str(statement), params))
+        return SimpleNamespace(fetchall=lambda: self.rows)
+
+    def close(self):
+        pass
+
+
+def test_keyword_search_uses_stored_tsvector_and_agent_scoped_legs(monkeypatch):
+    session = _Session([SimpleNamespace(id=3, content="refund policy", agent_id="a1", rank=0.4)])
+    monkeypatch.setattr(retrieval, "get_session", lambda: session)
+
+    docs = retrieval.keyword_search("refund", agent_id="a1", k=5)
+
+    sql, params = session.calls[0]
+    assert "p.content_tsv @@" in sql and "ts_rank(p.content_tsv" in sql
+    assert "to_tsvector" not in sql and "omni_documents" not in sql
+    assert "p.agent_id = :agent_id" in sql and "p.agent_id IS NULL" in sql and "UNION ALL" in sql
+    assert params == {"query": "refund", "limit_k": 5, "agent_id": "a1"}
+    assert docs == [{"content": "refund policy", "metadata": {"id": 3, "source": "keyword", "rank": 0.4}}]
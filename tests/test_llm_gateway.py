@@ -0,0 +1,196 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import core.llm as llm
+import core.llm_gateway as gateway
+
+
+class _FakeOpenAI(ThreadingHTTPServer):
+    """Minimal OpenAI-compatible /chat/completions endpoint."""
+
+    daemon_threads = True
+
+    def __init__(self, answer, delay=0.0, status=200):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.answer = answer
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            if server.status != 200:
+                body = {"error": {"message": "backend unhappy", "type": "server_error"}}
+            else:
+                body = {
+                    "id": "cmpl-1",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": "fake-model",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": server.answer}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7},
+                }
+            payload = json.dumps(body).encode()
+            self.send_response(server.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    started = []
+
+    def start(primary, replica=None):
+        started.extend(s for s in (primary, replica) if s is not None)
+        monkeypatch.setitem(
+            llm.MODEL_BACKENDS,
+            "fake",
+            {
+                "base_url": primary.url,
+                "replica_base_url": replica.url if replica else "",
+                "model": "fake-model",
+                "api_key": "test",
+            },
+        )
+
+    monkeypatch.setenv("LLM_RETRY_BACKOFF", "0")
+    monkeypatch.setattr(gateway, "_BACKENDS", {})
+    monkeypatch.setattr(llm, "_record_usage", lambda *args, **kwargs: None)
+    llm.reset_chain()
+    yield start
+    llm.reset_chain()
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+def _ask():
+    return llm.ainvoke_chain("question", "context", "", agent_id="a1", model_key="fake")
+
+
+async def _run(coro):
+    # Pooled clients belong to the event loop that used them.
+    try:
+        return await coro
+    finally:
+        await gateway.close_backends()
+        llm.reset_chain()
+
+
+def test_answers_through_pooled_backend(servers):
+    primary = _FakeOpenAI("hello")
+    servers(primary)
+
+    assert asyncio.run(_run(_ask())) == "hello"
+    assert primary.requests == 1
+
+
+def test_hedge_goes_to_replica_when_primary_is_slow(servers, monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "true")
+    monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "1")
+    primary = _FakeOpenAI("slow primary", delay=2.0)
+    replica = _FakeOpenAI("fast replica")
+    servers(primary, replica)
+    gateway.get_backend(primary.url).latencies.add(0.05)
+
+    started = time.monotonic()
+    answer = asyncio.run(_run(_ask()))
+
+    assert answer == "fast replica"
+    assert time.monotonic() - started < 1.5
+    assert primary.requests == 1 and replica.requests == 1
+
+
+def test_breaker_opens_then_fails_fast_and_fails_over(servers, monkeypatch):
+    monkeypatch.setenv("LLM_BREAKER_FAILURES", "2")
+    monkeypatch.setenv("LLM_BREAKER_COOLDOWN", "60")
+    primary = _FakeOpenAI("", status=500)
+    servers(primary)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(_run(_ask()))
+    assert primary.requests == 2  # LLM_RETRIES attempts, then the breaker opens
+
+    with pytest.raises(RuntimeError, match="circuit open"):
+        asyncio.run(_run(_ask()))
+    assert primary.requests == 2
+
+    replica = _FakeOpenAI("from replica")
+    servers(primary, replica)
+    assert asyncio.run(_run(_ask())) == "from replica"
+    assert primary.requests == 2
+
+
+def test_client_errors_are_not_retried_and_keep_breaker_closed(servers, monkeypatch):
+    monkeypatch.setenv("LLM_BREAKER_FAILURES", "1")
+    primary = _FakeOpenAI("", status=400)
+    servers(primary)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(_run(_ask()))
+
+    assert primary.requests == 1
+    assert gateway.get_backend(primary.url).breaker.state == 0
+
+
+def test_concurrency_is_limited_per_backend(servers, monkeypatch):
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "2")
+    primary = _FakeOpenAI("ok", delay=0.2)
+    servers(primary)
+
+    async def burst():
+        return await asyncio.gather(*[_ask() for _ in range(6)])
+
+    assert asyncio.run(_run(burst())) == ["ok"] * 6
+    assert primary.max_in_flight == 2
+
+
+def test_sync_retries_cap_the_backoff_held_in_the_worker_thread(monkeypatch):
+    monkeypatch.setenv("LLM_RETRIES", "3")
+    monkeypatch.setenv("LLM_RETRY_BACKOFF", "4")
+    monkeypatch.setenv("LLM_SYNC_RETRY_MAX_DELAY", "0.25")
+    monkeypatch.setenv("VLLM_METRICS_INTERVAL", "0")
+    monkeypatch.setattr(gateway, "_BACKENDS", {})
+    slept = []
+    monkeypatch.setattr(gateway.time, "sleep", slept.append)
+    attempts = []
+
+    def call(url):
+        attempts.append(url)
+        if len(attempts) < 3:
+            raise ConnectionError("backend restarting")
+        return "ok"
+
+    assert gateway.invoke_sync("http://sync-backend/v1", call) == "ok"
+    assert slept == [0.25, 0.25]
+    assert gateway.retry_delay(1) == 8.0
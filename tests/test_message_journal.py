@@ -0,0 +1,204 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DataError, OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import core.database as database
+import core.message_journal as journal
+import core.offload as offload
+
+
+def _sqlite(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    event.listen(engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    database.Base.metadata.create_all(
+        engine,
+        tables=[database.Agent.__table__, database.Message.__table__, database.AgentMessageDelta.__table__],
+    )
+    sessions = sessionmaker(bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", sessions)
+    monkeypatch.setattr(journal, "_start_worker_once", lambda: None)
+    monkeypatch.setattr(journal, "_PENDING", [])
+    monkeypatch.setattr(journal, "_IN_FLIGHT", [])
+    monkeypatch.setattr(journal, "_RETRY", {"failures": 0, "not_before": 0.0})
+    db = sessions()
+    db.add_all([database.Agent(id="a1", name="One", message_count=5), database.Agent(id="a2", name="Two")])
+    db.commit()
+    db.close()
+    return sessions
+
+
+def _dropped(reason):
+    return REGISTRY.get_sample_value("omnicortex_message_journal_dropped_total", {"reason": reason}) or 0.0
+
+
+def test_messages_are_batched_and_counted_through_deltas(monkeypatch):
+    sessions = _sqlite(monkeypatch)
+
+    for i in range(3):
+        database.save_message("user", f"question {i}", agent_id="a1")
+        database.save_message("assistant", f"answer {i}", agent_id="a1")
+    database.save_message("user", "hello", agent_id="a2")
+
+    # Buffered turns are visible to the next history read before any flush.
+    history = database.get_conversation_history(agent_id="a1", limit=3)
+    assert [m["content"] for m in history] == ["answer 1", "question 2", "answer 2"]
+
+    assert journal.flush_messages() == 7
+    db = sessions()
+    assert db.query(database.Message).count() == 7
+    assert sorted((d.agent_id, d.delta) for d in db.query(database.AgentMessageDelta)) == [("a1", 6), ("a2", 1)]
+    # The agent row is untouched until the rollup.
+    assert db.get(database.Agent, "a1").message_count == 5
+    db.close()
+
+    assert [m["content"] for m in database.get_conversation_history(agent_id="a1")][-2:] == ["question 2", "answer 2"]
+    assert journal.rollup_counts() == 2
+    db = sessions()
+    assert db.get(database.Agent, "a1").message_count == 11
+    assert db.get(database.Agent, "a2").message_count == 1
+    assert db.query(database.AgentMessageDelta).count() == 0
+    db.close()
+
+
+def test_failed_flush_keeps_rows_and_deleted_agents_are_dropped(monkeypatch):
+    sessions = _sqlite(monkeypatch)
+    database.save_message("user", "kept", agent_id="a1")
+
+    def broken(rows):
+        raise OperationalError("INSERT", {}, ConnectionError("database down"))
+
+    monkeypatch.setattr(database, "insert_journaled_messages", broken)
+    assert journal.flush_messages() == 0
+    assert [m["content"] for m in journal.pending_messages("a1")] == ["kept"]
+    monkeypatch.undo()
+
+    sessions = _sqlite(monkeypatch)
+    monkeypatch.setattr(journal, "_PENDING", [])
+    database.save_message("user", "kept", agent_id="a1")
+    database.save_message("user", "orphan", agent_id="gone")
+    assert journal.flush_messages() == 1
+    db = sessions()
+    assert [m.content for m in db.query(database.Message)] == ["kept"]
+    db.close()
+    database.clear_history(agent_id="a1")
+    assert journal.pending_messages() == []
+
+
+def test_rejected_rows_are_isolated_and_dropped_without_blocking_the_journal(monkeypatch):
+    sessions = _sqlite(monkeypatch)
+    real_insert = database.insert_journaled_messages
+    attempts = []
+
+    def picky(rows):
+        attempts.append(len(rows))
+        if any(row["content"] == "bad" for row in rows):
+            raise DataError("INSERT", {}, ValueError("invalid byte sequence"))
+        return real_insert(rows)
+
+    monkeypatch.setattr(database, "insert_journaled_messages", picky)
+    dropped = _dropped("rejected")
+    for content in ["one", "two", "bad", "three", "four"]:
+        database.save_message("user", content, agent_id="a1")
+
+    assert journal.flush_messages() == 4
+    assert journal.pending_messages() == []
+    assert _dropped("rejected") == dropped + 1
+    assert attempts[0] == 5 and len(attempts) < 10
+    db = sessions()
+    assert sorted(m.content for m in db.query(database.Message)) == ["four", "one", "three", "two"]
+    db.close()
+
+
+def test_async_backpressure_flush_leaves_the_event_loop(monkeypatch):
+    _sqlite(monkeypatch)
+    monkeypatch.setenv("MESSAGE_JOURNAL_MAX_PENDING", "2")
+    offloaded = []
+
+    async def fake_run_blocking(func, *args, **kwargs):
+        offloaded.append(func)
+        return func(*args, **kwargs)
+
+    monkeypatch.setattr(offload, "run_blocking", fake_run_blocking)
+
+    asyncio.run(database.asave_message("user", "first", agent_id="a1"))
+    assert offloaded == []
+    asyncio.run(database.asave_message("user", "second", agent_id="a1"))
+
+    assert offloaded == [journal.flush_backlog]
+    assert journal.pending_messages() == []
+
+
+def test_async_helpers_use_offloaded_sync_sessions_without_an_async_driver(monkeypatch):
+    sessions = _sqlite(monkeypatch)
+    monkeypatch.setattr(database, "DATABASE_URL", "sqlite:///test.db")
+    monkeypatch.setattr(database, "_ASYNC_SESSION_FACTORY", None)
+    monkeypatch.setattr(database, "_ASYNC_UNAVAILABLE", False)
+    monkeypatch.setenv("MESSAGE_JOURNAL_ENABLED", "false")
+
+    assert database._async_database_url("postgresql://u@h/db") == "postgresql+psycopg://u@h/db"
+    assert database.get_async_session_factory() is None
+    assert database._ASYNC_UNAVAILABLE
+
+    async def scenario():
+        await database.asave_message("user", "direct question", agent_id="a1")
+        await database.asave_message("assistant", "direct answer", agent_id="a1")
+        return await database.aget_conversation_history(agent_id="a1", limit=5)
+
+    history = asyncio.run(scenario())
+    assert [m["content"] for m in history] == ["direct question", "direct answer"]
+    db = sessions()
+    assert db.get(database.Agent, "a1").message_count == 7
+    db.close()
+
+
+def test_async_history_includes_journaled_messages(monkeypatch):
+    _sqlite(monkeypatch)
+    monkeypatch.setattr(database, "_ASYNC_SESSION_FACTORY", None)
+    monkeypatch.setattr(database, "_ASYNC_UNAVAILABLE", True)
+
+    async def scenario():
+        await database.asave_message("user", "stored", agent_id="a1")
+        journal.flush_messages()
+        await database.asave_message("user", "buffered", agent_id="a1")
+        return await database.aget_conversation_history(agent_id="a1")
+
+    assert [m["content"] for m in asyncio.run(scenario())] == ["stored", "buffered"]
+    assert journal.pending_messages("a1")[0]["content"] == "buffered"
+
+
+def test_outage_backs_off_and_caps_the_buffer(monkeypatch):
+    _sqlite(monkeypatch)
+    monkeypatch.setenv("MESSAGE_JOURNAL_MAX_PENDING", "2")
+    monkeypatch.setenv("MESSAGE_JOURNAL_HARD_LIMIT", "4")
+    attempts = []
+
+    def down(rows):
+        attempts.append(len(rows))
+        raise OperationalError("INSERT", {}, ConnectionError("database down"))
+
+    monkeypatch.setattr(database, "insert_journaled_messages", down)
+    overflow = _dropped("overflow")
+
+    database.save_message("user", "m0", agent_id="a1")
+    database.save_message("user", "m1", agent_id="a1")
+    assert attempts == [2]
+    first_delay = journal._retry_delay()
+    assert first_delay > 0
+
+    # While backing off, callers over the limit do not touch the database.
+    for i in range(2, 7):
+        database.save_message("user", f"m{i}", agent_id="a1")
+    assert attempts == [2]
+    assert [m["content"] for m in journal.pending_messages()] == ["m3", "m4", "m5", "m6"]
+    assert _dropped("overflow") == overflow + 3
+
+    # Each consecutive failure waits longer; a success resets the backoff.
+    journal.flush_messages()
+    assert journal._retry_delay() > first_delay
+    monkeypatch.setattr(database, "insert_journaled_messages", lambda rows: len(rows))
+    assert journal.flush_messages() == 4
+    assert journal._retry_delay() == 0
@@ -0,0 +1,69 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import core.offload as offload
+
+_REQUEST_ID = contextvars.ContextVar("request_id", default=None)
+
+
+def _fresh_pools(monkeypatch):
+    monkeypatch.setattr(offload, "_IO_EXECUTOR", None)
+    monkeypatch.setattr(offload, "_CPU_EXECUTOR", None)
+    monkeypatch.setattr(offload, "_RETRIEVAL_EXECUTOR", None)
+
+
+def test_pools_are_bounded_by_their_env_settings(monkeypatch):
+    _fresh_pools(monkeypatch)
+    monkeypatch.setenv("OFFLOAD_IO_WORKERS", "2")
+    monkeypatch.setenv("OFFLOAD_CPU_WORKERS", "not-a-number")
+    monkeypatch.setenv("OFFLOAD_RETRIEVAL_WORKERS", "0")
+
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def work():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(offload.run_blocking(work) for _ in range(6)))
+
+    try:
+        asyncio.run(scenario())
+        assert peak[0] == 2
+        assert offload.get_io_executor() is offload.get_io_executor()
+        assert offload.get_cpu_executor()._max_workers == offload._cpu_max_workers()
+        assert offload.get_retrieval_executor()._max_workers == 1
+    finally:
+        offload.shutdown_executors(wait=True)
+    assert offload._IO_EXECUTOR is None
+
+
+def test_contextvars_follow_work_into_the_pools(monkeypatch):
+    _fresh_pools(monkeypatch)
+
+    async def scenario():
+        _REQUEST_ID.set("req-1")
+        return await asyncio.gather(
+            offload.run_blocking(_REQUEST_ID.get),
+            offload.run_cpu_bound(_REQUEST_ID.get),
+            offload.run_retrieval(_REQUEST_ID.get),
+        )
+
+    token = _REQUEST_ID.set("req-2")
+    try:
+        assert asyncio.run(scenario()) == ["req-1", "req-1", "req-1"]
+        future = offload.submit_with_context(offload.get_io_executor(), _REQUEST_ID.get)
+        assert future.result(timeout=5) == "req-2"
+        # Plain submits run in the worker's own context, not the caller's.
+        assert offload.get_io_executor().submit(_REQUEST_ID.get).result(timeout=5) is None
+    finally:
+        _REQUEST_ID.reset(token)
+        offload.shutdown_executors(wait=True)
@@ -0,0 +1,54 @@
+import core.rag.retrieval as retrieval
+from core.chat_service import format_context
+
+
+def _child(text, parent_id):
+    return {"content": text, "metadata": {"parent_id": parent_id}, "source": "vector"}
+
+
+def test_children_collapse_to_parents_with_one_batched_fetch(monkeypatch):
+    fetches = []
+    parents = {
+        1: "alpha intro. " + "the refund window is thirty days. " + "alpha outro.",
+        2: "beta " * 300 + "shipping takes five business days." + " beta" * 300,
+    }
+
+    def fake_fetch(ids, agent_id=None):
+        fetches.append((sorted(ids), agent_id))
+        return {i: parents[i] for i in ids}
+
+    monkeypatch.setattr(retrieval, "get_parent_chunks", fake_fetch)
+    docs = [
+        _child("the refund window is thirty days.", 1),
+        _child("shipping takes five business days.", 2),
+        _child("alpha intro.", 1),
+        {"content": "orphan child", "metadata": {}, "source": "vector"},
+    ]
+
+    expanded = retrieval.expand_to_parents(docs, agent_id="a1", max_chars=1200, doc_max_chars=500)
+
+    assert fetches == [([1, 2], "a1")]
+    assert [d["metadata"].get("parent_id") for d in expanded] == [1, 2, None]
+    assert expanded[0]["content"] == parents[1]
+    assert expanded[0]["metadata"]["child_hits"] == 2
+    # Oversized parent: windowed around the matched child, within the per-doc cap.
+    assert "shipping takes five business days." in expanded[1]["content"]
+    assert len(expanded[1]["content"]) <= 500
+
+    context = format_context(expanded)
+    assert len(context) <= 1200 + 2 * len(expanded)
+    assert "..." not in context
+
+
+def test_keyword_parent_hits_skip_the_fetch_and_respect_top_k(monkeypatch):
+    monkeypatch.setattr(retrieval, "get_parent_chunks", lambda ids, agent_id=None: {7: "seven"} if ids else {})
+    docs = [
+        {"content": "parent five", "metadata": {"id": 5, "source": "keyword", "rank": 0.3}},
+        _child("five", 5),
+        _child("seven", 7),
+        _child("nine", 9),
+    ]
+
+    expanded = retrieval.expand_to_parents(docs, top_k=2)
+
+    assert [d["content"] for d in expanded] == ["parent five", "seven"]
@@ -0,0 +1,55 @@
+import httpx
+
+import core.llm as llm
+import core.vllm_metrics as vllm_metrics
+
+_V1_METRICS = """# HELP vllm:prefix_cache_queries Prefix cache queries, in terms of number of queried tokens.
+# TYPE vllm:prefix_cache_queries counter
+vllm:prefix_cache_queries_total{engine="0",model_name="m"} %s
+# HELP vllm:prefix_cache_hits Prefix cache hits, in terms of number of cached tokens.
+# TYPE vllm:prefix_cache_hits counter
+vllm:prefix_cache_hits_total{engine="0",model_name="m"} %s
+"""
+
+
+def _render(question, context, history, agent_context=""):
+    inputs = llm._chain_inputs(question, context, history, agent_context)
+    return llm.QA_PROMPT.format_messages(**inputs)
+
+
+def test_system_prefix_is_identical_across_requests_of_an_agent():
+    media = 'Available Images: ["menu {v2}.png"]'
+    first = _render("Opening hours?", "[Document 1]: 9-5", "No previous conversation.", media)
+    second = _render("Do you deliver?", "[Document 1]: yes", "User: hi\nAssistant: hello", media)
+
+    assert first[0].type == "system" and first[1].type == "human"
+    assert first[0].content == second[0].content
+    assert first[0].content.startswith(llm.SYSTEM_PROMPT)
+    assert first[0].content.endswith(media)
+    assert "Opening hours?" not in first[0].content
+    assert _render("q", "c", "h")[0].content == llm.SYSTEM_PROMPT
+
+
+def test_prefix_cache_counters_are_scraped_as_deltas(monkeypatch):
+    bodies = iter([_V1_METRICS % (1000, 400), _V1_METRICS % (1600, 850), _V1_METRICS % (100, 90)])
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        return httpx.Response(200, text=next(bodies))
+
+    monkeypatch.setattr(vllm_metrics, "_WATCHED", {})
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    url = "http://vllm-test:8080/v1"
+
+    assert vllm_metrics.scrape(url, client) == 0.4
+    assert vllm_metrics.scrape(url, client) == 0.75
+    # Counters reset (backend restarted): the new totals are the delta.
+    assert vllm_metrics.scrape(url, client) == 0.9
+    assert requested[0] == "http://vllm-test:8080/metrics"
+
+
+def test_legacy_hit_rate_gauge_is_understood():
+    text = "# TYPE vllm:gpu_prefix_cache_hit_rate gauge\nvllm:gpu_prefix_cache_hit_rate{model_name=\"m\"} 0.62\n"
+
+    assert vllm_metrics.parse_prefix_cache(text) == (None, None, 0.62)
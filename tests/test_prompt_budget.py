@@ -0,0 +1,94 @@
+import core.prompt_budget as budget
+
+
+class _WordTokenizer:
+    """One token per whitespace-separated word."""
+
+    name = "words"
+
+    def count(self, text):
+        return len(text.split())
+
+    def truncate(self, text, max_tokens):
+        return " ".join(text.split()[:max_tokens])
+
+
+def _use_words(monkeypatch, window=2000):
+    monkeypatch.setenv("PROMPT_TOKENIZER", "words")
+    monkeypatch.setenv("LLM_CONTEXT_WINDOW", str(window))
+    monkeypatch.setenv("PROMPT_OUTPUT_RESERVE", "500")
+    monkeypatch.setenv("PROMPT_SAFETY_MARGIN", "0")
+    monkeypatch.setitem(budget._TOKENIZERS, "words", _WordTokenizer())
+    budget._template_tokens.cache_clear()
+
+
+def _history(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "q " * 20})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "a " * 40})
+    return messages
+
+
+def test_heuristic_counts_non_latin_text_conservatively():
+    tokenizer = budget.HeuristicTokenizer()
+
+    assert tokenizer.count("a" * 40) == 10
+    assert tokenizer.count("\u4f60\u597d\u4e16\u754c") == 4
+    assert tokenizer.count(tokenizer.truncate("ab\u4f60cd" * 10, 5)) <= 5
+
+
+def test_missing_tokenizer_falls_back_to_heuristic(monkeypatch):
+    monkeypatch.setenv("PROMPT_TOKENIZER", "no/such-model-for-tests")
+    monkeypatch.setattr(budget, "_TOKENIZERS", {})
+
+    assert isinstance(budget.get_tokenizer(), budget.HeuristicTokenizer)
+    assert budget.get_tokenizer() is budget.get_tokenizer()
+
+
+def test_plan_fits_window_and_keeps_newest_history(monkeypatch):
+    _use_words(monkeypatch)
+    monkeypatch.setenv("PROMPT_HISTORY_MIN_TOKENS", "100")
+    docs = [{"content": "doc%d " % i + "word " * 600} for i in range(6)]
+
+    plan = budget.plan_prompt("what is the refund policy?", docs, _history(10), media_context="media " * 50, max_messages=10)
+
+    total = sum(plan.tokens.values())
+    assert total <= 2000 - 500
+    # The floor keeps the latest exchange even though documents could fill the window.
+    assert plan.history.startswith("User: question 9")
+    assert "answer 9" in plan.history
+    assert "question 0" not in plan.history
+    assert plan.context.startswith("[Document 1]: doc0")
+    assert plan.context.split("\n\n")[0].endswith("...")
+
+
+def test_short_history_leaves_room_for_documents(monkeypatch):
+    _use_words(monkeypatch, window=8192)
+    docs = [{"content": "word " * 100} for _ in range(3)]
+
+    plan = budget.plan_prompt("hi", docs, _history(1), media_context="[image] logo.png")
+
+    assert plan.context.count("[Document") == 3
+    assert "..." not in plan.context
+    assert plan.agent_context == "[image] logo.png"
+    assert plan.history.startswith("User: question 0")
+
+
+def test_warm_tokenizers_loads_every_backend_once(monkeypatch):
+    loaded = []
+
+    def fake_load(name):
+        loaded.append(name)
+        return budget.HeuristicTokenizer()
+
+    monkeypatch.delenv("PROMPT_TOKENIZER", raising=False)
+    monkeypatch.setattr(budget, "_TOKENIZERS", {})
+    monkeypatch.setattr(budget, "_load_tokenizer", fake_load)
+
+    assert not budget.tokenizer_ready()
+    budget.warm_tokenizers()
+    budget.warm_tokenizers()
+
+    assert budget.tokenizer_ready()
+    assert len(loaded) == len(set(loaded))
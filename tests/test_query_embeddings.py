@@ -0,0 +1,49 @@
+import asyncio
+
+import core.rag.embeddings as embeddings
+from core.offload import run_blocking, run_cpu_bound
+
+
+class _CountingEmbeddings:
+    model_name = "fake-model"
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return [float(len(text)), 1.0]
+
+
+def _install(monkeypatch, cache_size="0"):
+    fake = _CountingEmbeddings()
+    monkeypatch.setattr(embeddings, "get_embeddings", lambda: fake)
+    monkeypatch.setenv("QUERY_EMBEDDING_CACHE_SIZE", cache_size)
+    embeddings._QUERY_CACHE.clear()
+    return fake
+
+
+def test_turn_scope_embeds_once_across_offloaded_stages(monkeypatch):
+    fake = _install(monkeypatch)
+
+    @embeddings.with_query_embedding_scope
+    async def turn():
+        first = await run_cpu_bound(embeddings.embed_query_cached, "what are  your hours?")
+        second = await run_blocking(embeddings.embed_query_cached, "what are your hours?")
+        third = await run_cpu_bound(embeddings.embed_query_cached, " what are your hours? ")
+        return first, second, third
+
+    first, second, third = asyncio.run(turn())
+    assert first == second == third
+    assert fake.calls == ["what are your hours?"]
+
+    # Outside a turn with the LRU disabled, every call embeds again.
+    embeddings.embed_query_cached("what are your hours?")
+    assert len(fake.calls) == 2
+
+
+def test_lru_reuses_vectors_across_turns(monkeypatch):
+    fake = _install(monkeypatch, cache_size="2")
+    for text in ("a", "b", "a", "c", "a", "b"):
+        embeddings.embed_query_cached(text)
+    assert fake.calls == ["a", "b", "c", "b"]
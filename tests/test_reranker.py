@@ -0,0 +1,51 @@
+import threading
+
+from core.rag.reranker import RerankerService
+
+
+class _FakeCrossEncoder:
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def predict(self, pairs, batch_size=32):
+        self.release.wait(2)
+        self.batches.append(list(pairs))
+        return [float(len(doc)) for _, doc in pairs]
+
+
+def test_concurrent_requests_share_batches_and_scores_are_cached(monkeypatch):
+    # A long window that closes as soon as both requests' 4 pairs are queued.
+    monkeypatch.setenv("RERANKER_BATCH_WAIT_MS", "2000")
+    monkeypatch.setenv("RERANKER_MAX_BATCH", "4")
+    monkeypatch.setenv("RERANKER_MAX_LENGTH", "32")
+    model = _FakeCrossEncoder()
+    service = RerankerService("fake", loader=lambda name: model)
+
+    results = {}
+
+    def ask(name, docs):
+        results[name] = service.score("Refund policy?", docs)
+
+    threads = [
+        threading.Thread(target=ask, args=("a", ["short", "x" * 500])),
+        threading.Thread(target=ask, args=("b", ["medium text", "short"])),
+    ]
+    for thread in threads:
+        thread.start()
+    model.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # Long documents are clipped before scoring (32 tokens ~ 128 chars).
+    assert results["a"] == [5.0, 128.0]
+    assert results["b"] == [11.0, 5.0]
+    assert len(model.batches) == 1
+    assert len(model.batches[0]) == 4
+
+    # Whitespace differences hit the score cache; case differences do not.
+    assert service.score("  Refund   policy? ", ["medium text", "short"]) == [11.0, 5.0]
+    assert len(model.batches) == 1
+    monkeypatch.setenv("RERANKER_BATCH_WAIT_MS", "0")
+    service.score("refund POLICY?", ["short"])
+    assert len(model.batches) == 2
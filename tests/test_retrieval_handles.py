@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import core.rag.vector_store as vector_store
+from core.agent_cache import agent_cache
+
+
+def test_handles_are_reused_and_follow_agent_invalidation(monkeypatch):
+    built = []
+
+    def fake_build(agent_id):
+        built.append(agent_id)
+        return vector_store.RetrievalHandle(object(), vector_store.get_collection_name(agent_id), "uuid", 0.0)
+
+    monkeypatch.setattr(vector_store, "_build_handle", fake_build)
+    monkeypatch.setattr(vector_store, "_HANDLES", {})
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        handles = list(pool.map(lambda _: vector_store.get_retrieval_handle("a1"), range(32)))
+    assert built == ["a1"]
+    assert all(handle is handles[0] for handle in handles)
+
+    vector_store.get_retrieval_handle("a2")
+    agent_cache.invalidate("a1")
+    assert set(vector_store._HANDLES) == {"omni_agent_a2"}
+
+    agent_cache.invalidate()
+    assert vector_store._HANDLES == {}
+    vector_store.get_retrieval_handle("a1")
+    assert built == ["a1", "a2", "a1"]
@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+
+import core.cache as cache
+
+
+class _FakeResult:
+    def __init__(self, rows=None, scalar=None):
+        self._rows = rows or []
+        self._scalar = scalar
+
+    def fetchall(self):
+        return self._rows
+
+    def scalar(self):
+        return self._scalar
+
+
+class _FakeSession:
+    def __init__(self, legs):
+        self.legs = list(legs)
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        if "pg_extension" in sql:
+            return _FakeResult(scalar="0.8.0")
+        if sql.startswith("SET"):
+            return _FakeResult()
+        return _FakeResult(rows=self.legs.pop(0))
+
+
+def test_nearest_lookup_orders_by_distance_and_splits_scope(monkeypatch):
+    monkeypatch.setattr(cache, "_ITERATIVE_SCAN_SUPPORTED", None)
+    db = _FakeSession([
+        [SimpleNamespace(id=1, answer="agent", distance=0.05)],
+        [SimpleNamespace(id=2, answer="shared", distance=0.02)],
+    ])
+
+    candidates = cache.nearest_cached_answers(db, [0.1, 0.2], agent_id="a1")
+
+    lookups = [sql for sql in db.statements if "FROM omni_semantic_cache" in sql]
+    assert len(lookups) == 2
+    assert all("ORDER BY embedding <=> :q_vec" in sql and "LIMIT :k" in sql for sql in lookups)
+    assert not any("1 - (embedding" in sql for sql in lookups)
+    assert any("hnsw.iterative_scan" in sql for sql in db.statements)
+    assert cache.best_cached_answer(candidates)[:2] == (2, "shared")
+
+
+def test_best_cached_answer_applies_threshold_after_knn():
+    assert cache.best_cached_answer([(1, "far", 0.2), (2, "close", 0.05)], threshold=0.92) == (2, "close", 0.95)
+    assert cache.best_cached_answer([(1, "far", 0.2)], threshold=0.92) is None
+
+
+def test_cache_hits_are_coalesced_into_one_batched_update(monkeypatch):
+    import core.cache_lifecycle as lifecycle
+
+    executed = []
+
+    class _Session:
+        def execute(self, statement, params=None):
+            executed.append((str(statement), params))
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(lifecycle, "SessionLocal", _Session)
+    monkeypatch.setattr(lifecycle, "_PENDING_HITS", lifecycle.TallyCounter())
+    monkeypatch.setattr(lifecycle, "_LOOKUP_TOTALS", {"hit": 0, "miss": 0})
+
+    for entry_id in (7, 7, 9, None):
+        lifecycle.record_cache_lookup(entry_id)
+
+    assert lifecycle.flush_cache_hits() == 2
+    assert len(executed) == 1
+    sql, params = executed[0]
+    assert "unnest" in sql and "last_hit_at" in sql
+    assert dict(zip(params["ids"], params["counts"])) == {7: 2, 9: 1}
+    assert lifecycle.flush_cache_hits() == 0
+
+
+def test_failed_hit_flush_requeues_the_batch(monkeypatch):
+    import core.cache_lifecycle as lifecycle
+
+    attempts = []
+
+    class _Session:
+        def execute(self, statement, params=None):
+            attempts.append(dict(zip(params["ids"], params["counts"])))
+            if len(attempts) == 1:
+                raise RuntimeError("connection reset")
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(lifecycle, "SessionLocal", _Session)
+    monkeypatch.setattr(lifecycle, "_PENDING_HITS", lifecycle.TallyCounter())
+    monkeypatch.setattr(lifecycle, "_LOOKUP_TOTALS", {"hit": 0, "miss": 0})
+
+    lifecycle.record_cache_lookup(7)
+    assert lifecycle.flush_cache_hits() == 0
+    lifecycle.record_cache_lookup(7)
+
+    assert lifecycle.flush_cache_hits() == 1
+    assert attempts[-1] == {7: 2}
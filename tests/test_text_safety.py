@@ -0,0 +1,56 @@
+import re
+
+from prometheus_client import REGISTRY
+
+from core.guardrails import validate_input, validate_output
+from core.processing.pii import PATTERNS, mask_pii
+from core.text_safety import RuleSet
+
+
+def _hits(kind, rule):
+    return REGISTRY.get_sample_value("omnicortex_safety_rule_hits_total", {"kind": kind, "rule": rule}) or 0.0
+
+
+def _sequential_mask(text):
+    for label, pattern in PATTERNS.items():
+        text = re.sub(pattern, f"<{label}>", text)
+    return text
+
+
+def test_single_pass_masking_matches_sequential_passes():
+    samples = [
+        "mail john.doe@example.com or call (555) 123-4567",
+        "card 4111 1111 1111 1111, ssn 123-45-6789, host 192.168.0.1",
+        "+1 555.123.4567 then 4111-1111-1111-1111",
+        "5551234567@x.com",
+        "nothing sensitive here",
+    ]
+
+    for text in samples:
+        assert mask_pii(text) == _sequential_mask(text)
+    assert mask_pii("reach me: a@b.io / 555-123-4567") == "reach me: <EMAIL> / <PHONE>"
+
+
+def test_rule_hits_are_counted_per_rule():
+    emails, ssns = _hits("pii", "EMAIL"), _hits("pii", "SSN")
+
+    mask_pii("x@y.com, z@w.org and 123-45-6789")
+
+    assert _hits("pii", "EMAIL") == emails + 2
+    assert _hits("pii", "SSN") == ssns + 1
+
+
+def test_blacklist_is_case_insensitive_and_reports_the_phrase():
+    before = _hits("input", "jailbreak")
+
+    assert validate_input("Please JailBreak yourself") == (False, "Blocked content detected: 'jailbreak'")
+    assert validate_input("How do I reset my password?") == (True, "OK")
+    assert _hits("input", "jailbreak") == before + 1
+
+
+def test_output_rules_and_nested_groups_resolve_to_their_rule():
+    assert validate_output("key: sk-" + "a" * 24) == (False, "Potential API Key leakage detected")
+    assert validate_output("sk-short is fine") == (True, "OK")
+
+    rules = RuleSet("test", {"outer": r"(a)(b)?c", "plain": r"d+"})
+    assert rules.sub("ac dd abc", lambda rule, text: rule) == "outer plain outer"